@@ -37,7 +37,10 @@ setup(
         'setuptools',
         'psycopg2>=2.4.6',
         'numpy>=1.9',
+        'scipy',
         'sqlparse',
+        'osmium>=3.7',
+        'GDAL',
         # -*- Extra requirements: -*-
     ],
 
@@ -8,12 +8,16 @@ import os
 import re
 import subprocess
 import time
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
 from osgeo import ogr
+import psycopg2
 from psycopg2 import errors
 import logging
 
-from .connection import Connection, DBApp, Login
+from .connection import Connection, DBApp, Login, get_pool
+from .index_builder import IndexBuilder
+from .extract_cache import ExtractCache
 
 
 class BBox(object):
@@ -56,6 +60,20 @@ class Extract(DBApp):
     role = 'group_osm'
     foreign_schema = None
     schema = None
+    # tables copied directly from the source database instead of over FDW,
+    # opt-in, as it needs a login to the source database (FOREIGN_PASS)
+    direct_copy_tables = ()
+    # options of the foreign server, the extensions are shippable,
+    # so that their functions and operators (e.g. st_intersects) are
+    # evaluated on the source server
+    fdw_options = {
+        'fetch_size': '100000',
+        'extensions': 'postgis, hstore, postgis_raster',
+    }
+    # options per foreign table, they override the options of the server
+    foreign_table_options = {}
+    # options supported by postgres_fdw since PostgreSQL 14
+    fdw_options_pg14 = ('batch_size', 'async_capable')
 
     def __init__(self,
                  destination_db,
@@ -68,6 +86,10 @@ class Extract(DBApp):
                  logger=None,
                  boundary: ogr.Geometry = None,
                  boundary_name: str = 'bbox',
+                 n_workers: int = None,
+                 cache_folder: str = None,
+                 direct_copy_tables: List[str] = None,
+                 fdw_options: Dict[str, str] = None,
                  **options):
         self.srid = 4326
         self.logger = logger or logging.getLogger(self.__module__)
@@ -83,6 +105,20 @@ class Extract(DBApp):
         self.check_platform()
         self.boundary = boundary
         self.boundary_name = boundary_name
+        # number of tables extracted in parallel over separate connections
+        self.n_workers = n_workers or int(os.environ.get('EXTRACT_WORKERS', 1))
+        # cache of extracted tables, disabled if no folder is given
+        cache_folder = cache_folder or os.environ.get('EXTRACT_CACHE')
+        self.extract_cache = (ExtractCache(cache_folder, logger=self.logger)
+                              if cache_folder else None)
+        # tables streamed with COPY from the source database,
+        # a comma separated list or * for all in EXTRACT_DIRECT_COPY
+        if direct_copy_tables is None and 'EXTRACT_DIRECT_COPY' in os.environ:
+            direct_copy_tables = [
+                t.strip() for t in
+                os.environ['EXTRACT_DIRECT_COPY'].split(',') if t.strip()]
+        if direct_copy_tables is not None:
+            self.direct_copy_tables = direct_copy_tables
         self.set_login(database=self.destination_db)
         self.foreign_login = foreign_login or Login(
             host=os.environ.get('FOREIGN_HOST', 'localhost'),
@@ -91,6 +127,17 @@ class Extract(DBApp):
             password=os.environ.get('FOREIGN_PASS', ''),
             db=self.source_db
         )
+        # server options: class defaults < foreign login < environment
+        # < arguments
+        env_options = {
+            option: os.environ[f'FDW_{option.upper()}']
+            for option in ('fetch_size', 'batch_size', 'use_remote_estimate',
+                           'async_capable', 'extensions')
+            if f'FDW_{option.upper()}' in os.environ}
+        self.fdw_options = {**self.fdw_options,
+                            **getattr(self.foreign_login, 'fdw_options', {}),
+                            **env_options,
+                            **(fdw_options or {})}
         self.target_srid = (target_srid or self.get_target_srid()
                             or 25832)
 
@@ -120,11 +167,13 @@ class Extract(DBApp):
                 self.create_foreign_catalog()
                 self.create_foreign_schema()
                 self.conn.commit()
-                for tn, geom in self.tables.items():
-                    self.extract_table(tn, geom=geom)
+                self.extract_tables(self.tables)
                 self.additional_stuff()
                 self.conn.commit()
                 self.final_stuff()
+                # the new version of the extracted tables for the layers
+                # built on them
+                ExtractCache.record_versions(self.schema, self.conn)
                 self.conn.commit()
                 self.further_stuff()
         except Exception as e:
@@ -134,6 +183,52 @@ class Extract(DBApp):
                 self.cleanup(conn=conn)
                 self.cleanup(conn=conn, schema='temp_pg_catalog')
 
+    def extract_tables(self, tables: dict):
+        """
+        extract the tables with their geometry columns,
+        with more than one worker the tables are extracted in parallel
+        over separate connections, each committed on its own
+
+        Parameters
+        ----------
+        tables : dict
+            the name of the geometry column (or None) per table
+        """
+        # each worker holds a connection from the pool besides the
+        # connection of the extract
+        max_workers = get_pool(self.login).maxconn - 1
+        if self.n_workers > max_workers:
+            self.logger.warning(f'{self.n_workers} workers requested, '
+                                f'but only {max_workers} connections are '
+                                'available in the pool')
+        n_workers = min(self.n_workers, max_workers, len(tables))
+        if n_workers <= 1:
+            for tn, geom in tables.items():
+                self.extract_table(tn, geom=geom)
+            return
+
+        def extract(tn: str, geom: str):
+            with Connection(login=self.login) as conn:
+                self.extract_table(tn, geom=geom, conn=conn)
+
+        self.logger.info(f'Extracting {len(tables)} tables '
+                         f'with {n_workers} workers')
+        failed = {}
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(extract, tn, geom): tn
+                       for tn, geom in tables.items()}
+            for future in as_completed(futures):
+                tn = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    self.logger.error(f'Extracting table "{tn}" failed: {e}')
+                    failed[tn] = e
+        if failed:
+            raise Exception(f'Extraction of the tables '
+                            f'{", ".join(failed)} failed') \
+                from next(iter(failed.values()))
+
     def further_stuff(self):
         """
         To be defined in the subclass
@@ -182,6 +277,9 @@ class Extract(DBApp):
                                                  find_port=self.foreign_login.port,
                                                  find_db=self.foreign_login.db,
                                                  find_user=self.foreign_login.user)
+        fdw_options = ''.join(f"""
+            {option} '{value}',""" for option, value in
+            self.supported_fdw_options(self.fdw_options).items())
         sql = f"""
         -- server
         DROP SERVER IF EXISTS {self.foreign_server} CASCADE;
@@ -189,9 +287,7 @@ class Extract(DBApp):
         FOREIGN DATA WRAPPER postgres_fdw
         OPTIONS (
             host '{self.foreign_login.host}',
-            port '{self.foreign_login.port}', dbname '{self.foreign_login.db}',
-            fetch_size '100000',
-            extensions 'postgis, hstore, postgis_raster',
+            port '{self.foreign_login.port}', dbname '{self.foreign_login.db}',{fdw_options}
             updatable 'true'
         );
         -- user
@@ -205,6 +301,46 @@ class Extract(DBApp):
         with Connection(login=self.login) as conn:
             self.run_query(sql, conn=conn)
 
+    def supported_fdw_options(self, options: Dict[str, str]
+                              ) -> Dict[str, str]:
+        """
+        return the options, which are supported by postgres_fdw
+        of the target database
+        """
+        if not hasattr(self, '_server_version'):
+            with Connection(login=self.login) as conn:
+                self._server_version = conn.server_version
+        if self._server_version >= 140000:
+            return dict(options)
+        unsupported = [o for o in options if o in self.fdw_options_pg14]
+        if unsupported:
+            self.logger.warning(f'postgres_fdw options {unsupported} '
+                                'require PostgreSQL 14 and are ignored')
+        return {o: v for o, v in options.items()
+                if o not in self.fdw_options_pg14}
+
+    def set_foreign_table_options(self,
+                                  target_schema: str,
+                                  tables: list = None,
+                                  conn=None):
+        """
+        set the `foreign_table_options` of the imported foreign tables
+        """
+        conn = conn or self.conn
+        for tn, options in self.foreign_table_options.items():
+            if tables and tn not in tables:
+                continue
+            options = self.supported_fdw_options(options)
+            if not options:
+                continue
+            opt_str = ', '.join(f"ADD {option} '{value}'"
+                                for option, value in options.items())
+            sql = f'''
+            ALTER FOREIGN TABLE IF EXISTS {target_schema}.{tn}
+            OPTIONS ({opt_str});
+            '''
+            self.run_query(sql, conn=conn)
+
     def create_extensions(self):
         """
         extensions needed later (usually provided by the template already)
@@ -239,52 +375,139 @@ class Extract(DBApp):
         To be defined in the subclass
         """
 
-    def extract_table(self, tn, geom='geom', boundary_name=None):
+    def extract_table(self, tn, geom='geom', boundary_name=None, conn=None):
         """
         extracts a single table
         """
-        cols = self.conn.get_column_dict(tn, self.temp)
+        conn = conn or self.conn
+        cols = conn.get_column_dict(tn, self.temp)
 
         if geom is None:
             cols = ('t."{}"'.format(c)
                     for c in cols)
             col_str = ', '.join(cols)
-            sql = f"""
-SELECT {col_str}
-INTO {self.schema}.{tn}
-FROM {self.temp}.{tn} t;
-            """
+            source_filter = ''
         else:
 
             wkt = self.get_target_boundary(
-                boundary_name=boundary_name or self.boundary_name)
-            geometrytype = self.get_geometrytype(tn, geom)
+                boundary_name=boundary_name or self.boundary_name, conn=conn)
+            geometrytype = self.get_geometrytype(tn, geom, conn=conn)
             cols_without_geom = ('t."{}"'.format(c)
                                  for c in cols if c != geom)
-            col_str = ', '.join(cols_without_geom)
-
-            sql = f"""
-            SELECT
-              {col_str},
+            col_str = f"""{', '.join(cols_without_geom)},
               st_transform(t.{geom}, {self.target_srid})::geometry({geometrytype},
-              {self.target_srid}) as geom
-            INTO {self.schema}.{tn}
-            FROM {self.temp}.{tn} t,
+              {self.target_srid}) as geom"""
+            source_filter = f""",
             (SELECT ST_GeomFromEWKT('SRID={self.srid};{wkt}') AS source_geom) tb
             WHERE
-            st_intersects(t.{geom}, tb.source_geom);
+            st_intersects(t.{geom}, tb.source_geom)"""
+
+        sql = f"""
+            SELECT
+              {col_str}
+            INTO {self.schema}.{tn}
+            FROM {self.temp}.{tn} t{source_filter};
             """
 
-        self.logger.info(f'Extracting table "{tn}" into {self.schema}.{tn}')
-        self.run_query(sql, conn=self.conn)
+        cache_key = self.get_cache_key(tn, sql)
+        source_schema = self.foreign_schema or self.schema
+        if cache_key and self.extract_cache.restore(
+                cache_key, self.schema, tn, conn):
+            self.logger.info(f'Restored table "{tn}" into {self.schema}.{tn} '
+                             'from the cache')
+            cache_key = None
+        elif self.copy_from_source(
+                tn,
+                select_target=f'SELECT {col_str} FROM {self.temp}.{tn} t',
+                select_source=f'SELECT {col_str} '
+                f'FROM {source_schema}.{tn} t{source_filter}',
+                conn=conn):
+            pass
+        else:
+            self.logger.info(
+                f'Extracting table "{tn}" into {self.schema}.{tn}')
+            self.run_query(sql, conn=conn)
+        if cache_key:
+            self.extract_cache.store(cache_key, self.schema, tn, conn)
 
         description = self.get_description(
-            tn, self.foreign_schema or self.schema, foreign=True)
+            tn, self.foreign_schema or self.schema, foreign=True, conn=conn)
         if description:
             sql = f'''
             COMMENT ON TABLE {self.schema}.{tn} IS '{description}';
             '''
-            self.run_query(sql, conn=self.conn)
+            self.run_query(sql, conn=conn)
+
+    def copy_from_source(self,
+                         tn: str,
+                         select_target: str,
+                         select_source: str,
+                         conn=None) -> bool:
+        """
+        create the table tn with the columns of `select_target` run over the
+        foreign server and fill it with the result of `select_source`
+        run directly on the source database, streamed with binary COPY,
+        if tn is one of the `direct_copy_tables`
+
+        Returns
+        -------
+        bool : True, if the table was copied, False if the table has to be
+        extracted over the foreign server (not selected or the copy failed)
+        """
+        if not ('*' in self.direct_copy_tables
+                or tn in self.direct_copy_tables):
+            return False
+        conn = conn or self.conn
+        sql_create = f'''
+        SELECT * INTO {self.schema}.{tn} FROM ({select_target} LIMIT 0) q;
+        '''
+        copy_to = f'COPY ({select_source}) TO STDOUT WITH (FORMAT binary)'
+        copy_from = f'COPY {self.schema}.{tn} FROM STDIN WITH (FORMAT binary)'
+        self.logger.info(f'Copying table "{tn}" from the source database '
+                         f'into {self.schema}.{tn}')
+        cur = conn.cursor()
+        cur.execute('SAVEPOINT copy_from_source;')
+        try:
+            self.run_query(sql_create, conn=conn)
+            with Connection(login=self.foreign_login) as source_conn:
+                n_rows = self.copy_between(copy_to, source_conn,
+                                           copy_from, conn)
+        except (psycopg2.Error, OSError) as e:
+            self.logger.warning(f'Direct copy of table "{tn}" failed, '
+                                f'falling back to the foreign server: {e}')
+            cur.execute('ROLLBACK TO SAVEPOINT copy_from_source;')
+            return False
+        cur.execute('RELEASE SAVEPOINT copy_from_source;')
+        self.logger.info(f'{n_rows} rows copied into {self.schema}.{tn}')
+        return True
+
+    def get_cache_key(self, tn: str, sql: str) -> str:
+        """
+        return the key of table tn extracted by the query sql
+        in the extraction cache or None, if the table cannot be cached
+        """
+        if not self.extract_cache:
+            return
+        marker = self.get_source_marker(tn)
+        if marker is None:
+            return
+        fl = self.foreign_login
+        return self.extract_cache.key(fl.host, fl.port, fl.db,
+                                      self.foreign_schema or self.schema, tn,
+                                      marker, ' '.join(sql.split()))
+
+    def get_source_marker(self, tn: str) -> str:
+        """
+        return the version of the table tn in the source database,
+        or None, if the version cannot be determined (e.g. for views)
+        """
+        try:
+            with Connection(login=self.foreign_login) as conn:
+                return ExtractCache.source_version(
+                    self.foreign_schema or self.schema, tn, conn)
+        except psycopg2.Error as e:
+            self.logger.warning(f'version of the source table {tn} is '
+                                f'unknown, it is not cached: {e}')
 
     def get_description(self, relation, schema, foreign=False, conn=None):
         cat = 'temp_pg_catalog' if foreign else 'pg_catalog'
@@ -313,11 +536,12 @@ FROM {self.temp}.{tn} t;
         relkinds = cur.fetchall()
         return dict(relkinds)
 
-    def get_geometrytype(self, tn, geom):
+    def get_geometrytype(self, tn, geom, conn=None):
         sql = """
         SELECT geometrytype({geom}) FROM {sn}.{tn} LIMIT 1;
         """.format(geom=geom, sn=self.temp, tn=tn)
-        cur = self.conn.cursor()
+        conn = conn or self.conn
+        cur = conn.cursor()
         cur.execute(sql)
         geometrytype = cur.fetchone()[0]
         return geometrytype
@@ -344,6 +568,8 @@ FROM {self.temp}.{tn} t;
             sql += f'LIMIT TO ({",".join(tables)}) '
         sql += f'FROM SERVER {self.foreign_server} INTO {target_schema};'
         self.run_query(sql, conn=conn)
+        self.set_foreign_table_options(target_schema, tables=tables,
+                                       conn=conn)
 
 
     def create_foreign_catalog(self):
@@ -365,19 +591,22 @@ FROM {self.temp}.{tn} t;
         FROM SERVER {self.foreign_server} INTO {target_schema};'''
         self.run_query(sql, conn=self.conn)
 
-    def get_target_boundary(self, boundary_name=None):
+    def get_target_boundary(self, boundary_name=None, conn=None):
         """
-        get the target boundary from the destination database
+        get the target boundary from the destination database,
+        over the given connection or a new one
         """
-        with Connection(login=self.login) as conn:
-            cur = conn.cursor()
-            sql = f"""
-            SELECT ST_AsText(source_geom) as wkt FROM meta.boundary
-            WHERE name='{boundary_name or self.boundary_name}';
-            """
-            cur.execute(sql)
-            row = cur.fetchone()
-            return row.wkt
+        if conn is None:
+            with Connection(login=self.login) as conn:
+                return self.get_target_boundary(boundary_name, conn=conn)
+        sql = f"""
+        SELECT ST_AsText(source_geom) as wkt FROM meta.boundary
+        WHERE name='{boundary_name or self.boundary_name}';
+        """
+        cur = conn.cursor()
+        cur.execute(sql)
+        row = cur.fetchone()
+        return row.wkt
 
     def get_target_srid(self):
         """
@@ -625,12 +854,13 @@ WHERE c.schema = %s
 AND c.tblname = ANY(%s)
 AND c.contype <> 'f'::"char";
         '''
+        index_builder = IndexBuilder(self)
         cur = self.conn.cursor()
         cur.execute(sql_constraints, (schema, tables))
         rows = cur.fetchall()
         for row in rows:
             sql = f'ALTER TABLE "{schema}"."{row.tblname}" ADD CONSTRAINT "{row.conname}" {row.condef};'
-            cur.execute(sql)
+            index_builder.add(sql)
 
         # add indices not defined by constraints
         sql_indices = f'''
@@ -648,8 +878,8 @@ AND i.tblname = ANY(%s);
         rows = cur.fetchall()
         for row in rows:
             sql = f'{row.idxdef};'
-            cur.execute(sql)
-
+            index_builder.add(sql)
+        index_builder.run(conn=self.conn)
 
         # add foreign keys
         sql_fk = f'''
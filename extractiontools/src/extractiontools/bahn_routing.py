@@ -73,12 +73,19 @@ class DBRouting(DBApp):
             "{schema}"."{table}" d
             WHERE ST_DWithin(h.geom, d.geom, 70000);
             '''
-            cur.execute(sql)
-            routes = cur.fetchall()
+            # the routes are streamed with a cursor surviving the commits
+            routes = (route for rows in self.iter_query(
+                sql, conn=conn, itersize=1000, withhold=True)
+                      for route in rows)
             closest_stops = {}
 
-            self.logger.info(f'Scraping {len(routes)} Routes '
-                             'from Deutsche Bahn')
+            self.logger.info('Scraping Routes from Deutsche Bahn')
+            inserter = self.bulk_inserter(
+                target_table,
+                columns=('origin_H_ID', 'destination_id',
+                         'destination_H_ID', 'destination_H_NAME',
+                         'modes', 'changes', 'duration', 'departure'),
+                schema=schema, conn=conn)
             for i, (origin_stop_id, origin_stop_name,
                  dest_id, dest_x, dest_y) in enumerate(routes):
                 closest_stop = closest_stops.get(dest_id)
@@ -95,19 +102,11 @@ class DBRouting(DBApp):
                      max_retries=5)
                 if duration > 10000000:
                     continue
-                if 'character' in pk_type or 'text' in pk_type:
-                    dest_id = f"'{dest_id}'"
-                sql = f'''
-                INSERT INTO "{schema}"."{target_table}"
-                ("origin_H_ID", destination_id,
-                 "destination_H_ID", "destination_H_NAME",
-                 modes, changes, duration, departure)
-                VALUES
-                ({origin_stop_id}, {dest_id},
-                 {closest_stop['id']}, '{closest_stop['name']}',
-                 '{modes}', {changes}, {duration}, '{departure}')
-                '''
-                cur.execute(sql)
+                inserter.add((origin_stop_id, dest_id,
+                              closest_stop['id'], closest_stop['name'],
+                              modes, changes, duration, departure))
                 if (i + 1) % 100 == 0:
-                    self.logger.info(f'{i+1}/{len(routes)} Routes processed')
-                    conn.commit()
\ No newline at end of file
+                    self.logger.info(f'{i+1} Routes processed')
+                    inserter.flush()
+                    conn.commit()
+            inserter.close()
@@ -1,9 +1,22 @@
 #!/usr/bin/env python
 # coding:utf-8
 
+import os
+import queue
+import tempfile
+import threading
+import time
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
 
 from extractiontools.connection import Connection, DBApp
+from extractiontools.index_builder import IndexBuilder
+from extractiontools.utils import dem, link_attributes
+from extractiontools.utils.graph import NetworkGraph
 #from . import wingdbstub
 
 
@@ -23,6 +36,7 @@ class BuildNetwork(DBApp):
                  corine: str = 'clc18',
                  include_planning: bool=False,
                  routing_walk: bool=False,
+                 n_workers: int = None,
                  **kwargs
                  ):
         super().__init__(**kwargs)
@@ -38,6 +52,8 @@ class BuildNetwork(DBApp):
         self.routing_walk = routing_walk
         self.include_planning = include_planning
         self.pg_replacement = '_pg_replacement'
+        # number of connections creating the link_points and links in parallel
+        self.n_workers = n_workers or int(os.environ.get('NETWORK_WORKERS', 1))
 
     def build(self):
         """
@@ -49,50 +65,321 @@ class BuildNetwork(DBApp):
             self.conn = conn
             self.get_srid()
             # self.set_session_authorization(self.conn)
-            self.create_schema()
-            self.create_streets_view()
-
-            # create postgis_replacement_functions
-            self.create_postgis_replacement_functions()
-            self.conn.commit()
+            self.prepare_schema()
 
             # select roads and junctions
             self.logger.info(f'Create Views')
             self.create_roads()
             self.create_junctions()
             self.conn.commit()
-            self.create_functions()
-            self.conn.commit()
             # create links
-            self.fill_link_points_and_create_links()
-            self.create_chunks()
-            self.create_links()
-            self.fill_links()
-            self.conn.commit()
-            # update link attributes
-            self.update_linktypes()
-            self.update_oneway()
-            self.update_lanes()
-            self.create_slope()
-            self.update_speed()
-            self.update_time()
-            self.create_index()
-            self.create_barriers()
-            self.conn.commit()
-            # prepare the search for accessible links
-            self.create_pgrouting_network()
-            self.conn.commit()
-            self.update_egde_table()
-            self.conn.commit()
-            self.create_topology()
-            self.create_views_reachable_edges()
+            self.generate_links()
+            self.complete_network()
+            self.reset_authorization(self.conn)
+
+    def prepare_schema(self):
+        """
+        create the schema with the streets view
+        and the postgis replacement functions
+        """
+        self.create_schema()
+        self.create_streets_view()
+
+        # create postgis_replacement_functions
+        self.create_postgis_replacement_functions()
+        self.conn.commit()
+
+    def complete_network(self):
+        """
+        set the attributes of the links and check the connectivity
+        of the network
+        """
+        # update link attributes
+        self.update_link_attributes()
+        self.create_index()
+        self.create_barriers()
+        self.conn.commit()
+        # prepare the search for accessible links
+        self.create_pgrouting_network()
+        self.conn.commit()
+        self.update_egde_table()
+        self.conn.commit()
+        self.create_topology()
+        self.create_views_reachable_edges()
+        self.conn.commit()
+
+        # create the final views
+        self.create_views_accessible_links()
+        self.create_views_roadtypes()
+        self.record_osm_sequence()
+        self.conn.commit()
+
+    def update(self, wayids: List[int] = None):
+        """
+        Update the network incrementally for changed or deleted ways
+
+        The links of the changed ways and of the roads sharing a node with
+        them are regenerated in a scratch schema with the same methods as in
+        the full build and replace the old ones. The edge_table and its
+        vertices are patched in place and only the strong components of the
+        parts of the network connected to the changes are recomputed.
+        junctions_z, link_from_to_node and wayid_chunk are intermediate
+        results of the full build and are not updated.
+
+        Parameters
+        ----------
+        wayids : list of int, optional
+            the ids of the changed or deleted ways, defaults to the ways in
+            osm.changed_ways changed after the last build or update
+        """
+        with Connection(login=self.login) as conn:
+            self.conn = conn
+            if not self.table_exists(self.network, 'edge_table'):
+                raise ValueError(f'the network in schema {self.network} '
+                                 'has to be built before it can be updated')
+            self.get_srid()
+            if wayids is None:
+                wayids = self.get_changed_ways()
+            if not wayids:
+                self.logger.info(f'No changed ways to update in {self.network}')
+                return
+            self.logger.info(f'Update Network in schema {self.network} '
+                             f'for {len(wayids)} changed ways')
+            network = self.network
+            scratch = f'{network}_update'
+            self.create_update_schema(scratch, wayids)
+            self.refresh_roads()
+            self.find_affected_ways(scratch)
+            self.update_junctions(scratch)
+            self.create_update_views(scratch)
             self.conn.commit()
 
-            # create the final views
-            self.create_views_accessible_links()
-            self.create_views_roadtypes()
+            # regenerate the links of the affected ways in the scratch schema
+            self.network = scratch
+            try:
+                self.create_junctions_z()
+                self.create_link_points()
+                if self.table_exists(scratch, 'wayids', rows=True):
+                    self.generate_links()
+                else:
+                    self.create_links()
+                self.update_link_attributes()
+                self.conn.commit()
+            finally:
+                self.network = network
+
+            self.replace_links(scratch)
+            self.patch_edge_table(scratch)
+            self.update_components(scratch, 'nodes_reached',
+                                   planned=self.include_planning,
+                                   min_component_size=self.links_to_find)
+            self.record_osm_sequence()
+            self.run_query(f'DROP SCHEMA "{scratch}" CASCADE;')
             self.conn.commit()
-            self.reset_authorization(self.conn)
+
+    def table_exists(self, schema: str, table: str, rows: bool = False
+                     ) -> bool:
+        """
+        return if the table or view exists in the schema,
+        with rows=True if it has also rows
+        """
+        cur = self.conn.cursor()
+        cur.execute(f"SELECT to_regclass('\"{schema}\".\"{table}\"') "
+                    "IS NOT NULL;")
+        exists = cur.fetchone()[0]
+        if not (exists and rows):
+            return exists
+        cur.execute(f'SELECT EXISTS (SELECT 1 FROM "{schema}"."{table}");')
+        return cur.fetchone()[0]
+
+    def get_changed_ways(self) -> List[int]:
+        """
+        return the ids of the ways in osm.changed_ways with a sequence number
+        above the one recorded in the last build or update
+        """
+        if not self.table_exists(self.schema, 'changed_ways'):
+            return []
+        last_sequence = None
+        cur = self.conn.cursor()
+        if self.table_exists(self.network, 'osm_replication'):
+            cur.execute(f'SELECT max(sequence_number) '
+                        f'FROM "{self.network}".osm_replication;')
+            last_sequence = cur.fetchone()[0]
+        cur.execute(f'''
+        SELECT id FROM "{self.schema}".changed_ways
+        WHERE %(sequence)s::bigint IS NULL
+        OR sequence_number > %(sequence)s;
+        ''', {'sequence': last_sequence})
+        return [row.id for row in cur.fetchall()]
+
+    def record_osm_sequence(self):
+        """
+        record the sequence number of the last osm change applied to the
+        osm schema, which is contained in the network
+        """
+        if self.table_exists('meta', 'osm_replication'):
+            sequence = 'SELECT max(sequence_number) FROM meta.osm_replication'
+        else:
+            sequence = 'SELECT NULL::bigint'
+        sql = f'''
+CREATE TABLE IF NOT EXISTS "{self.network}".osm_replication
+(sequence_number bigint);
+TRUNCATE "{self.network}".osm_replication;
+INSERT INTO "{self.network}".osm_replication (sequence_number)
+{sequence};
+        '''
+        self.run_query(sql)
+
+    def create_update_schema(self, scratch: str, wayids: List[int]):
+        """
+        create the scratch schema for the update with the changed ways
+        """
+        sql = f'''
+DROP SCHEMA IF EXISTS "{scratch}" CASCADE;
+CREATE SCHEMA "{scratch}";
+CREATE TABLE "{scratch}".changed_ways (wayid bigint PRIMARY KEY);
+        '''
+        self.run_query(sql)
+        self.run_query(f'''
+INSERT INTO "{scratch}".changed_ways (wayid)
+SELECT DISTINCT unnest(%(wayids)s::bigint[]);
+        ''', split=False, vars={'wayids': list(wayids)})
+
+    def refresh_roads(self):
+        """
+        refresh the materialized views with the streets and roads
+        """
+        self.logger.info('Refresh Streets and Roads')
+        sql = f'''
+REFRESH MATERIALIZED VIEW "{self.network}".streets;
+REFRESH MATERIALIZED VIEW "{self.network}".roads;
+REFRESH MATERIALIZED VIEW "{self.network}".wayids;
+ANALYZE "{self.network}".roads;
+        '''
+        self.run_query(sql)
+
+    def find_affected_ways(self, scratch: str):
+        """
+        find the nodes of the changed ways before and after the change
+        and the ways, whose splitting into links may change at these nodes
+        """
+        network = self.network
+        sql = f'''
+CREATE TABLE "{scratch}".affected_nodes AS
+SELECT lp.nodeid
+FROM "{network}".link_points lp, "{scratch}".changed_ways c
+WHERE lp.wayid = c.wayid
+UNION
+SELECT wn.node_id AS nodeid
+FROM osm.way_nodes wn, "{scratch}".changed_ways c
+WHERE wn.way_id = c.wayid;
+ALTER TABLE "{scratch}".affected_nodes ADD PRIMARY KEY (nodeid);
+
+CREATE TABLE "{scratch}".affected_ways AS
+SELECT c.wayid
+FROM "{scratch}".changed_ways c
+UNION
+SELECT lp.wayid
+FROM "{network}".link_points lp, "{scratch}".affected_nodes a
+WHERE lp.nodeid = a.nodeid
+UNION
+SELECT r.id AS wayid
+FROM osm.way_nodes wn, "{scratch}".affected_nodes a, "{network}".roads r
+WHERE wn.node_id = a.nodeid
+AND wn.way_id = r.id;
+ALTER TABLE "{scratch}".affected_ways ADD PRIMARY KEY (wayid);
+ANALYZE "{scratch}".affected_ways;
+        '''
+        self.run_query(sql)
+        cur = self.conn.cursor()
+        cur.execute(f'SELECT count(*) FROM "{scratch}".affected_ways;')
+        self.logger.info(f'{cur.fetchone()[0]} ways affected by the changes')
+
+    def update_junctions(self, scratch: str):
+        """
+        recalculate the junctions at the affected nodes
+        like in create_junctions
+        """
+        network = self.network
+        sql = f'''
+DELETE FROM "{network}".junctions j
+USING "{scratch}".affected_nodes a
+WHERE j.nodeid = a.nodeid;
+
+-- Knoten, die Teil von mehr als einer Road oder Endknoten einer Road sind
+INSERT INTO "{network}".junctions (nodeid, geom, pnt_wgs)
+SELECT
+  n.id AS nodeid, n.geom, st_transform(n.geom, 4326) AS pnt_wgs
+FROM osm.nodes n,
+  ( SELECT wn.node_id
+    FROM "{scratch}".affected_nodes a,
+         osm.way_nodes wn,
+         "{network}".roads r,
+         osm.ways w
+    WHERE wn.node_id = a.nodeid
+    AND wn.way_id = r.id
+    AND w.id = r.id
+    GROUP BY wn.node_id
+    HAVING count(*) > 1
+    OR bool_or(wn.node_id IN (w.nodes[1], w.nodes[array_upper(w.nodes, 1)]))
+  ) j
+WHERE n.id = j.node_id;
+ANALYZE "{network}".junctions;
+        '''
+        self.run_query(sql)
+
+    def create_update_views(self, scratch: str):
+        """
+        create the views in the scratch schema, which restrict the roads and
+        junctions of the network to the affected ways
+        """
+        network = self.network
+        sql = f'''
+CREATE VIEW "{scratch}".streets AS
+SELECT s.* FROM "{network}".streets s;
+
+CREATE VIEW "{scratch}".roads AS
+SELECT r.*
+FROM "{network}".roads r, "{scratch}".affected_ways a
+WHERE r.id = a.wayid;
+
+CREATE VIEW "{scratch}".wayids AS
+SELECT DISTINCT id AS wayid FROM "{scratch}".roads;
+
+CREATE VIEW "{scratch}".junctions AS
+SELECT j.*
+FROM "{network}".junctions j
+WHERE j.nodeid IN (
+  SELECT wn.node_id
+  FROM osm.way_nodes wn, "{scratch}".roads r
+  WHERE wn.way_id = r.id);
+        '''
+        self.run_query(sql)
+
+    def replace_links(self, scratch: str):
+        """
+        replace the link_points and links of the affected ways
+        with the regenerated ones
+        """
+        self.logger.info('Replace Links of the affected ways')
+        network = self.network
+        columns = ', '.join(c for c in self.get_columns(network, 'links')
+                            if c != 'id')
+        sql = f'''
+DELETE FROM "{network}".link_points lp
+USING "{scratch}".affected_ways a
+WHERE lp.wayid = a.wayid;
+INSERT INTO "{network}".link_points (wayid, segment, idx, nodeid)
+SELECT wayid, segment, idx, nodeid FROM "{scratch}".link_points;
+
+DELETE FROM "{network}".links l
+USING "{scratch}".affected_ways a
+WHERE l.wayid = a.wayid;
+INSERT INTO "{network}".links ({columns})
+SELECT {columns} FROM "{scratch}".links;
+ANALYZE "{network}".links;
+        '''
+        self.run_query(sql)
 
     def spatial_ref_systems(self):
         """
@@ -292,8 +579,16 @@ AND w.nodes[array_upper(w.nodes, 1)] = n.id
 
 CREATE INDEX idx_junctions_geom ON "{network}".junctions USING gist(geom);
 ANALYZE "{network}".junctions;
+"""
+        self.run_query(sql.format(network=self.network, srid=self.srid))
+        self.create_junctions_z()
+        self.create_link_points()
 
-
+    def create_junctions_z(self):
+        """
+        calculate the z-coordinates of the junctions
+        """
+        sql = """
 -- Berechne Z-Koordinaten
 CREATE OR REPLACE VIEW "{network}".junctions_z_interpolated AS
 WITH dx AS (SELECT generate_series(-1, 1) AS dx),
@@ -362,12 +657,14 @@ CREATE INDEX pk_junctions_z ON "{network}".junctions_z USING btree(nodeid);
         self.run_query(sql.format(beta=-0.1,  # Gewichtungsfaktor weight = exp(beta * meter)
                                   max_dist=30,  # Maximale Distanz zu benachbarten Centroiden
                                   network=self.network,
-                                  srid=self.srid,
                                   pg=self.pg_replacement,
                                   ))
 
-        #
-
+    def create_link_points(self):
+        """
+        create the table link_points and the views to split the ways
+        at the junctions
+        """
         sql = """
 
 -- markiere in in der inneren Select-Abfrage die junctions in der nodelist
@@ -434,6 +731,124 @@ ORDER BY wayid, segment, idx DESC;
         """.format(network=self.network)
         self.run_query(sql)
 
+    def copy_segments(self, segments: str):
+        """
+        copy the links of the roads of this network and their junctions and
+        link points from the schema `segments`, where the ways of several
+        networks were split into links together
+
+        The ways are split at the junctions of all networks there. The
+        segments of a way, which are split at a node, which is no junction
+        of this network alone, are merged again, so that the links are the
+        same as in a build of this network on its own.
+        """
+        self.logger.info(f'Copy the links of the roads from {segments}')
+        network = self.network
+        sql = f"""
+CREATE INDEX idx_roads_id ON "{network}".roads USING btree(id);
+ANALYZE "{network}".roads;
+
+-- die wayids der roads
+CREATE MATERIALIZED VIEW "{network}".wayids AS
+SELECT DISTINCT id AS wayid FROM "{network}".roads;
+CREATE INDEX idx_wayids_wayid ON "{network}".wayids USING btree(wayid);
+
+CREATE TABLE "{network}".junctions
+(id SERIAL,
+nodeid bigint PRIMARY KEY,
+geom geometry(POINT, {self.srid}),
+pnt_wgs geometry(POINT, 4326));
+
+-- die Junctions der roads wie in create_junctions,
+-- Knoten, die Teil von mehr als einer Road oder Endknoten einer Road sind
+INSERT INTO "{network}".junctions
+SELECT
+  row_number() OVER (ORDER BY j.nodeid)::integer AS id,
+  j.nodeid,
+  j.geom,
+  j.pnt_wgs
+FROM "{segments}".junctions j
+WHERE j.nodeid IN (
+  SELECT wn.node_id
+  FROM osm.way_nodes wn, "{network}".roads r, osm.ways w
+  WHERE wn.way_id = r.id
+  AND w.id = r.id
+  GROUP BY wn.node_id
+  HAVING count(*) > 1
+  OR bool_or(wn.node_id IN (w.nodes[1], w.nodes[array_upper(w.nodes, 1)])));
+SELECT setval(pg_get_serial_sequence('"{network}".junctions', 'id'),
+              COALESCE(max(id), 0) + 1, false)
+FROM "{network}".junctions;
+
+CREATE INDEX idx_junctions_geom ON "{network}".junctions USING gist(geom);
+ANALYZE "{network}".junctions;
+
+CREATE TABLE "{network}".junctions_z AS
+SELECT z.nodeid, z.z
+FROM "{segments}".junctions_z z, "{network}".junctions j
+WHERE z.nodeid = j.nodeid;
+CREATE INDEX pk_junctions_z ON "{network}".junctions_z USING btree(nodeid);
+"""
+        self.run_query(sql)
+        self.create_link_points()
+        self.create_links()
+        links_query = self.links_query(
+            lower=f'(SELECT min(wayid) - 1 FROM "{network}".wayids)',
+            upper=f'(SELECT max(wayid) FROM "{network}".wayids)')
+        sql = f"""
+-- die Segmente der Links beginnen nur an den Junctions dieses Netzes neu
+CREATE UNLOGGED TABLE "{network}"._segments AS
+SELECT
+  l.wayid,
+  l.segment AS segment_all,
+  (sum((l.segment > 0 AND j.nodeid IS NOT NULL)::integer)
+   OVER (PARTITION BY l.wayid ORDER BY l.segment))::integer AS segment
+FROM "{segments}".links l
+JOIN "{network}".wayids w ON l.wayid = w.wayid
+LEFT JOIN "{network}".junctions j ON j.nodeid = l.fromnode;
+ALTER TABLE "{network}"._segments ADD PRIMARY KEY (wayid, segment_all);
+
+-- ein Knoten, an dem nur die Segmente geteilt wurden, ist nur einmal
+-- Punkt des zusammengefassten Segments
+INSERT INTO "{network}".link_points (wayid, segment, idx, nodeid)
+SELECT DISTINCT lp.wayid, s.segment, lp.idx, lp.nodeid
+FROM "{segments}".link_points lp
+JOIN "{network}"._segments s
+ON s.wayid = lp.wayid AND s.segment_all = lp.segment;
+ANALYZE "{network}".link_points;
+REFRESH MATERIALIZED VIEW "{network}".link_from_to_node;
+
+DROP TABLE "{network}"._segments;
+
+-- die Links aus den zusammengefassten link_points
+INSERT INTO "{network}".links (fromnode, tonode, wayid, segment, geom,
+                               linkname, linkref)
+{links_query};
+"""
+        self.run_query(sql)
+        self.conn.commit()
+
+    def generate_links(self):
+        """
+        create the link_points and the links of the roads
+        """
+        self.create_functions()
+        self.conn.commit()
+        self.fill_link_points_and_create_links()
+        self.create_chunks()
+        self.create_links()
+        self.fill_links()
+        self.conn.commit()
+
+    def update_link_attributes(self):
+        """
+        set the attributes of the links, the slope derived from the heights
+        of the junctions is refined with the elevation model, if available
+        """
+        self.update_linktypes()
+        self.compute_link_attributes()
+        self.create_slope()
+
     def drop_temp_wayids(self):
         sql = '''
 DROP TABLE IF EXISTS "{network}".temp_wayids;
@@ -442,18 +857,27 @@ DROP TABLE IF EXISTS "{network}".temp_wayids;
 
     def fill_link_points_and_create_links(self):
         """
-        fill link points and create links
+        fill link points and create links,
+        with more than one worker the chunks of ways are processed
+        in parallel
         """
+        network = self.network
         sql = """
 -- fülle Tabelle link_points mit "Knoten" und lösche dazu vorher den Index
 ALTER TABLE "{network}".link_points DROP CONSTRAINT link_points_pkey;
 DROP INDEX "{network}".link_points_nodeid;
 
 TRUNCATE "{network}".link_points;
+""".format(network=network)
+        self.run_query(sql)
+        if self.n_workers > 1:
+            self.insert_link_points_parallel()
+            return
+        sql = """
 SELECT "{network}".createlink_points(500000000,0);
 ALTER TABLE "{network}".link_points ADD PRIMARY KEY (wayid, segment, idx);
 CREATE INDEX link_points_nodeid ON "{network}".link_points USING btree(nodeid);
-""".format(network=self.network)
+""".format(network=network)
         self.run_query(sql)
         sql = """
 -- füge noch die endpoints ein
@@ -462,8 +886,152 @@ SELECT "{network}".insertendpoints(500000000,0);
 -- erstelle Tabelle mit Start und Endpunkten der links
 REFRESH MATERIALIZED VIEW "{network}".link_from_to_node;
 
-        """.format(network=self.network)
+        """.format(network=network)
+        self.run_query(sql)
+
+    def insert_link_points_parallel(self):
+        """
+        insert the link points and the endpoints of the chunks of ways
+        over parallel connections
+        """
+        network = self.network
+        bounds = self.get_chunk_bounds(
+            f'SELECT wayid AS id FROM "{network}".wayids', self.chunksize)
+
+        def link_points_chunk(part: str, lower: int, upper: int) -> str:
+            return f"""
+WITH lp (wayid, segment, idx, nodeid) AS (
+{self.link_points_query(lower, upper)})
+INSERT INTO "{network}"."{part}" (wayid, segment, idx, nodeid)
+SELECT wayid, segment, idx, nodeid FROM lp
+UNION ALL
+{self.endpoints_query('lp', lower, upper)};
+"""
+
+        self.insert_chunks('link_points', bounds, link_points_chunk)
+        sql = f"""
+ALTER TABLE "{network}".link_points ADD PRIMARY KEY (wayid, segment, idx);
+CREATE INDEX link_points_nodeid ON "{network}".link_points USING btree(nodeid);
+
+-- erstelle Tabelle mit Start und Endpunkten der links
+REFRESH MATERIALIZED VIEW "{network}".link_from_to_node;
+"""
+        self.run_query(sql)
+
+    def get_chunk_bounds(self, sql_ids: str, chunksize: int
+                         ) -> List[Tuple[int, int]]:
+        """
+        return the ranges (lower, upper] of chunks of `chunksize` ids
+        of the query `sql_ids` (an id column named `id`)
+        """
+        sql = f"""
+SELECT id
+FROM (SELECT id,
+        row_number() OVER (ORDER BY id) AS rn,
+        count(*) OVER () AS n
+      FROM ({sql_ids}) q) w
+WHERE mod(rn, {chunksize}) = 0 OR rn = n
+ORDER BY id;
+"""
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        uppers = [row.id for row in cur.fetchall()]
+        return list(zip([-1] + uppers[:-1], uppers))
+
+    def insert_chunks(self,
+                      table: str,
+                      bounds: List[Tuple[int, int]],
+                      chunk_sql: Callable[[str, int, int], str]):
+        """
+        insert the rows of the chunks of ways into the table
+        over n_workers parallel connections
+
+        Each worker takes the next chunk until all are done and writes into
+        its own unlogged partition of the table, each chunk committed on its
+        own. The partitions are merged into the table at the end.
+
+        Parameters
+        ----------
+        table : str
+            the table in the network schema
+        bounds : list of tuple
+            the ranges (lower, upper] of the wayids of the chunks
+        chunk_sql : callable
+            returns the insert statement of a chunk
+            for the partition, the lower and the upper bound
+        """
+        network = self.network
+        n_workers = min(self.n_workers, len(bounds))
+        if not n_workers:
+            return
+        parts = [f'{table}_part{i}' for i in range(n_workers)]
+        sql = ''.join(f"""
+DROP TABLE IF EXISTS "{network}"."{part}";
+CREATE UNLOGGED TABLE "{network}"."{part}"
+(LIKE "{network}"."{table}" INCLUDING DEFAULTS);
+""" for part in parts)
         self.run_query(sql)
+        self.conn.commit()
+
+        chunks = queue.Queue()
+        for n, (lower, upper) in enumerate(bounds, 1):
+            chunks.put((n, lower, upper))
+        cancelled = threading.Event()
+
+        def insert(part: str) -> int:
+            n_rows = 0
+            with Connection(login=self.login) as conn:
+                while not cancelled.is_set():
+                    try:
+                        n, lower, upper = chunks.get_nowait()
+                    except queue.Empty:
+                        break
+                    t0 = time.perf_counter()
+                    cur = self.run_query(chunk_sql(part, lower, upper),
+                                         conn=conn, split=False,
+                                         verbose=False)
+                    conn.commit()
+                    duration = time.perf_counter() - t0
+                    n_rows += cur.rowcount
+                    self.logger.info(
+                        f'{table} chunk {n}/{len(bounds)} '
+                        f'(ways {lower} to {upper}): {cur.rowcount} rows '
+                        f'in {duration:.2f}s '
+                        f'({cur.rowcount / max(duration, 1e-6):.0f} rows/s)')
+            return n_rows
+
+        self.logger.info(f'Create {table} in {len(bounds)} chunks '
+                         f'with {n_workers} workers')
+        t0 = time.perf_counter()
+        n_rows = 0
+        failed = {}
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(insert, part): part for part in parts}
+            for future in as_completed(futures):
+                part = futures[future]
+                try:
+                    n_rows += future.result()
+                except Exception as e:
+                    cancelled.set()
+                    self.logger.error(f'Creating {table} in {part} '
+                                      f'failed: {e}')
+                    failed[part] = e
+
+        merge = '' if failed else ''.join(f"""
+INSERT INTO "{network}"."{table}" SELECT * FROM "{network}"."{part}";
+""" for part in parts)
+        drop = ''.join(f'DROP TABLE "{network}"."{part}";\n'
+                       for part in parts)
+        self.run_query(merge + drop)
+        self.conn.commit()
+        if failed:
+            raise Exception(f'Creating {table} failed in {len(failed)} '
+                            f'of {n_workers} workers') \
+                from next(iter(failed.values()))
+        duration = time.perf_counter() - t0
+        self.logger.info(f'{n_rows} rows of {table} created in '
+                         f'{duration:.2f}s ({n_rows / max(duration, 1e-6):.0f}'
+                         f' rows/s)')
 
     def create_links(self):
         """
@@ -501,20 +1069,50 @@ WITH (
 
     def fill_links(self):
         """
-        fill the links
+        fill the links,
+        with more than one worker the chunks of wayid_chunk are processed
+        in parallel
         """
         self.logger.debug(f'Fill Links')
         network = self.network
         limit = self.limit or 'NULL'
-        sql = f"""
+        if self.n_workers > 1:
+            self.insert_links_parallel()
+            sql = ''
+        else:
+            sql = f"""
 TRUNCATE "{network}".links;
 SELECT "{network}".create_links({limit}, 0);
-
+"""
+        sql += f"""
 -- lösche links ohne Geometrie
 DELETE FROM "{network}".links WHERE st_NumPoints(geom) = 0;
         """
         self.run_query(sql)
 
+    def insert_links_parallel(self):
+        """
+        create the links of the chunks in wayid_chunk
+        over parallel connections
+        """
+        network = self.network
+        cur = self.conn.cursor()
+        cur.execute(f'SELECT id FROM "{network}".wayid_chunk ORDER BY id;')
+        uppers = [row.id for row in cur.fetchall()]
+        bounds = list(zip([-1] + uppers[:-1], uppers))
+        if self.limit and self.limit != 'NULL':
+            bounds = bounds[:int(self.limit)]
+        self.run_query(f'TRUNCATE "{network}".links;')
+
+        def links_chunk(part: str, lower: int, upper: int) -> str:
+            return f"""
+INSERT INTO "{network}"."{part}" (fromnode, tonode, wayid, segment, geom,
+                                  linkname, linkref)
+{self.links_query(lower, upper)};
+"""
+
+        self.insert_chunks('links', bounds, links_chunk)
+
     def create_postgis_replacement_functions(self):
         """Build postgis replacement functions required for PostgreSQL 17"""
         self.logger.debug(
@@ -643,6 +1241,110 @@ IS 'pgr_strongComponents
 '''
         cur.execute(sql)
 
+    def link_points_query(self, lower: str, upper: str) -> str:
+        """
+        return the query splitting the roads with ids in the range
+        (lower, upper] into the points of the segments between junctions
+        """
+        network = self.network
+        return f"""
+SELECT id,segment,idx,nodeid
+FROM
+(
+SELECT
+  way_marked_junctions.id,
+  way_marked_junctions.idx,
+  way_marked_junctions.nodeid,
+  way_marked_junctions.isjunction,
+  sum(way_marked_junctions.isjunction) OVER (PARTITION BY way_marked_junctions.id
+                                             ORDER BY way_marked_junctions.idx
+                                             RANGE UNBOUNDED PRECEDING) AS segment
+FROM
+    (
+    SELECT
+      wm.id,
+      wm.idx,
+      wm.nodeid,
+      (wm.idx < (wm.lastindex - 1) AND wm.idx > 0 AND wm.isjunction IS NOT NULL)::integer AS isjunction
+    FROM
+        (SELECT
+           wn.way_id AS id,
+           wn.sequence_id AS idx,
+           wn.node_id AS nodeid,
+           j.nodeid AS isjunction,
+           count(*) OVER (PARTITION BY wn.way_id) AS lastindex
+         FROM osm.way_nodes wn
+         LEFT JOIN "{network}".junctions j ON (wn.node_id = j.nodeid),
+         "{network}".roads r
+         WHERE wn.way_id = r.id AND r.id > {lower} AND r.id <= {upper}
+         ) wm
+   ) way_marked_junctions
+GROUP BY way_marked_junctions.id,
+         way_marked_junctions.idx,
+         way_marked_junctions.nodeid,
+         way_marked_junctions.isjunction
+ORDER BY way_marked_junctions.id,
+         way_marked_junctions.idx
+) wl"""
+
+    def endpoints_query(self, source: str, lower: str, upper: str) -> str:
+        """
+        return the query selecting the junctions of the link points in
+        `source` with wayids in the range (lower, upper] as last point of
+        the preceding segment
+        """
+        network = self.network
+        return f"""
+SELECT a.wayid, a.segment, a.idx, a.nodeid
+FROM
+(SELECT
+  lp.wayid,
+  lp.segment-1 AS segment,
+  idx,
+  lp.nodeid,
+  max(idx) OVER(PARTITION BY wayid ) AS lastindex,
+  (j.nodeid is not null) As junct
+FROM
+  {source} lp LEFT JOIN "{network}".junctions j ON (lp.nodeid=j.nodeid)
+  WHERE wayid > {lower} AND wayid <= {upper}
+) a
+WHERE
+  junct and
+  idx > 0 AND idx < lastindex"""
+
+    def links_query(self, lower: str, upper: str) -> str:
+        """
+        return the query building the links from the link points
+        with wayids in the range (lower, upper]
+        """
+        network = self.network
+        return f"""
+SELECT l.fromnode, l.tonode, l.wayid, l.segment, l.geom,
+w.tags -> 'name' AS linkname, w.tags -> 'ref' AS linkref
+FROM
+(
+SELECT fromnode, tonode, wayid, segment, St_MakeLine(geom ORDER BY lp.idx ASC) geom
+FROM
+ (SELECT ft.fromnode,
+     ft.tonode,
+     lp.wayid AS wayid,
+     lp.segment as segment,
+     n.geom AS geom,
+     lp.idx idx
+  FROM
+    "{network}".link_points lp,
+    "{network}".link_from_to_node AS ft,
+    osm.nodes n
+  WHERE
+    lp.wayid = ft.wayid and lp.segment = ft.segment
+    and lp.nodeid = n.id
+    AND lp.wayid > {lower} AND lp.wayid <= {upper}
+    AND ft.wayid > {lower} AND ft.wayid <= {upper}
+)lp
+GROUP BY fromnode, tonode, wayid, segment) AS l,
+osm.ways w
+WHERE w.id = l.wayid"""
+
     def create_functions(self):
         """
         Create functions to create link_points and links
@@ -670,44 +1372,7 @@ LOOP
     toRow := fl.wayid;
     RAISE NOTICE 'Erstelle link_points für way % to %', fromRow, toRow;
     INSERT INTO "{network}".link_points (wayid,segment,idx,nodeid)
-    SELECT id,segment,idx,nodeid
-    FROM
-    (
-    SELECT
-      way_marked_junctions.id,
-      way_marked_junctions.idx,
-      way_marked_junctions.nodeid,
-      way_marked_junctions.isjunction,
-      sum(way_marked_junctions.isjunction) OVER (PARTITION BY way_marked_junctions.id
-                                                 ORDER BY way_marked_junctions.idx
-                                                 RANGE UNBOUNDED PRECEDING) AS segment
-    FROM
-        (
-        SELECT
-          wm.id,
-          wm.idx,
-          wm.nodeid,
-          (wm.idx < (wm.lastindex - 1) AND wm.idx > 0 AND wm.isjunction IS NOT NULL)::integer AS isjunction
-        FROM
-            (SELECT
-               wn.way_id AS id,
-               wn.sequence_id AS idx,
-               wn.node_id AS nodeid,
-               j.nodeid AS isjunction,
-               count(*) OVER (PARTITION BY wn.way_id) AS lastindex
-             FROM osm.way_nodes wn
-             LEFT JOIN "{network}".junctions j ON (wn.node_id = j.nodeid),
-             "{network}".roads r
-             WHERE wn.way_id = r.id AND r.id > fromRow AND r.id <= toRow
-             ) wm
-       ) way_marked_junctions
-    GROUP BY way_marked_junctions.id,
-             way_marked_junctions.idx,
-             way_marked_junctions.nodeid,
-             way_marked_junctions.isjunction
-    ORDER BY way_marked_junctions.id,
-             way_marked_junctions.idx
-    ) wl
+    {link_points}
     ;
     fromRow := toRow;
   END IF;
@@ -718,7 +1383,8 @@ $BODY$
   LANGUAGE plpgsql VOLATILE
   COST 100;
   COMMIT;
-  '''.format(chunksize=self.chunksize, network=self.network)
+  '''.format(chunksize=self.chunksize, network=self.network,
+             link_points=self.link_points_query('fromRow', 'toRow'))
         cur.execute(sql)
 
         sql = '''
@@ -746,22 +1412,7 @@ IF mod(fl.rowid,10000) = 0 OR fl.wayid = maxRow THEN
     RAISE NOTICE 'Erstelle Endpunkte für way % bis %', fromRow, toRow;
 
 INSERT INTO "{network}".link_points
-SELECT a.wayid, a.segment, a.idx, a.nodeid
-FROM
-(SELECT
-  lp.wayid,
-  lp.segment-1 AS segment,
-  idx,
-  lp.nodeid,
-  max(idx) OVER(PARTITION BY wayid ) AS lastindex,
-  (j.nodeid is not null) As junct
-FROM
-  "{network}".link_points lp LEFT JOIN "{network}".junctions j ON (lp.nodeid=j.nodeid)
-  WHERE wayid > fromRow AND wayid <= toRow
-) a
-WHERE
-  junct and
-  idx > 0 AND idx < lastindex
+{endpoints}
 ;
 fromRow := toRow;
 END IF;
@@ -772,7 +1423,9 @@ $BODY$
   LANGUAGE plpgsql VOLATILE
   COST 100;
   COMMIT;
-  '''.format(network=self.network)
+  '''.format(network=self.network,
+             endpoints=self.endpoints_query(
+                 f'"{self.network}".link_points', 'fromRow', 'toRow'))
         cur.execute(sql)
 
         sql = """
@@ -795,31 +1448,7 @@ BEGIN
   LOOP
 	INSERT INTO "{network}".links (fromnode, tonode, wayid, segment, geom,
                                linkname, linkref)
-    SELECT l.fromnode, l.tonode, l.wayid, l.segment, l.geom,
-    w.tags -> 'name' AS linkname, w.tags -> 'ref' AS linkref
-    FROM
-    (
-	SELECT fromnode, tonode, wayid, segment, St_MakeLine(geom ORDER BY lp.idx ASC) geom
-	FROM
-	 (SELECT ft.fromnode,
-		 ft.tonode,
-		 lp.wayid AS wayid,
-		 lp.segment as segment,
-		 n.geom AS geom,
-		 lp.idx idx
-	  FROM
-	    "{network}".link_points lp,
-	    "{network}".link_from_to_node AS ft,
-	    osm.nodes n
-	  WHERE
-	    lp.wayid = ft.wayid and lp.segment = ft.segment
-	    and lp.nodeid = n.id
-	    AND lp.wayid>fl.rowidfrom and lp.wayid <= fl.rowidto
-	    AND ft.wayid>fl.rowidfrom and ft.wayid <= fl.rowidto
-	)lp
-	GROUP BY fromnode, tonode, wayid, segment) AS l,
-    osm.ways w
-    WHERE w.id = l.wayid;
+    {links};
     RAISE NOTICE 'Noch % links: Erstelle links von % bis %', fl.todo, fl.rowidfrom, fl.rowidto;
   END LOOP;
 RETURN fl.rowidto;
@@ -828,7 +1457,8 @@ $BODY$
   LANGUAGE plpgsql VOLATILE
   COST 100;
 COMMIT;
-        """.format(chunksize=self.chunksize, network=self.network)
+        """.format(chunksize=self.chunksize, network=self.network,
+                   links=self.links_query('fl.rowidfrom', 'fl.rowidto'))
         cur.execute(sql)
 
     def update_linktypes(self):
@@ -883,196 +1513,298 @@ AND w.tags @> lt.tag2;
            corine=corine)
         self.run_query(sql)
 
-    def update_speed(self):
+    def compute_link_attributes(self):
         """
+        derive the oneway, lanes, bridges and tunnels, slope, speed and
+        travel time of the links from the tags of their ways in one pass
+        and replace the links table with a new one holding the results
         """
-        self.logger.debug('Set Maxspeed and Average Speed')
-
+        self.logger.debug('Compute the attributes of the links')
+        network = self.network
         sql = """
--- erzeuge speed_zulaessig
-ALTER TABLE "{network}".links
-  ADD COLUMN speed_zulaessig INTEGER;
-ALTER TABLE "{network}".links
-  ALTER COLUMN speed_zulaessig SET DEFAULT 50;
-
--- setze maxspeed aus tags
-UPDATE "{network}".links l
-SET maxspeed = substring(w.tags -> 'maxspeed' FROM '[-+]?\d*\.\d+|\d+')::float,
-    speed_zulaessig = substring(w.tags -> 'maxspeed' FROM '[-+]?\d*\.\d+|\d+')::float::integer
-FROM osm.ways w
-WHERE l.wayid=w.id and w.tags ? 'maxspeed';
-
--- setze maxspeed auf 120 für BAB-Abschnitte mit Wechselanzeigen
-UPDATE "{network}".links l
-SET maxspeed = 120,
-    speed_zulaessig = 120
-FROM osm.ways w
-WHERE l.wayid=w.id and w.tags -> 'maxspeed' = 'signals';
-
--- setze maxspeed auf 150 für BAB-Abschnitte ohne Geschwindigkeitsbegrenzung
-UPDATE "{network}".links l
-SET maxspeed = 150,
-    speed_zulaessig = 150
-FROM osm.ways w
-WHERE l.wayid=w.id and w.tags -> 'maxspeed' = 'none';
-
-UPDATE "{network}".links l
-SET maxspeed = ld.v_kfz,
-    speed_zulaessig = ld.v_kfz_zulaessig
+SELECT ld.linktype_number AS linktype, ld.innerorts AS io,
+  ld.v_kfz, ld.v_kfz_zulaessig
 FROM classifications.link_defaults ld, classifications.linktypes lt
-WHERE
-ld.linktype_number = lt.id AND
-ld.linktype_number = l.linktype AND ld.innerorts = l.io
-AND l.maxspeed IS NULL;
+WHERE ld.linktype_number = lt.id;
+"""
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        defaults = pd.DataFrame(cur.fetchall(),
+                                columns=[c.name for c in cur.description])
+        cur.execute('SELECT id, road_category '
+                    'FROM classifications.linktypes;')
+        road_categories = pd.Series({row.id: row.road_category
+                                     for row in cur.fetchall()})
 
-UPDATE "{network}".links l
-SET maxspeed = ld.v_kfz
-FROM classifications.link_defaults ld, classifications.linktypes lt
-WHERE
-ld.linktype_number = lt.id AND
-ld.linktype_number = l.linktype AND ld.innerorts = l.io
-AND ld.v_kfz < l.maxspeed and lt.road_category >'A';
-        """.format(network=self.network)
+        sql = f"""
+DROP TABLE IF EXISTS "{network}".link_attributes;
+CREATE UNLOGGED TABLE "{network}".link_attributes
+(
+  id bigint PRIMARY KEY,
+  fromnode bigint,
+  tonode bigint,
+  reverse boolean,
+  linkname text,
+  oneway boolean,
+  lanes smallint,
+  bridge_tunnel "char",
+  slope double precision,
+  maxspeed integer,
+  speed_zulaessig integer,
+  t_kfz double precision
+);
+"""
         self.run_query(sql)
 
-    def update_oneway(self):
+        t0 = time.perf_counter()
+        n_links = self.bulk_insert(
+            'link_attributes',
+            self.link_attribute_rows(defaults, road_categories),
+            columns=link_attributes.ATTRIBUTE_COLUMNS,
+            schema=network, binary=True, batch_size=100000)
+        self.logger.info(f'Attributes of {n_links} links computed in '
+                         f'{time.perf_counter() - t0:.2f}s')
+        # an empty links table is swapped as well, so that the links
+        # have the same columns in any case
+        self.swap_links()
+
+    def link_attribute_rows(self,
+                            defaults: pd.DataFrame,
+                            road_categories: pd.Series) -> Iterator[List]:
         """
-        Update oneway streets
-        """
-        self.logger.debug('Update Oneway Streets')
-        sql = """
-UPDATE "{network}".links l
-SET oneway = TRUE
-FROM osm.ways w
-WHERE
-(  w.tags -> 'oneway' = 'motor_vehicle' OR
-  w.tags -> 'oneway' = 'true' OR
-  w.tags -> 'oneway' = 'yes' OR
-  w.tags -> 'junction' = 'roundabout' OR
-  w.tags -> 'oneway' = '1')
-AND w.id = l.wayid
-;
-
-UPDATE "{network}".links l
-SET oneway = FALSE
-FROM osm.ways w
-WHERE
-  w.tags -> 'oneway' = 'no'
-AND w.id = l.wayid
-;
+        fetch the links with the tags of their ways in batches and yield the
+        rows of the computed link attributes batch by batch
 
--- drehe links mit oneway = -1 und setze oneway auf True
-UPDATE "{network}".links l
-SET oneway = TRUE,
-    fromnode = tonode,
-    tonode = fromnode,
-    geom = st_reverse(geom)
-FROM osm.ways w
-WHERE
-  w.tags -> 'oneway' = '-1'
-AND w.id = l.wayid
-;
-        """.format(network=self.network)
-        self.run_query(sql)
-
-    def update_time(self):
+        the links are ordered by way and the links of the last way of a batch
+        are deferred to the next batch, so that all segments of a way,
+        e.g. of a ferry, are computed together
         """
-        Update Travel Times
-        """
-        self.logger.debug('Update travel times for links')
-
-        sql = """
-UPDATE "{network}".links l
-SET
-  t_kfz = CASE
-    WHEN l.maxspeed = 0
-    THEN 9999999
-    ELSE st_length(l.geom) / l.maxspeed * 3.6 / 60
-    END;
-
--- Ferries
-UPDATE "{network}".links l
-SET
-  t_kfz = g.duration
-FROM
-(
-  SELECT
-    f.wayid,
-    f.segment,
-    CASE
-      WHEN rn=1
-      THEN f.duration
-      ELSE 0.01
-    END AS duration
-FROM
-(SELECT
-    l.wayid, l.segment,
-    substring(w.tags -> 'duration', '[-+]?\d*\.\d+|\d+')::double precision AS duration,
-    row_number() OVER (PARTITION BY l.wayid ORDER BY st_length(l.geom) DESC) AS rn
-FROM
- "{network}".links l,
- classifications.linktypes lt,
- osm.ways w
-WHERE lt.road_category = 'D'
-AND w.tags ? 'duration'
-AND l.wayid = w.id AND l.linktype = lt.id) f
-) g
-WHERE l.wayid = g.wayid AND l.segment = g.segment;
-        """.format(network=self.network)
-        self.run_query(sql)
-
-    def update_lanes(self):
+        network = self.network
+        tags = ',\n  '.join(f"w.tags -> '{tag}' AS tag_{tag}"
+                            for tag in link_attributes.TAGS)
+        sql = f"""
+SELECT
+  l.id, l.fromnode, l.tonode, l.wayid, l.segment,
+  st_length(l.geom) AS length,
+  l.linkname, l.linkref, l.linktype, l.io,
+  COALESCE(zf.z, 'NaN') AS z_from,
+  COALESCE(zt.z, 'NaN') AS z_to,
+  {tags}
+FROM "{network}".links l
+LEFT JOIN osm.ways w ON w.id = l.wayid
+LEFT JOIN "{network}".junctions_z zf ON zf.nodeid = l.fromnode
+LEFT JOIN "{network}".junctions_z zt ON zt.nodeid = l.tonode
+ORDER BY l.wayid, l.segment
+"""
+        dtypes = {'id': 'i8', 'fromnode': 'i8', 'tonode': 'i8', 'wayid': 'i8',
+                  'segment': 'i4', 'length': 'f8', 'io': bool,
+                  'z_from': 'f8', 'z_to': 'f8'}
+        integer_columns = ('id', 'fromnode', 'tonode', 'lanes', 'maxspeed',
+                           'speed_zulaessig')
+        deferred = None
+        for batch in self.iter_query(sql, arrays=True, dtypes=dtypes,
+                                     itersize=100000):
+            links = pd.DataFrame(batch)
+            if deferred is not None:
+                links = pd.concat([deferred, links], ignore_index=True)
+            last_way = links['wayid'].iat[-1]
+            is_last_way = (links['wayid'] == last_way).to_numpy()
+            deferred = links[is_last_way]
+            if is_last_way.all():
+                continue
+            attrs = link_attributes.car_attributes(
+                links[~is_last_way], defaults, road_categories)
+            yield from link_attributes.to_rows(
+                attrs, integer_columns=integer_columns)
+        if deferred is not None:
+            attrs = link_attributes.car_attributes(
+                deferred, defaults, road_categories)
+            yield from link_attributes.to_rows(
+                attrs, integer_columns=integer_columns)
+
+    def swap_links(self):
         """
+        replace the links with a new table joining the computed
+        link_attributes, which leaves no dead tuples behind
         """
-        self.logger.debug('Update number of lanes')
-        sql = """
-UPDATE "{network}".links l
-SET lanes = 1
-WHERE l.oneway;
-
-UPDATE "{network}".links l
-SET lanes = GREATEST(LEAST(substring(w.tags->'lanes' FROM '[0-9]+')::integer, 10), 0)
-FROM osm.ways w
-WHERE l.wayid=w.id AND w.tags ? 'lanes';
+        network = self.network
+        attributes = set(link_attributes.ATTRIBUTE_COLUMNS) - {'id', 'reverse'}
+        columns = self.get_columns(network, 'links')
+        if 'speed_zulaessig' not in columns:
+            columns.append('speed_zulaessig')
+        select = []
+        for col in columns:
+            if col == 'geom':
+                select.append('CASE WHEN a.reverse THEN st_reverse(l.geom) '
+                              'ELSE l.geom END')
+            elif col in attributes:
+                select.append(f'a.{col}')
+            else:
+                select.append(f'l.{col}')
+        select = ',\n  '.join(select)
+        cur = self.conn.cursor()
+        cur.execute(f"""SELECT pg_get_serial_sequence('"{network}".links', """
+                    """'id') AS seq;""")
+        sequence = cur.fetchone().seq
+        # keep the sequence of the ids, when the old links are dropped
+        owned_by = (f'ALTER SEQUENCE {sequence} '
+                    f'OWNED BY "{network}".links_new.id;'
+                    if sequence else '')
+        sql = f"""
+DROP TABLE IF EXISTS "{network}".links_new;
+CREATE TABLE "{network}".links_new
+(LIKE "{network}".links INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+ALTER TABLE "{network}".links_new
+  ADD COLUMN IF NOT EXISTS speed_zulaessig integer DEFAULT 50;
 
-UPDATE "{network}".links l
-SET bridge_tunnel = 'b'
-FROM osm.ways w
-WHERE l.wayid=w.id AND w.tags ? 'bridge' AND w.tags->'bridge' <> 'no';
-;
+INSERT INTO "{network}".links_new ({', '.join(columns)})
+SELECT
+  {select}
+FROM "{network}".links l
+JOIN "{network}".link_attributes a ON a.id = l.id;
 
-UPDATE "{network}".links l
-SET bridge_tunnel = 't'
-FROM osm.ways w
-WHERE l.wayid=w.id AND w.tags ? 'tunnel' AND w.tags->'tunnel' <> 'no';
-;
+{owned_by}
+DROP TABLE "{network}".links;
+ALTER TABLE "{network}".links_new RENAME TO links;
+DROP TABLE "{network}".link_attributes;
 
-UPDATE "{network}".links l
-SET linkname = linkref
-WHERE linkname IS NULL AND linkref IS NOT NULL;
-        """.format(network=self.network)
+CREATE INDEX idx_links_geom ON "{network}".links USING gist (geom);
+CREATE INDEX idx_links_linktype ON "{network}".links USING btree (linktype, io);
+ANALYZE "{network}".links;
+"""
         self.run_query(sql)
 
     def create_slope(self):
         """
+        calculate the slope of the links from the heights of all their
+        vertices sampled in the elevation model (landuse.aster) and store
+        the slope statistics in the table link_slopes
         """
         self.logger.debug('calculate slope of links')
-        sql = """
+        network = self.network
+        with tempfile.TemporaryDirectory() as folder:
+            dem_srid = self.export_dem(os.path.join(folder, 'dem'))
+            if dem_srid is None:
+                self.logger.warning('No elevation data found, '
+                                    'the slope of the links is not updated')
+                return
+            elevation = dem.DEM.load(os.path.join(folder, 'dem'))
+            sql = f"""
+SELECT
+  l.wayid,
+  l.segment,
+  ST_AsBinary(ST_Force2D(l.geom)) AS geom,
+  ST_AsBinary(ST_Force2D(ST_Transform(l.geom, {dem_srid}))) AS geom_dem
+FROM "{network}".links l
+WHERE l.bridge_tunnel = '';
+"""
+            slopes = []
+            for rows in self.iter_query(sql, itersize=100000):
+                slopes.extend(self.slope_rows(rows, elevation))
+
+        sql = f"""
+DROP TABLE IF EXISTS "{network}".link_slopes;
+CREATE TABLE "{network}".link_slopes
+(
+  wayid bigint,
+  segment integer,
+  slope double precision,
+  ascent double precision,
+  descent double precision,
+  max_slope double precision,
+  PRIMARY KEY (wayid, segment)
+);
+"""
+        self.run_query(sql)
+        self.bulk_insert('link_slopes', slopes,
+                         columns=('wayid', 'segment', 'slope', 'ascent',
+                                  'descent', 'max_slope'),
+                         schema=network, binary=True, batch_size=100000)
+        sql = f"""
 UPDATE "{network}".links l
-SET slope = CASE
-            WHEN st_length(l.geom)=0
-            THEN 0
-            ELSE (tn.z-fn.z) / st_length(l.geom)
-            END
-FROM
-"{network}".junctions_z fn,
-"{network}".junctions_z tn
-WHERE fn.nodeid = l.fromnode
-AND tn.nodeid = l.tonode
-AND bridge_tunnel = '';
-        """.format(network=self.network)
+SET slope = s.slope
+FROM "{network}".link_slopes s
+WHERE l.wayid = s.wayid
+AND l.segment = s.segment
+AND s.slope IS NOT NULL;
+"""
         self.run_query(sql)
 
+    @staticmethod
+    def slope_rows(rows: List[tuple], elevation: dem.DEM) -> List[tuple]:
+        """
+        return the wayid, segment and slope statistics of the links
+        """
+        coords = [dem.linestring_coords(row.geom) for row in rows]
+        coords_dem = np.concatenate(
+            [dem.linestring_coords(row.geom_dem) for row in rows])
+        offsets = np.cumsum([0] + [len(c) for c in coords])
+        coords = np.concatenate(coords)
+        distances = np.hypot(*np.diff(coords, axis=0, prepend=np.nan).T)
+        z = elevation.sample(coords_dem[:, 0], coords_dem[:, 1])
+        stats = dem.slope_statistics(z, distances, offsets)
+        return [(row.wayid, row.segment) + tuple(
+                    None if np.isnan(v) else float(v) for v in s)
+                for row, s in zip(rows, stats)]
+
+    def export_dem(self, path: str) -> int:
+        """
+        export the tiles of the elevation model around the links to a
+        memory-mappable array at path
+
+        Returns
+        -------
+        int : the srid of the elevation model, None if there is no data
+        """
+        if not self.table_exists('landuse', 'aster', rows=True):
+            return None
+        cur = self.conn.cursor()
+        cur.execute('SELECT ST_SRID(a.rast) AS srid, '
+                    'abs(ST_ScaleX(a.rast)) AS cellsize '
+                    'FROM landuse.aster a LIMIT 1;')
+        row = cur.fetchone()
+        dem_srid, cellsize = row.srid, row.cellsize
+        extent = f"""
+WITH ext AS (
+  SELECT ST_Expand(
+    ST_Transform(ST_SetSRID(ST_Extent(l.geom)::geometry, {self.srid}),
+                 {dem_srid}),
+    {2 * cellsize}) AS geom
+  FROM "{self.network}".links l)
+"""
+        header = """
+  ST_UpperLeftX(a.rast) AS ulx,
+  ST_UpperLeftY(a.rast) AS uly,
+  ST_ScaleX(a.rast) AS scalex,
+  ST_ScaleY(a.rast) AS scaley,
+  ST_SkewX(a.rast) AS skewx,
+  ST_SkewY(a.rast) AS skewy"""
+        cur.execute(f"""{extent}
+SELECT {header},
+  ST_Width(a.rast) AS width,
+  ST_Height(a.rast) AS height
+FROM landuse.aster a, ext
+WHERE ST_Intersects(a.rast, ext.geom);
+""")
+        headers = [tuple(row) for row in cur.fetchall()]
+        if not headers:
+            return None
+        sql = f"""{extent}
+SELECT {header},
+  ST_BandNoDataValue(a.rast, 1) AS nodata,
+  ST_DumpValues(a.rast, 1, false) AS values
+FROM landuse.aster a, ext
+WHERE ST_Intersects(a.rast, ext.geom);
+"""
+        # the tiles are written into the memory-mapped file as they come
+        tiles = (tuple(row) for rows in self.iter_query(sql, itersize=100)
+                 for row in rows)
+        elevation = dem.DEM.from_tiles(tiles, path=path, headers=headers)
+        self.logger.info(f'Elevation model of {len(headers)} tiles with '
+                         f'{elevation.values.shape[0]}x'
+                         f'{elevation.values.shape[1]} cells exported')
+        return dem_srid
+
     def create_chunks(self):
         self.logger.debug('Create chunks')
         sql = """
@@ -1162,7 +1894,9 @@ CREATE INDEX idx_links_bridge ON "{network}".links USING btree (bridge_tunnel) W
 CREATE INDEX idx_links_fromnode_tonode ON "{network}".links USING btree (fromnode, tonode);
 CLUSTER "{network}".links USING idx_links_geom;
         """.format(network=self.network)
-        self.run_query(sql)
+        index_builder = IndexBuilder(self)
+        index_builder.add(sql)
+        index_builder.run(conn=self.conn)
 
     def create_views_accessible_links(self):
         """
@@ -1237,8 +1971,8 @@ fromnode bigint,
 tonode bigint,
 linkid bigint,
 geom geometry(LineString,{srid}),
-"source" integer,
-"target" integer,
+"source" bigint,
+"target" bigint,
 cost float,
 reverse_cost float,
 wayid bigint,
@@ -1268,20 +2002,18 @@ e.fromnode=l.fromnode AND e.tonode=l.tonode AND
         """.format(network=self.network)
         self.run_query(sql)
 
-    def update_egde_table(self):
+    # the columns of the edge_table selected by edges_query
+    edge_columns = ('fromnode', 'tonode', 'linkid', 'geom', 'cost',
+                    'reverse_cost', 'wayid', 'segment', 'planned')
+
+    def edges_query(self) -> str:
         """
-        Updates the edge_table
+        return the query selecting the edges from the links
         """
-        self.logger.info('Update Edge Table')
-        sql = """
-
-TRUNCATE "{network}".edge_table;
-INSERT INTO "{network}".edge_table (id, fromnode, tonode, linkid, geom,
-cost, reverse_cost, wayid, segment, planned)
+        return f"""
 SELECT
-  row_number() OVER (ORDER BY fromnode, tonode)::integer AS id,
-  fromnode,
-  tonode,
+  l.fromnode,
+  l.tonode,
   l.id,
   l.geom,
   l.t_kfz AS cost,
@@ -1289,37 +2021,129 @@ SELECT
   l.wayid,
   l.segment,
   l.planned OR l.construction AS planned
-FROM "{network}".links l;
-        """.format(network=self.network)
+FROM "{self.network}".links l"""
+
+    def update_egde_table(self):
+        """
+        Updates the edge_table
+        """
+        self.logger.info('Update Edge Table')
+        network = self.network
+        columns = ', '.join(self.edge_columns)
+        sql = f"""
+
+TRUNCATE "{network}".edge_table;
+INSERT INTO "{network}".edge_table (id, {columns})
+SELECT
+  row_number() OVER (ORDER BY e.fromnode, e.tonode)::integer AS id,
+  e.*
+FROM ({self.edges_query()}) e;
+        """
+        self.run_query(sql)
+
+    def patch_edge_table(self, scratch: str):
+        """
+        replace the edges of the affected ways in the edge_table
+        and add and remove the vertices of the topology accordingly
+        """
+        self.logger.info('Patch Edge Table and Topology')
+        network = self.network
+        columns = ', '.join(self.edge_columns)
+        vertices = f'"{network}".edge_table_vertices_pgr'
+        touched_vertices = self.vertices_query(
+            f'v.id IN (SELECT t.id FROM "{scratch}".touched_vertices t)')
+        sql = f"""
+CREATE TABLE "{scratch}".touched_vertices (id bigint);
+
+WITH deleted AS (
+  DELETE FROM "{network}".edge_table e
+  USING "{scratch}".affected_ways a
+  WHERE e.wayid = a.wayid
+  RETURNING e.source, e.target)
+INSERT INTO "{scratch}".touched_vertices (id)
+SELECT source FROM deleted
+UNION
+SELECT target FROM deleted;
+
+INSERT INTO "{network}".edge_table (id, {columns})
+SELECT
+  (m.max_id + row_number() OVER (ORDER BY e.fromnode, e.tonode))::integer AS id,
+  e.*
+FROM ({self.edges_query()}) e,
+  "{scratch}".affected_ways a,
+  (SELECT COALESCE(max(id), 0) AS max_id FROM "{network}".edge_table) m
+WHERE e.wayid = a.wayid;
+
+UPDATE "{network}".edge_table
+SET source = fromnode, target = tonode
+WHERE source IS NULL;
+
+INSERT INTO "{scratch}".touched_vertices (id)
+SELECT e.source
+FROM "{network}".edge_table e, "{scratch}".affected_ways a
+WHERE e.wayid = a.wayid
+UNION
+SELECT e.target
+FROM "{network}".edge_table e, "{scratch}".affected_ways a
+WHERE e.wayid = a.wayid;
+
+-- erzeuge die betroffenen Vertices neu,
+-- Vertices ohne Kanten entfallen dabei
+DELETE FROM {vertices} AS v
+USING "{scratch}".touched_vertices t
+WHERE v.id = t.id;
+INSERT INTO {vertices}
+{touched_vertices};
+ANALYZE "{network}".edge_table;
+        """
         self.run_query(sql)
 
     def create_topology(self):
         """
-        create and analyze the topology
+        create the topology keyed on the OSM ids of the from- and tonodes
+
+        The links are split at the junctions, so the nodes at the start and
+        the end of the edges are the vertices and their ids can be used
+        as source and target instead of comparing the geometries
         """
         self.logger.info('Create Topology')
-
+        network = self.network
         sql = f'''
-        SELECT * INTO {self.network}.edge_table_vertices_pgr
-        FROM pgr_extractVertices(
-            'SELECT id, geom FROM {self.network}.edge_table'
-        );
+        UPDATE "{network}".edge_table
+        SET source = fromnode, target = tonode;
+
+        CREATE TABLE "{network}".edge_table_vertices_pgr AS
+        {self.vertices_query()};
+        ALTER TABLE "{network}".edge_table_vertices_pgr ADD PRIMARY KEY (id);
+        ANALYZE "{network}".edge_table;
         '''
-        self.logger.info('Extracting vertices')
         self.run_query(sql)
 
-        update_st_sql = f'''
-        UPDATE {self.network}.edge_table AS e
-        SET source = v.id
-        FROM {self.network}.edge_table_vertices_pgr AS v
-        WHERE ST_StartPoint(e.geom) = v.geom;
-        UPDATE {self.network}.edge_table AS e
-        SET target = v.id
-        FROM {self.network}.edge_table_vertices_pgr AS v
-        WHERE ST_EndPoint(e.geom) = v.geom;
-        '''
-        self.logger.info('Setting source and target vertices to edges')
-        self.run_query(update_st_sql)
+    def vertices_query(self, where: str = 'TRUE') -> str:
+        """
+        return the query selecting the vertices of the edge_table
+        with their in- and outgoing edges like pgr_extractVertices
+        """
+        return f'''
+        WITH ends AS (
+          SELECT e.source AS id, NULL::bigint AS in_edge, e.id AS out_edge
+          FROM "{self.network}".edge_table e
+          UNION ALL
+          SELECT e.target AS id, e.id AS in_edge, NULL::bigint AS out_edge
+          FROM "{self.network}".edge_table e)
+        SELECT
+          v.id,
+          array_agg(v.in_edge ORDER BY v.in_edge)
+            FILTER (WHERE v.in_edge IS NOT NULL) AS in_edges,
+          array_agg(v.out_edge ORDER BY v.out_edge)
+            FILTER (WHERE v.out_edge IS NOT NULL) AS out_edges,
+          st_x(n.geom) AS x,
+          st_y(n.geom) AS y,
+          n.geom
+        FROM ends v
+        JOIN "{self.schema}".nodes n ON n.id = v.id
+        WHERE {where}
+        GROUP BY v.id, n.geom'''
 
     def create_views_reachable_edges(self):
         self.create_view_reachable_nodes('nodes_reached', planned=self.include_planning,
@@ -1328,25 +2152,106 @@ FROM "{network}".links l;
                                          planned=self.include_planning)
 
     def create_view_reachable_nodes(self, target_view_name, planned=False, min_component_size=10):
-        where = 'WHERE planned = FALSE' if not planned else ''
-        edge_query = f'SELECT id, source, target, cost, reverse_cost FROM {self.network}.edge_table {where};'
+        """
+        store the strong and weak components of the network in a table and
+        create the view with the nodes of the strong components with more
+        than min_component_size nodes
+        """
+        components = f'{target_view_name}_components'
         sql = f'''
+        CREATE TABLE "{self.network}"."{components}" (
+        node bigint PRIMARY KEY,
+        component bigint,
+        weak_component bigint,
+        reached boolean);
+        '''
+        self.run_query(sql)
+        self.compute_components(components, planned=planned,
+                                min_component_size=min_component_size)
+
+        sql = f'''
+        CREATE INDEX "{components}_component_idx"
+        ON "{self.network}"."{components}" USING btree(component);
+        CREATE INDEX "{components}_weak_component_idx"
+        ON "{self.network}"."{components}" USING btree(weak_component);
+
         CREATE OR REPLACE VIEW "{self.network}"."{target_view_name}" AS
-        WITH c AS (
-        SELECT * FROM "{self.pg_replacement}".pgr_strongComponents('{edge_query}')
-        ),
-        d AS (
-        SELECT c.component, count(*) AS cnt
-        FROM c
-        GROUP BY c.component)
+        SELECT c.node, c.component
+        FROM "{self.network}"."{components}" c
+        WHERE c.reached;
+        '''
+        self.run_query(sql)
 
-        SELECT
-        c.node, c.component
-        FROM c, d
-        WHERE c.component = d.component
-        AND d.cnt > {min_component_size};
+    graph_dtypes = {'fromnode': 'i8', 'tonode': 'i8',
+                    'cost': 'f8', 'reverse_cost': 'f8'}
+
+    def compute_components(self, components: str, planned: bool = False,
+                           min_component_size: int = 10,
+                           where: str = 'TRUE'):
+        """
+        compute the strong and weak components of the edges in memory
+        and copy them into the components table
+        """
+        sql = f'''
+        SELECT e.fromnode, e.tonode, e.cost, e.reverse_cost
+        FROM "{self.network}".edge_table e
+        WHERE {'e.planned = FALSE AND ' if not planned else ''}{where}
+        '''
+        graph = NetworkGraph.from_batches(
+            self.iter_query(sql, arrays=True, dtypes=self.graph_dtypes,
+                            itersize=100000))
+        t0 = time.time()
+        strong, weak, reached = graph.analyze(min_component_size)
+        self.logger.info(
+            f'{graph.n_nodes} nodes and {len(graph.source)} edges analyzed: '
+            f'{len(np.unique(strong))} strong components, '
+            f'{reached.sum()} nodes reached '
+            f'({time.time() - t0:.1f}s)')
+        rows = zip(graph.nodes.tolist(), strong.tolist(), weak.tolist(),
+                   reached.tolist())
+        self.bulk_insert(components, rows,
+                         columns=('node', 'component', 'weak_component',
+                                  'reached'),
+                         schema=self.network, binary=True)
+
+    def update_components(self, scratch: str, target_view_name: str,
+                          planned: bool = False,
+                          min_component_size: int = 10):
+        """
+        recompute the components of the parts of the network, which are
+        weakly connected to the vertices touched by the update
+
+        A strong component never extends over a weak component, so the
+        components of the other parts remain valid. The component ids are
+        the smallest node id of the component
+        """
+        self.logger.info('Update Strong Components')
+        network = self.network
+        components = f'{target_view_name}_components'
+        sql = f'''
+        CREATE TABLE "{scratch}".component_nodes AS
+        SELECT t.id AS node
+        FROM "{scratch}".touched_vertices t
+        WHERE t.id IS NOT NULL
+        UNION
+        SELECT c.node
+        FROM "{network}"."{components}" c
+        WHERE c.weak_component IN (
+          SELECT w.weak_component
+          FROM "{network}"."{components}" w, "{scratch}".touched_vertices t
+          WHERE w.node = t.id);
+        ALTER TABLE "{scratch}".component_nodes ADD PRIMARY KEY (node);
+
+        DELETE FROM "{network}"."{components}" c
+        USING "{scratch}".component_nodes n
+        WHERE c.node = n.node;
         '''
         self.run_query(sql)
+        self.compute_components(
+            components, planned=planned,
+            min_component_size=min_component_size,
+            where=('e.source IN (SELECT n.node '
+                   f'FROM "{scratch}".component_nodes n)'))
 
     def create_view_reachable_edges(self, edges_target_view_name, nodes_view_name, planned=False):
         edges_sql = f'''
@@ -1406,6 +2311,11 @@ if __name__ == '__main__':
                         help="corine landuse table",
                         dest="corine", default='clc18')
 
+    parser.add_argument("--workers", action="store",
+                        help="number of connections creating the links "
+                        "in parallel", type=int,
+                        dest="n_workers", default=None)
+
     options = parser.parse_args()
 
     build_network = BuildNetwork(schema='osm',
@@ -1413,6 +2323,7 @@ if __name__ == '__main__':
                                  db=options.db,
                                  limit=options.limit,
                                  chunksize=options.chunksize,
+                                 n_workers=options.n_workers,
                                  links_to_find=options.links_to_find,
                                  corine=options.corine)
     build_network.set_login(host=options.host,
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Build the networks of several modes (e.g. car and walk/cycle) in one pass.
+
+The ways of all networks are split into links only once in a shared schema.
+The networks copy their links from there and derive their mode-specific
+attributes, barriers and accessibility in their own schemas.
+"""
+
+from typing import List
+
+from extractiontools.connection import Connection
+from extractiontools.build_network_car import BuildNetwork
+
+
+class BuildNetworkMultiMode(BuildNetwork):
+    """
+    Build several networks sharing the link generation
+    """
+
+    def __init__(self,
+                 networks: List[BuildNetwork],
+                 segments_schema: str = 'network_segments',
+                 keep_segments: bool = False,
+                 **kwargs):
+        """
+        Parameters
+        ----------
+        networks : list of BuildNetwork
+            the builders of the networks, each with its own network schema
+        segments_schema : str, optional
+            the schema, where the ways of all networks are split into links
+        keep_segments : bool, optional
+            keep the segments schema after the build, if True
+        """
+        super().__init__(network_schema=segments_schema, **kwargs)
+        if not networks:
+            raise ValueError('no networks given')
+        schemas = [network.network for network in networks]
+        if len(set(schemas + [segments_schema])) != len(schemas) + 1:
+            raise ValueError('the networks and the segments need '
+                             f'different schemas, got {schemas} '
+                             f'and {segments_schema}')
+        self.networks = networks
+        self.keep_segments = keep_segments
+
+    def build(self):
+        """
+        Build the networks
+        """
+        schemas = ', '.join(network.network for network in self.networks)
+        self.logger.info(f'Build Networks in schemas {schemas} '
+                         f'with the links split in {self.network}')
+        with Connection(login=self.login) as conn:
+            self.conn = conn
+            self.get_srid()
+            self.prepare_schema()
+            # select the streets and roads of each network
+            for network in self.networks:
+                network.conn = conn
+                network.srid = self.srid
+                network.prepare_schema()
+                network.create_roads()
+                self.conn.commit()
+
+            # split the roads of all networks into links at once
+            self.logger.info(f'Create Views')
+            self.create_roads()
+            self.create_junctions()
+            self.conn.commit()
+            self.generate_links()
+
+            # derive the attributes and the accessibility per network
+            for network in self.networks:
+                self.logger.info(f'Complete Network in schema '
+                                 f'{network.network}')
+                network.copy_segments(self.network)
+                network.complete_network()
+
+            if not self.keep_segments:
+                self.run_query(f'DROP SCHEMA "{self.network}" CASCADE;')
+                self.conn.commit()
+            self.reset_authorization(self.conn)
+
+    def create_streets_view(self):
+        """
+        the streets are selected in the schemas of the networks
+        """
+
+    def create_roads(self):
+        """
+        Create the view with the roads of all networks
+        """
+        self.logger.info(f'Create Roads of all networks')
+        roads = '\nUNION\n'.join(f'SELECT id FROM "{network.network}".roads'
+                                 for network in self.networks)
+        sql = f"""
+CREATE MATERIALIZED VIEW "{self.network}".roads AS
+{roads};
+"""
+        self.run_query(sql)
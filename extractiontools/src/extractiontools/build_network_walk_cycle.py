@@ -118,6 +118,17 @@ WITH (
         """
         self.run_query(sql.format(srid=self.srid, network=self.network))
 
+    def update_link_attributes(self):
+        """
+        set the attributes of the links for walking and cycling
+        """
+        self.update_linktypes()
+        self.update_oneway()
+        self.update_lanes()
+        self.create_slope()
+        self.update_speed()
+        self.update_time()
+
     def update_oneway(self):
         """
 
@@ -399,11 +410,14 @@ CREATE OR REPLACE VIEW "{network}".line_barriers_cycle AS
         """.format(network=self.network, srid=self.srid, osm=self.schema)
         self.run_query(sql)
 
-    def update_egde_table(self):
+    # the columns of the edge_table selected by edges_query
+    edge_columns = ('fromnode', 'tonode', 'geom', 'cost', 'reverse_cost',
+                    'wayid', 'segment', 'planned')
+
+    def edges_query(self) -> str:
         """
-        Updates the edge_table
+        return the query selecting the edges from the links
         """
-        self.logger.info('Updating edges')
         if self.routing_walk:
             cost = 'l.t_foot_hin'
             reverse_cost = 'l.t_foot_rueck'
@@ -411,24 +425,18 @@ CREATE OR REPLACE VIEW "{network}".line_barriers_cycle AS
             cost = 'l.t_bicycle_hin'
             reverse_cost = 'CASE WHEN l.oneway THEN -1 ELSE l.t_bicycle_rueck END'
 
-        sql = """
-
-TRUNCATE "{network}".edge_table;
-INSERT INTO "{network}".edge_table (id, fromnode, tonode, geom,
-cost, reverse_cost, wayid, segment, planned)
+        return """
 SELECT
-  row_number() OVER (ORDER BY fromnode, tonode)::integer AS id,
-  fromnode,
-  tonode,
+  l.fromnode,
+  l.tonode,
   l.geom,
   {cost} AS cost,
   {reverse_cost} AS reverse_cost,
   l.wayid,
   l.segment,
   l.planned OR l.construction AS planned
-FROM "{network}".links l;
-        """.format(network=self.network, cost=cost, reverse_cost=reverse_cost)
-        self.run_query(sql)
+FROM "{network}".links l""".format(network=self.network, cost=cost,
+                                   reverse_cost=reverse_cost)
 
     def create_views_roadtypes(self):
         """
@@ -2,18 +2,30 @@
 # coding:utf-8
 
 import sys
+import time
+import atexit
+import threading
 import psycopg2
 from psycopg2.extras import NamedTupleConnection, DictCursor
-import sqlparse
 from psycopg2.sql import SQL, Composed, Literal
 from psycopg2.extensions import Column
 from copy import deepcopy
 from typing import Union, Dict, OrderedDict, Tuple, List
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extensions import (ISOLATION_LEVEL_AUTOCOMMIT,
+                                  TRANSACTION_STATUS_IDLE)
 from psycopg2.sql import Identifier, SQL
 
+import io
 import os
+import re
 import logging
+import itertools
+from typing import Iterable, Iterator, Sequence
+import numpy as np
+
+from extractiontools.utils import copy_format
+from extractiontools.utils.query_stats import query_stats
+from extractiontools.utils.sql_split import split_sql
 
 
 class Login:
@@ -27,12 +39,15 @@ class Login:
                  user='postgres',
                  password='',
                  db='',
+                 fdw_options: Dict[str, str] = None,
                  ):
         self.host = host
         self.port = port
         self.user = user
         self.password = password
         self.db = db
+        # options of a postgres_fdw server pointing to this database
+        self.fdw_options = fdw_options or {}
 
     def __repr__(self):
         """
@@ -41,24 +56,246 @@ class Login:
         return msg.format(h=self.host, p=self.port, U=self.user,
                           pw=self.password, db=self.db)
 
+    @property
+    def key(self) -> Tuple[str, str, str, str, str]:
+        """the key identifying the connections of this login in the pool"""
+        return (str(self.host), str(self.port), str(self.user),
+                str(self.password), str(self.db))
+
+    def connect(self) -> NamedTupleConnection:
+        """open a new (unpooled) connection to the database"""
+        return psycopg2.connect(host=self.host,
+                                user=self.user,
+                                password=self.password,
+                                port=self.port,
+                                database=self.db,
+                                connection_factory=NamedTupleConnection,
+                                sslmode='prefer')
+
+
+class PoolError(psycopg2.Error):
+    """Raised when no connection is available in the pool"""
+
+
+class ConnectionPool:
+    """
+    Pool of open connections to the database defined by a login
+
+    Connections returned to the pool are kept open and handed out again
+    by `getconn`. Connections that were idle for more than `max_idle` seconds
+    are closed, connections that were idle for more than `ping_after` seconds
+    are checked with a `SELECT 1` before they are handed out again.
+    """
+
+    def __init__(self,
+                 login: Login,
+                 maxconn: int = 32,
+                 max_idle: float = 300,
+                 ping_after: float = 10,
+                 timeout: float = 60):
+        self.login = login
+        self.maxconn = maxconn
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self.timeout = timeout
+        # list of (connection, time returned to the pool)
+        self._idle: List[Tuple[NamedTupleConnection, float]] = []
+        self._used = set()
+        # connections in use during closeall, closed when returned
+        self._retired = set()
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}(db={self.login.db}, '
+                f'used={len(self._used)}, idle={len(self._idle)})')
+
+    def getconn(self) -> NamedTupleConnection:
+        """
+        return an open connection,
+        wait up to `timeout` seconds if all connections are in use
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                self._evict_idle()
+                while self._idle:
+                    conn, returned = self._idle.pop()
+                    if self._is_healthy(conn, returned):
+                        self._used.add(conn)
+                        return conn
+                    self._close(conn)
+                if len(self._used) < self.maxconn:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolError(
+                        f'all {self.maxconn} connections to database '
+                        f'"{self.login.db}" are in use')
+                self._cond.wait(remaining)
+            # reserve the slot before connecting outside of the lock
+            placeholder = object()
+            self._used.add(placeholder)
+        try:
+            conn = self.login.connect()
+        except Exception:
+            with self._cond:
+                self._used.discard(placeholder)
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._used.discard(placeholder)
+            self._used.add(conn)
+        return conn
+
+    def putconn(self, conn: NamedTupleConnection, close: bool = False):
+        """
+        return the connection to the pool,
+        close it, if `close` is True or the connection is broken
+        """
+        with self._cond:
+            self._used.discard(conn)
+            if conn in self._retired:
+                self._retired.discard(conn)
+                close = True
+            if close or not self._reset(conn):
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """
+        close all idle connections,
+        the connections in use are closed when they are returned
+        """
+        with self._cond:
+            for conn, returned in self._idle:
+                self._close(conn)
+            self._idle.clear()
+            # skip the placeholders of connections being opened
+            self._retired.update(conn for conn in self._used
+                                 if hasattr(conn, 'close'))
+            self._cond.notify_all()
+
+    def _reset(self, conn: NamedTupleConnection) -> bool:
+        """
+        roll back pending transactions and discard the session state
+        like temp tables, prepared statements, advisory locks and settings
+        like search_path, isolation level or session authorization
+
+        Returns
+        -------
+        True, if the connection can be reused
+        """
+        if conn.closed:
+            return False
+        try:
+            conn.reset()
+            # DISCARD ALL cannot run inside a transaction block
+            conn.autocommit = True
+            try:
+                cur = conn.cursor()
+                cur.execute('DISCARD ALL;')
+            finally:
+                conn.autocommit = False
+        except psycopg2.Error:
+            return False
+        return conn.info.transaction_status == TRANSACTION_STATUS_IDLE
+
+    def _is_healthy(self, conn: NamedTupleConnection, returned: float) -> bool:
+        """check if the connection is still usable"""
+        if conn.closed:
+            return False
+        if time.monotonic() - returned < self.ping_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1;')
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _evict_idle(self):
+        """close connections which were idle for too long"""
+        now = time.monotonic()
+        keep = []
+        for conn, returned in self._idle:
+            if now - returned > self.max_idle:
+                self._close(conn)
+            else:
+                keep.append((conn, returned))
+        self._idle = keep
+
+    @staticmethod
+    def _close(conn: NamedTupleConnection):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pools: Dict[Tuple[str, str, str, str, str], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(login: Login) -> ConnectionPool:
+    """
+    return the process-wide connection pool for the login,
+    the pool size and timeouts can be set with the environment variables
+    DB_POOL_MAXCONN, DB_POOL_MAX_IDLE and DB_POOL_PING_AFTER
+    """
+    key = login.key
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                deepcopy(login),
+                maxconn=int(os.environ.get('DB_POOL_MAXCONN', 32)),
+                max_idle=float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+                ping_after=float(os.environ.get('DB_POOL_PING_AFTER', 10)),
+            )
+            _pools[key] = pool
+    return pool
+
+
+def close_pools(database: str = None):
+    """
+    close the pooled connections,
+    if a database is given, only the connections to this database
+    """
+    with _pools_lock:
+        keys = [key for key, pool in _pools.items()
+                if database is None or pool.login.db == database]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.closeall()
+
+
+atexit.register(close_pools)
+
 
 class Connection:
     """
     Connection object
+
+    The connection is taken from the process-wide pool of the login
+    and returned to it on exit. Set `pooled` to False or the environment
+    variable DB_POOL to 0 to open and close a new connection instead.
     """
 
-    def __init__(self, login=None):
+    def __init__(self, login=None, pooled: bool = None):
         self.login = login or Login()
+        if pooled is None:
+            pooled = os.environ.get('DB_POOL', '1') != '0'
+        self.pooled = pooled
 
     def __enter__(self) -> NamedTupleConnection:
-        login = self.login
-        conn = psycopg2.connect(host=login.host,
-                                user=login.user,
-                                password=login.password,
-                                port=login.port,
-                                database=login.db,
-                                connection_factory=NamedTupleConnection,
-                                sslmode='prefer')
+        if self.pooled:
+            self.pool = get_pool(self.login)
+            conn = self.pool.getconn()
+        else:
+            conn = self.login.connect()
         self.conn = conn
         self.conn.get_dict_cursor = self.get_dict_cursor
         self.conn.get_column_dict = self.get_column_dict
@@ -67,8 +304,19 @@ class Connection:
         return conn
 
     def __exit__(self, t, value, traceback):
-        self.conn.commit()
-        self.conn.close()
+        broken = False
+        try:
+            if not self.conn.closed:
+                self.conn.commit()
+        except psycopg2.Error:
+            broken = True
+            if t is None:
+                raise
+        finally:
+            if self.pooled:
+                self.pool.putconn(self.conn, close=broken)
+            else:
+                self.conn.close()
 
     def set_copy_command_format(self):
         """
@@ -133,11 +381,262 @@ class Connection:
         return OrderedDict(((d.name, d) for d in descr))
 
 
+class ColumnType:
+    """The type of a column as required to encode its values for COPY"""
+
+    def __init__(self,
+                 typname: str,
+                 srid: int = 0,
+                 element_typname: str = None,
+                 element_oid: int = None):
+        self.typname = typname
+        self.srid = srid
+        self.element_typname = element_typname
+        self.element_oid = element_oid
+
+
+class BulkInserter:
+    """
+    Insert rows into a table with COPY ... FROM STDIN
+
+    The rows are encoded into an in-memory buffer, which is copied
+    to the database every `batch_size` rows and when the inserter is flushed.
+    If geometries are given in another srid than the srid of the
+    geometry column or an `on_conflict` action is defined, the rows are
+    copied into a temporary staging table first and inserted from there.
+    """
+    _counter = itertools.count()
+
+    def __init__(self,
+                 conn: NamedTupleConnection,
+                 table: str,
+                 columns: Sequence[str],
+                 schema: str = None,
+                 batch_size: int = 10000,
+                 binary: bool = False,
+                 geometry_srid: Dict[str, int] = None,
+                 on_conflict: str = None,
+                 conflict_columns: Sequence[str] = None,
+                 logger: logging.Logger = None):
+        """
+        Parameters
+        ----------
+        conn : Connection
+            the connection to use
+        table : str
+            the name of the table
+        columns : list of str
+            the names of the columns in the order of the values in the rows
+        schema : str, optional
+            the schema of the table
+        batch_size : int, optional
+            the number of rows to buffer before they are copied
+        binary : bool, optional
+            use the binary COPY format instead of the text format
+        geometry_srid : dict, optional
+            the srid of the geometries (WKB or EWKB) given per column,
+            geometries are transformed to the srid of the column if required
+        on_conflict : str, optional
+            'nothing' or 'update', the action taken, if a row violates
+            the unique constraint on the `conflict_columns`
+        conflict_columns : list of str, optional
+            the columns of the unique constraint for `on_conflict`
+        """
+        if on_conflict not in (None, 'nothing', 'update'):
+            raise ValueError(f'on_conflict {on_conflict} not in '
+                             '(None, "nothing", "update")')
+        if on_conflict == 'update' and not conflict_columns:
+            raise ValueError('conflict_columns required to update on conflict')
+        self.conn = conn
+        self.table = Identifier(schema, table) if schema else Identifier(table)
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.binary = binary
+        self.geometry_srid = geometry_srid or {}
+        self.on_conflict = on_conflict
+        self.conflict_columns = list(conflict_columns or [])
+        self.logger = logger or logging.getLogger(self.__module__)
+        self.rowcount = 0
+        self._rows = []
+        self._stage = None
+
+        coltypes = self._get_column_types()
+        missing = set(self.columns) - set(coltypes)
+        if missing:
+            raise ValueError(f'columns {missing} not in table {table}')
+
+        transform = {}
+        for col, srid in self.geometry_srid.items():
+            target_srid = coltypes[col].srid
+            if target_srid and target_srid != srid:
+                transform[col] = target_srid
+        self.transform = transform
+        if transform or on_conflict:
+            self._create_stage()
+
+        self.encoders = [self._encoder(col, coltypes[col])
+                         for col in self.columns]
+        target = self._stage or self.table
+        fmt = SQL('(FORMAT binary)' if binary else '(FORMAT text)')
+        self.copy_sql = SQL('COPY {target} ({columns}) FROM STDIN {fmt}').format(
+            target=target,
+            columns=SQL(', ').join(Identifier(c) for c in self.columns),
+            fmt=fmt).as_string(conn)
+
+    def _get_column_types(self) -> Dict[str, ColumnType]:
+        """query the types of the columns of the table"""
+        sql = SQL("""
+        SELECT
+          a.attname,
+          t.typname,
+          format_type(a.atttypid, a.atttypmod) AS fulltype,
+          et.typname AS element_typname,
+          et.oid AS element_oid
+        FROM pg_attribute a
+        JOIN pg_type t ON t.oid = a.atttypid
+        LEFT JOIN pg_type et ON et.oid = t.typelem AND t.typcategory = 'A'
+        WHERE a.attrelid = {table}::regclass
+        AND a.attnum > 0
+        AND NOT a.attisdropped;
+        """).format(table=Literal(self.table.as_string(self.conn)))
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        coltypes = {}
+        for row in cur.fetchall():
+            match = re.search(r'\(\w+,\s*(\d+)\)', row.fulltype)
+            srid = int(match.group(1)) if match else 0
+            coltypes[row.attname] = ColumnType(row.typname, srid,
+                                               row.element_typname,
+                                               row.element_oid)
+        return coltypes
+
+    def _encoder(self, column: str, coltype: ColumnType):
+        """return the encoder for the values of the column"""
+        if self.binary:
+            encoder = copy_format.binary_encoder(coltype.typname,
+                                                 coltype.element_typname,
+                                                 coltype.element_oid)
+        else:
+            encoder = copy_format.text_encoder(coltype.typname)
+        srid = self.geometry_srid.get(column)
+        if srid is None:
+            return encoder
+        return lambda value: encoder(copy_format.to_ewkb(value, srid))
+
+    def _create_stage(self):
+        """create the temporary staging table"""
+        stage = Identifier(f'_bulk_{next(self._counter)}')
+        sql = SQL("""
+        CREATE TEMP TABLE {stage} AS SELECT {columns} FROM {table} LIMIT 0;
+        """).format(stage=stage,
+                    columns=SQL(', ').join(Identifier(c) for c in self.columns),
+                    table=self.table)
+        for col in self.transform:
+            sql += SQL("""
+            ALTER TABLE {stage} ALTER COLUMN {col} TYPE geometry;
+            """).format(stage=stage, col=Identifier(col))
+        self.conn.cursor().execute(sql)
+        self._stage = stage
+
+    def _merge_stage(self):
+        """insert the rows of the staging table into the table"""
+        columns = SQL(', ').join(Identifier(c) for c in self.columns)
+        values = SQL(', ').join(
+            SQL('ST_Transform({col}, {srid})').format(
+                col=Identifier(c), srid=Literal(self.transform[c]))
+            if c in self.transform else Identifier(c)
+            for c in self.columns)
+        if self.on_conflict == 'update':
+            keys = SQL(', ').join(Identifier(c) for c in self.conflict_columns)
+            values = SQL('DISTINCT ON ({keys}) ').format(keys=keys) + values
+        sql = SQL('INSERT INTO {table} ({columns}) SELECT {values} FROM {stage}'
+                  ).format(table=self.table, columns=columns,
+                           values=values, stage=self._stage)
+        if self.on_conflict:
+            keys = SQL(', ').join(Identifier(c) for c in self.conflict_columns)
+            target = (SQL(' ({keys})').format(keys=keys)
+                      if self.conflict_columns else SQL(''))
+            if self.on_conflict == 'nothing':
+                action = SQL('NOTHING')
+            else:
+                updates = [c for c in self.columns
+                           if c not in self.conflict_columns]
+                action = SQL('UPDATE SET ') + SQL(', ').join(
+                    SQL('{col} = EXCLUDED.{col}').format(col=Identifier(c))
+                    for c in updates)
+            sql += SQL(' ON CONFLICT{target} DO ').format(target=target) + action
+        sql += SQL('; TRUNCATE {stage};').format(stage=self._stage)
+        self.conn.cursor().execute(sql)
+
+    def add(self, row: Sequence):
+        """add a row, copy the buffered rows if the batch is full"""
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def extend(self, rows: Iterable[Sequence]):
+        """add the rows"""
+        for row in rows:
+            self.add(row)
+
+    def flush(self) -> int:
+        """
+        copy the buffered rows to the database
+
+        Returns
+        -------
+        the number of rows copied
+        """
+        n_rows = len(self._rows)
+        if not n_rows:
+            return 0
+        encoders = self.encoders
+        if self.binary:
+            buffer = io.BytesIO()
+            buffer.write(copy_format.BINARY_HEADER)
+            for row in self._rows:
+                buffer.write(copy_format.binary_row(row, encoders))
+            buffer.write(copy_format.BINARY_TRAILER)
+        else:
+            buffer = io.StringIO()
+            for row in self._rows:
+                buffer.write(copy_format.text_row(row, encoders))
+        buffer.seek(0)
+        self._rows = []
+        cur = self.conn.cursor()
+        cur.copy_expert(self.copy_sql, buffer)
+        if self._stage:
+            self._merge_stage()
+        self.rowcount += n_rows
+        self.logger.debug(f'copied {n_rows} rows into '
+                          f'{self.table.as_string(self.conn)}')
+        return n_rows
+
+    def close(self):
+        """flush the remaining rows and drop the staging table"""
+        self.flush()
+        self._drop_stage()
+
+    def _drop_stage(self):
+        if self._stage:
+            sql = SQL('DROP TABLE IF EXISTS {stage};').format(stage=self._stage)
+            self.conn.cursor().execute(sql)
+            self._stage = None
+
+    def __enter__(self) -> 'BulkInserter':
+        return self
+
+    def __exit__(self, t, value, traceback):
+        if t is None:
+            self.close()
+
+
 class DBApp:
     """
 
     """
     role = None
+    _cursor_counter = itertools.count()
 
     def __init__(self,
                  schema: str = 'osm',
@@ -263,16 +762,26 @@ class DBApp:
         """
         conn = conn or self.conn
         cur = conn.cursor()
+        stats_login = self._stats_login(conn) if query_stats.enabled else None
+        # the cursor of the last statement, which is returned
+        result = cur
 
         def execute(query, vars=None):
+            nonlocal result
             if verbose:
                 self.logger.debug(query)
-            cur.execute(query, vars)
+            if query_stats.enabled:
+                # explained statements return a proxy with their rowcount
+                result = query_stats.execute(cur, query, vars,
+                                             app=type(self).__name__,
+                                             login=stats_login)
+            else:
+                cur.execute(query, vars)
 
         if split:
             query_string = sql.as_string(
                 conn) if isinstance(sql, Composed) else sql
-            for query in sqlparse.split(query_string):
+            for query in split_sql(query_string):
                 if query.strip().rstrip(';'):
                     query_without_comments = '\n'.join([
                         q for q in query.replace('\r', '').split('\n')
@@ -282,7 +791,99 @@ class DBApp:
         else:
             execute(sql, vars)
 
-        return cur
+        return result
+
+    def _stats_login(self, conn: NamedTupleConnection) -> Login:
+        """
+        return the login to the database of the connection
+        to write the query stats to
+        """
+        login = getattr(self, 'login', None)
+        if login is None or not hasattr(conn, 'info'):
+            return None
+        info = conn.info
+        return Login(info.host, info.port, info.user, login.password,
+                     info.dbname)
+
+    def iter_query(self,
+                   sql: Union[str, Composed],
+                   vars: Union[Dict[str, object], Sequence] = None,
+                   conn: NamedTupleConnection = None,
+                   itersize: int = 10000,
+                   arrays: bool = False,
+                   dtypes: Dict[str, object] = None,
+                   withhold: bool = False,
+                   ) -> Iterator[Union[List[tuple], Dict[str, np.ndarray]]]:
+        """
+        run a query with a named server-side cursor and yield the results
+        in batches of `itersize` rows, so that the result is never
+        completely loaded into memory
+
+        Parameters
+        ----------
+        sql : str or SQL
+            the query
+        vars: dict or sequence (optional)
+            values to pass to the query
+        conn : Connection-Instance (optional)
+            if not given, than the default connection self.conn is taken
+        itersize : int (optional)
+            the number of rows fetched and yielded at once
+        arrays : bool (optional)
+            if True, yield a dict with a numpy-array per column
+            instead of a list of rows
+        dtypes : dict (optional)
+            the dtypes of the arrays per column, if not given,
+            the dtypes are inferred by numpy
+        withhold : bool (optional)
+            keep the cursor open after a commit of the connection
+
+        Yields
+        ------
+        list of named tuples or dict of numpy-arrays
+        """
+        conn = conn or self.conn
+        name = f'iter_{next(self._cursor_counter)}'
+        cur = conn.cursor(name=name, withhold=withhold)
+        cur.itersize = itersize
+        if self.logger:
+            self.logger.debug(sql if isinstance(sql, str)
+                              else sql.as_string(conn))
+        try:
+            cur.execute(sql, vars)
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                if arrays:
+                    yield self._rows_to_arrays(rows, cur.description, dtypes)
+                else:
+                    yield rows
+        finally:
+            if not cur.closed and not conn.closed:
+                try:
+                    cur.close()
+                # the cursor is gone, if the transaction was aborted
+                except psycopg2.Error:
+                    pass
+
+    @staticmethod
+    def _rows_to_arrays(rows: List[tuple],
+                        description: Tuple[Column, ...],
+                        dtypes: Dict[str, object] = None,
+                        ) -> Dict[str, np.ndarray]:
+        """convert the rows to a dict with a numpy-array per column"""
+        dtypes = dtypes or {}
+        arrays = {}
+        for i, col in enumerate(description):
+            values = [row[i] for row in rows]
+            dtype = dtypes.get(col.name)
+            if dtype is not None:
+                arrays[col.name] = np.fromiter(values, dtype=dtype,
+                                               count=len(values))
+            else:
+                arrays[col.name] = np.array(values)
+        return arrays
 
     def set_search_path(self, connstr: str = 'conn'):
         conn = getattr(self, connstr)
@@ -349,6 +950,8 @@ class DBApp:
         """
         if conn is None:
             conn = self.conn
+        # pooled connections to the database would be terminated anyway
+        close_pools(database=dbname)
         sql = f"""
 UPDATE pg_database set datallowconn = 'false' where datname = '{dbname}';
 SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = '{dbname}';
@@ -449,3 +1052,131 @@ AND    i.indisprimary;
         rows = cur.fetchall()
         return [r.column_name for r in rows]
 
+    def bulk_inserter(self,
+                      table: str,
+                      columns: Sequence[str],
+                      schema: str = None,
+                      conn: NamedTupleConnection = None,
+                      **kwargs) -> BulkInserter:
+        """
+        return a BulkInserter to copy rows into schema.table,
+        the keyword arguments are passed to the BulkInserter
+        """
+        return BulkInserter(conn or self.conn, table, columns,
+                            schema=schema, logger=self.logger, **kwargs)
+
+    def bulk_insert(self,
+                    table: str,
+                    rows: Iterable[Sequence],
+                    columns: Sequence[str],
+                    schema: str = None,
+                    conn: NamedTupleConnection = None,
+                    batch_size: int = 10000,
+                    binary: bool = False,
+                    geometry_srid: Dict[str, int] = None,
+                    on_conflict: str = None,
+                    conflict_columns: Sequence[str] = None) -> int:
+        """
+        insert the rows into schema.table with COPY ... FROM STDIN
+
+        Parameters
+        ----------
+        table : str
+            the name of the table
+        rows : iterable of sequences
+            the rows with the values in the order of the columns
+        columns : list of str
+            the names of the columns
+        schema : str, optional
+            the schema of the table
+        conn : Connection-Instance (optional)
+            if not given, than the default connection self.conn is taken
+        batch_size : int, optional
+            the number of rows copied at once
+        binary : bool, optional
+            use the binary COPY format instead of the text format
+        geometry_srid : dict, optional
+            the srid of the geometries (WKB or EWKB) given per column,
+            geometries are transformed to the srid of the column if required
+        on_conflict : str, optional
+            'nothing' or 'update', the action taken, if a row violates
+            the unique constraint on the `conflict_columns`
+        conflict_columns : list of str, optional
+            the columns of the unique constraint for `on_conflict`
+
+        Returns
+        -------
+        the number of rows copied
+        """
+        with self.bulk_inserter(table, columns, schema=schema, conn=conn,
+                                batch_size=batch_size, binary=binary,
+                                geometry_srid=geometry_srid,
+                                on_conflict=on_conflict,
+                                conflict_columns=conflict_columns) as inserter:
+            inserter.extend(rows)
+        return inserter.rowcount
+
+    def copy_between(self,
+                     copy_to: str,
+                     source_conn: NamedTupleConnection,
+                     copy_from: str,
+                     target_conn: NamedTupleConnection = None) -> int:
+        """
+        stream the output of `COPY ... TO STDOUT` on the source connection
+        into `COPY ... FROM STDIN` on the target connection through a pipe,
+        without an intermediate file
+
+        Parameters
+        ----------
+        copy_to : str
+            the COPY ... TO STDOUT statement run on the source
+        source_conn : Connection-Instance
+            the connection to the source database
+        copy_from : str
+            the COPY ... FROM STDIN statement run on the target
+        target_conn : Connection-Instance (optional)
+            if not given, than the default connection self.conn is taken
+
+        Returns
+        -------
+        the number of rows copied
+        """
+        target_conn = target_conn or self.conn
+        self.logger.debug(f'{copy_to}\n{copy_from}')
+        fd_read, fd_write = os.pipe()
+        reader = os.fdopen(fd_read, 'rb')
+        writer = os.fdopen(fd_write, 'wb')
+        errors = []
+
+        def produce():
+            try:
+                source_conn.cursor().copy_expert(copy_to, writer)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # the end of the pipe finishes the COPY on the target
+                try:
+                    writer.close()
+                except OSError:
+                    pass
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        cur = target_conn.cursor()
+        try:
+            cur.copy_expert(copy_from, reader)
+        except Exception:
+            # unblock the producer, if the target stopped reading
+            reader.close()
+            producer.join()
+            # an error of the source is the cause of the broken stream
+            source_errors = [e for e in errors
+                             if isinstance(e, psycopg2.Error)]
+            if source_errors:
+                raise source_errors[0]
+            raise
+        reader.close()
+        producer.join()
+        if errors:
+            raise errors[0]
+        return cur.rowcount
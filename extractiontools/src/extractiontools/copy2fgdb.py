@@ -2,13 +2,20 @@
 # coding:utf-8
 
 from argparse import ArgumentParser
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Tuple
 
-import sys
 import os
-import subprocess
+import shutil
+import tempfile
+import time
+import zipfile
+from psycopg2.extras import NamedTupleConnection
+
 from extractiontools.connection import Login, Connection
 from extractiontools.ausschnitt import Extract
+from extractiontools.utils import gdal_export
+from extractiontools.utils.progress import Progress
 
 
 class Copy2FGDB(Extract):
@@ -16,17 +23,29 @@ class Copy2FGDB(Extract):
 
     gdal_file_extensions = {'OpenFileGDB': 'gdb',
                             'GPKG': 'gpkg',
+                            'FlatGeobuf': 'fgb',
+                            'Parquet': 'parquet',
                             }
+    # the number of rows fetched and written at once
+    itersize = 10000
 
     def __init__(self,
                  destination_db,
                  layers: Dict[str, str],
                  filename: str,
                  schema: str = None,
-                 logger=None
+                 logger=None,
+                 n_workers: int = None,
                  ):
-        """"""
-        super().__init__(destination_db, logger=logger)
+        """
+        Parameters
+        ----------
+        n_workers : int, optional
+            the number of layers exported at the same time,
+            EXPORT_WORKERS or 1 if not given
+        """
+        n_workers = n_workers or int(os.environ.get('EXPORT_WORKERS', 1))
+        super().__init__(destination_db, logger=logger, n_workers=n_workers)
         self.layers = layers
         self.filename = filename
         self.schema = schema
@@ -35,37 +54,124 @@ class Copy2FGDB(Extract):
                    schema: str,
                    layer: str,
                    dest_schema: str = None,
-                   gdal_format: str = 'OpenFileGDB'):
+                   gdal_format: str = 'OpenFileGDB',
+                   path: str = None):
         """
         copy layer
         Parameters
         ----------
         layer : str
+        path : str, optional
+            the file to copy the layer to, the path of the format if not given
+
+        Returns
+        -------
+        dict : the number of features and bytes copied, the seconds
+        and the features per second
         """
-        path = self.get_path(gdal_format)
+        path = path or self.get_layer_path(gdal_format, layer)
 
-        lco = ''
+        layer_options = []
         if gdal_format == 'OpenFileGDB':
-            lco = f' -lco FEATURE_DATASET="{dest_schema}"'
+            layer_options.append(f'FEATURE_DATASET={dest_schema}')
 
-        # get srid
-        if self.target_srid is None:
-            srid = self.get_target_srid()
-            srid_option = f'-a_srs EPSG:{srid}'
-        else:
-            srid_option = f'-t_srs EPSG:{self.target_srid}'
+        with Connection(login=self.login) as conn:
+            fields = self.get_fields(schema, layer, conn)
+            geometry, n_rows = self.get_layer_info(schema, layer, conn)
+            # get srid
+            if self.target_srid is None:
+                srid = self.get_target_srid()
+                geom = 't.geom'
+            else:
+                srid = self.target_srid
+                geom = f'ST_Transform(t.geom, {srid})'
 
-        cmd = f'{self.OGR2OGRPATH} -overwrite -geomfield geom -nln {layer} '\
-            f'{srid_option}{lco} -f "{gdal_format}" {path} '\
-            f'PG:"host={self.login.host} port={self.login.port} user={self.login.user} '\
-            f'dbname={self.destination_db}" "{schema}.{layer}"'
+            columns = ''.join(
+                f',\n  t.{gdal_export.select_expression(name, typname)}'
+                for name, typname in fields)
+            sql = f'''
+SELECT
+  ST_AsBinary({geom}) AS geom{columns}
+FROM "{schema}"."{layer}" t;
+'''
+            self.logger.info(f'Copying {layer}')
+            progress = Progress(f'{schema}.{layer}', logger=self.logger,
+                                total=n_rows)
+            gdal_export.write_layer(
+                path, gdal_format, layer, fields,
+                self.iter_query(sql, conn=conn, itersize=self.itersize),
+                srid=srid,
+                geometry=geometry,
+                layer_options=layer_options,
+                progress=progress)
+        return progress.finish()
 
-        self.logger.info(f'Copying {layer}')
-        self.logger.debug(cmd)
-        ret = subprocess.call(cmd, shell=self.SHELL)
-        if ret:
+    def get_fields(self,
+                   schema: str,
+                   layer: str,
+                   conn: NamedTupleConnection) -> List[Tuple[str, str]]:
+        """
+        return the names and types of the columns of the layer
+        without the geometry columns
+        """
+        sql = '''
+SELECT a.attname AS name, t.typname
+FROM pg_attribute a
+JOIN pg_type t ON a.atttypid = t.oid
+WHERE a.attrelid = %s::regclass
+AND a.attnum > 0
+AND NOT a.attisdropped
+AND t.typname NOT IN ('geometry', 'geography')
+ORDER BY a.attnum;
+'''
+        cur = conn.cursor()
+        cur.execute(sql, (f'"{schema}"."{layer}"', ))
+        return [(row.name, row.typname) for row in cur.fetchall()]
+
+    def get_layer_info(self,
+                       schema: str,
+                       layer: str,
+                       conn: NamedTupleConnection) -> Tuple[str, int]:
+        """
+        return the type of the geometry column geom and the estimated
+        number of rows of the layer (None for views)
+        """
+        sql = '''
+SELECT
+  (SELECT g.type FROM geometry_columns g
+   WHERE g.f_table_schema = %(schema)s
+   AND g.f_table_name = %(layer)s
+   AND g.f_geometry_column = 'geom') AS geometry,
+  (SELECT c.reltuples FROM pg_class c
+   WHERE c.oid = %(relation)s::regclass
+   AND c.relkind IN ('r', 'm')) AS n_rows;
+'''
+        cur = conn.cursor()
+        cur.execute(sql, {'schema': schema, 'layer': layer,
+                          'relation': f'"{schema}"."{layer}"'})
+        row = cur.fetchone()
+        n_rows = int(row.n_rows) if row.n_rows and row.n_rows > 0 else None
+        return row.geometry, n_rows
+
+    def merge_layer(self,
+                    source: str,
+                    layer: str,
+                    dest_schema: str = None,
+                    gdal_format: str = 'OpenFileGDB'):
+        """
+        copy the layer exported to the file source into the file of the format
+        """
+        path = self.get_path(gdal_format)
+        layer_options = []
+        if gdal_format == 'OpenFileGDB':
+            layer_options.append(f'FEATURE_DATASET={dest_schema}')
+        self.logger.debug(f'Merging {source} into {path}')
+        try:
+            gdal_export.translate_layer(source, path, gdal_format, layer,
+                                        layer_options=layer_options)
+        except RuntimeError as e:
             raise IOError(
-                f'Layer {layer} could not be copied to {gdal_format}')
+                f'Layer {layer} could not be merged into {path}') from e
 
     def get_path(self, gdal_format: str) -> str:
         """return the path to the file to create"""
@@ -91,6 +197,20 @@ class Copy2FGDB(Extract):
         path = os.path.join(folder, filename)
         return path
 
+    def get_layer_path(self, gdal_format: str, layer: str) -> str:
+        """
+        return the path to the file to copy the layer to, for formats with
+        one layer per file the file of the layer in a folder named like the
+        file of the format
+        """
+        path = self.get_path(gdal_format)
+        if gdal_format not in gdal_export.SINGLE_LAYER_FORMATS:
+            return path
+        ext = self.gdal_file_extensions[gdal_format]
+        folder = os.path.splitext(path)[0]
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f'{layer}.{ext}')
+
     def check_if_features(self, layer):
         """
         copy layer
@@ -109,50 +229,101 @@ SELECT * FROM {schema}.{layer} LIMIT 1;
 
     def copy_layers(self, gdal_format: str = 'OpenFileGDB'):
         """
-        copy all layers in option.layers
+        copy all layers in option.layers,
+        with more than one worker the layers are exported at the same time
         """
+        layers = []
         for full_layer, dest_schema in self.layers.items():
-            self.dest_schema = dest_schema
             schema_layer = full_layer.split('.')
             if len(schema_layer) == 1:
                 schema = self.schema
                 layer = schema_layer[0]
             else:
                 schema, layer = schema_layer
-            self.copy_layer(schema, layer, dest_schema, gdal_format)
+            layers.append((schema, layer, dest_schema))
 
-        if gdal_format == 'OpenFileGDB':
-            # zip folder
-            path = self.get_path(gdal_format)
-            cmd_zip = f'zip -r -j -m {path}.zip {path}'
-
-            self.logger.info(f'Zipping FGDBs to {path}')
-            self.logger.debug(cmd_zip)
-            ret = subprocess.call(cmd_zip, shell=self.SHELL)
-            if ret:
-                raise IOError(
-                    f'could not zip {path}')
-            # remove folder
-            cmd_rm = f'rm -R {path}'
-            self.logger.debug(cmd_rm)
-            ret = subprocess.call(cmd_rm, shell=self.SHELL)
-            if ret:
-                raise IOError(
-                    f'could not remove {path}')
-
-    def check_platform(self):
-        """
-        check the platform
-        """
-        super().check_platform()
-        if sys.platform.startswith('win'):
-            self.OGR_FOLDER = r'C:\Program Files\QGIS Brighton\bin'
-            self.OGR2OGRPATH = os.path.join(self.OGR_FOLDER, 'ogr2ogr.exe')
-            self.OGRINFO = os.path.join(self.OGR_FOLDER, 'ogrinfo.exe')
+        n_workers = min(self.n_workers, len(layers))
+        if n_workers <= 1:
+            for schema, layer, dest_schema in layers:
+                self.copy_layer(schema, layer, dest_schema, gdal_format)
         else:
-            self.OGR_FOLDER = '/usr/bin'
-            self.OGR2OGRPATH = os.path.join(self.OGR_FOLDER, 'ogr2ogr')
-            self.OGRINFO = os.path.join(self.OGR_FOLDER, 'ogrinfo')
+            self.copy_layers_parallel(layers, gdal_format, n_workers)
+
+        if gdal_format == 'OpenFileGDB':
+            self.zip_folder(self.get_path(gdal_format))
+
+    def copy_layers_parallel(self,
+                             layers: List[Tuple[str, str, str]],
+                             gdal_format: str,
+                             n_workers: int):
+        """
+        export the layers at the same time into one file per layer
+        and merge these files into the file of the format
+
+        Parameters
+        ----------
+        layers : list of tuples
+            the schema, the layer and the destination schema of each layer
+        """
+        path = self.get_path(gdal_format)
+        ext = self.gdal_file_extensions[gdal_format]
+        t0 = time.time()
+        self.logger.info(f'Copying {len(layers)} layers '
+                         f'with {n_workers} workers')
+        single_layer = gdal_format in gdal_export.SINGLE_LAYER_FORMATS
+        parts_folder = tempfile.mkdtemp(prefix='parts_',
+                                        dir=os.path.dirname(path))
+        try:
+            # layers in files of their own are written there directly
+            parts = {layer: (self.get_layer_path(gdal_format, layer)
+                             if single_layer else
+                             os.path.join(parts_folder, f'{layer}.{ext}'))
+                     for _, layer, _ in layers}
+            failed = {}
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                futures = {
+                    executor.submit(self.copy_layer, schema, layer,
+                                    dest_schema, gdal_format,
+                                    path=parts[layer]): layer
+                    for schema, layer, dest_schema in layers}
+                for future in as_completed(futures):
+                    layer = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.logger.error(f'Copying layer {layer} failed: {e}')
+                        failed[layer] = e
+            if failed:
+                raise Exception(f'Copying the layers {", ".join(failed)} '
+                                f'failed') from next(iter(failed.values()))
+
+            # the layers are merged one by one into the file in the order
+            # they are given
+            for _, layer, dest_schema in ([] if single_layer else layers):
+                self.merge_layer(parts[layer], layer, dest_schema,
+                                 gdal_format)
+        finally:
+            shutil.rmtree(parts_folder, ignore_errors=True)
+        self.logger.info(f'{len(layers)} layers copied to {path} '
+                         f'in {time.time() - t0:.1f}s')
+
+    def zip_folder(self, path: str):
+        """
+        zip the files in the folder to {path}.zip and remove the folder
+        """
+        self.logger.info(f'Zipping FGDBs to {path}')
+        zip_path = f'{path}.zip'
+        try:
+            with zipfile.ZipFile(zip_path, 'w',
+                                 compression=zipfile.ZIP_DEFLATED) as zf:
+                for root, _, files in os.walk(path):
+                    for fn in sorted(files):
+                        # the files are streamed into the archive
+                        # without the folders like zip -j does
+                        zf.write(os.path.join(root, fn), arcname=fn)
+        except OSError as e:
+            raise IOError(f'could not zip {path}') from e
+        shutil.rmtree(path)
 
 
 if __name__ == '__main__':
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 # coding:utf-8
 
-from typing import List, Tuple
+import os
+from typing import Dict, List, Tuple
 from argparse import ArgumentParser
 
 import logging
@@ -9,10 +10,33 @@ logger = logging.getLogger('OrcaLog')
 
 from extractiontools.connection import Connection
 from extractiontools.copy2fgdb import Copy2FGDB
+from extractiontools.extract_cache import ExtractCache
 
 
 class CopyOSM2FGDB(Copy2FGDB):
 
+    def __init__(self,
+                 destination_db,
+                 layers: Dict[str, str],
+                 filename: str,
+                 schema: str = None,
+                 logger=None,
+                 materialize: bool = None,
+                 n_workers: int = None):
+        """
+        Parameters
+        ----------
+        materialize : bool, optional
+            create the layers as tables with a spatial index instead of
+            views, which are only rebuilt if their query or the data they
+            depend on changed, defaults to OSM_LAYER_MATERIALIZE
+        """
+        super().__init__(destination_db, layers=layers, filename=filename,
+                         schema=schema, logger=logger, n_workers=n_workers)
+        if materialize is None:
+            materialize = os.environ.get('OSM_LAYER_MATERIALIZE', '0') != '0'
+        self.materialize = materialize
+
     def create_views(self):
         """Create the osm views that should be exported"""
         with Connection(login=self.login) as conn:
@@ -37,9 +61,157 @@ class CopyOSM2FGDB(Copy2FGDB):
         schema = self.schema
         sql = """
 CREATE SCHEMA IF NOT EXISTS {schema} AUTHORIZATION group_osm;
+-- the dependency hashes of the materialized layers
+CREATE TABLE IF NOT EXISTS {schema}.layer_state (
+  layer text PRIMARY KEY,
+  dependency_hash text NOT NULL,
+  refreshed timestamp NOT NULL DEFAULT now());
         """.format(schema=schema)
         self.run_query(sql)
 
+    def create_layer(self,
+                     view: str,
+                     schema: str,
+                     query: str,
+                     sources: List[str],
+                     comment: str = None):
+        """
+        Create the layer schema.view with the query as view or, if
+        materialize is set, as table with a spatial index on geom
+
+        a materialized layer is only rebuilt, if the hash of the query and of
+        the versions of the tables it depends on differs from the hash
+        recorded in layer_state
+
+        Parameters
+        ----------
+        view : str
+            the layer to create
+        schema : str
+            the schema of the layer
+        query : str
+            the SELECT statement defining the layer
+        sources : list of str
+            the relations (schema.name) queried
+        comment : str, optional
+            the comment on the layer
+        """
+        if not self.materialize:
+            self.logger.info(f'Creating view {schema}.{view}')
+            self.drop_layer(view, schema)
+            sql = f"""
+        CREATE OR REPLACE VIEW {schema}.{view} AS
+        {query};
+        """
+            self.run_query(sql)
+            if comment:
+                sql = f"""
+        COMMENT ON VIEW {schema}.{view} IS '{comment}';
+        """
+                self.run_query(sql)
+            return
+
+        dependency_hash = self.dependency_hash(query, sources)
+        if (dependency_hash is not None
+                and dependency_hash == self.get_layer_hash(view, schema)):
+            self.logger.info(f'Layer {schema}.{view} is up to date')
+            return
+        self.logger.info(f'Materializing layer {schema}.{view}')
+        self.drop_layer(view, schema)
+        sql = f"""
+        CREATE TABLE {schema}.{view} AS
+        {query};
+        CREATE INDEX {view}_geom_idx ON {schema}.{view} USING gist(geom);
+        ANALYZE {schema}.{view};
+        """
+        self.run_query(sql)
+        if comment:
+            sql = f"""
+        COMMENT ON TABLE {schema}.{view} IS '{comment}';
+        """
+            self.run_query(sql)
+        if dependency_hash is not None:
+            sql = f"""
+        INSERT INTO {schema}.layer_state (layer, dependency_hash)
+        VALUES (%(layer)s, %(hash)s);
+        """
+            self.run_query(sql, vars={'layer': view,
+                                      'hash': dependency_hash})
+
+    def drop_layer(self, view: str, schema: str):
+        """
+        Drop the layer, if it exists as view or as table,
+        and the dependency hash recorded for it
+        """
+        relkind = self.get_relkinds(schema).get(view)
+        if relkind == 'v':
+            self.run_query(f'DROP VIEW {schema}.{view} CASCADE;')
+        elif relkind == 'r':
+            self.run_query(f'DROP TABLE {schema}.{view} CASCADE;')
+        sql = f"""
+        DELETE FROM {schema}.layer_state WHERE layer = %(layer)s;
+        """
+        self.run_query(sql, vars={'layer': view})
+
+    def get_layer_hash(self, view: str, schema: str) -> str:
+        """
+        return the dependency hash of the layer,
+        if it exists as materialized table
+        """
+        if self.get_relkinds(schema).get(view) != 'r':
+            return None
+        cur = self.conn.cursor()
+        sql = f"""
+        SELECT dependency_hash FROM {schema}.layer_state
+        WHERE layer = %s;
+        """
+        cur.execute(sql, (view, ))
+        row = cur.fetchone()
+        return row.dependency_hash if row else None
+
+    def dependency_hash(self, query: str, sources: List[str]) -> str:
+        """
+        return a hash of the query and of the versions of the tables the
+        sources are built on, which changes when one of these tables is
+        rewritten or its data is updated, or None, if the version of a table
+        cannot be determined
+
+        see ExtractCache.source_version for the version of a table
+        """
+        sql = """
+        WITH RECURSIVE deps(oid) AS (
+          SELECT unnest(%s::regclass[])::oid
+          UNION
+          SELECT d.refobjid
+          FROM deps
+          JOIN pg_rewrite r ON r.ev_class = deps.oid
+          JOIN pg_depend d
+            ON d.classid = 'pg_rewrite'::regclass
+            AND d.objid = r.oid
+            AND d.refclassid = 'pg_class'::regclass
+            AND d.refobjid <> deps.oid
+        )
+        SELECT n.nspname, c.relname
+        FROM deps
+        JOIN pg_class c ON c.oid = deps.oid
+        JOIN pg_namespace n ON c.relnamespace = n.oid
+        WHERE c.relkind IN ('r', 'm')
+        ORDER BY n.nspname, c.relname;
+        """
+        cur = self.conn.cursor()
+        cur.execute(sql, (sources, ))
+        rows = cur.fetchall()
+        if not rows:
+            return None
+        versions = []
+        for row in rows:
+            version = ExtractCache.source_version(row.nspname, row.relname,
+                                                  self.conn)
+            if version is None:
+                return None
+            versions.append((row.nspname, row.relname, version))
+        return ExtractCache.key(' '.join(query.split()), *versions)
+
     def create_geometry_layer(self,
                               columns: str,
                               where_clause: str,
@@ -51,7 +223,6 @@ CREATE SCHEMA IF NOT EXISTS {schema} AUTHORIZATION group_osm;
         """Create a linestring layer schema.view, with the given fields
         and the given where-clause"""
 
-        self.logger.info(f'Creating view {schema}.{view}')
         geometrytypes = {'nodes': ('POINT', 'geom'),
                          'lines': ('LINESTRING', 'geom'),
                          'polygons': ('MULTIPOLYGON', 'geom'), }
@@ -61,9 +232,7 @@ CREATE SCHEMA IF NOT EXISTS {schema} AUTHORIZATION group_osm;
         except KeyError:
             raise KeyError('geometrytype {gt} is not valid')
 
-        sql = f"""
-        DROP VIEW IF EXISTS {schema}.{view} CASCADE;
-        CREATE OR REPLACE VIEW {schema}.{view} AS
+        query = f"""
         SELECT
           t.id AS id_long,
           t.{geomcolumn}::geometry({geomtype}, {self.target_srid}) AS geom,
@@ -71,19 +240,16 @@ CREATE SCHEMA IF NOT EXISTS {schema} AUTHORIZATION group_osm;
           {columns}
 
         FROM {osm_geom_schema}.{geometrytype} t
-        WHERE {where_clause};
-        """
-        self.run_query(sql)
+        WHERE {where_clause}"""
 
         if sql_comment is None:
             sql_comment = f'OSM {geometrytype} where {where_clause}'
 
         geom_desc = self.get_description(geometrytype, osm_geom_schema) or ''
 
-        sql = f'''
-        COMMENT ON VIEW {schema}.{view} IS '{sql_comment}\r\n{geom_desc}';
-        '''
-        self.run_query(sql, conn=self.conn)
+        self.create_layer(view, schema, query,
+                          sources=[f'{osm_geom_schema}.{geometrytype}'],
+                          comment=f'{sql_comment}\r\n{geom_desc}')
 
     def create_layer_by_key(self,
                             view: str,
@@ -161,23 +327,14 @@ CREATE SCHEMA IF NOT EXISTS {schema} AUTHORIZATION group_osm;
                                                   srid=self.target_srid)
                                        for layer in layers)
 
-        sql = """
-        DROP VIEW IF EXISTS {schema}.{view} CASCADE;
-        CREATE OR REPLACE VIEW {schema}.{view} AS
-        {queries};
-        """.format(schema=schema, view=view, queries=queries)
-        self.run_query(sql)
-
         description = ''
         for layer in layers:
             desc = self.get_description(layer, schema)
             if desc:
                 description += f'{desc}\r\n'
-        if description:
-            sql = f'''
-            COMMENT ON VIEW {schema}.{view} IS '{description}';
-            '''
-            self.run_query(sql)
+        self.create_layer(view, schema, queries,
+                          sources=[f'{schema}.{layer}' for layer in layers],
+                          comment=description or None)
 
     def create_railways(self):
         """Create railways layer"""
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Export the routable network to files, which the travel demand models
+can load without querying the database.
+
+The graph is saved in compressed sparse row format as one .npy file per
+array, which can be memory-mapped, together with its cost matrix and a
+hash of the network, and the edges with their geometries as GeoParquet.
+"""
+
+import os
+import json
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from extractiontools.connection import Connection, DBApp
+from extractiontools.utils.graph import (csr_graph, matrix_arrays,
+                                         save_graph)
+
+
+class ExportNetworkGraph(DBApp):
+    """
+    Export the edge_table of a network as graph and GeoParquet
+    """
+
+    def __init__(self,
+                 database: str,
+                 network_schema: str = 'network',
+                 subfolder: str = 'graph',
+                 only_reached: bool = True,
+                 **kwargs):
+        """
+        Parameters
+        ----------
+        database : str
+            the database with the network
+        network_schema : str, optional
+            the schema of the network
+        subfolder : str, optional
+            the subfolder within the project folder
+        only_reached : bool, optional
+            export only the edges in edges_reached, if True
+        """
+        super().__init__(**kwargs)
+        self.set_login(database=database)
+        self.network = network_schema
+        self.subfolder = subfolder
+        self.only_reached = only_reached
+
+    @property
+    def export_folder(self) -> str:
+        return os.path.abspath(os.path.join(self.folder,
+                                            'projekte',
+                                            self.login.db,
+                                            self.subfolder,
+                                            self.network))
+
+    def export(self):
+        """
+        export the graph and the edges
+        """
+        folder = self.export_folder
+        os.makedirs(folder, exist_ok=True)
+        with Connection(login=self.login) as conn:
+            self.conn = conn
+            self.srid = self.get_srid()
+            edges = self.load_edges()
+            self.export_graph(edges, folder)
+            self.export_edges(edges, folder)
+
+    def get_srid(self) -> int:
+        cur = self.conn.cursor()
+        cur.execute(f'''
+SELECT ST_SRID(e.geom) AS srid FROM "{self.network}".edge_table e LIMIT 1;
+''')
+        row = cur.fetchone()
+        return row.srid if row else None
+
+    def network_hash(self) -> str:
+        """
+        return a hash of the edges exported and of the coordinates of their
+        nodes, which changes when the network is changed, rebuilt or updated
+
+        the hashes of the rows are summed up, so that the hash does not
+        depend on the order of the rows and no sort is needed
+        """
+        network = self.network
+        reached = (f'JOIN "{network}".edges_reached r ON r.id = e.id'
+                   if self.only_reached else '')
+        sql = f'''
+SELECT
+  (SELECT count(*) || ':' || COALESCE(sum(hashtextextended(concat_ws(',',
+     e.id, e.fromnode, e.tonode, e.cost, e.reverse_cost), 0)::numeric), 0)
+   FROM "{network}".edge_table e
+   {reached}) AS edges,
+  (SELECT count(*) || ':' || COALESCE(sum(hashtextextended(concat_ws(',',
+     v.id, v.x, v.y), 0)::numeric), 0)
+   FROM "{network}".edge_table_vertices_pgr v) AS vertices;
+'''
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        row = cur.fetchone()
+        return f'{row.edges}/{row.vertices}'
+
+    def load_edges(self) -> pd.DataFrame:
+        """
+        load the edges with their geometries as WKB
+        """
+        network = self.network
+        reached = (f'JOIN "{network}".edges_reached r ON r.id = e.id'
+                   if self.only_reached else '')
+        sql = f'''
+SELECT
+  e.id, e.fromnode, e.tonode, e.wayid, e.segment,
+  e.cost, e.reverse_cost, e.planned,
+  ST_AsBinary(e.geom) AS geom
+FROM "{network}".edge_table e
+{reached}
+ORDER BY e.id;
+'''
+        dtypes = {'id': 'i8', 'fromnode': 'i8', 'tonode': 'i8',
+                  'wayid': 'i8', 'segment': 'i4',
+                  'cost': 'f8', 'reverse_cost': 'f8', 'planned': bool,
+                  'geom': object}
+        batches = [pd.DataFrame(batch) for batch in
+                   self.iter_query(sql, arrays=True, dtypes=dtypes,
+                                   itersize=100000)]
+        if not batches:
+            raise ValueError(f'no edges found in {network}.edge_table')
+        edges = pd.concat(batches, ignore_index=True)
+        self.logger.info(f'{len(edges)} edges loaded from {network}')
+        return edges
+
+    def export_graph(self, edges: pd.DataFrame, folder: str):
+        """
+        save the graph in compressed sparse row format
+        with the coordinates of the nodes and the cost matrix
+        """
+        arrays = csr_graph(edges['id'], edges['fromnode'], edges['tonode'],
+                           edges['cost'], edges['reverse_cost'])
+        # the parallel arcs are reduced once here and not in every
+        # process computing shortest paths
+        arrays.update(matrix_arrays(arrays))
+        cur = self.conn.cursor()
+        cur.execute(f'''
+SELECT v.id, v.x, v.y
+FROM "{self.network}".edge_table_vertices_pgr v
+ORDER BY v.id;
+''')
+        vertices = np.array([(r.id, r.x, r.y) for r in cur.fetchall()],
+                            dtype=[('id', 'i8'), ('x', 'f8'), ('y', 'f8')])
+        idx = np.searchsorted(vertices['id'], arrays['nodes'])
+        idx = np.clip(idx, 0, max(len(vertices) - 1, 0))
+        found = (vertices['id'][idx] == arrays['nodes']
+                 if len(vertices) else np.zeros(len(idx), dtype=bool))
+        arrays['x'] = np.where(found, vertices['x'][idx], np.nan)
+        arrays['y'] = np.where(found, vertices['y'][idx], np.nan)
+        save_graph(os.path.join(folder, 'csr'), arrays)
+        with open(os.path.join(folder, 'csr', 'meta.json'), 'w') as f:
+            json.dump({'database': self.login.db, 'network': self.network,
+                       'srid': self.srid,
+                       'only_reached': self.only_reached,
+                       'network_hash': self.network_hash()}, f)
+        self.logger.info(f'Graph with {len(arrays["nodes"])} nodes and '
+                         f'{len(arrays["indices"])} arcs saved to '
+                         f'{folder}')
+
+    def export_edges(self, edges: pd.DataFrame, folder: str):
+        """
+        save the edges with their geometries as GeoParquet
+        """
+        geoms = gpd.GeoSeries.from_wkb(edges['geom'].map(bytes),
+                                       crs=self.srid)
+        gdf = gpd.GeoDataFrame(edges.drop(columns='geom'), geometry=geoms)
+        for col in ('cost', 'reverse_cost'):
+            gdf[col] = gdf[col].astype(np.float32)
+        path = os.path.join(folder, 'edges.parquet')
+        gdf.to_parquet(path, index=False)
+        self.logger.info(f'{len(gdf)} edges saved to {path}')
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description="Export the network as graph")
+
+    parser.add_argument("-n", '--name', action="store",
+                        help="Name of database",
+                        dest="database", default='extract')
+    parser.add_argument('--network', action="store",
+                        help="network schema",
+                        dest="network_schema", default='network')
+    parser.add_argument('--subfolder', action="store",
+                        help="subfolder within the project folder",
+                        dest="subfolder", default='graph')
+    parser.add_argument('--all-edges', action="store_false",
+                        help="export also the edges not reached",
+                        dest="only_reached")
+
+    options = parser.parse_args()
+
+    export = ExportNetworkGraph(database=options.database,
+                                network_schema=options.network_schema,
+                                subfolder=options.subfolder,
+                                only_reached=options.only_reached)
+    export.export()
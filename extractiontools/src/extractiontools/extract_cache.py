@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Content-addressed cache of extracted tables.
+
+An extracted table is stored as a binary COPY dump together with a json
+file describing its columns. The key of the entry is a hash of everything
+the extraction depends on (the extraction query with the boundary and the
+target srid, the source database and the version of the source table),
+so that a changed source table or boundary is never restored.
+
+The version of a source table is deterministic: the relfilenode of the
+table, which changes when the table is truncated, rewritten or refreshed,
+and the data versions recorded in the meta schema of the source database.
+The version of the table in meta.table_versions is recorded with
+`ExtractCache.record_versions` by the processes creating or changing the
+table: the extractions, the creation of the osm polygons and the update of
+the osm data. For the tables of the osm schema also the last applied
+replication sequence in meta.osm_replication is taken into account.
+
+Untracked tables, which have neither a recorded version nor a replication
+sequence, are not cached, as changes of their rows cannot be detected.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extras import NamedTupleConnection
+
+
+class ExtractCache:
+    """
+    Stores extracted tables as binary COPY dumps in a folder
+    """
+
+    def __init__(self, folder: str, logger: logging.Logger = None):
+        self.folder = folder
+        self.logger = logger or logging.getLogger(__name__)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """return the key of the cache entry for the given parts"""
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(str(part).encode('utf-8'))
+            h.update(b'\x00')
+        return h.hexdigest()
+
+    def path(self, key: str) -> Tuple[str, str]:
+        """return the paths of the dump and of the column definitions"""
+        folder = os.path.join(self.folder, key[:2])
+        return (os.path.join(folder, f'{key}.copy'),
+                os.path.join(folder, f'{key}.json'))
+
+    def __contains__(self, key: str) -> bool:
+        return all(os.path.exists(p) for p in self.path(key))
+
+    def remove(self, key: str):
+        """remove the cache entry with the key"""
+        for path in self.path(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def source_version(schema: str,
+                       table: str,
+                       conn: NamedTupleConnection,
+                       osm_schema: str = 'osm') -> Optional[str]:
+        """
+        return the version of the table in the source database
+        or None, if it cannot be determined (views or untracked tables)
+
+        the replication sequence is only applied to the tables
+        of the osm_schema
+        """
+        cur = conn.cursor()
+        cur.execute('''
+        SELECT
+          (SELECT c.relfilenode
+           FROM pg_class c
+           JOIN pg_namespace n ON c.relnamespace = n.oid
+           WHERE n.nspname = %s AND c.relname = %s
+           AND c.relkind IN ('r', 'm')) AS relfilenode,
+          to_regclass('meta.osm_replication') IS NOT NULL AS replication,
+          to_regclass('meta.table_versions') IS NOT NULL AS versions;
+        ''', (schema, table))
+        row = cur.fetchone()
+        if row.relfilenode is None:
+            return
+        sequence = version = None
+        if row.replication and schema == osm_schema:
+            cur.execute('''
+            SELECT max(r.sequence_number) FROM meta.osm_replication r;
+            ''')
+            sequence = cur.fetchone()[0]
+        if row.versions:
+            cur.execute('''
+            SELECT v.version FROM meta.table_versions v
+            WHERE v.schema_name = %s AND v.table_name = %s;
+            ''', (schema, table))
+            result = cur.fetchone()
+            version = result[0] if result else None
+        if sequence is None and version is None:
+            return
+        return f'{row.relfilenode}/{sequence}/{version}'
+
+    @staticmethod
+    def record_versions(schema: str,
+                        conn: NamedTupleConnection,
+                        tables: List[str] = None):
+        """
+        record a new version of the tables in meta.table_versions,
+        of all tables and materialized views of the schema,
+        if no tables are given
+
+        has to be called in the transaction creating or changing the tables
+        """
+        cur = conn.cursor()
+        cur.execute('''
+        CREATE SCHEMA IF NOT EXISTS meta;
+        CREATE TABLE IF NOT EXISTS meta.table_versions (
+          schema_name text,
+          table_name text,
+          version bigint NOT NULL,
+          PRIMARY KEY (schema_name, table_name));
+        ''')
+        # the time of the change in microseconds is a version, which is not
+        # repeated, even if the table and its relfilenode are recreated
+        cur.execute('''
+        INSERT INTO meta.table_versions (schema_name, table_name, version)
+        SELECT n.nspname, c.relname,
+          (extract(epoch FROM clock_timestamp()) * 1000000)::bigint
+        FROM pg_class c
+        JOIN pg_namespace n ON c.relnamespace = n.oid
+        WHERE n.nspname = %(schema)s
+        AND c.relkind IN ('r', 'm')
+        AND (%(tables)s::text[] IS NULL OR c.relname::text = ANY(%(tables)s))
+        ON CONFLICT (schema_name, table_name)
+        DO UPDATE SET version = EXCLUDED.version;
+        ''', {'schema': schema, 'tables': tables})
+
+    @staticmethod
+    def get_column_definitions(schema: str,
+                               table: str,
+                               conn: NamedTupleConnection
+                               ) -> List[Tuple[str, str]]:
+        """return the names and types of the columns of the table"""
+        sql = '''
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod) AS typ
+        FROM pg_attribute a
+        WHERE a.attrelid = %s::regclass
+        AND a.attnum > 0
+        AND NOT a.attisdropped
+        ORDER BY a.attnum;
+        '''
+        cur = conn.cursor()
+        cur.execute(sql, (f'{schema}.{table}', ))
+        return [(row[0], row[1]) for row in cur.fetchall()]
+
+    def store(self, key: str, schema: str, table: str,
+              conn: NamedTupleConnection):
+        """store the table as the cache entry with the key"""
+        dump_path, json_path = self.path(key)
+        os.makedirs(os.path.dirname(dump_path), exist_ok=True)
+        columns = self.get_column_definitions(schema, table, conn)
+        cur = conn.cursor()
+        t0 = time.time()
+        # write to temporary files first, so that parallel or interrupted
+        # extractions never leave incomplete entries
+        suffix = f'.{os.getpid()}.tmp'
+        with open(dump_path + suffix, 'wb') as f:
+            cur.copy_expert(
+                f'COPY {schema}.{table} TO STDOUT WITH (FORMAT binary)', f)
+        with open(json_path + suffix, 'w') as f:
+            json.dump({'table': table, 'columns': columns,
+                       'created': time.strftime('%Y-%m-%d %H:%M:%S')}, f)
+        os.replace(dump_path + suffix, dump_path)
+        os.replace(json_path + suffix, json_path)
+        self.logger.debug(f'stored {schema}.{table} in cache as {key} '
+                          f'in {time.time() - t0:.2f}s')
+
+    def restore(self, key: str, schema: str, table: str,
+                conn: NamedTupleConnection) -> bool:
+        """
+        create the table from the cache entry with the key
+
+        Returns
+        -------
+        bool : True, if the table was restored, False if there is no entry
+        or the entry could not be restored, then the entry is removed
+        and the transaction is left as it was before
+        """
+        if key not in self:
+            return False
+        dump_path, json_path = self.path(key)
+        cur = conn.cursor()
+        cur.execute('SAVEPOINT restore_from_cache;')
+        try:
+            with open(json_path) as f:
+                columns = json.load(f)['columns']
+            col_defs = ',\n'.join(f'"{name}" {typ}' for name, typ in columns)
+            cur.execute(f'CREATE TABLE {schema}.{table} (\n{col_defs}\n);')
+            with open(dump_path, 'rb') as f:
+                cur.copy_expert(
+                    f'COPY {schema}.{table} FROM STDIN WITH (FORMAT binary)',
+                    f)
+        except (psycopg2.Error, OSError, ValueError, KeyError) as e:
+            self.logger.warning(f'cache entry {key} of {schema}.{table} '
+                                f'could not be restored and is removed: {e}')
+            cur.execute('ROLLBACK TO SAVEPOINT restore_from_cache;')
+            self.remove(key)
+            return False
+        cur.execute('RELEASE SAVEPOINT restore_from_cache;')
+        return True
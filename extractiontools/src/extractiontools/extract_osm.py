@@ -2,8 +2,11 @@
 # coding:utf-8
 
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from extractiontools.ausschnitt import Extract
+from extractiontools.connection import Connection
+from extractiontools.index_builder import IndexBuilder
 import psycopg2
 
 
@@ -13,6 +16,13 @@ class ExtractOSM(Extract):
     """
     schema = 'osm'
     role = 'group_osm'
+    # the large tables are fetched in larger batches
+    foreign_table_options = {
+        'osm_nodes': {'fetch_size': '500000'},
+        'osm_ways': {'fetch_size': '200000'},
+        'way_nodes': {'fetch_size': '500000'},
+        'relation_members': {'fetch_size': '500000'},
+    }
 
     def additional_stuff(self):
         """
@@ -53,6 +63,94 @@ class ExtractOSM(Extract):
             sql = f"COMMENT ON TABLE {self.schema}.{table} IS '{description}'"
             self.run_query(sql)
 
+    def insert_by_id_chunks(self,
+                            sql: str,
+                            sql_ids: str,
+                            chunksize: int,
+                            label: str):
+        """
+        run the insert statement `sql` for the ids of `sql_ids` in chunks
+        of `chunksize` ids in a loop on the database server,
+        the ids of a chunk are available as the array `ids_` in `sql`.
+
+        Joins between local and foreign tables are not pushed down to the
+        source database, but a condition `= ANY(ids_)` is sent there as a
+        parameter of the remote query, so the ids never pass the client.
+        With more than one worker the ids are partitioned into ranges which
+        are inserted in parallel over separate connections, each committed
+        on its own.
+        """
+        n_workers = self.n_workers
+        if n_workers <= 1:
+            self.run_query(self._id_chunk_loop(sql, sql_ids, chunksize),
+                           conn=self.conn, split=False)
+            return
+
+        # the ranges are taken from the committed tables
+        self.conn.commit()
+        sql_bounds = f'''
+        SELECT min(id) AS lower, max(id) AS upper
+        FROM (SELECT id, ntile({n_workers}) OVER (ORDER BY id) AS part
+              FROM ({sql_ids.rstrip().rstrip(';')}) q) p
+        GROUP BY part ORDER BY part;
+        '''
+        cur = self.conn.cursor()
+        cur.execute(sql_bounds)
+        bounds = cur.fetchall()
+        self.conn.commit()
+
+        def insert_range(lower: int, upper: int):
+            sql_range = f'''
+            SELECT id FROM ({sql_ids.rstrip().rstrip(';')}) q
+            WHERE id BETWEEN {lower} AND {upper}
+            '''
+            with Connection(login=self.login) as conn:
+                self.run_query(self._id_chunk_loop(sql, sql_range, chunksize),
+                               conn=conn, split=False)
+
+        self.logger.info(f'{label} in {len(bounds)} id ranges '
+                         f'with {n_workers} workers')
+        failed = {}
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(insert_range, lower, upper):
+                       (lower, upper) for lower, upper in bounds}
+            for future in as_completed(futures):
+                lower, upper = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    self.logger.error(f'{label} for the ids {lower} to '
+                                      f'{upper} failed: {e}')
+                    failed[(lower, upper)] = e
+        if failed:
+            raise Exception(f'{label} failed for {len(failed)} id ranges') \
+                from next(iter(failed.values()))
+
+    @staticmethod
+    def _id_chunk_loop(sql: str, sql_ids: str, chunksize: int) -> str:
+        """
+        return a DO block running `sql` for each chunk of the ids
+        of `sql_ids` (an id column named `id`) as array `ids_`
+        """
+        return f'''
+        DO $chunks$
+        DECLARE
+          ids_ bigint[];
+        BEGIN
+          FOR ids_ IN
+            SELECT array_agg(c.id ORDER BY c.id)
+            FROM (SELECT q.id,
+                  (row_number() OVER (ORDER BY q.id) - 1) / {chunksize} AS chunk
+                  FROM ({sql_ids.rstrip().rstrip(';')}) q) c
+            GROUP BY c.chunk
+            ORDER BY c.chunk
+          LOOP
+            {sql.rstrip().rstrip(';')};
+          END LOOP;
+        END
+        $chunks$;
+        '''
+
     def copy_relations(self):
         """
         copy relation and relation_member Schema
@@ -69,108 +167,86 @@ class ExtractOSM(Extract):
         (SELECT * FROM {self.temp}.relation_members) WITH NO DATA;
         """
         self.run_query(sql, conn=self.conn)
+        # the ids of the relations to copy, `done` when their parent
+        # relations have been looked up
+        # the id ranges of the members looked up in parallel share many
+        # relations, so they are collected in a staging table without a
+        # unique key, which the parallel transactions cannot deadlock on
+        sql = f"""
+        CREATE UNLOGGED TABLE "{self.schema}"._relation_ids
+        (id bigint PRIMARY KEY, done boolean NOT NULL DEFAULT false);
+        CREATE UNLOGGED TABLE "{self.schema}"._relation_ids_found
+        (id bigint);
+        """
+        self.run_query(sql, conn=self.conn)
         self.conn.commit()
 
         self.logger.info(f'Copying relations to {self.schema}.relations')
-
-        if len(self.way_ids) == 0:
-            return
-        relation_ids = set()
         chunksize = 100000
-        total = len(self.way_ids)
-        cur = self.conn.cursor()
-        for i in range(0, total, chunksize):
-            cur_ids = self.way_ids[i: i + chunksize]
+        for table, member_type in [('ways', 'W'), ('nodes', 'N')]:
             sql = f"""
-            -- get relation_ids for ways
+            -- get relation_ids for {table}
+            INSERT INTO "{self.schema}"._relation_ids_found (id)
             SELECT DISTINCT rm.relation_id
             FROM
               {self.temp}.relation_members rm
             WHERE
-              rm.member_id = ANY(%s) AND
-              rm.member_type = 'W'::bpchar
-            ;"""
-            self.logger.debug(f'{i}/{total}: {sql}')
-            cur.execute(sql, (cur_ids, ))
-            rows = cur.fetchall()
-            relation_ids = relation_ids | {row[0] for row in rows}
-
-        sql = f'''
-        SELECT id FROM {self.schema}.nodes n;
-        '''
-        cur.execute(sql)
-        rows = cur.fetchall()
-        self.node_ids = [row[0] for row in rows]
-        total = len(self.node_ids)
-        for i in range(0, total, chunksize):
-            cur_ids = self.node_ids[i: i + chunksize]
-            sql = f"""
-            -- get relation_ids for nodes
-            SELECT DISTINCT rm.relation_id
-            FROM
-              {self.temp}.relation_members rm
-            WHERE
-              rm.member_id = ANY(%s) AND
-              rm.member_type = 'N'::bpchar
-            ;"""
-            self.logger.debug(f'{i}/{total}: {sql}')
-            cur.execute(sql, (cur_ids, ))
-            rows = cur.fetchall()
-            relation_ids = relation_ids | {row[0] for row in rows}
+              rm.member_id = ANY(ids_) AND
+              rm.member_type = '{member_type}'::bpchar
+            """
+            self.insert_by_id_chunks(
+                sql, f'SELECT id FROM "{self.schema}".{table}', chunksize,
+                label=f'Looking up the relations of the {table}')
+        sql = f"""
+        INSERT INTO "{self.schema}"._relation_ids (id)
+        SELECT DISTINCT f.id FROM "{self.schema}"._relation_ids_found f
+        ON CONFLICT DO NOTHING;
+        DROP TABLE "{self.schema}"._relation_ids_found;
+        """
+        self.run_query(sql, conn=self.conn)
 
-        while relation_ids:
-            sql = f'''
-            SELECT id FROM {self.schema}.relations tr WHERE id = ANY(%s);
-            '''
-            self.logger.debug(sql)
-            cur.execute(sql, (list(relation_ids), ))
-            rows = cur.fetchall()
-            already_in = {row[0] for row in rows}
-            relation_ids = relation_ids - already_in
-            if not relation_ids:
-                break
-
-            sql = f'''
-            INSERT INTO {self.schema}.relations
+        # add the parent relations until there are no more new relations
+        sql = f"""
+        DO $relations$
+        DECLARE
+          ids_ bigint[];
+        BEGIN
+          LOOP
+            WITH new_ids AS (
+              UPDATE "{self.schema}"._relation_ids SET done = true
+              WHERE NOT done
+              RETURNING id)
+            SELECT array_agg(id) INTO ids_ FROM new_ids;
+            EXIT WHEN ids_ IS NULL;
+
+            INSERT INTO "{self.schema}".relations
             SELECT id, version, user_id, tstamp, changeset_id, tags
-            FROM {self.temp}.relations WHERE id = ANY(%s)
-            '''
-            self.logger.debug(sql)
-            cur.execute(sql, (list(relation_ids), ))
+            FROM {self.temp}.relations WHERE id = ANY(ids_);
 
-            sql = f'''
-            SELECT DISTINCT rm.relation_id AS id
+            INSERT INTO "{self.schema}"._relation_ids (id)
+            SELECT DISTINCT rm.relation_id
             FROM {self.temp}.relation_members rm
-            WHERE rm.member_id = ANY(%s)
-            AND rm.member_type = 'R';
-            '''
-            self.logger.debug(sql)
-            cur.execute(sql, (list(relation_ids), ))
-            rows = cur.fetchall()
-            relation_ids = {row[0] for row in rows}
+            WHERE rm.member_id = ANY(ids_)
+            AND rm.member_type = 'R'
+            ON CONFLICT DO NOTHING;
+          END LOOP;
+        END
+        $relations$;
+        """
+        self.run_query(sql, conn=self.conn, split=False)
+        self.run_query(f'DROP TABLE "{self.schema}"._relation_ids;',
+                       conn=self.conn)
 
-        sql = f'''
-        SELECT id FROM {self.schema}.relations r;
-        '''
-        cur.execute(sql)
-        rows = cur.fetchall()
-        ids = [row[0] for row in rows]
-        if len(ids) == 0:
-            return
-        chunksize = 100000
-        total = len(ids)
-        for i in range(0, total, chunksize):
-            cur_ids = ids[i: i + chunksize]
-            arr = ','.join([str(ci) for ci in cur_ids])
-            sql = f"""
-            -- INSERT Relation members
-            INSERT INTO {self.schema}.relation_members
-            SELECT rm.*
-            FROM {self.temp}.relation_members rm
-            WHERE rm.relation_id = ANY(%s);
-            """
-            self.logger.debug(f'{i}/{total}: {sql}')
-            cur.execute(sql, (cur_ids, ))
+        sql = f"""
+        -- INSERT Relation members
+        INSERT INTO {self.schema}.relation_members
+        SELECT rm.*
+        FROM {self.temp}.relation_members rm
+        WHERE rm.relation_id = ANY(ids_)
+        """
+        self.insert_by_id_chunks(
+            sql, f'SELECT id FROM "{self.schema}".relations', chunksize,
+            label='Copying the relation members')
 
     def copy_way_nodes(self):
         """
@@ -185,49 +261,36 @@ class ExtractOSM(Extract):
         '''
         self.run_query(sql, conn=self.conn)
 
-        sql = f'''
-        SELECT id FROM {self.schema}.ways w;
-        '''
-        cur = self.conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        self.way_ids = [row[0] for row in rows]
-        if len(self.way_ids) == 0:
-            return
         chunksize = 50000
-        total = len(self.way_ids)
-        for i in range(0, total, chunksize):
-            cur_ids = self.way_ids[i: i + chunksize]
-            sql = f"""
-            -- INSERT way_nodes
-            INSERT INTO {self.schema}.way_nodes
-            SELECT wn.*
-            FROM {self.temp}.way_nodes wn
-            WHERE wn.way_id = ANY(%s);
-            """
-            self.logger.debug(f'{i}/{total}: {sql}')
-            cur.execute(sql, (cur_ids, ))
-
-        sql = '''
-        SELECT DISTINCT wn.node_id FROM "{schema}".way_nodes wn
-        WHERE NOT EXISTS (SELECT 1 FROM "{schema}".nodes tn WHERE wn.node_id = tn.id);
-        '''.format(temp=self.temp, schema=self.schema)
+        sql = f"""
+        -- INSERT way_nodes
+        INSERT INTO {self.schema}.way_nodes
+        SELECT wn.*
+        FROM {self.temp}.way_nodes wn
+        WHERE wn.way_id = ANY(ids_)
+        """
+        self.insert_by_id_chunks(
+            sql, f'SELECT id FROM "{self.schema}".ways', chunksize,
+            label='Copying the way nodes')
 
-        cur.execute(sql)
-        rows = cur.fetchall()
-        ids = [row[0] for row in rows]
+        sql_ids = f'''
+        SELECT DISTINCT wn.node_id AS id FROM "{self.schema}".way_nodes wn
+        WHERE NOT EXISTS (SELECT 1 FROM "{self.schema}".nodes tn WHERE wn.node_id = tn.id)
+        '''
 
         self.logger.info(f'Copying related nodes to {self.schema}.nodes')
+        # the ids of all chunks are determined before the first insert,
+        # so the inserted nodes do not change the result of sql_ids
         sql = f'''
         INSERT INTO {self.schema}.nodes
         SELECT
           n.id, n.version, n.user_id, n.tstamp, n.changeset_id, n.tags,
           st_transform(n.geom, {self.target_srid}) AS geom
         FROM {self.temp}.nodes n
-        WHERE n.id = ANY(%s);
+        WHERE n.id = ANY(ids_)
         '''
-        self.logger.debug(sql)
-        cur.execute(sql, (ids, ))
+        self.insert_by_id_chunks(sql, sql_ids, chunksize,
+                                 label='Copying the related nodes')
 
     def copy_users(self):
         """
@@ -288,6 +351,8 @@ class ExtractOSM(Extract):
         '''
         self.logger.info('Creating session')
         self.run_query(sql, conn=self.conn)
+        # the session has to be visible to direct connections to the source
+        self.conn.commit()
 
     def remove_session(self):
         '''
@@ -308,11 +373,21 @@ class ExtractOSM(Extract):
     def extract_ways(self):
         """
         """
-        sql = """
-        SELECT
+        cols = """
           w.id, w.version, w.user_id, w.tstamp, w.changeset_id, w.tags, w.nodes,
           st_transform(st_setsrid(Box2D(w.linestring), {source_srid}), {target_srid})::geometry(GEOMETRY, {target_srid}) AS bbox,
           st_transform(w.linestring, {target_srid})::geometry(LINESTRING, {target_srid}) AS linestring
+        """.format(target_srid=self.target_srid, source_srid=self.srid)
+        if self.copy_from_source(
+                'ways',
+                select_target=f'SELECT {cols} FROM "{self.temp_meta}".osm_ways w',
+                select_source=f'SELECT {cols} FROM meta.osm_ways w '
+                f"WHERE w.session_id='{self.session_id}'"):
+            self.run_query(f'ANALYZE "{self.schema}".ways;', conn=self.conn)
+            return
+        sql = """
+        SELECT
+          {cols}
         INTO "{schema}".ways
         FROM "{temp_meta}".osm_ways w
         WHERE w.session_id='{session_id}';
@@ -320,26 +395,35 @@ class ExtractOSM(Extract):
         """
         self.logger.info(f'Extracting ways into {self.schema}.ways')
         self.run_query(sql.format(temp_meta=self.temp_meta, schema=self.schema,
-                                  target_srid=self.target_srid,
-                                  source_srid=self.srid,
+                                  cols=cols,
                                   session_id=self.session_id),
                        conn=self.conn)
 
     def extract_nodes(self):
         """
         """
-        sql = """
-        SELECT
+        cols = """
           n.id, n.version, n.user_id, n.tstamp, n.changeset_id, n.tags,
           st_transform(n.geom, {target_srid})::geometry('POINT', {target_srid}) AS geom
+        """.format(target_srid=self.target_srid)
+        if self.copy_from_source(
+                'nodes',
+                select_target=f'SELECT {cols} FROM {self.temp_meta}.osm_nodes n',
+                select_source=f'SELECT {cols} FROM meta.osm_nodes n '
+                f"WHERE n.session_id='{self.session_id}'"):
+            self.run_query(f'ANALYZE "{self.schema}".nodes;', conn=self.conn)
+            return
+        sql = """
+        SELECT
+          {cols}
         INTO "{schema}".nodes
         FROM {temp_meta}.osm_nodes n
         WHERE n.session_id='{session_id}';
         ANALYZE "{schema}".nodes;
         """
         self.logger.info(f'Extracting nodes into {self.schema}.nodes')
-        self.run_query(sql.format(temp=self.temp, schema=self.schema,
-                                  target_srid=self.target_srid,
+        self.run_query(sql.format(schema=self.schema,
+                                  cols=cols,
                                   temp_meta=self.temp_meta,
                                   session_id=self.session_id),
                        conn=self.conn)
@@ -437,7 +521,9 @@ class ExtractOSM(Extract):
 
         """.format(schema=self.schema)
         self.logger.info('Creating indexes')
-        self.run_query(sql, self.conn)
+        index_builder = IndexBuilder(self)
+        index_builder.add(sql)
+        index_builder.run(conn=self.conn)
 
     def further_stuff(self):
         """
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Extract the OSM data of the project area from a local .osm.pbf file
+instead of a pgsnapshot source database.
+
+The tables of the osm schema are created with the same columns as the ones
+extracted by ExtractOSM, so that BuildNetwork and CreatePolygons work on
+them unchanged.
+"""
+
+import os
+from argparse import ArgumentParser
+
+from extractiontools.connection import Connection
+from extractiontools.extract_osm import ExtractOSM
+from extractiontools.utils.osm_pbf import OSMSelection
+
+
+class ExtractOSMFromPBF(ExtractOSM):
+    """
+    Extract the osm data from a PBF file
+    """
+    # the version of the pgsnapshot schema
+    schema_version = 6
+
+    def __init__(self,
+                 destination_db: str,
+                 pbf_file: str = None,
+                 copy_classifications: bool = True,
+                 batch_size: int = 100000,
+                 **kwargs):
+        """
+        Parameters
+        ----------
+        pbf_file : str
+            the path to the .osm.pbf file, defaults to the environment
+            variable OSM_PBF_FILE
+        copy_classifications : bool, optional
+            copy the classifications used by the network builds from the
+            source database like ExtractOSM, if True
+        batch_size : int, optional
+            the number of objects read and copied at once
+        """
+        super().__init__(destination_db, **kwargs)
+        self.pbf_file = pbf_file or os.environ.get('OSM_PBF_FILE')
+        if not self.pbf_file:
+            raise ValueError('no pbf file given')
+        self.copy_classifications = copy_classifications
+        self.batch_size = batch_size
+
+    def extract(self):
+        self.set_pg_path()
+        try:
+            with Connection(login=self.login) as conn:
+                self.conn = conn
+                if self.boundary:
+                    self.set_target_boundary(self.boundary,
+                                             name=self.boundary_name)
+                self.update_boundaries()
+                self.create_schema(self.schema, conn=conn, replace=True)
+                self.create_tables()
+                self.load_pbf()
+                self.add_comments()
+                self.conn.commit()
+                self.final_stuff()
+                self.conn.commit()
+                if self.copy_classifications:
+                    self.further_stuff()
+        finally:
+            with Connection(login=self.login) as conn:
+                self.cleanup(conn=conn, schema='temp_pg_catalog')
+
+    def create_tables(self):
+        """
+        create the tables of the pgsnapshot schema
+        """
+        sql = f'''
+        CREATE TABLE "{self.schema}".nodes (
+          id bigint NOT NULL,
+          version integer NOT NULL,
+          user_id integer NOT NULL,
+          tstamp timestamp without time zone NOT NULL,
+          changeset_id bigint NOT NULL,
+          tags hstore,
+          geom geometry(POINT, {self.target_srid})
+        );
+        CREATE TABLE "{self.schema}".ways (
+          id bigint NOT NULL,
+          version integer NOT NULL,
+          user_id integer NOT NULL,
+          tstamp timestamp without time zone NOT NULL,
+          changeset_id bigint NOT NULL,
+          tags hstore,
+          nodes bigint[],
+          bbox geometry(GEOMETRY, {self.target_srid}),
+          linestring geometry(LINESTRING, {self.target_srid})
+        );
+        CREATE TABLE "{self.schema}".way_nodes (
+          way_id bigint NOT NULL,
+          node_id bigint NOT NULL,
+          sequence_id integer NOT NULL
+        );
+        CREATE TABLE "{self.schema}".relations (
+          id bigint NOT NULL,
+          version integer NOT NULL,
+          user_id integer NOT NULL,
+          tstamp timestamp without time zone NOT NULL,
+          changeset_id bigint NOT NULL,
+          tags hstore
+        );
+        CREATE TABLE "{self.schema}".relation_members (
+          relation_id bigint NOT NULL,
+          member_id bigint NOT NULL,
+          member_type character(1) NOT NULL,
+          member_role text NOT NULL,
+          sequence_id integer NOT NULL
+        );
+        CREATE TABLE "{self.schema}".users (
+          id integer NOT NULL,
+          name text NOT NULL
+        );
+        CREATE TABLE "{self.schema}".actions (
+          data_type character(1) NOT NULL,
+          action character(1) NOT NULL,
+          id bigint NOT NULL
+        );
+        CREATE TABLE "{self.schema}".schema_info (
+          version integer NOT NULL
+        );
+        INSERT INTO "{self.schema}".schema_info VALUES ({self.schema_version});
+        '''
+        self.run_query(sql, conn=self.conn)
+
+    def load_pbf(self):
+        """
+        select the objects in the area in a first pass over the file
+        and copy them into the tables in a second pass
+        """
+        self.logger.info(f'Selecting the OSM data in the area '
+                         f'from {self.pbf_file}')
+        self.selection = OSMSelection(self.get_target_boundary(),
+                                      batch_size=self.batch_size,
+                                      logger=self.logger)
+        self.selection.select(self.pbf_file)
+
+        self.logger.info(f'Copying the OSM data into {self.schema}')
+        columns = {
+            'nodes': ('id', 'version', 'user_id', 'tstamp', 'changeset_id',
+                      'tags', 'geom'),
+            'ways': ('id', 'version', 'user_id', 'tstamp', 'changeset_id',
+                     'tags', 'nodes', 'bbox', 'linestring'),
+            'way_nodes': ('way_id', 'node_id', 'sequence_id'),
+            'relations': ('id', 'version', 'user_id', 'tstamp',
+                          'changeset_id', 'tags'),
+            'relation_members': ('relation_id', 'member_id', 'member_type',
+                                 'member_role', 'sequence_id'),
+        }
+        geometries = {'nodes': ('geom', ),
+                      'ways': ('bbox', 'linestring')}
+        inserters = {
+            table: self.bulk_inserter(
+                table, cols, schema=self.schema, batch_size=self.batch_size,
+                binary=True,
+                geometry_srid={col: 4326 for col in geometries.get(table, ())})
+            for table, cols in columns.items()}
+        for table, rows in self.selection.rows(self.pbf_file):
+            inserters[table].extend(rows)
+        for table, inserter in inserters.items():
+            inserter.close()
+            self.logger.info(f'{inserter.rowcount} rows copied into '
+                             f'{self.schema}.{table}')
+
+        self.bulk_insert('users', sorted(self.selection.users.items()),
+                         columns=('id', 'name'), schema=self.schema,
+                         binary=True)
+        for table in columns:
+            self.run_query(f'ANALYZE "{self.schema}".{table};',
+                           conn=self.conn)
+
+    def add_comments(self):
+        self.logger.info('Applying table descriptions')
+        timestamp = self.selection.max_timestamp
+        t = timestamp.strftime('%Y-%m-%d %H:%M:%S') if timestamp else ''
+        pbf_file = os.path.basename(self.pbf_file)
+        for table in ['relation_members', 'users', 'way_nodes', 'relations',
+                      'ways', 'nodes', 'actions']:
+            description = f'timestamp: {t} \r\nextracted from {pbf_file}'
+            sql = f"COMMENT ON TABLE {self.schema}.{table} IS '{description}'"
+            self.run_query(sql)
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description="Extract OSM-Data from a PBF file")
+
+    parser.add_argument("-n", '--name', action="store",
+                        help="Name of destination database",
+                        dest="destination_db", default='extract')
+    parser.add_argument('--pbf', action="store",
+                        help="the .osm.pbf file",
+                        dest="pbf_file", required=True)
+    parser.add_argument('--skip-classifications', action="store_false",
+                        help="do not copy the classifications from the "
+                        "source database",
+                        dest="copy_classifications")
+
+    options = parser.parse_args()
+
+    extract = ExtractOSMFromPBF(destination_db=options.destination_db,
+                                pbf_file=options.pbf_file,
+                                copy_classifications=options.copy_classifications)
+    extract.extract()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Measure the effect of postgres_fdw options on the extraction of tables.
+
+The tables are extracted within the project area of an existing project
+database once per combination of fetch_size and shippable extensions.
+All changes (server options, extracted tables) are rolled back.
+"""
+
+from argparse import ArgumentParser
+import time
+import logging
+from typing import List
+
+from extractiontools.ausschnitt import Extract
+from extractiontools.connection import Connection
+
+
+class FDWBenchmark(Extract):
+    """
+    Benchmark of the options of the foreign server
+    """
+
+    def benchmark(self,
+                  schema: str,
+                  tables: List[str],
+                  geom: str = 'geom',
+                  fetch_sizes: List[int] = (100, 10000, 100000, 500000),
+                  extensions: List[str] = ('', 'postgis, hstore')):
+        """
+        extract the tables with all combinations of fetch sizes and
+        shippable extensions and log the times
+        """
+        self.schema = schema
+        wkt = self.get_target_boundary()
+        results = []
+        with Connection(login=self.login) as conn:
+            self.conn = conn
+            self.create_foreign_schema(foreign_schema=schema,
+                                       target_schema=self.temp,
+                                       tables=tables)
+            for ext in extensions:
+                for fetch_size in fetch_sizes:
+                    sql = f'''
+                    ALTER SERVER {self.foreign_server}
+                    OPTIONS (SET fetch_size '{fetch_size}',
+                             SET extensions '{ext}');
+                    '''
+                    self.run_query(sql, conn=conn)
+                    for tn in tables:
+                        sql = f'''
+                        CREATE TEMP TABLE bench_{tn} AS
+                        SELECT t.* FROM {self.temp}.{tn} t,
+                        (SELECT ST_GeomFromEWKT('SRID={self.srid};{wkt}')
+                         AS source_geom) tb
+                        WHERE st_intersects(t.{geom}, tb.source_geom);
+                        '''
+                        t0 = time.perf_counter()
+                        cur = self.run_query(sql, conn=conn)
+                        duration = time.perf_counter() - t0
+                        results.append((tn, fetch_size, ext or '-',
+                                        cur.rowcount, duration))
+                        self.logger.info(
+                            f'{tn}: fetch_size {fetch_size}, extensions '
+                            f'"{ext}": {cur.rowcount} rows in '
+                            f'{duration:.2f}s')
+                        self.run_query(f'DROP TABLE bench_{tn};', conn=conn)
+            conn.rollback()
+        return results
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description="Benchmark the FDW options")
+
+    parser.add_argument("-n", '--name', action="store",
+                        help="Name of the project database",
+                        dest="destination_db", default='extract')
+    parser.add_argument('--source-db', action="store",
+                        help="source database",
+                        dest="source_db", default='europe')
+    parser.add_argument('--schema', action="store",
+                        help="schema of the tables in the source database",
+                        dest="schema", default='osm')
+    parser.add_argument('--tables', action="store", nargs='*',
+                        help="tables to extract",
+                        dest="tables", default=['nodes'])
+    parser.add_argument('--geom', action="store",
+                        help="geometry column of the tables",
+                        dest="geom", default='geom')
+    parser.add_argument('--fetch-sizes', action="store", nargs='*', type=int,
+                        help="fetch sizes to compare",
+                        dest="fetch_sizes", default=[100, 10000, 100000])
+
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    bench = FDWBenchmark(destination_db=options.destination_db,
+                         source_db=options.source_db,
+                         temp='bench_fdw')
+    bench.benchmark(options.schema, options.tables, geom=options.geom,
+                    fetch_sizes=options.fetch_sizes)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Build indexes and constraints of several tables concurrently.
+
+The statements are collected per table and run in their order per table.
+Consecutive `CREATE INDEX` statements of a table are built in parallel
+(they only take a SHARE lock on the table), all other statements
+(`ALTER TABLE`, `CLUSTER`, `ANALYZE`, ...) wait for the preceding
+statements of the table and block the following ones.
+Statements of different tables run independently of each other.
+"""
+
+import os
+import re
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Tuple
+
+from extractiontools.connection import Connection, DBApp
+from extractiontools.utils.sql_split import split_sql
+
+_IDENT = r'(?:"[^"]+"|[\w$]+)'
+_TABLE = rf'({_IDENT}(?:\.{_IDENT})?)'
+_CREATE_INDEX = re.compile(
+    r'^CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?!CONCURRENTLY\b)'
+    rf'(?:IF\s+NOT\s+EXISTS\s+)?({_IDENT}\s+)?ON\s+(?:ONLY\s+)?{_TABLE}',
+    re.IGNORECASE)
+_TABLE_STATEMENTS = [
+    re.compile(rf'^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?{_TABLE}',
+               re.IGNORECASE),
+    re.compile(rf'^CLUSTER\s+(?:VERBOSE\s+)?{_TABLE}', re.IGNORECASE),
+    re.compile(rf'^ANALYZE\s+(?:VERBOSE\s+)?{_TABLE}', re.IGNORECASE),
+    re.compile(rf'^COMMENT\s+ON\s+TABLE\s+{_TABLE}', re.IGNORECASE),
+]
+_COMMENT = re.compile(r'--[^\n]*')
+
+
+def _normalize(table: str) -> str:
+    return table.replace('"', '').lower()
+
+
+def parse_statement(sql: str) -> Tuple[str, bool, str]:
+    """
+    return the table of the statement, if the statement can run in parallel
+    with other statements of the table and a label for the report
+    """
+    statement = _COMMENT.sub('', sql).strip()
+    match = _CREATE_INDEX.match(statement)
+    if match:
+        name = (match.group(1) or '').strip()
+        table = _normalize(match.group(2))
+        return table, True, name.replace('"', '') or f'index on {table}'
+    label = ' '.join(statement.split())[:60]
+    for pattern in _TABLE_STATEMENTS:
+        match = pattern.match(statement)
+        if match:
+            return _normalize(match.group(1)), False, label
+    return '', False, label
+
+
+class IndexBuilder:
+    """
+    Collects index and constraint DDL and builds it concurrently
+    over separate connections to the database of the app
+    """
+
+    def __init__(self,
+                 app: DBApp,
+                 n_workers: int = None,
+                 maintenance_work_mem: str = None,
+                 max_parallel_maintenance_workers: int = None,
+                 logger: logging.Logger = None):
+        """
+        Parameters
+        ----------
+        app : DBApp
+            the app with the login to the database, its run_query is used
+        n_workers : int (optional)
+            number of statements run at once, defaults to the environment
+            variable INDEX_WORKERS or 4
+        maintenance_work_mem : str (optional)
+            maintenance_work_mem of the sessions building the indexes,
+            defaults to INDEX_MAINTENANCE_WORK_MEM or 1GB
+        max_parallel_maintenance_workers: int (optional)
+            parallel workers per index build, defaults to
+            INDEX_PARALLEL_WORKERS or 2
+        """
+        self.app = app
+        self.logger = logger or app.logger
+        self.n_workers = n_workers or int(
+            os.environ.get('INDEX_WORKERS', 4))
+        self.maintenance_work_mem = maintenance_work_mem or os.environ.get(
+            'INDEX_MAINTENANCE_WORK_MEM', '1GB')
+        self.max_parallel_maintenance_workers = (
+            max_parallel_maintenance_workers
+            if max_parallel_maintenance_workers is not None
+            else int(os.environ.get('INDEX_PARALLEL_WORKERS', 2)))
+        # the groups of statements per table,
+        # a group is a list of (label, sql, parallel) which may run at once
+        self.tables: Dict[str, List[List[Tuple[str, str, bool]]]] = \
+            OrderedDict()
+        # all statements in the order they were added
+        self.statements: List[Tuple[str, str]] = []
+        self.timings: Dict[str, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.statements)
+
+    def add(self, sql: str):
+        """add the statements of the sql script"""
+        for statement in split_sql(sql):
+            if not _COMMENT.sub('', statement).strip().rstrip(';'):
+                continue
+            table, parallel, label = parse_statement(statement)
+            self.statements.append((label, statement))
+            groups = self.tables.setdefault(table, [])
+            if parallel and groups and groups[-1][-1][2]:
+                groups[-1].append((label, statement, parallel))
+            else:
+                groups.append([(label, statement, parallel)])
+
+    def session_settings(self) -> str:
+        """the settings for the transaction building the indexes"""
+        return (f"SET LOCAL maintenance_work_mem = "
+                f"'{self.maintenance_work_mem}';\n"
+                f"SET LOCAL max_parallel_maintenance_workers = "
+                f"{self.max_parallel_maintenance_workers};")
+
+    def _execute(self, label: str, sql: str, conn=None) -> float:
+        t0 = time.perf_counter()
+        if conn is None:
+            with Connection(login=self.app.login) as conn:
+                self.app.run_query(self.session_settings(), conn=conn,
+                                   verbose=False)
+                self.app.run_query(sql, conn=conn, split=False)
+        else:
+            self.app.run_query(sql, conn=conn, split=False)
+        duration = time.perf_counter() - t0
+        self.logger.debug(f'{label}: {duration:.2f}s')
+        return duration
+
+    def run(self, conn=None) -> Dict[str, float]:
+        """
+        build the collected indexes and constraints
+
+        With one worker, the statements run one after another on `conn`
+        in the order they were added.
+        Otherwise `conn` is committed first, so that the tables are visible
+        to the other connections, and every statement is committed on its
+        own.
+
+        Parameters
+        ----------
+        conn : Connection-Instance (optional)
+            if not given, than the default connection of the app is taken
+
+        Returns
+        -------
+        dict : the build time in seconds per index or statement
+        """
+        conn = conn or self.app.conn
+        tables, self.tables = self.tables, OrderedDict()
+        statements, self.statements = self.statements, []
+        n_statements = len(statements)
+        if not n_statements:
+            return {}
+        t0 = time.perf_counter()
+        if self.n_workers <= 1:
+            self.app.run_query(self.session_settings(), conn=conn,
+                               verbose=False)
+            for label, sql in statements:
+                self.timings[label] = self._execute(label, sql, conn=conn)
+        else:
+            conn.commit()
+            self._run_parallel(tables)
+        self.logger.info(
+            f'{n_statements} indexes and constraints built in '
+            f'{time.perf_counter() - t0:.2f}s')
+        for label, duration in sorted(self.timings.items(),
+                                      key=lambda t: t[1], reverse=True)[:10]:
+            self.logger.info(f'{duration:10.2f}s: {label}')
+        return self.timings
+
+    def _run_parallel(self,
+                      tables: Dict[str, List[List[Tuple[str, str, bool]]]]):
+        """
+        run the groups of each table one after another,
+        the statements in a group and the tables in parallel
+        """
+        pending = {table: list(groups) for table, groups in tables.items()}
+        # number of running statements of the current group per table
+        running_per_table = {}
+        failed = {}
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            futures = {}
+
+            def submit_next(table: str):
+                groups = pending[table]
+                if not groups or table in failed:
+                    return
+                group = groups.pop(0)
+                running_per_table[table] = len(group)
+                for label, sql, parallel in group:
+                    future = executor.submit(self._execute, label, sql)
+                    futures[future] = (table, label)
+
+            for table in tables:
+                submit_next(table)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    table, label = futures.pop(future)
+                    try:
+                        self.timings[label] = future.result()
+                    except Exception as e:
+                        self.logger.error(f'{label} failed: {e}')
+                        failed[table] = e
+                    running_per_table[table] -= 1
+                    if not running_per_table[table]:
+                        submit_next(table)
+        if failed:
+            raise Exception(f'Building the indexes of '
+                            f'{", ".join(failed)} failed') \
+                from next(iter(failed.values()))
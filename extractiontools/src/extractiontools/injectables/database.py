@@ -180,6 +180,25 @@ def target_srid() -> int:
     return 25832
 
 
+@meta(group='(1) Projekt', order=7, title='Parallele Extraktion',
+      description='Anzahl der Tabellen, die gleichzeitig über eigene '
+      'Datenbankverbindungen extrahiert werden, und der Pakete von '
+      'Relationen, aus denen gleichzeitig Multipolygone gebildet werden.')
+@orca.injectable()
+def extract_workers() -> int:
+    """The number of tables extracted or relation batches built in parallel"""
+    return int(os.environ.get('EXTRACT_WORKERS', 1))
+
+
+@meta(group='(1) Projekt', order=8, title='Paralleler Export',
+      description='Anzahl der Layer, die gleichzeitig in FGDB- oder '
+      'Geopackage-Dateien exportiert werden.')
+@orca.injectable()
+def export_workers() -> int:
+    """The number of layers exported in parallel"""
+    return int(os.environ.get('EXPORT_WORKERS', 1))
+
+
 @meta(group='(1) Projekt', order=5, choices=['europe'], title='Quelldatenbank',
       description='Der Name der Datenbank, aus der die Daten extrahiert werden.')
 @orca.injectable()
@@ -391,6 +410,15 @@ def chunksize() -> int:
     return 1000
 
 
+@meta(group='(3) Netzwerk', title='Parallele Netzbildung',
+      description='Anzahl der Datenbankverbindungen, über die die Chunks der '
+      'Links gleichzeitig erzeugt werden.')
+@orca.injectable()
+def network_workers() -> int:
+    """number of connections creating the chunks of links in parallel"""
+    return int(os.environ.get('NETWORK_WORKERS', 1))
+
+
 @meta(group='(3) Netzwerk', title='Mindestanzahl Links',
       description="Mindestanzahl der verbunden Kanten innerhalb einer Netzwerkkomponente (unverbundenes Teilnetzwerk). "
                   "Komponenten mit weniger Kanten fliegen aus dem Netzwerk.")
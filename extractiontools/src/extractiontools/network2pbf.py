@@ -3,16 +3,17 @@
 
 from argparse import ArgumentParser
 
-import sys
 import os
-import subprocess
+from typing import Callable, List, Tuple
 from extractiontools.connection import Login, Connection, DBApp
+from extractiontools.utils.progress import Progress
 
 
 class CopyNetwork2Pbf(DBApp):
     """
     Copy osm data that belong to a network
     """
+    itersize = 10000
 
     def __init__(self,
                  database: str,
@@ -199,28 +200,8 @@ USING btree(id);
                    srid=self.srid)
         self.run_query(sql)
 
-    def check_platform(self):
-        """
-        check the platform
-        """
-        super().check_platform()
-        if sys.platform.startswith('win'):
-            self.OSM_FOLDER = r'E:\Modell\osmosis'
-            self.OSMOSISPATH = os.path.join(self.OSM_FOLDER, 'bin',
-                                            'osmosis.bat')
-            self.AUTHFILE = os.path.join(self.OSM_FOLDER, 'config', 'pwd')
-        else:
-            self.OSM_FOLDER = '$HOME/gis/osm'
-            self.OSMOSISPATH = os.path.join('/opt', 'osmosis',
-                                            'bin', 'osmosis')
-        self.AUTHFILE = os.path.join('/run', 'secrets', 'osmosis_pwd')
-
-    def copy2pbf(self):
-        """
-        copy the according schema to a pbf with osmosis
-        """
-
-        fn = f'{self.login.db}_{self.network}'
+    @property
+    def pbf_path(self) -> str:
         folder = os.path.abspath(
             os.path.join(self.folder,
                          'projekte',
@@ -228,38 +209,95 @@ USING btree(id);
                          self.subfolder,
                          )
         )
-        os.makedirs(folder, exist_ok=True)
-
-        file_path = os.path.join(folder, fn)
+        return os.path.join(folder, f'{self.login.db}_{self.network}')
 
+    def copy2pbf(self):
+        """
+        copy the according schema to a pbf with pyosmium,
+        the nodes, ways and relations are read in batches sorted by id
+        """
+        import osmium
+        file_path = self.pbf_path
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        paths = [f'{file_path}.osm.pbf']
         if self.as_xml:
-            to_xml = f' --tee --write-xml file={file_path}.osm.bz2 '
-        else:
-            to_xml = ''
-        cmd = ('{OSMOSIS} -v '
-               '--read-pgsql '
-               'postgresSchema={schema} '
-               'authFile="{authfile}" '
-               'host={host}:{port} user={user} database={db} '
-               '--dataset-dump {to_xml}'
-               '--write-pbf omitmetadata=true file={fn}.osm.pbf')
-
-        full_cmd = cmd.format(OSMOSIS=self.OSMOSISPATH,
-                              schema=self.schema,
-                              authfile=self.AUTHFILE,
-                              host=self.login.host,
-                              port=self.login.port,
-                              user=self.login.user,
-                              db=self.login.db,
-                              fn=file_path,
-                              to_xml=to_xml,
-                              )
-        self.logger.debug(full_cmd)
-        self.logger.info(f'Writing OSM network data to {fn}.osm.pbf')
-        ret = subprocess.call(full_cmd, shell=self.SHELL)
-        if ret:
-            layer = 'pbf'
-            raise IOError(f'Layer {layer} could not becopied to pbf-file')
+            paths.append(f'{file_path}.osm.bz2')
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self.logger.info(f'Writing OSM network data to {paths[0]}')
+        writers = [osmium.SimpleWriter(paths[0],
+                                       filetype='pbf,add_metadata=false')]
+        if self.as_xml:
+            writers.append(osmium.SimpleWriter(paths[1]))
+        try:
+            with Connection(login=self.login) as conn:
+                for osm_type, sql, to_osm in self.osm_queries():
+                    progress = Progress(f'{osm_type} of {self.schema}',
+                                        logger=self.logger)
+                    for rows in self.iter_query(sql, conn=conn,
+                                                itersize=self.itersize):
+                        for row in rows:
+                            obj = to_osm(row)
+                            for writer in writers:
+                                writer.add(obj)
+                        progress.update(len(rows))
+                    progress.finish()
+        except Exception as e:
+            raise IOError(f'{self.schema} could not be copied to '
+                          f'{paths[0]}') from e
+        finally:
+            for writer in writers:
+                writer.close()
+
+    def osm_queries(self) -> List[Tuple[str, str, Callable]]:
+        """
+        return the type, the query and the function creating the
+        osmium object from a row for the nodes, ways and relations
+        """
+        from osmium.osm.mutable import Node, Way, Relation
+        schema = self.schema
+
+        def tags(a):
+            return dict(zip(a[::2], a[1::2])) if a else {}
+
+        nodes = f'''
+SELECT n.id, ST_X(n.geom) AS lon, ST_Y(n.geom) AS lat,
+  hstore_to_array(n.tags) AS tags
+FROM "{schema}".nodes n
+ORDER BY n.id;
+'''
+        ways = f'''
+SELECT w.id, w.nodes, hstore_to_array(w.tags) AS tags
+FROM "{schema}".ways w
+ORDER BY w.id;
+'''
+        relations = f'''
+SELECT r.id, hstore_to_array(r.tags) AS tags,
+  m.types, m.ids, m.roles
+FROM "{schema}".relations r
+LEFT JOIN (
+  SELECT rm.relation_id,
+    array_agg(lower(rm.member_type::text) ORDER BY rm.sequence_id) AS types,
+    array_agg(rm.member_id ORDER BY rm.sequence_id) AS ids,
+    array_agg(rm.member_role ORDER BY rm.sequence_id) AS roles
+  FROM "{schema}".relation_members rm
+  GROUP BY rm.relation_id
+) m ON m.relation_id = r.id
+ORDER BY r.id;
+'''
+        return [
+            ('nodes', nodes,
+             lambda r: Node(id=r.id, location=(r.lon, r.lat),
+                            tags=tags(r.tags))),
+            ('ways', ways,
+             lambda r: Way(id=r.id, nodes=r.nodes or [], tags=tags(r.tags))),
+            ('relations', relations,
+             lambda r: Relation(
+                 id=r.id,
+                 members=list(zip(r.types, r.ids, r.roles)) if r.ids else [],
+                 tags=tags(r.tags))),
+        ]
 
 
 class CopyNetwork2PbfTagged(CopyNetwork2Pbf):
@@ -1,19 +1,32 @@
 #!/usr/bin/env python
 # coding:utf-8
 
+import os
+import time
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Tuple
+
+import psycopg2
 
 from extractiontools.connection import Connection, Login
 from extractiontools.ausschnitt import Extract
+from extractiontools.extract_cache import ExtractCache
 
 
 class CreatePolygons(Extract):
     """"""
+    # the tables created, on which the views polygons and lines are built
+    polygon_tables = ('simple_polys', 'polygon_with_holes', 'multi_polygons',
+                      'ways_in_poly')
 
-    def __init__(self, destination_db, **kwargs):
+    def __init__(self, destination_db, chunksize: int = None, **kwargs):
         """"""
         super().__init__(destination_db=destination_db, **kwargs)
         self.check_platform()
+        # number of relations assembled in one batch
+        self.chunksize = chunksize or int(
+            os.environ.get('POLYGON_CHUNKSIZE', 5000))
 
     def create_poly_and_multipolygons(self, schema='osm'):
         """
@@ -58,112 +71,11 @@ FROM "{schema}".relations r
 WHERE r.tags -> 'type' = 'multipolygon'
 AND r.tags ? 'type';
 
--- set array of outerrings
-UPDATE "{schema}".polygon_with_holes r
-SET outerring_array = a.arr,
-outerring_linestring = a.geom
-FROM (
-SELECT r.relation_id,
-array_agg(rm.member_id) as arr,
-st_multi(ST_LineMerge(ST_Collect(w.linestring))) AS geom
-  FROM
-  "{schema}".polygon_with_holes r,
-  "{schema}".relation_members rm,
-  "{schema}".ways w
-  WHERE rm.member_role = 'outer'
-    and rm.relation_id = r.relation_id
-    and w.id = rm.member_id
-    and st_NPoints(w.linestring) > 1
-    and st_IsValid(w.linestring)
-  GROUP BY r.relation_id) a
-  WHERE a.relation_id = r.relation_id;
-
--- set innerrings
-UPDATE "{schema}".polygon_with_holes r
-SET innerring_linestring = b.geom_arr
-FROM (
-SELECT a.relation_id,
-array_agg(geom) AS geom_arr
-FROM (
-SELECT
-rr.relation_id,
-(st_dump(ST_LineMerge(ST_Collect(w.linestring)))).geom
-  FROM
-    "{schema}".relation_members rm,
-    "{schema}".ways w,
-    "{schema}".polygon_with_holes rr
-  WHERE rm.member_role = 'inner'
-    and rm.relation_id = rr.relation_id
-    and w.id = rm.member_id
-  GROUP BY rr.relation_id ) a
-  GROUP BY a.relation_id ) b
-  WHERE b.relation_id = r.relation_id;
-
--- a ring with only 3 points is flat: A-B-A (1st point = 3rd point), hence buggy
-UPDATE "{schema}".polygon_with_holes r
-SET poly_type= 'no valid outerring' WHERE
-st_NPoints(r.outerring_linestring) < 4 -- 5 relations are buggy in italy.osm
-or r.outerring_linestring IS NULL -- about 16000 (relations between simple nodes?)
-;
--- the above must be done before what follows, because if less than 3 points, test may crash
-UPDATE "{schema}".polygon_with_holes r
-SET poly_type= 'no valid outerring' WHERE
-r.poly_type = 'unknown'
-and NOT st_IsClosed(r.outerring_linestring); -- 136 are buggy in italy.osm
-
-UPDATE "{schema}".polygon_with_holes r
-SET poly_type= 'no valid outerring' WHERE
-r.poly_type = 'unknown'
-and NOT st_IsSimple(r.outerring_linestring); -- 102 more are buggy in italy.osm
-
-
--- If (NOT poly_type= 'no valid outerring') after the above,
--- it means there is a valid outerring. Now, l
--- et us see if there is a valid innerring (or several)
-
--- if there is no inner line, there is no valid innerring
-UPDATE "{schema}".polygon_with_holes r
-SET poly_type= 'no valid innerring'
-WHERE r.poly_type = 'unknown'
-and r.innerring_linestring IS NULL
-; -- 3015 more have no valid innerring
-
--- innering must be closed
-UPDATE "{schema}".polygon_with_holes r
-SET poly_type= 'no valid innerring'
-WHERE r.poly_type = 'unknown'
-and (NOT st_ISClosed(ST_LineMerge(ST_Collect(r.innerring_linestring))))
-; -- 44 more are buggy
-
--- innering must be big enough
--- all innerrings must have at least three points
-UPDATE "{schema}".polygon_with_holes r
-SET poly_type= 'no valid innerring'
-FROM (
-SELECT r2.relation_id
-FROM (
-SELECT r.relation_id, st_NPoints(unnest(r.innerring_linestring)) n
-FROM "{schema}".polygon_with_holes r ) r2
-GROUP BY r2.relation_id
-HAVING not bool_and(r2.n > 3)) r3
-WHERE r.poly_type = 'unknown'
-AND r3.relation_id = r.relation_id
-;
-
--- check further validity of innerring: closed (multi)linestring?
-UPDATE "{schema}".polygon_with_holes r
-SET poly_type= 'valid innerring'
-WHERE r.poly_type = 'unknown'
-and (st_ISClosed(ST_LineMerge(ST_Collect(r.innerring_linestring))))
-;
-
-
---finally create the Polygon
-UPDATE "{schema}".polygon_with_holes r
-SET polygon = st_multi(ST_MakePolygon(r.outerring_linestring,
-                                      (r.innerring_linestring )))
-WHERE poly_type= 'valid innerring'
-and GeometryType(r.outerring_linestring) ='LINESTRING';
+-- the relations, whose polygons could not be built
+DROP TABLE IF EXISTS "{schema}".polygon_errors;
+CREATE TABLE "{schema}".polygon_errors (
+relation_id bigint PRIMARY KEY,
+error text);
 """
 
         sql_create_multipolygons = f"""
@@ -177,66 +89,6 @@ polygon geometry(POLYGON, {self.target_srid}));
 
 ALTER TABLE "{schema}".multi_polygons
 ADD PRIMARY KEY (relation_id, path);
-
--- fill the multipolygon_table
-INSERT INTO "{schema}".multi_polygons (relation_id, path, outerring)
-SELECT r.relation_id,
-(st_dump(r.outerring_linestring)).path[1],
-(st_dump(r.outerring_linestring)).geom
-FROM "{schema}".polygon_with_holes r
-WHERE geometrytype(r.outerring_linestring) = 'MULTILINESTRING';
-
--- build the outerring polygon
-UPDATE "{schema}".multi_polygons m
-SET polygon = st_makepolygon(outerring)
-WHERE st_isclosed(outerring)
-AND st_npoints(outerring) > 3;
-
--- create the full polygon
-UPDATE "{schema}".multi_polygons m
-SET polygon = st_makepolygon(m.outerring, i2.geom_agg)
-FROM
-(SELECT
-  i.relation_id,
-  i.path,
-  array_agg(i.geom) AS geom_agg
- FROM
-(SELECT
-  m.relation_id,
-  m.path,
-  m.polygon,
-  -- one row per innerring
-  unnest(r.innerring_linestring) AS geom
-FROM
-  "{schema}".polygon_with_holes r,
-  "{schema}".multi_polygons m
-WHERE r.relation_id = m.relation_id ) i
--- check which innerring is in which outer polygon for each relation
-WHERE st_within(i.geom, i.polygon)
--- only consider valid innerrings
-AND st_isclosed(i.geom)
-AND st_npoints(i.geom) > 3
-
--- regroup the valid innerrings to a geometry array
-GROUP BY i.relation_id, i.path) AS i2
-WHERE m.relation_id = i2.relation_id
-AND m.path = i2.path;
-
-
--- and the Multipolygons
-UPDATE "{schema}".polygon_with_holes r
-SET polygon = mm.geom,
-poly_type = 'multipolygon'
-FROM
-(SELECT m.relation_id,
-st_multi(st_collect(m.polygon)) AS geom
-FROM
-"{schema}".multi_polygons m,
-"{schema}".polygon_with_holes r
-WHERE m.relation_id = r.relation_id
-GROUP BY m.relation_id) mm
-WHERE mm.relation_id = r.relation_id;
-
 """
         sql_delete_unused_simple_polygons = f"""
 -- the complex polygons that are valid no longer need to be represented with their outerring only
@@ -367,7 +219,7 @@ SELECT m.relation_id AS id,
 m.polygon AS geom,
 m.tags
 FROM "{schema}".polygon_with_holes m
-WHERE m.poly_type != 'no valid outerring';
+WHERE m.poly_type NOT IN ('no valid outerring', 'error');
 
 DROP VIEW IF EXISTS "{schema}".lines CASCADE;
 CREATE OR REPLACE VIEW "{schema}".lines
@@ -387,6 +239,8 @@ WHERE NOT EXISTS
             self.run_query(sql_create_simple_polygons)
             self.run_query(sql_create_polygons_with_holes)
             self.run_query(sql_create_multipolygons)
+            self.conn.commit()
+            self.assemble_polygons(schema)
             self.run_query(sql_delete_unused_simple_polygons)
             self.logger.info('Updating tags')
             self.run_query(sql_update_tags)
@@ -395,8 +249,315 @@ WHERE NOT EXISTS
             self.logger.info(f'Creating views {schema}.polygons and '
                              f'{schema}.lines')
             self.run_query(sql_create_view)
+            ExtractCache.record_versions(schema, self.conn,
+                                         tables=list(self.polygon_tables))
             self.conn.commit()
 
+    def assemble_polygons(self, schema: str = 'osm'):
+        """
+        assemble the rings of the multipolygon relations in batches of
+        relation ids, with more than one worker in parallel over separate
+        connections, each batch committed on its own
+
+        the relations of a failing batch are assembled one by one and those
+        failing again are quarantined in polygon_errors
+        """
+        t0 = time.perf_counter()
+        batches = self.relation_batches(schema)
+        n_workers = min(self.n_workers, len(batches))
+        self.logger.info(f'Assembling the multipolygons in {len(batches)} '
+                         f'batches with {max(n_workers, 1)} workers')
+        n_errors = 0
+        if n_workers <= 1:
+            for first, last in batches:
+                n_errors += self.assemble_batch(schema, first, last,
+                                                conn=self.conn)
+        else:
+            def assemble(first: int, last: int) -> int:
+                with Connection(login=self.login) as conn:
+                    return self.assemble_batch(schema, first, last,
+                                               conn=conn)
+
+            failed = {}
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                futures = {executor.submit(assemble, first, last):
+                           (first, last) for first, last in batches}
+                for future in as_completed(futures):
+                    first, last = futures[future]
+                    try:
+                        n_errors += future.result()
+                    except Exception as e:
+                        self.logger.error(f'Assembling the relations '
+                                          f'{first}-{last} failed: {e}')
+                        failed[(first, last)] = e
+            if failed:
+                raise Exception(f'Assembling the multipolygons failed in '
+                                f'{len(failed)} batches') \
+                    from next(iter(failed.values()))
+        if n_errors:
+            self.logger.warning(f'{n_errors} relations could not be '
+                                f'assembled, see {schema}.polygon_errors')
+        self.logger.info(f'Multipolygons assembled in '
+                         f'{time.perf_counter() - t0:.2f}s')
+
+    def relation_batches(self, schema: str = 'osm') -> List[Tuple[int, int]]:
+        """
+        return the first and the last relation id of the batches of
+        chunksize relations
+        """
+        sql = f"""
+SELECT min(r.relation_id) AS first, max(r.relation_id) AS last
+FROM (
+  SELECT
+    relation_id,
+    (row_number() OVER (ORDER BY relation_id) - 1) / {self.chunksize} AS batch
+  FROM "{schema}".polygon_with_holes) r
+GROUP BY r.batch
+ORDER BY r.batch;
+"""
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        return [(row.first, row.last) for row in cur.fetchall()]
+
+    def assemble_batch(self,
+                       schema: str,
+                       first: int,
+                       last: int,
+                       conn: Connection) -> int:
+        """
+        assemble the polygons of the relations with ids from first to last
+
+        Returns
+        -------
+        int : the number of relations quarantined in polygon_errors
+        """
+        try:
+            self.run_query(self.assembly_query(schema, first, last),
+                           conn=conn, verbose=False)
+            conn.commit()
+            return 0
+        except psycopg2.DatabaseError as e:
+            conn.rollback()
+            self.logger.warning(f'Assembling the relations {first}-{last} '
+                                f'failed, retrying them one by one: {e}')
+        cur = conn.cursor()
+        cur.execute(f"""
+SELECT relation_id FROM "{schema}".polygon_with_holes
+WHERE relation_id BETWEEN {first} AND {last}
+ORDER BY relation_id;
+""")
+        relation_ids = [row.relation_id for row in cur.fetchall()]
+        n_errors = 0
+        for relation_id in relation_ids:
+            cur.execute('SAVEPOINT relation;')
+            try:
+                self.run_query(
+                    self.assembly_query(schema, relation_id, relation_id),
+                    conn=conn, verbose=False)
+            except psycopg2.DatabaseError as e:
+                cur.execute('ROLLBACK TO SAVEPOINT relation;')
+                self.run_query(f"""
+INSERT INTO "{schema}".polygon_errors (relation_id, error)
+VALUES (%(relation_id)s, %(error)s);
+UPDATE "{schema}".polygon_with_holes
+SET poly_type = 'error'
+WHERE relation_id = %(relation_id)s;
+""", conn=conn, verbose=False,
+                               vars={'relation_id': relation_id,
+                                     'error': str(e).strip()})
+                n_errors += 1
+            cur.execute('RELEASE SAVEPOINT relation;')
+        conn.commit()
+        return n_errors
+
+    def assembly_query(self, schema: str, first: int, last: int) -> str:
+        """
+        return the queries assembling the rings of the relations
+        with ids from first to last
+        """
+        batch = f'BETWEEN {first} AND {last}'
+        return f"""
+-- set array of outerrings
+UPDATE "{schema}".polygon_with_holes r
+SET outerring_array = a.arr,
+outerring_linestring = a.geom
+FROM (
+SELECT r.relation_id,
+array_agg(rm.member_id) as arr,
+st_multi(ST_LineMerge(ST_Collect(w.linestring))) AS geom
+  FROM
+  "{schema}".polygon_with_holes r,
+  "{schema}".relation_members rm,
+  "{schema}".ways w
+  WHERE rm.member_role = 'outer'
+    and r.relation_id {batch}
+    and rm.relation_id = r.relation_id
+    and w.id = rm.member_id
+    and st_NPoints(w.linestring) > 1
+    and st_IsValid(w.linestring)
+  GROUP BY r.relation_id) a
+  WHERE a.relation_id = r.relation_id;
+
+-- set innerrings
+UPDATE "{schema}".polygon_with_holes r
+SET innerring_linestring = b.geom_arr
+FROM (
+SELECT a.relation_id,
+array_agg(geom) AS geom_arr
+FROM (
+SELECT
+rr.relation_id,
+(st_dump(ST_LineMerge(ST_Collect(w.linestring)))).geom
+  FROM
+    "{schema}".relation_members rm,
+    "{schema}".ways w,
+    "{schema}".polygon_with_holes rr
+  WHERE rm.member_role = 'inner'
+    and rr.relation_id {batch}
+    and rm.relation_id = rr.relation_id
+    and w.id = rm.member_id
+  GROUP BY rr.relation_id ) a
+  GROUP BY a.relation_id ) b
+  WHERE b.relation_id = r.relation_id;
+
+-- a ring with only 3 points is flat: A-B-A (1st point = 3rd point), hence buggy
+UPDATE "{schema}".polygon_with_holes r
+SET poly_type= 'no valid outerring' WHERE
+r.relation_id {batch}
+and (st_NPoints(r.outerring_linestring) < 4 -- 5 relations are buggy in italy.osm
+or r.outerring_linestring IS NULL) -- about 16000 (relations between simple nodes?)
+;
+-- the above must be done before what follows, because if less than 3 points, test may crash
+UPDATE "{schema}".polygon_with_holes r
+SET poly_type= 'no valid outerring' WHERE
+r.relation_id {batch}
+and r.poly_type = 'unknown'
+and NOT st_IsClosed(r.outerring_linestring); -- 136 are buggy in italy.osm
+
+UPDATE "{schema}".polygon_with_holes r
+SET poly_type= 'no valid outerring' WHERE
+r.relation_id {batch}
+and r.poly_type = 'unknown'
+and NOT st_IsSimple(r.outerring_linestring); -- 102 more are buggy in italy.osm
+
+
+-- If (NOT poly_type= 'no valid outerring') after the above,
+-- it means there is a valid outerring. Now, l
+-- et us see if there is a valid innerring (or several)
+
+-- if there is no inner line, there is no valid innerring
+UPDATE "{schema}".polygon_with_holes r
+SET poly_type= 'no valid innerring'
+WHERE r.relation_id {batch}
+and r.poly_type = 'unknown'
+and r.innerring_linestring IS NULL
+; -- 3015 more have no valid innerring
+
+-- innering must be closed
+UPDATE "{schema}".polygon_with_holes r
+SET poly_type= 'no valid innerring'
+WHERE r.relation_id {batch}
+and r.poly_type = 'unknown'
+and (NOT st_ISClosed(ST_LineMerge(ST_Collect(r.innerring_linestring))))
+; -- 44 more are buggy
+
+-- innering must be big enough
+-- all innerrings must have at least three points
+UPDATE "{schema}".polygon_with_holes r
+SET poly_type= 'no valid innerring'
+FROM (
+SELECT r2.relation_id
+FROM (
+SELECT r.relation_id, st_NPoints(unnest(r.innerring_linestring)) n
+FROM "{schema}".polygon_with_holes r
+WHERE r.relation_id {batch}) r2
+GROUP BY r2.relation_id
+HAVING not bool_and(r2.n > 3)) r3
+WHERE r.poly_type = 'unknown'
+AND r3.relation_id = r.relation_id
+;
+
+-- check further validity of innerring: closed (multi)linestring?
+UPDATE "{schema}".polygon_with_holes r
+SET poly_type= 'valid innerring'
+WHERE r.relation_id {batch}
+and r.poly_type = 'unknown'
+and (st_ISClosed(ST_LineMerge(ST_Collect(r.innerring_linestring))))
+;
+
+
+--finally create the Polygon
+UPDATE "{schema}".polygon_with_holes r
+SET polygon = st_multi(ST_MakePolygon(r.outerring_linestring,
+                                      (r.innerring_linestring )))
+WHERE r.relation_id {batch}
+and poly_type= 'valid innerring'
+and GeometryType(r.outerring_linestring) ='LINESTRING';
+
+-- fill the multipolygon_table
+INSERT INTO "{schema}".multi_polygons (relation_id, path, outerring)
+SELECT r.relation_id,
+(st_dump(r.outerring_linestring)).path[1],
+(st_dump(r.outerring_linestring)).geom
+FROM "{schema}".polygon_with_holes r
+WHERE r.relation_id {batch}
+AND geometrytype(r.outerring_linestring) = 'MULTILINESTRING';
+
+-- build the outerring polygon
+UPDATE "{schema}".multi_polygons m
+SET polygon = st_makepolygon(outerring)
+WHERE m.relation_id {batch}
+AND st_isclosed(outerring)
+AND st_npoints(outerring) > 3;
+
+-- create the full polygon
+UPDATE "{schema}".multi_polygons m
+SET polygon = st_makepolygon(m.outerring, i2.geom_agg)
+FROM
+(SELECT
+  i.relation_id,
+  i.path,
+  array_agg(i.geom) AS geom_agg
+ FROM
+(SELECT
+  m.relation_id,
+  m.path,
+  m.polygon,
+  -- one row per innerring
+  unnest(r.innerring_linestring) AS geom
+FROM
+  "{schema}".polygon_with_holes r,
+  "{schema}".multi_polygons m
+WHERE r.relation_id = m.relation_id
+AND r.relation_id {batch}) i
+-- check which innerring is in which outer polygon for each relation
+WHERE st_within(i.geom, i.polygon)
+-- only consider valid innerrings
+AND st_isclosed(i.geom)
+AND st_npoints(i.geom) > 3
+
+-- regroup the valid innerrings to a geometry array
+GROUP BY i.relation_id, i.path) AS i2
+WHERE m.relation_id = i2.relation_id
+AND m.path = i2.path;
+
+
+-- and the Multipolygons
+UPDATE "{schema}".polygon_with_holes r
+SET polygon = mm.geom,
+poly_type = 'multipolygon'
+FROM
+(SELECT m.relation_id,
+st_multi(st_collect(m.polygon)) AS geom
+FROM
+"{schema}".multi_polygons m,
+"{schema}".polygon_with_holes r
+WHERE m.relation_id = r.relation_id
+AND r.relation_id {batch}
+GROUP BY m.relation_id) mm
+WHERE mm.relation_id = r.relation_id;
+"""
+
 
 if __name__ == '__main__':
 
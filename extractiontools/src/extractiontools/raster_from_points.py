@@ -3,8 +3,7 @@
 
 import os
 import sys
-import tempfile
-import subprocess
+import time
 from extractiontools.connection import Connection, DBApp, Login
 
 
@@ -207,9 +206,6 @@ WHERE
         """
         export the data to tiff files
         """
-        tempfile_hex = tempfile.TemporaryFile
-        tempfile_hex = '/tmp/{tn}.hex'.format(tn=tablename)
-
         folder = os.path.join(self.folder,
                               'projekte',
                               self.destination_db,
@@ -219,38 +215,32 @@ WHERE
         fn = '{tn}.tiff'.format(tn=tablename)
         file_path = os.path.join(folder, fn)
 
-        copy_sql = """
-COPY (
-  SELECT encode(
-    ST_AsTIFF(st_union({rast}), 'LZW'),
-    'hex') AS png
-  FROM {s}.{tn})
-  TO STDOUT;
+        # the tiff is fetched as binary value and written directly
+        sql = """
+SELECT ST_AsTIFF(st_union({rast}), 'LZW') AS tiff
+FROM {s}.{tn};
     """.format(
             s=self.schema,
             tn=tablename,
             rast=raster_col,
         )
 
-        with tempfile.NamedTemporaryFile('wb', delete=False) as f:
-            cur = self.conn.cursor()
-
-            self.logger.info(f'Exporting raster file')
-            self.logger.debug(copy_sql)
-            cur.copy_expert(copy_sql, f)
-            f.close()
-
-            cmd = f'/usr/bin/xxd -p -r {f.name} > {file_path}'
-            self.logger.info(f'Copying raster file to {file_path}')
-            self.logger.debug(cmd)
-            ret = subprocess.call(cmd, shell=self.SHELL)
-            try:
-                os.remove(f.name)
-            except IOError:
-                pass
-        if ret:
+        cur = self.conn.cursor()
+        self.logger.info(f'Exporting raster file')
+        self.logger.debug(sql)
+        t0 = time.perf_counter()
+        cur.execute(sql)
+        row = cur.fetchone()
+        if row is None or row.tiff is None:
             msg = f'Raster Table {tablename} could not be copied to {file_path}'
             raise IOError(msg)
+        with open(file_path, 'wb') as f:
+            f.write(row.tiff)
+        seconds = max(time.perf_counter() - t0, 1e-6)
+        size = len(row.tiff) / 2**20
+        self.logger.info(f'Raster file with {size:.1f} MB copied to '
+                         f'{file_path} in {seconds:.1f}s '
+                         f'({size / seconds:.1f} MB/s)')
 
     def create_matview_poly_with_raster(self,
                                         tablename,
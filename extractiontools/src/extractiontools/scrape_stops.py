@@ -5,6 +5,7 @@ from argparse import ArgumentParser
 
 from extractiontools.ausschnitt import Extract, Connection
 from extractiontools.utils.bahn_query import BahnQuery
+from extractiontools.utils.copy_format import point_ewkb
 from psycopg2.extras import NamedTupleCursor
 from typing import Tuple
 
@@ -195,24 +196,13 @@ class ScrapeStops(Extract):
             LIKE "{self.schema}".haltestellen INCLUDING CONSTRAINTS INCLUDING DEFAULTS);
             '''
         self.run_query(sql)
-        for stop in stops:
-            sql = f"""
-                INSERT INTO "{self.schema}"."{temp_table}"
-                ("H_Name", "H_ID", geom, in_area)
-                VALUES
-                (%(stop_name)s, %(stop_id)s,
-                st_transform(
-                  st_setsrid(st_makepoint( %(x)s, %(y)s), 4326 ), %(target_srid)s),
-                True::boolean)
-                """
-            cursor.execute(sql,
-                           {'stop_name': stop['name'],
-                            'stop_id': stop['id'],
-                            'x': stop['x'],
-                            'y': stop['y'],
-                            'target_srid': self.target_srid,
-                            }
-                           )
+        rows = ((stop['name'], stop['id'],
+                 point_ewkb(stop['x'], stop['y'], 4326), True)
+                for stop in stops)
+        self.bulk_insert(temp_table, rows,
+                         columns=('H_Name', 'H_ID', 'geom', 'in_area'),
+                         schema=self.schema,
+                         geometry_srid={'geom': 4326})
 
         sql = f'''
             DELETE FROM "{self.schema}"."{temp_table}" a
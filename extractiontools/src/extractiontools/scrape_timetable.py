@@ -195,30 +195,21 @@ class ScrapeTimetable(ScrapeStops):
                     )
         j_id = cur.fetchone()
 
+        rows = []
         for i, section in enumerate(route):
             arr_time = section.get('arrival')
-            at = (f"'{arr_time.strftime(self.sql_timestamp_format)}'"
+            at = (arr_time.strftime(self.sql_timestamp_format)
                   if arr_time else None)
             dep_time = section.get('departure')
-            dt = (f"'{dep_time.strftime(self.sql_timestamp_format)}'"
+            dt = (dep_time.strftime(self.sql_timestamp_format)
                   if dep_time else None)
-            sql = f"""
-            INSERT INTO "{self.schema}".fahrten
-            (abfahrt_id, "Fahrt_Name", fahrt_index,
-            "H_Name", "H_Ankunft", "H_Abfahrt", "H_ID")
-            VALUES (%(journey_id)s, %(journey_name)s, %(index)s, %(station_name)s,
-                    %(at)s, %(dt)s, %(station_id)s);
-            """
-
-            cur.execute(sql, vars=dict(
-                journey_id=j_id[0],
-                journey_name=journey['name'],
-                index=i + 1,
-                station_name=section['station_name'],
-                at=at,
-                dt=dt,
-                station_id=section['station_id'],
-            ))
+            rows.append((j_id[0], journey['name'], i + 1,
+                         section['station_name'], at, dt,
+                         section['station_id']))
+        self.bulk_insert('fahrten', rows,
+                         columns=('abfahrt_id', 'Fahrt_Name', 'fahrt_index',
+                                  'H_Name', 'H_Ankunft', 'H_Abfahrt', 'H_ID'),
+                         schema=self.schema)
 
     def check_journey(self, journey, stop_id):
         departure = journey['departure'].strftime(self.sql_time_format)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Skim matrices of the travel costs between sets of points in the network.
+
+The points are snapped to the nearest node of the graph exported by
+ExportNetworkGraph, which is exported again, if the network has changed
+since. The shortest paths are computed with Dijkstra's algorithm from
+chunks of origins in worker processes, which share the memory-mapped
+cost matrix of the exported graph.
+"""
+
+import os
+import json
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from extractiontools.connection import Connection, DBApp
+from extractiontools.export_network_graph import ExportNetworkGraph
+from extractiontools.utils.graph import (load_graph, graph_matrix,
+                                         snap_points, shortest_paths)
+
+
+# the cost matrix of the graph in a worker process
+_worker_matrix = None
+
+
+def _init_worker(folder: str):
+    """map the cost matrix of the graph in the worker process"""
+    global _worker_matrix
+    _worker_matrix = graph_matrix(load_graph(folder))
+
+
+def _skim_chunk(origins: np.ndarray,
+                destinations: np.ndarray,
+                limit: float) -> np.ndarray:
+    """compute the rows of the skim matrix of a chunk of origins"""
+    return shortest_paths(_worker_matrix, origins, destinations, limit=limit)
+
+
+class SkimMatrix(DBApp):
+    """
+    Compute the skim matrix between the points of two tables
+    """
+
+    def __init__(self,
+                 database: str,
+                 origins: str,
+                 destinations: str = None,
+                 id_column: str = 'id',
+                 geom_column: str = 'geom',
+                 network_schema: str = 'network',
+                 subfolder: str = 'skims',
+                 graph_subfolder: str = 'graph',
+                 max_cost: float = None,
+                 n_workers: int = None,
+                 chunksize: int = 20,
+                 file_format: str = 'npz',
+                 **kwargs):
+        """
+        Parameters
+        ----------
+        database : str
+            the database with the network
+        origins : str
+            the table with the origins as schema.table,
+            e.g. laea.laea_vector_1000 or verwaltungsgrenzen.gem
+        destinations : str, optional
+            the table with the destinations, the origins if not given
+        id_column : str, optional
+            the column with the ids of the points in both tables
+        geom_column : str, optional
+            the geometry column in both tables, for polygons
+            a point on the surface is taken
+        network_schema : str, optional
+            the schema of the network
+        subfolder : str, optional
+            the subfolder for the skim matrices within the project folder
+        graph_subfolder : str, optional
+            the subfolder with the exported graphs, the graph is exported
+            if it is not found there
+        max_cost : float, optional
+            the search stops at this cost, the costs above are infinite
+        n_workers : int, optional
+            the number of processes computing the shortest paths,
+            SKIM_WORKERS or 1 if not given
+        chunksize : int, optional
+            the number of origins per task, each origin holds the
+            costs to all nodes of the graph in memory
+        file_format : str, optional
+            'npz' for a compressed numpy matrix or 'parquet' for a table
+            of the reached pairs of origins and destinations
+        """
+        super().__init__(**kwargs)
+        if file_format not in ('npz', 'parquet'):
+            raise ValueError(f'unknown file format {file_format}')
+        self.set_login(database=database)
+        self.origins = origins
+        self.destinations = destinations or origins
+        self.id_column = id_column
+        self.geom_column = geom_column
+        self.network = network_schema
+        self.subfolder = subfolder
+        self.graph_subfolder = graph_subfolder
+        self.max_cost = np.inf if max_cost is None else max_cost
+        self.n_workers = n_workers or int(os.environ.get('SKIM_WORKERS', 1))
+        self.chunksize = chunksize
+        self.file_format = file_format
+
+    @property
+    def graph_folder(self) -> str:
+        return os.path.abspath(os.path.join(self.folder,
+                                            'projekte',
+                                            self.login.db,
+                                            self.graph_subfolder,
+                                            self.network,
+                                            'csr'))
+
+    @property
+    def skim_file(self) -> str:
+        origins = self.origins.replace('.', '_')
+        destinations = self.destinations.replace('.', '_')
+        return os.path.abspath(os.path.join(
+            self.folder, 'projekte', self.login.db, self.subfolder,
+            f'{self.network}_{origins}_{destinations}.{self.file_format}'))
+
+    def run(self):
+        """
+        compute the skim matrix and write it to the skim file
+        """
+        export = ExportNetworkGraph(self.login.db,
+                                    network_schema=self.network,
+                                    subfolder=self.graph_subfolder,
+                                    logger=self.logger)
+        with Connection(login=self.login) as conn:
+            self.conn = export.conn = conn
+            meta = self.graph_meta()
+            if meta.get('network_hash') != export.network_hash():
+                self.logger.info(f'Exporting the graph of {self.network}, '
+                                 'it is missing or out of date')
+                export.export()
+                meta = self.graph_meta()
+            srid = meta['srid']
+            origins = self.get_points(self.origins, srid)
+            destinations = self.get_points(self.destinations, srid)
+        graph = load_graph(self.graph_folder)
+        origin_nodes, origin_distance = snap_points(
+            graph['x'], graph['y'], origins['x'], origins['y'])
+        destination_nodes, destination_distance = snap_points(
+            graph['x'], graph['y'], destinations['x'], destinations['y'])
+        del graph
+        costs = self.compute(origin_nodes, destination_nodes)
+        self.save(costs,
+                  origins['id'], destinations['id'],
+                  origin_distance, destination_distance)
+
+    def graph_meta(self) -> dict:
+        """
+        return the metadata of the exported graph,
+        an empty dict if it was not exported yet
+        """
+        path = os.path.join(self.graph_folder, 'meta.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def get_points(self, table: str, srid: int) -> Dict[str, np.ndarray]:
+        """
+        return the ids and the coordinates of the points of the table
+        in the projection of the network
+        """
+        sql = f'''
+SELECT
+  p.id,
+  ST_X(p.pnt) AS x,
+  ST_Y(p.pnt) AS y
+FROM (
+  SELECT
+    t."{self.id_column}" AS id,
+    ST_Transform(ST_PointOnSurface(t."{self.geom_column}"), {srid}) AS pnt
+  FROM {table} t
+  WHERE t."{self.geom_column}" IS NOT NULL
+) p
+ORDER BY p.id;
+'''
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        rows = cur.fetchall()
+        if not rows:
+            raise ValueError(f'no points found in {table}')
+        self.logger.info(f'{len(rows)} points loaded from {table}')
+        return {'id': np.array([r.id for r in rows]),
+                'x': np.array([r.x for r in rows], dtype=np.float64),
+                'y': np.array([r.y for r in rows], dtype=np.float64)}
+
+    def compute(self,
+                origin_nodes: np.ndarray,
+                destination_nodes: np.ndarray) -> np.ndarray:
+        """
+        compute the costs between the nodes in chunks of origins
+        in parallel processes
+        """
+        n_origins = len(origin_nodes)
+        costs = np.empty((n_origins, len(destination_nodes)),
+                         dtype=np.float32)
+        starts = range(0, n_origins, self.chunksize)
+        self.logger.info(f'Computing the skim matrix {n_origins} x '
+                         f'{len(destination_nodes)} in {len(starts)} chunks '
+                         f'with {self.n_workers} workers')
+        failed = {}
+        with ProcessPoolExecutor(max_workers=self.n_workers,
+                                 initializer=_init_worker,
+                                 initargs=(self.graph_folder, )) as executor:
+            futures = {
+                executor.submit(_skim_chunk,
+                                origin_nodes[start:start + self.chunksize],
+                                destination_nodes,
+                                self.max_cost): start
+                for start in starts}
+            for future in as_completed(futures):
+                start = futures[future]
+                try:
+                    rows = future.result()
+                    costs[start:start + len(rows)] = rows
+                except Exception as e:
+                    self.logger.error(
+                        f'Chunk starting at origin {start} failed: {e}')
+                    failed[start] = e
+        if failed:
+            raise Exception(f'{len(failed)} chunks of the skim matrix '
+                            f'failed') from next(iter(failed.values()))
+        return costs
+
+    def save(self,
+             costs: np.ndarray,
+             origin_ids: np.ndarray,
+             destination_ids: np.ndarray,
+             origin_distance: np.ndarray,
+             destination_distance: np.ndarray):
+        """
+        save the skim matrix with the ids of the origins and destinations
+        and the distances of the points to the nodes they are snapped to
+        """
+        path = self.skim_file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.file_format == 'npz':
+            np.savez_compressed(
+                path, cost=costs,
+                origins=origin_ids, destinations=destination_ids,
+                origin_distance=origin_distance.astype(np.float32),
+                destination_distance=destination_distance.astype(np.float32))
+        else:
+            orig, dest = np.nonzero(np.isfinite(costs))
+            df = pd.DataFrame({
+                'origin': origin_ids[orig],
+                'destination': destination_ids[dest],
+                'cost': costs[orig, dest],
+                'origin_distance': origin_distance[orig].astype(np.float32),
+                'destination_distance':
+                destination_distance[dest].astype(np.float32),
+            })
+            df.to_parquet(path, index=False)
+        self.logger.info(f'Skim matrix saved to {path}')
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description="Compute a skim matrix")
+
+    parser.add_argument("-n", '--name', action="store",
+                        help="Name of database",
+                        dest="database", default='extract')
+    parser.add_argument('--origins', action="store",
+                        help="table with the origins",
+                        dest="origins", default='laea.laea_vector_1000')
+    parser.add_argument('--destinations', action="store",
+                        help="table with the destinations",
+                        dest="destinations")
+    parser.add_argument('--id-column', action="store",
+                        help="column with the ids of the points",
+                        dest="id_column", default='cellcode')
+    parser.add_argument('--network', action="store",
+                        help="network schema",
+                        dest="network_schema", default='network')
+    parser.add_argument('--max-cost', action="store", type=float,
+                        help="maximum cost of the paths",
+                        dest="max_cost")
+    parser.add_argument('--workers', action="store", type=int,
+                        help="number of worker processes",
+                        dest="n_workers")
+    parser.add_argument('--format', action="store",
+                        help="npz or parquet",
+                        dest="file_format", default='npz')
+
+    options = parser.parse_args()
+
+    skims = SkimMatrix(database=options.database,
+                       origins=options.origins,
+                       destinations=options.destinations,
+                       id_column=options.id_column,
+                       network_schema=options.network_schema,
+                       max_cost=options.max_cost,
+                       n_workers=options.n_workers,
+                       file_format=options.file_format)
+    skims.run()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Compare `split_sql` with `sqlparse.split` on the SQL scripts
+found in the source code of extractiontools.
+
+    python -m extractiontools.sql_split_benchmark
+"""
+
+import os
+import re
+import ast
+import time
+from argparse import ArgumentParser
+from typing import Iterator
+
+import sqlparse
+
+from extractiontools.utils.sql_split import split_sql
+
+
+def repo_scripts() -> Iterator[str]:
+    """
+    yield the sql scripts in the string literals of the modules of
+    extractiontools, the placeholders of f-strings are replaced by `x`
+    """
+    package = os.path.dirname(__file__)
+    keywords = re.compile(r'\b(SELECT|INSERT|UPDATE|DELETE|CREATE|DROP|ALTER)\b',
+                          re.IGNORECASE)
+    for root, dirs, files in os.walk(package):
+        for fn in files:
+            if not fn.endswith('.py'):
+                continue
+            with open(os.path.join(root, fn), encoding='utf-8-sig') as f:
+                tree = ast.parse(f.read())
+            for node in ast.walk(tree):
+                if isinstance(node, ast.JoinedStr):
+                    script = ''.join(v.value if isinstance(v, ast.Constant)
+                                     else 'x' for v in node.values)
+                elif (isinstance(node, ast.Constant)
+                      and isinstance(node.value, str)):
+                    script = node.value
+                else:
+                    continue
+                if ';' in script and keywords.search(script):
+                    yield script
+
+
+def benchmark(repeat: int = 5):
+    """compare split_sql with sqlparse.split on the scripts of the repo"""
+    scripts = list(repo_scripts())
+    size = sum(len(s) for s in scripts)
+    print(f'{len(scripts)} scripts with {size / 1024:.0f} kB of SQL')
+
+    differing = [s for s in scripts
+                 if tuple(sqlparse.split(s)) != split_sql.__wrapped__(s)]
+    print(f'{len(differing)} scripts are split differently than by sqlparse')
+
+    def timeit(func):
+        t0 = time.perf_counter()
+        for i in range(repeat):
+            for script in scripts:
+                func(script)
+        return (time.perf_counter() - t0) / repeat
+
+    t_sqlparse = timeit(sqlparse.split)
+    t_split = timeit(split_sql.__wrapped__)
+    split_sql.cache_clear()
+    t_cached = timeit(split_sql)
+    print(f'sqlparse.split:    {t_sqlparse * 1000:10.1f} ms')
+    print(f'split_sql:         {t_split * 1000:10.1f} ms '
+          f'({t_sqlparse / t_split:.0f}x)')
+    print(f'split_sql cached:  {t_cached * 1000:10.1f} ms '
+          f'({t_sqlparse / t_cached:.0f}x)')
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description="Benchmark the splitting of SQL")
+    parser.add_argument('--repeat', action="store",
+                        help="number of repetitions", type=int,
+                        dest="repeat", default=5)
+    options = parser.parse_args()
+    benchmark(options.repeat)
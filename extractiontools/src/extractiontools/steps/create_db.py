@@ -1,6 +1,7 @@
 import orca
 
 from orcadjango.decorators import meta
+from extractiontools.utils.query_stats import log_query_stats
 from extractiontools.ausschnitt import Extract
 from extractiontools.drop_db import DropDatabase
 from extractiontools.archive import Archive
@@ -14,6 +15,7 @@ __parent_modules__ = [
 @meta(group='(1) Projekt', order=1, title='Datenbank erstellen',
       description='Erstellen der Zieldatenbank.')
 @orca.step()
+@log_query_stats
 def create_db(target_srid: str, project_area: ogr.Geometry, database: str,
               db_status):
     """
@@ -33,6 +35,7 @@ def create_db(target_srid: str, project_area: ogr.Geometry, database: str,
       description='Löscht Zieldatenbank und ihre Inhalte komplett.',
       required=create_db)
 @orca.step()
+@log_query_stats
 def drop_db(database: str, db_status):
     """
     drop the database and its contents
@@ -50,6 +53,7 @@ def remove_db_after_archiving() -> bool:
 @meta(group='(1) Projekt', order=4, required=create_db, title='Datenbank archivieren',
       description='Archiviert die Zieldatenbank als Dump')
 @orca.step()
+@log_query_stats
 def archive_db(database: str, db_status, remove_db_after_archiving):
     '''
     '''
@@ -79,6 +83,7 @@ def archive_fn() -> str:
       description='Stellt die Zieldatenbank aus einem archivierten Dump wieder her. Die Datenbank darf nicht ' 
                   'existieren, muss also eventuell vorher gelöscht werden.')
 @orca.step()
+@log_query_stats
 def restore_db(database: str, db_status, archive_fn):
     '''
     '''
@@ -94,6 +99,7 @@ def restore_db(database: str, db_status, archive_fn):
       die Zugriffsrechte zum Schema "osm" zurückgesetzt, wenn der Schritt
       "extract_osm" erneut ausgeführt wird) ''')
 @orca.step()
+@log_query_stats
 def grant_access(database: str, db_users: list):
     '''
     Grant read and write access to the database for the specified users.
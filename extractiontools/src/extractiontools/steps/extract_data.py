@@ -1,11 +1,15 @@
 """orca-steps for miraculix"""
 
+import os
 from typing import List, Dict
 import orca
 from orcadjango.decorators import meta
+from extractiontools.utils.query_stats import log_query_stats
 from extractiontools.gebietsstand import Gebietsstaende
 from extractiontools.injectables.database import extracted_vwg_tables_choices
 from extractiontools.extract_osm import ExtractOSM
+from extractiontools.extract_osm_pbf import ExtractOSMFromPBF
+from extractiontools.update_osm import UpdateOSM
 from extractiontools.osm2polygons import CreatePolygons
 from extractiontools.extract_landuse import ExtractLanduse
 from extractiontools.extract_verwaltungsgrenzen import (
@@ -33,6 +37,7 @@ __parent_modules__ = [
       title='OSM-Daten extrahieren', description='OSM-Daten aus der '
       'Quelldatenbank extrahieren')
 @orca.step()
+@log_query_stats
 def extract_osm(source_db: str, database: str, target_srid: int,
                 project_area: ogr.Geometry):
     """
@@ -48,6 +53,7 @@ def extract_osm(source_db: str, database: str, target_srid: int,
       title='OSM-Daten extrahieren', description='OSM-Daten aus der '
       'Quelldatenbank extrahieren')
 @orca.step()
+@log_query_stats
 def extract_osm(source_db: str, database: str, target_srid: int,
                 project_area: ogr.Geometry):
     """
@@ -59,15 +65,69 @@ def extract_osm(source_db: str, database: str, target_srid: int,
     extract.extract()
 
 
+@meta(group='(2) Datenextraktion', scope='step', title='OSM-PBF-Datei',
+      description='Pfad zur .osm.pbf-Datei, aus der die OSM-Daten alternativ '
+      'zur Quelldatenbank extrahiert werden.')
+@orca.injectable()
+def osm_pbf_file() -> str:
+    """the path to the .osm.pbf file"""
+    return os.environ.get('OSM_PBF_FILE', '')
+
+
+@meta(group='(2) Datenextraktion', order=1, required='create_db',
+      title='OSM-Daten aus PBF-Datei extrahieren',
+      description='OSM-Daten aus einer lokalen .osm.pbf-Datei statt aus der '
+      'Quelldatenbank extrahieren')
+@orca.step()
+@log_query_stats
+def extract_osm_from_pbf(source_db: str, database: str, target_srid: int,
+                         project_area: ogr.Geometry, osm_pbf_file: str):
+    """
+    extract OSM data in the area from a PBF file
+    """
+    extract = ExtractOSMFromPBF(source_db=source_db, destination_db=database,
+                                pbf_file=osm_pbf_file,
+                                target_srid=target_srid, logger=orca.logger,
+                                boundary=project_area)
+    extract.extract()
+
+
+@meta(group='(2) Datenextraktion', scope='step', title='osmChange-Dateien',
+      description='Pfade zu den osmChange-Dateien (.osc.gz), mit denen die '
+      'extrahierten OSM-Daten aktualisiert werden.')
+@orca.injectable()
+def osm_change_files() -> List[str]:
+    """the paths to the osmChange files"""
+    return []
+
+
+@meta(group='(2) Datenextraktion', order=6, required=extract_osm,
+      title='OSM-Daten aktualisieren',
+      description='Die extrahierten OSM-Daten mit osmChange-Dateien '
+      'aktualisieren. Die Polygone und OSM-Views müssen danach neu '
+      'erzeugt werden.')
+@orca.step()
+@log_query_stats
+def update_osm(database: str, osm_change_files: List[str]):
+    """
+    apply the osmChange files to the extracted OSM data
+    """
+    update = UpdateOSM(destination_db=database, logger=orca.logger)
+    update.update(osm_change_files)
+
+
 @meta(group='(2) Datenextraktion', order=2, required=extract_osm,
       title='Polygone erzeugen', description='(Multi-)Polygone aus den '
       'OSM-Daten erzeugen')
 @orca.step()
-def create_polygons_from_osm(database: str):
+@log_query_stats
+def create_polygons_from_osm(database: str, extract_workers: int):
     """
     create polygons and multipolygons out of the OSM data
     """
-    copy2fgdb = CreatePolygons(destination_db=database, logger=orca.logger)
+    copy2fgdb = CreatePolygons(destination_db=database,
+                               n_workers=extract_workers,
+                               logger=orca.logger)
     copy2fgdb.create_poly_and_multipolygons()
 
 
@@ -75,6 +135,7 @@ def create_polygons_from_osm(database: str):
       title='Landnutzung extrahieren',
       description='Daten zur Landnutzung im Projektgebiet extrahieren')
 @orca.step()
+@log_query_stats
 def extract_landuse(source_db: str, database: str, gmes: List[str],
                     corine: List[str], target_srid: int,
                     project_area: ogr.Geometry):
@@ -92,9 +153,11 @@ def extract_landuse(source_db: str, database: str, gmes: List[str],
       description='administrative Grenzen innerhalb des Projektgebiets '
       'extrahieren')
 @orca.step()
+@log_query_stats
 def extract_verwaltungsgrenzen(source_db: str, database: str,
                                verwaltungsgrenzen_tables: List[str],
-                               target_srid: int, project_area: ogr.Geometry):
+                               target_srid: int, project_area: ogr.Geometry,
+                               extract_workers: int):
     """
     extract administrative boundaries in the area
     """
@@ -102,7 +165,8 @@ def extract_verwaltungsgrenzen(source_db: str, database: str,
     extract = ExtractVerwaltungsgrenzen(source_db=source_db,
                                         destination_db=database, tables=tables,
                                         logger=orca.logger,
-                                        boundary=project_area)
+                                        boundary=project_area,
+                                        n_workers=extract_workers)
     extract.extract()
 
 
@@ -133,6 +197,7 @@ def gebietsstand_schwellwert() -> int:
       description='Vergleicht einen Stand von Verwaltungsgrenzen als Referenz mit anderen Gebietsständen und gibt '
                   'die Anteile der Flächen dieser an den Referenzgebieten aus.')
 @orca.step()
+@log_query_stats
 def gebietsstaende(database: str, gebietsstand_bezugsstand: str, gebietsstand_vergleichsstaende: list[str],
                    gebietsstand_schwellwert: int):
     g = Gebietsstaende(destination_db=database, ref_table=gebietsstand_bezugsstand,
@@ -146,9 +211,11 @@ def gebietsstaende(database: str, gebietsstand_bezugsstand: str, gebietsstand_ve
       description='Firmen und Nachbarschaften innerhalb des '
       'Projektgebiets extrahieren')
 @orca.step()
+@log_query_stats
 def extract_firms_neighbourhoods(source_db: str, database: str,
                                  firms_tables: List[str],
-                                 target_srid: int, project_area: ogr.Geometry):
+                                 target_srid: int, project_area: ogr.Geometry,
+                                 extract_workers: int):
     """
     extract firms and neighbourhoods in the area
     """
@@ -157,7 +224,8 @@ def extract_firms_neighbourhoods(source_db: str, database: str,
                                          destination_db=database,
                                          tables=tables,
                                          logger=orca.logger,
-                                         boundary=project_area)
+                                         boundary=project_area,
+                                         n_workers=extract_workers)
     extract.extract()
 
 
@@ -166,6 +234,7 @@ def extract_firms_neighbourhoods(source_db: str, database: str,
       description='LAEA- und Zensus-Raster innerhalb des '
       'Projektgebiets extrahieren')
 @orca.step()
+@log_query_stats
 def extract_laea_raster(source_db: str, database: str, target_srid: int,
                         project_area: ogr.Geometry):
     """
@@ -178,13 +247,24 @@ def extract_laea_raster(source_db: str, database: str, target_srid: int,
     z2r.run()
 
 
+@meta(group='(2) Datenextraktion', title='OSM-Layer materialisieren',
+      description='Die OSM-Layer als Tabellen mit räumlichem Index statt als '
+      'Views anlegen. Die Tabellen werden nur neu erzeugt, wenn sich ihre '
+      'Definition oder die OSM-Daten geändert haben.')
+@orca.injectable()
+def materialize_osm_layers() -> bool:
+    """create the OSM layers as indexed tables instead of views"""
+    return os.environ.get('OSM_LAYER_MATERIALIZE', '0') != '0'
+
+
 @meta(group='(2) Datenextraktion', order=3, required=create_polygons_from_osm,
       title='OSM-Views erzeugen',
       description='erzeugt spezialisierte Views auf die OSM-Daten. <br>'
       '<b>Achtung</b>: bereits existierende OSM-Views und davon abhängende '
       'Views werden kaskadiert gelöscht!')
 @orca.step()
-def create_osm_views(database: str):
+@log_query_stats
+def create_osm_views(database: str, materialize_osm_layers: bool):
     """
     creates views on the OSM data;
     attention: drops already existing OSM views and dependent views cascadingly
@@ -193,6 +273,7 @@ def create_osm_views(database: str):
                              layers=osm_layers,
                              filename='osm_layers.gdb',
                              schema='osm_layer',
+                             materialize=materialize_osm_layers,
                              logger=orca.logger)
     copy2fgdb.create_views()
 
@@ -220,7 +301,9 @@ def osm_layers() -> Dict[str, str]:
 @meta(group='(5) Export', required=create_osm_views, title='OSM nach FGDB',
       description='Export der OSM-Layer in eine FGDB-Datei')
 @orca.step()
-def copy_osm_to_fgdb(database: str, osm_layers: Dict[str, str]):
+@log_query_stats
+def copy_osm_to_fgdb(database: str, osm_layers: Dict[str, str],
+                     export_workers: int):
     """
     copy OSM layers and views to a file-gdb
     """
@@ -229,6 +312,7 @@ def copy_osm_to_fgdb(database: str, osm_layers: Dict[str, str]):
                              layers=osm_layers,
                              filename='osm_layers',
                              schema='osm_layer',
+                             n_workers=export_workers,
                              logger=orca.logger)
     copy2fgdb.copy_layers('OpenFileGDB')
 
@@ -236,7 +320,9 @@ def copy_osm_to_fgdb(database: str, osm_layers: Dict[str, str]):
 @meta(group='(5) Export', required=create_osm_views, title='OSM nach GPKG',
       description='Export der OSM-Layer in eine Geopackage-Datei')
 @orca.step()
-def copy_osm_to_gpkg(database: str, osm_layers: Dict[str, str]):
+@log_query_stats
+def copy_osm_to_gpkg(database: str, osm_layers: Dict[str, str],
+                     export_workers: int):
     """
     copy OSM layers and views to a Geopackage
     """
@@ -245,6 +331,7 @@ def copy_osm_to_gpkg(database: str, osm_layers: Dict[str, str]):
                              layers=osm_layers,
                              filename='osm_layers',
                              schema='osm_layer',
+                             n_workers=export_workers,
                              logger=orca.logger)
     copy2fgdb.copy_layers('GPKG')
 
@@ -252,6 +339,7 @@ def copy_osm_to_gpkg(database: str, osm_layers: Dict[str, str]):
 @meta(group='(5) Export', required=extract_laea_raster, title='Zensus-TIFF',
       description='Export des Zensus in eine GeoTIFF')
 @orca.step()
+@log_query_stats
 def copy_zensus_to_tiff(database: str, subfolder_tiffs: str):
     """
     export zensus to raster-TIFF files
@@ -266,6 +354,7 @@ def copy_zensus_to_tiff(database: str, subfolder_tiffs: str):
       'gegebenen Gemeindegrenzen aus der Quelldatenbank extrahieren',
       required=['create_db', 'extract_verwaltungsgrenzen'])
 @orca.step()
+@log_query_stats
 def extract_regionalstatistik(source_db: str,
                               database: str,
                               regionalstatistik_gemeinden: str,
@@ -284,6 +373,7 @@ def extract_regionalstatistik(source_db: str,
 
 @meta(group='(8b) Pendler', title='Pendlerdaten importieren')
 @orca.step()
+@log_query_stats
 def import_pendlerdaten(source_db: str,
                         subfolder_pendlerdaten: str,
                         pendlerdaten_years: List[str]):
@@ -301,6 +391,7 @@ def import_pendlerdaten(source_db: str,
 @meta(group='(8b) Pendler', required=extract_regionalstatistik,
       title='Pendlerdaten extrahieren')
 @orca.step()
+@log_query_stats
 def extract_pendlerdaten(source_db: str,
                          database: str,
                          pendlerdaten_gemeinden: str):
@@ -318,6 +409,7 @@ def extract_pendlerdaten(source_db: str,
 @meta(group='(8b) Pendler', required=extract_pendlerdaten,
       title='Pendlerspinne erzeugen')
 @orca.step()
+@log_query_stats
 def create_pendlerspinne(database: str,
                          pendlerspinne_gebiete: str,
                          target_srid: int):
@@ -335,6 +427,7 @@ def create_pendlerspinne(database: str,
 @meta(group='(8b) Pendler', required=extract_pendlerdaten,
       title='Pendlerdaten exportieren')
 @orca.step()
+@log_query_stats
 def export_pendlerdaten(database: str):
     """
     Export Pendlerdaten in Excel-Dateien auf dem Server zum Download
@@ -350,6 +443,7 @@ def export_pendlerdaten(database: str):
       description='Vorbereitung der Tabellen und Views für das '
       'Verschneidungstool')
 @orca.step()
+@log_query_stats
 def prepare_verschneidungstool(source_db: str, database: str, target_srid: int):
     """
     prepare Verschneidungstool tables and views
@@ -363,6 +457,7 @@ def prepare_verschneidungstool(source_db: str, database: str, target_srid: int):
       description='BASt-Netzwerk und Verkehrszählungen aus der Quelldatenbank '
       'extrahieren')
 @orca.step()
+@log_query_stats
 def extract_bast(source_db: str, database: str, target_srid: int):
     """
     Copy BASt-Network and Traffic counts
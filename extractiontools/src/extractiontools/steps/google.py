@@ -2,9 +2,11 @@ import orca
 import math
 import json
 from orcadjango.decorators import meta
+from extractiontools.utils.query_stats import log_query_stats
 from extractiontools.ausschnitt import Extract
 from extractiontools.connection import Connection
 from extractiontools.utils.google_api import GooglePlacesAPI
+from extractiontools.utils.copy_format import point_ewkb
 
 
 @meta(group='(7) Google', required='create_db', title='Google-Places-Suche',
@@ -12,6 +14,7 @@ from extractiontools.utils.google_api import GooglePlacesAPI
       'sind in der Google-Places-API als Einrichtungen, geografische Orte oder '
       'prominente Punkte von Interesse definiert.')
 @orca.step()
+@log_query_stats
 def google_places(database: str, google_key: str, places_table: str,
                   places_type: str, places_keyword: str,
                   project_area: 'ogr.Geometry', places_search_radius:  int):
@@ -56,7 +59,7 @@ class GoogleApp(Extract):
               place_id TEXT PRIMARY KEY,
               name TEXT,
               vicinity TEXT,
-              geom GEOMETRY,
+              geom GEOMETRY(POINT, {self.target_srid}),
               types TEXT,
               opening_hours JSON,
               business_status TEXT,
@@ -91,6 +94,14 @@ class GoogleApp(Extract):
             cursor.execute(sql, {'boundary_name': self.boundary_name})
             points = cursor.fetchall()
 
+            inserter = self.bulk_inserter(
+                table,
+                columns=('place_id', 'name', 'vicinity', 'geom',
+                         'types', 'opening_hours', 'business_status',
+                         'rating', 'user_ratings_total', 'icon', 'photos'),
+                schema=self.schema, conn=conn,
+                geometry_srid={'geom': 4326},
+                on_conflict='nothing', conflict_columns=('place_id', ))
             n_found = 0
             for i, point in enumerate(points):
                 api = GooglePlacesAPI(key, logger=self.logger)
@@ -101,38 +112,23 @@ class GoogleApp(Extract):
                 for result in results:
                     location = result['geometry']['location']
                     types = ','.join(result.get('types', []))
-                    sql = f'''
-                    INSERT INTO {self.schema}.{table}
-                    (place_id, name, vicinity,
-                    geom,
-                    types, opening_hours, business_status,
-                    rating, user_ratings_total,
-                    icon, photos)
-                    VALUES (
-                    %(place_id)s, %(name)s, %(vicinity)s,
-                    ST_TRANSFORM(ST_SetSRID(ST_MakePoint({location['lng']}, {location['lat']}), 4326), {self.target_srid}),
-                    %(types)s, %(opening_hours)s, %(business_status)s,
-                    {result.get('rating')}, {result.get('user_ratings_total')},
-                    %(icon)s, %(photos)s
-                    )
-                    ON CONFLICT (place_id) DO NOTHING;
-                    '''
-                    cursor.execute(sql, {
-                        'place_id': result['place_id'],
-                        'name': result.get('name'),
-                        'vicinity': result.get('vicinity'),
-                        'types': types,
-                        'opening_hours': json.dumps(
-                            result.get('opening_hours', {})),
-                        'business_status': result.get('business_status'),
-                        'icon': result.get('icon'),
-                        'photos': json.dumps(
-                            result.get('photos', {}))
-                    })
+                    inserter.add((
+                        result['place_id'],
+                        result.get('name'),
+                        result.get('vicinity'),
+                        point_ewkb(location['lng'], location['lat'], 4326),
+                        types,
+                        json.dumps(result.get('opening_hours', {})),
+                        result.get('business_status'),
+                        result.get('rating'),
+                        result.get('user_ratings_total'),
+                        result.get('icon'),
+                        json.dumps(result.get('photos', {})),
+                    ))
 
                 if i > 0 and i % 50 == 0:
                     self.logger.info(f'{i+1}/{len(points)} processed. '
                                      f'{n_found} places found so far.')
+                    inserter.flush()
                     conn.commit()
-
-
+            inserter.close()
@@ -7,15 +7,19 @@ import orca
 from osgeo import ogr
 from datetime import date
 from orcadjango.decorators import meta
+from extractiontools.utils.query_stats import log_query_stats
 from extractiontools.connection import Login
 from extractiontools.build_network_car import BuildNetwork
 from extractiontools.build_graduated_network import BuildGraduatedNetwork
 from extractiontools.build_network_walk_cycle import BuildNetworkWalkCycle
+from extractiontools.build_network_multimode import BuildNetworkMultiMode
 from extractiontools.scrape_stops import ScrapeStops
 from extractiontools.bahn_routing import DBRouting
 from extractiontools.scrape_timetable import ScrapeTimetable
 from extractiontools.hafasdb2gtfs import HafasDB2GTFS
 from extractiontools.network2pbf import CopyNetwork2Pbf, CopyNetwork2PbfTagged
+from extractiontools.export_network_graph import ExportNetworkGraph
+from extractiontools.skim_matrix import SkimMatrix
 from extractiontools.stop_otp_router import OTPServer
 from extractiontools.copy2fgdb import Copy2FGDB
 from extractiontools.extract_gtfs import ExtractGTFS
@@ -33,8 +37,10 @@ default_login = Login(
 @meta(group='(3) Netzwerk', required=['extract_osm', 'extract_landuse'],
       title='Netzwerk Auto bauen', description='Ein Netzwerk für den Modus Auto aus OSM-Daten bauen.')
 @orca.step()
+@log_query_stats
 def build_network_car(database: str,
                       chunksize: int,
+                      network_workers: int,
                       limit4links: int,
                       links_to_find: int,
                       corine: str,
@@ -46,20 +52,50 @@ def build_network_car(database: str,
                                  network_schema=network_schema,
                                  limit=limit4links,
                                  chunksize=chunksize,
+                                 n_workers=network_workers,
                                  links_to_find=links_to_find,
                                  corine=corine,
                                  logger=orca.logger)
     build_network.build()
 
 
+@meta(group='(3) Netzwerk', required=['build_network_car', 'update_osm'],
+      title='Netzwerk Auto aktualisieren', description='Das Netzwerk für den '
+      'Modus Auto nur für die seit dem letzten Bau oder der letzten '
+      'Aktualisierung geänderten OSM-Wege neu berechnen.')
+@orca.step()
+@log_query_stats
+def update_network_car(database: str,
+                       chunksize: int,
+                       network_workers: int,
+                       limit4links: int,
+                       links_to_find: int,
+                       corine: str,
+                       network_schema: str):
+    """
+    update the car network incrementally for the changed osm ways
+    """
+    build_network = BuildNetwork(db=database,
+                                 network_schema=network_schema,
+                                 limit=limit4links,
+                                 chunksize=chunksize,
+                                 n_workers=network_workers,
+                                 links_to_find=links_to_find,
+                                 corine=corine,
+                                 logger=orca.logger)
+    build_network.update()
+
+
 @meta(group='(3) Netzwerk', required=['extract_osm', 'extract_landuse'],
       title='abgestuftes Netzwerk Auto bauen', description='Ein Netzwerk für '
       'den Modus Auto bauen mit Abstufung in ein Gebiet mit feiner Auflösung '
       'und ein größeres Gebiet mit grober Auflösung ')
 @orca.step()
+@log_query_stats
 def build_graduated_network_car(database: str,
                                 include_planning: bool,
                                 chunksize: int,
+                                network_workers: int,
                                 limit4links: int,
                                 links_to_find: int,
                                 corine: str,
@@ -73,6 +109,7 @@ def build_graduated_network_car(database: str,
                                           network_schema=network_graduated_schema,
                                           limit=limit4links,
                                           chunksize=chunksize,
+                                          n_workers=network_workers,
                                           links_to_find=links_to_find,
                                           include_planning=include_planning,
                                           corine=corine,
@@ -87,9 +124,11 @@ def build_graduated_network_car(database: str,
       title='Netzwerk Fahrrad/zu Fuß bauen', description='ein Netzwerk für die '
       'Modi Fahrrad und optional zu Fuß (Parameter) bauen')
 @orca.step()
+@log_query_stats
 def build_network_fr(database: str,
                      include_planning: bool,
                      chunksize: int,
+                     network_workers: int,
                      limit4links: int,
                      links_to_find: int,
                      corine: str,
@@ -105,6 +144,7 @@ def build_network_fr(database: str,
         network_schema=network_fr_schema,
         limit=limit4links,
         chunksize=chunksize,
+        n_workers=network_workers,
         links_to_find=links_to_find,
         corine=corine,
         routing_walk=routing_walk,
@@ -115,10 +155,55 @@ def build_network_fr(database: str,
     build_network.build()
 
 
+@meta(group='(3) Netzwerk', required=['extract_osm', 'extract_landuse'],
+      title='Netzwerke Auto und Fahrrad/zu Fuß bauen', description='Die '
+      'Netzwerke für den Modus Auto und für die Modi Fahrrad und optional zu '
+      'Fuß in einem Durchgang bauen. Die Wege werden dabei nur einmal in '
+      'Links aufgeteilt, die Attribute und die Erreichbarkeit werden je '
+      'Netzwerk berechnet.')
+@orca.step()
+@log_query_stats
+def build_networks_car_fr(database: str,
+                          include_planning: bool,
+                          chunksize: int,
+                          network_workers: int,
+                          limit4links: int,
+                          links_to_find: int,
+                          corine: str,
+                          routing_walk: bool,
+                          network_schema: str,
+                          network_fr_schema: str,
+                          detailed_area: str,
+                          ):
+    """
+    build the car and the walk and cycle network sharing the links
+    """
+    kwargs = dict(db=database,
+                  limit=limit4links,
+                  chunksize=chunksize,
+                  n_workers=network_workers,
+                  links_to_find=links_to_find,
+                  corine=corine,
+                  logger=orca.logger)
+    network_car = BuildNetwork(network_schema=network_schema, **kwargs)
+    network_fr = BuildNetworkWalkCycle(
+        network_schema=network_fr_schema,
+        routing_walk=routing_walk,
+        include_planning=include_planning,
+        detailed_network_area=detailed_area,
+        **kwargs)
+    build_network = BuildNetworkMultiMode(
+        networks=[network_car, network_fr],
+        segments_schema=f'{network_schema}_segments',
+        **kwargs)
+    build_network.build()
+
+
 @meta(group='(4) ÖPNV', order=1, required='create_db',
       title='Haltestellen extrahieren',
       description='ÖPNV-Haltestellen aus der Quelldatenbank extrahieren')
 @orca.step()
+@log_query_stats
 def extract_stops(database: str):
     """
     extract public stops from database
@@ -131,6 +216,7 @@ def extract_stops(database: str):
       title='Haltestellen scrapen', description='Zieht die Haltestellen von der '
       'Deutsche Bahn-Website')
 @orca.step()
+@log_query_stats
 def scrape_stops(database: str):
     """
     scrape public stops from Deutsche Bahn web interface
@@ -152,6 +238,7 @@ def scrape_stops(database: str):
       '<b>Einer</b> der beiden Schritte ("scrape_stops" oder "extract_stops") '
       'muss vorher ausgeführt worden sein (nicht beide)')
 @orca.step()
+@log_query_stats
 def scrape_db_fastest_routes(database: str, destinations_db_routing: str,
                              date_db_routing: date, times_db_routing: List[int],
                              distance_db_routing):
@@ -231,6 +318,7 @@ def recreate_timetable_tables() -> bool:
       '<b>Einer</b> der beiden Schritte ("scrape_stops" oder "extract_stops") '
       'muss vorher ausgeführt worden sein (nicht beide)')
 @orca.step()
+@log_query_stats
 def scrape_timetables(database: str, source_db: str,
                       date_timetable: str,
                       recreate_timetable_tables: bool):
@@ -264,6 +352,7 @@ def tbl_kreise() -> str:
       description='Exportiert die Zeittabellen als GTFS-Dateien',
       required=[scrape_timetables, 'extract_verwaltungsgrenzen'])
 @orca.step()
+@log_query_stats
 def timetables_gtfs(database: str,
                     date_timetable: str,
                     gtfs_only_one_day: bool,
@@ -368,6 +457,7 @@ def otp_networks() -> Dict[str, str]:
       title='Netzwerk nach PBF', description='Exportiert die Netzwerkdaten als '
       'PBF-Dateien in die angegebenen Ordner')
 @orca.step()
+@log_query_stats
 def copy_network_pbf(database: str,
                      otp_networks: Dict[str, str]):
     """copy the osm networkdata to a pbf file"""
@@ -383,6 +473,7 @@ def copy_network_pbf(database: str,
       title='Netzwerk nach PBF und XML', description='Exportiert die '
       'Netzwerkdaten als PBF- und XML-Dateien in die angegebenen Ordner')
 @orca.step()
+@log_query_stats
 def copy_network_pbf_xml(database: str,
                          otp_networks: Dict[str, str]):
     """copy the osm networkdata to a pbf and .xml.bz file"""
@@ -400,6 +491,7 @@ def copy_network_pbf_xml(database: str,
       'Netzwerkdaten getaggt mit Höhendaten als PBF- und XML-Dateien in die '
       'angegebenen Ordner')
 @orca.step()
+@log_query_stats
 def copy_tagged_nw_pbf_xml(database: str,
                            otp_networks: Dict[str, str]):
     """
@@ -414,6 +506,93 @@ def copy_tagged_nw_pbf_xml(database: str,
         copy2pbf.copy()
 
 
+@meta(group='(5) Export', title='Graph-Ordner',
+      description='Unterordner im Projektordner für den Export der Graphen')
+@orca.injectable()
+def graph_subfolder() -> str:
+    """the subfolder for the exported graphs"""
+    return 'graph'
+
+
+@meta(group='(5) Export', required=[build_network_car, build_network_fr],
+      title='Netzwerk als Graph', description='Exportiert die Netzwerke als '
+      'Graph im CSR-Format (numpy) und die Kanten als GeoParquet für die '
+      'Verkehrsmodelle')
+@orca.step()
+@log_query_stats
+def export_network_graph(database: str,
+                         otp_networks: Dict[str, str],
+                         graph_subfolder: str):
+    """export the networks as graph in csr-format and the edges as parquet"""
+    for network_schema in otp_networks:
+        export = ExportNetworkGraph(database,
+                                    network_schema=network_schema,
+                                    subfolder=graph_subfolder,
+                                    logger=orca.logger)
+        export.export()
+
+
+@meta(group='(5) Export', title='Quellen der Reisezeitmatrix',
+      description='Tabelle (schema.tabelle) mit den Quellen der '
+      'Reisezeitmatrix')
+@orca.injectable()
+def skim_origins() -> str:
+    """the table with the origins of the skim matrix"""
+    return 'laea.laea_vector_1000'
+
+
+@meta(group='(5) Export', title='Ziele der Reisezeitmatrix',
+      description='Tabelle (schema.tabelle) mit den Zielen der '
+      'Reisezeitmatrix, leer für die Quellen')
+@orca.injectable()
+def skim_destinations() -> str:
+    """the table with the destinations of the skim matrix"""
+    return ''
+
+
+@meta(group='(5) Export', title='ID-Spalte der Reisezeitmatrix',
+      description='Spalte mit den IDs der Quellen und Ziele')
+@orca.injectable()
+def skim_id_column() -> str:
+    """the column with the ids of the origins and destinations"""
+    return 'cellcode'
+
+
+@meta(group='(5) Export', title='Parallele Reisezeitberechnung',
+      description='Anzahl der Prozesse, die die Reisezeitmatrix '
+      'gleichzeitig berechnen')
+@orca.injectable()
+def skim_workers() -> int:
+    """number of processes computing the skim matrix"""
+    return int(os.environ.get('SKIM_WORKERS', 1))
+
+
+@meta(group='(5) Export', required=export_network_graph,
+      title='Reisezeitmatrix', description='Berechnet die Reisezeitmatrix '
+      'zwischen den Quellen und Zielen auf den Netzwerken und speichert sie '
+      'als komprimierte numpy-Datei')
+@orca.step()
+@log_query_stats
+def compute_skim_matrix(database: str,
+                        otp_networks: Dict[str, str],
+                        graph_subfolder: str,
+                        skim_origins: str,
+                        skim_destinations: str,
+                        skim_id_column: str,
+                        skim_workers: int):
+    """compute the skim matrices between the points on the networks"""
+    for network_schema in otp_networks:
+        skims = SkimMatrix(database,
+                           origins=skim_origins,
+                           destinations=skim_destinations or None,
+                           id_column=skim_id_column,
+                           network_schema=network_schema,
+                           graph_subfolder=graph_subfolder,
+                           n_workers=skim_workers,
+                           logger=orca.logger)
+        skims.run()
+
+
 @meta(group='(6) OTP', title='OTP-Ports',
       description='Ports, auf denen OTP auf dem Server läuft')
 @orca.injectable()
@@ -538,13 +717,16 @@ def gdbname(database) -> str:
       title='Netzwerk Auto nach FGDB', description='Exportiert das '
       'Netzwerk Auto in eine FGDB-Datei')
 @orca.step()
+@log_query_stats
 def copy_network_car_fgdb(database: str,
-                          network_layers: Dict[str, str]):
+                          network_layers: Dict[str, str],
+                          export_workers: int):
     """copy car network to a file-gdb"""
     copy2fgdb = Copy2FGDB(database,
                           layers=network_layers,
                           filename='network_car.gdb',
-                          schema='network', logger=orca.logger)
+                          schema='network', n_workers=export_workers,
+                          logger=orca.logger)
     copy2fgdb.copy_layers('OpenFileGDB')
 
 
@@ -552,10 +734,13 @@ def copy_network_car_fgdb(database: str,
       title='Netzwerk Fahrrad/zu Fuß nach FGDB', description='Exportiert das '
       'Netzwerk Fahrrad/zu Fuß in eine FGDB-Datei')
 @orca.step()
+@log_query_stats
 def copy_network_fr_fgdb(database: str,
-                         network_fr_layers: Dict[str, str]):
+                         network_fr_layers: Dict[str, str],
+                         export_workers: int):
     """copy walk and cycle network to a file-gdb"""
     copy2fgdb = Copy2FGDB(database, layers=network_fr_layers,
                           filename='network_fr.gdb',
-                          schema='network_fr', logger=orca.logger)
+                          schema='network_fr', n_workers=export_workers,
+                          logger=orca.logger)
     copy2fgdb.copy_layers('OpenFileGDB')
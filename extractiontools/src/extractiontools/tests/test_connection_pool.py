@@ -0,0 +1,115 @@
+import unittest
+import time
+from types import SimpleNamespace
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from ..connection import ConnectionPool, Login, PoolError
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, vars=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError('server closed the connection')
+        self.conn.executed.append((sql, self.conn.autocommit))
+
+
+class FakeConnection:
+    """mimics the parts of a psycopg2 connection used by the pool"""
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.resets = 0
+        self.autocommit = False
+        self.executed = []
+        self.info = SimpleNamespace(transaction_status=TRANSACTION_STATUS_IDLE)
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def reset(self):
+        if self.broken:
+            raise psycopg2.OperationalError('server closed the connection')
+        self.resets += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeLogin(Login):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.opened = []
+
+    def connect(self):
+        conn = FakeConnection()
+        self.opened.append(conn)
+        return conn
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Test the pooling of connections"""
+
+    def test_reuse(self):
+        login = FakeLogin(db='test')
+        pool = ConnectionPool(login, maxconn=2)
+        conn1 = pool.getconn()
+        pool.putconn(conn1)
+        conn2 = pool.getconn()
+        self.assertIs(conn1, conn2)
+        self.assertEqual(len(login.opened), 1)
+        self.assertEqual(conn1.resets, 1)
+        # the session state is discarded outside of a transaction
+        self.assertEqual(conn1.executed, [('DISCARD ALL;', True)])
+        self.assertFalse(conn1.autocommit)
+
+    def test_maxconn(self):
+        login = FakeLogin(db='test')
+        pool = ConnectionPool(login, maxconn=2, timeout=0.05)
+        conn1 = pool.getconn()
+        conn2 = pool.getconn()
+        self.assertIsNot(conn1, conn2)
+        with self.assertRaises(PoolError):
+            pool.getconn()
+        pool.putconn(conn2)
+        self.assertIs(pool.getconn(), conn2)
+
+    def test_broken_connection_is_replaced(self):
+        login = FakeLogin(db='test')
+        pool = ConnectionPool(login, ping_after=0)
+        conn1 = pool.getconn()
+        pool.putconn(conn1)
+        conn1.broken = True
+        conn2 = pool.getconn()
+        self.assertIsNot(conn1, conn2)
+        self.assertTrue(conn1.closed)
+
+    def test_idle_eviction(self):
+        login = FakeLogin(db='test')
+        pool = ConnectionPool(login, max_idle=0.01)
+        conn1 = pool.getconn()
+        pool.putconn(conn1)
+        time.sleep(0.02)
+        conn2 = pool.getconn()
+        self.assertIsNot(conn1, conn2)
+        self.assertTrue(conn1.closed)
+
+    def test_closeall(self):
+        login = FakeLogin(db='test')
+        pool = ConnectionPool(login)
+        conn1 = pool.getconn()
+        conn2 = pool.getconn()
+        pool.putconn(conn1)
+        pool.closeall()
+        self.assertTrue(conn1.closed)
+        # the connection in use is closed when it is returned
+        self.assertFalse(conn2.closed)
+        pool.putconn(conn2)
+        self.assertTrue(conn2.closed)
+        conn3 = pool.getconn()
+        self.assertIsNot(conn3, conn2)
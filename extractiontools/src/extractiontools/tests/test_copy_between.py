@@ -0,0 +1,196 @@
+import unittest
+import logging
+from unittest import mock
+from collections import namedtuple
+import psycopg2
+from ..connection import ConnectionPool, DBApp, Login
+try:
+    from .. import ausschnitt
+except ImportError:
+    # the extracts need gdal
+    ausschnitt = None
+
+
+class FakeCopyCursor:
+    """mimics the COPY of a psycopg2 cursor"""
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = -1
+
+    def execute(self, sql, vars=None):
+        self.conn.executed.append(sql)
+
+    def copy_expert(self, sql, f):
+        self.conn.executed.append(sql)
+        if self.conn.error:
+            raise self.conn.error
+        if 'TO STDOUT' in sql:
+            for chunk in self.conn.chunks:
+                f.write(chunk)
+        else:
+            self.conn.received = f.read()
+            self.rowcount = len(self.conn.received)
+
+
+class FakeCopyConnection:
+    def __init__(self, chunks=(), error=None):
+        self.chunks = chunks
+        self.error = error
+        self.received = None
+        self.executed = []
+
+    def cursor(self):
+        return FakeCopyCursor(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class TestCopyBetween(unittest.TestCase):
+    """Test streaming a COPY between two databases"""
+
+    def setUp(self):
+        self.target = FakeCopyConnection()
+        self.app = DBApp(conn=self.target)
+        self.app.logger = logging.getLogger('OrcaLog')
+
+    def test_copy(self):
+        # more data than fits into the buffer of the pipe
+        chunks = [bytes([i]) * 100000 for i in range(3)]
+        source = FakeCopyConnection(chunks=chunks)
+        n_rows = self.app.copy_between('COPY t TO STDOUT', source,
+                                       'COPY t FROM STDIN')
+        self.assertEqual(self.target.received, b''.join(chunks))
+        self.assertEqual(n_rows, 300000)
+
+    def test_source_error(self):
+        source = FakeCopyConnection(
+            error=psycopg2.OperationalError('connection lost'))
+        with self.assertRaises(psycopg2.OperationalError):
+            self.app.copy_between('COPY t TO STDOUT', source,
+                                  'COPY t FROM STDIN')
+
+
+@unittest.skipIf(ausschnitt is None, 'gdal is not installed')
+class TestCopyFromSource(unittest.TestCase):
+    """Test the fallback of the direct copy to the foreign server"""
+
+    def setUp(self):
+        self.target = FakeCopyConnection()
+        self.extract = ausschnitt.Extract.__new__(ausschnitt.Extract)
+        self.extract.conn = self.target
+        self.extract.logger = logging.getLogger('OrcaLog')
+        self.extract.schema = 'osm'
+        self.extract.foreign_login = None
+        self.extract.run_query = lambda sql, conn=None: None
+
+    def copy_from_source(self, source: FakeCopyConnection) -> bool:
+        with mock.patch.object(ausschnitt, 'Connection',
+                               return_value=source):
+            return self.extract.copy_from_source(
+                'nodes',
+                select_target='SELECT * FROM temp.nodes',
+                select_source='SELECT * FROM osm.nodes')
+
+    def test_not_selected(self):
+        # the direct copy is opt-in
+        self.assertEqual(self.extract.direct_copy_tables, ())
+        self.assertFalse(
+            self.copy_from_source(FakeCopyConnection(chunks=[b'rows'])))
+        self.assertEqual(self.target.executed, [])
+
+    def test_copy(self):
+        self.extract.direct_copy_tables = ['nodes']
+        self.assertTrue(
+            self.copy_from_source(FakeCopyConnection(chunks=[b'rows'])))
+        self.assertEqual(self.target.received, b'rows')
+        self.assertEqual(self.target.executed[-1],
+                         'RELEASE SAVEPOINT copy_from_source;')
+
+    def test_fallback(self):
+        self.extract.direct_copy_tables = ['*']
+        source = FakeCopyConnection(
+            error=psycopg2.OperationalError('password authentication failed'))
+        with self.assertLogs(self.extract.logger, 'WARNING'):
+            self.assertFalse(self.copy_from_source(source))
+        # the created table is rolled back, so that the table can be
+        # extracted over the foreign server
+        self.assertEqual(self.target.executed[-1],
+                         'ROLLBACK TO SAVEPOINT copy_from_source;')
+
+
+Boundary = namedtuple('Boundary', ['wkt'])
+
+
+class FakeBoundaryConnection(FakeCopyConnection):
+    """returns the boundary of the project area"""
+    def cursor(self):
+        cur = FakeCopyCursor(self)
+        cur.fetchone = lambda: Boundary('POLYGON((0 0,1 0,1 1,0 0))')
+        return cur
+
+
+@unittest.skipIf(ausschnitt is None, 'gdal is not installed')
+class TestExtractTables(unittest.TestCase):
+    """Test extracting the tables over the connections of the pool"""
+
+    def setUp(self):
+        self.extract = ausschnitt.Extract.__new__(ausschnitt.Extract)
+        self.extract.logger = logging.getLogger('OrcaLog')
+        self.extract.login = Login(db='test_extract_tables')
+        self.extract.boundary_name = 'bbox'
+
+    def test_workers_limited_by_pool(self):
+        self.extract.n_workers = 8
+        extracted = []
+        self.extract.extract_table = \
+            lambda tn, geom, conn=None: extracted.append(tn)
+        tables = {f't{i}': 'geom' for i in range(8)}
+        pool = ConnectionPool(self.extract.login, maxconn=3)
+        with mock.patch.object(ausschnitt, 'get_pool', return_value=pool), \
+                mock.patch.object(ausschnitt, 'Connection',
+                                  return_value=FakeCopyConnection()), \
+                mock.patch.object(
+                    ausschnitt, 'ThreadPoolExecutor',
+                    wraps=ausschnitt.ThreadPoolExecutor) as executor, \
+                self.assertLogs(self.extract.logger, 'WARNING'):
+            self.extract.extract_tables(tables)
+        # one connection of the pool is held by the extract itself
+        executor.assert_called_once_with(max_workers=2)
+        self.assertListEqual(sorted(extracted), sorted(tables))
+
+    def test_boundary_over_connection(self):
+        conn = FakeBoundaryConnection()
+        with mock.patch.object(ausschnitt, 'Connection',
+                               side_effect=AssertionError('no connection')):
+            wkt = self.extract.get_target_boundary(conn=conn)
+        self.assertEqual(wkt, 'POLYGON((0 0,1 0,1 1,0 0))')
+        self.assertIn("WHERE name='bbox'", conn.executed[0])
+
+    def test_record_versions(self):
+        """the versions of the extracted tables are recorded once"""
+        self.extract.schema = 'osm'
+        self.extract.tables = {'nodes': 'geom'}
+        self.extract.boundary = None
+        steps = mock.Mock()
+        for step in ('set_pg_path', 'update_boundaries', 'create_schema',
+                     'create_foreign_catalog', 'create_foreign_schema',
+                     'extract_tables', 'additional_stuff', 'final_stuff',
+                     'further_stuff', 'cleanup'):
+            setattr(self.extract, step, getattr(steps, step))
+        conn = mock.MagicMock()
+        conn.__enter__.return_value = conn
+        with mock.patch.object(ausschnitt, 'Connection', return_value=conn), \
+                mock.patch.object(ausschnitt.ExtractCache, 'record_versions',
+                                  steps.record_versions):
+            self.extract.extract()
+        steps.record_versions.assert_called_once_with('osm', conn)
+        # after the indexes are created and before the further steps
+        names = [call[0] for call in steps.method_calls]
+        self.assertLess(names.index('final_stuff'),
+                        names.index('record_versions'))
+        self.assertLess(names.index('record_versions'),
+                        names.index('further_stuff'))
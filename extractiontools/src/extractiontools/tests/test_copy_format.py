@@ -0,0 +1,97 @@
+import unittest
+import struct
+import datetime
+import numpy as np
+from ..utils import copy_format as cf
+
+
+class TestCopyFormat(unittest.TestCase):
+    """Test the encoding of rows for COPY"""
+
+    def test_text_row(self):
+        encoders = [cf.text_encoder(t) for t in
+                    ('text', 'int4', 'bool', 'hstore', '_int8', 'bytea')]
+        row = ('a\tb\\c\nd', 5, True, {'name': 'A "B"', 'ref': None},
+               [1, 2, 3], b'\x00\xff')
+        line = cf.text_row(row, encoders)
+        self.assertEqual(
+            line,
+            'a\\tb\\\\c\\nd\t5\tt\t"name"=>"A \\\\"B\\\\"",'
+            '"ref"=>NULL\t{1,2,3}\t\\\\x00ff\n')
+        self.assertEqual(cf.text_row((None, 1), encoders[:2]), '\\N\t1\n')
+
+    def test_text_datetime(self):
+        enc = cf.text_encoder('timestamp')
+        dt = datetime.datetime(2021, 3, 4, 5, 6)
+        self.assertEqual(enc(dt), '2021-03-04T05:06:00')
+        self.assertEqual(enc('2021-03-04 05:06'), '2021-03-04 05:06')
+
+    def test_point_ewkb(self):
+        ewkb = cf.point_ewkb(9.5, 54.2, 4326)
+        endian, geomtype, srid, x, y = struct.unpack('<BIidd', ewkb)
+        self.assertEqual(endian, 1)
+        self.assertEqual(geomtype, 0x20000001)
+        self.assertEqual(srid, 4326)
+        self.assertEqual((x, y), (9.5, 54.2))
+        self.assertEqual(cf.text_encoder('geometry')(ewkb), ewkb.hex())
+
+    def test_to_ewkb(self):
+        wkb = struct.pack('<BIdd', 1, 1, 1.0, 2.0)
+        self.assertEqual(cf.to_ewkb(wkb, 25832),
+                         cf.point_ewkb(1.0, 2.0, 25832))
+        # a geometry with srid is not changed
+        ewkb = cf.point_ewkb(1.0, 2.0, 4326)
+        self.assertEqual(cf.to_ewkb(ewkb, 25832), ewkb)
+        # ISO-WKB Point Z in big endian
+        wkb_z = struct.pack('>BIddd', 0, 1001, 1.0, 2.0, 3.0)
+        ewkb_z = cf.to_ewkb(wkb_z.hex(), 4326)
+        self.assertEqual(struct.unpack('>BIi', ewkb_z[:9]),
+                         (0, 0x80000000 | 0x20000000 | 1, 4326))
+        self.assertEqual(ewkb_z[9:], wkb_z[5:])
+
+    def test_binary_row(self):
+        encoders = [cf.binary_encoder('int8'),
+                    cf.binary_encoder('text'),
+                    cf.binary_encoder('float8'),
+                    cf.binary_encoder('_int8', 'int8', 20)]
+        data = cf.binary_row((7, 'ä', None, [1, None]), encoders)
+        expected = (struct.pack('!h', 4)
+                    + struct.pack('!iq', 8, 7)
+                    + struct.pack('!i', 2) + 'ä'.encode('utf-8')
+                    + struct.pack('!i', -1)
+                    + struct.pack('!i', 36)
+                    + struct.pack('!iiIii', 1, 1, 20, 2, 1)
+                    + struct.pack('!iq', 8, 1)
+                    + struct.pack('!i', -1))
+        self.assertEqual(data, expected)
+
+    def test_binary_hstore(self):
+        data = cf.binary_encoder('hstore')({'a': 'b', 'c': None})
+        expected = (struct.pack('!i', 2)
+                    + struct.pack('!i', 1) + b'a'
+                    + struct.pack('!i', 1) + b'b'
+                    + struct.pack('!i', 1) + b'c'
+                    + struct.pack('!i', -1))
+        self.assertEqual(data, expected)
+
+    def test_binary_timestamp(self):
+        enc = cf.binary_encoder('timestamp')
+        self.assertEqual(enc(datetime.datetime(2000, 1, 2)),
+                         struct.pack('!q', 86400 * 1000000))
+        self.assertEqual(cf.binary_encoder('date')(datetime.date(1999, 12, 31)),
+                         struct.pack('!i', -1))
+
+    def test_unsupported_binary_type(self):
+        with self.assertRaises(ValueError):
+            cf.binary_encoder('numeric')
+
+    def test_linestring_and_box_ewkb(self):
+        ewkb = cf.linestring_ewkb(np.array([1.0, 2.0, 3.0, 4.0]), 4326)
+        self.assertEqual(ewkb, cf.linestring_ewkb((1.0, 2.0, 3.0, 4.0), 4326))
+        self.assertEqual(struct.unpack('<BIiI4d', ewkb),
+                         (1, 0x20000002, 4326, 2, 1.0, 2.0, 3.0, 4.0))
+        box = cf.box_ewkb(1.0, 2.0, 3.0, 4.0, 4326)
+        self.assertEqual(struct.unpack('<BIiII', box[:17]),
+                         (1, 0x20000003, 4326, 1, 5))
+        self.assertEqual(cf.box_ewkb(1.0, 2.0, 1.0, 2.0, 4326),
+                         cf.point_ewkb(1.0, 2.0, 4326))
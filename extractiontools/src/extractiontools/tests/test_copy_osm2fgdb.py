@@ -0,0 +1,139 @@
+import unittest
+import logging
+from collections import namedtuple
+from unittest import mock
+try:
+    from ..copy_osm2fgdb import CopyOSM2FGDB
+except ImportError:
+    # the extracts need gdal
+    CopyOSM2FGDB = None
+from ..extract_cache import ExtractCache
+
+
+Dependency = namedtuple('Dependency', ['nspname', 'relname'])
+LayerState = namedtuple('LayerState', ['dependency_hash'])
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, sql, vars=None):
+        if 'WITH RECURSIVE deps' in sql:
+            self.rows = [Dependency(*source.split('.'))
+                         for source in vars[0]]
+        elif 'FROM osm_layer.layer_state' in sql:
+            layer_hash = self.db.layer_state.get(vars[0])
+            self.rows = [LayerState(layer_hash)] if layer_hash else []
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeDatabase:
+    """mimics the relations and the layer_state table of the database"""
+    def __init__(self):
+        self.relkinds = {}
+        self.layer_state = {}
+        self.versions = {'osm.lines': '1234/7/None'}
+        self.created = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+if CopyOSM2FGDB is not None:
+    class FakeCopyOSM2FGDB(CopyOSM2FGDB):
+        """CopyOSM2FGDB running its queries on a FakeDatabase"""
+        def __init__(self, materialize: bool):
+            self.materialize = materialize
+            self.logger = logging.getLogger('OrcaLog')
+            self.conn = FakeDatabase()
+
+        def get_relkinds(self, schema, foreign=False, conn=None) -> dict:
+            return dict(self.conn.relkinds)
+
+        def run_query(self, sql, conn=None, vars=None):
+            db = self.conn
+            if 'CREATE OR REPLACE VIEW' in sql:
+                db.relkinds['railways'] = 'v'
+                db.created.append('view')
+            elif 'CREATE TABLE' in sql:
+                db.relkinds['railways'] = 'r'
+                db.created.append('table')
+            elif 'DROP' in sql:
+                db.relkinds.pop('railways')
+            elif 'INSERT INTO osm_layer.layer_state' in sql:
+                db.layer_state[vars['layer']] = vars['hash']
+            elif 'DELETE FROM osm_layer.layer_state' in sql:
+                db.layer_state.pop(vars['layer'], None)
+
+
+@unittest.skipIf(CopyOSM2FGDB is None, 'gdal is not installed')
+class TestMaterializedLayers(unittest.TestCase):
+    """Test that materialized layers are only rebuilt when necessary"""
+    query = "SELECT * FROM osm.lines WHERE tags ? 'railway'"
+
+    def create_layer(self, copy, query=None):
+        def source_version(schema, table, conn):
+            return conn.versions.get(f'{schema}.{table}')
+        with mock.patch.object(ExtractCache, 'source_version',
+                               side_effect=source_version):
+            copy.create_layer('railways', 'osm_layer', query or self.query,
+                              sources=['osm.lines'])
+
+    def test_skip_and_refresh(self):
+        copy = FakeCopyOSM2FGDB(materialize=True)
+        db = copy.conn
+        self.create_layer(copy)
+        self.assertEqual(db.created, ['table'])
+        self.assertIn('railways', db.layer_state)
+
+        # unchanged query and data
+        self.create_layer(copy)
+        self.assertEqual(db.created, ['table'])
+
+        # the data was updated
+        db.versions['osm.lines'] = '1234/8/None'
+        self.create_layer(copy)
+        self.assertEqual(db.created, ['table', 'table'])
+        self.create_layer(copy)
+        self.assertEqual(db.created, ['table', 'table'])
+
+        # the query changed
+        self.create_layer(copy, query=self.query + ' AND true')
+        self.assertEqual(db.created, ['table', 'table', 'table'])
+
+    def test_unknown_version(self):
+        copy = FakeCopyOSM2FGDB(materialize=True)
+        db = copy.conn
+        db.versions.clear()
+        self.create_layer(copy)
+        self.create_layer(copy)
+        # without a version the layer is rebuilt each time
+        self.assertEqual(db.created, ['table', 'table'])
+        self.assertNotIn('railways', db.layer_state)
+
+    def test_drop_layer(self):
+        copy = FakeCopyOSM2FGDB(materialize=True)
+        db = copy.conn
+        self.create_layer(copy)
+        copy.drop_layer('railways', 'osm_layer')
+        self.assertNotIn('railways', db.relkinds)
+        self.assertNotIn('railways', db.layer_state)
+
+        # a view replaces the materialized layer and its state
+        self.create_layer(copy)
+        copy.materialize = False
+        self.create_layer(copy)
+        self.assertEqual(db.relkinds['railways'], 'v')
+        self.assertNotIn('railways', db.layer_state)
+        # and is materialized again, even if the data is unchanged
+        copy.materialize = True
+        self.create_layer(copy)
+        self.assertEqual(db.relkinds['railways'], 'r')
+        self.assertEqual(db.created, ['table', 'table', 'view', 'table'])
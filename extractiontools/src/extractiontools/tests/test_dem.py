@@ -0,0 +1,97 @@
+import os
+import struct
+import tempfile
+import unittest
+import numpy as np
+from ..utils import dem
+
+
+def plane_tile(ulx, uly, rows, cols, cellsize=1.):
+    """a north-up tile with the heights z = x + 2y at the cell centres"""
+    x = ulx + (np.arange(cols) + .5) * cellsize
+    y = uly - (np.arange(rows) + .5) * cellsize
+    values = x[np.newaxis, :] + 2 * y[:, np.newaxis]
+    return (ulx, uly, cellsize, -cellsize, 0, 0, -9999, values.tolist())
+
+
+class TestDEM(unittest.TestCase):
+    """Test the sampling of the elevation model"""
+
+    def setUp(self):
+        self.tiles = [plane_tile(0, 4, 2, 4), plane_tile(0, 2, 2, 4),
+                      plane_tile(4, 4, 4, 2)]
+
+    def test_from_tiles(self):
+        elevation = dem.DEM.from_tiles(self.tiles)
+        self.assertEqual(elevation.values.shape, (4, 6))
+        self.assertEqual((elevation.x0, elevation.y0), (0, 4))
+        # the centre of the lower left cell
+        self.assertEqual(elevation.values[3, 0], .5 + 2 * .5)
+
+    def test_sample(self):
+        elevation = dem.DEM.from_tiles(self.tiles)
+        x = np.array([.5, 1.25, 3.7, 5.5, -1])
+        y = np.array([.5, 2.5, 1.1, 3.5, 1])
+        z = elevation.sample(x, y)
+        # bilinear interpolation is exact on a plane
+        np.testing.assert_allclose(z[:4], x[:4] + 2 * y[:4])
+        self.assertTrue(np.isnan(z[4]))
+
+    def test_nodata(self):
+        tile = list(plane_tile(0, 2, 2, 2))
+        tile[-1][0][0] = -9999
+        elevation = dem.DEM.from_tiles([tile])
+        self.assertTrue(np.isnan(elevation.values[0, 0]))
+        # the cells without data are left out of the interpolation
+        z = elevation.sample(np.array([1.]), np.array([1.]))
+        self.assertFalse(np.isnan(z[0]))
+
+    def test_save_load(self):
+        elevation = dem.DEM.from_tiles(self.tiles)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'dem')
+            elevation.save(path)
+            loaded = dem.DEM.load(path)
+            self.assertIsInstance(loaded.values, np.memmap)
+            np.testing.assert_array_equal(loaded.values, elevation.values)
+            self.assertEqual(loaded.dy, -1)
+            del loaded
+
+    def test_from_tiles_to_file(self):
+        headers = [tile[:6] + (len(tile[7][0]), len(tile[7]))
+                   for tile in self.tiles]
+        self.assertEqual(dem.DEM.tile_grid(headers), (0, 4, 1, -1, 4, 6))
+        expected = dem.DEM.from_tiles(self.tiles)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'dem')
+            # the tiles are consumed one by one
+            elevation = dem.DEM.from_tiles(iter(self.tiles), path=path,
+                                           headers=headers)
+            self.assertIsInstance(elevation.values, np.memmap)
+            loaded = dem.DEM.load(path)
+            np.testing.assert_array_equal(loaded.values, expected.values)
+            self.assertEqual((loaded.x0, loaded.y0), (0, 4))
+            del elevation, loaded
+
+    def test_linestring_coords(self):
+        coords = [(1., 2.), (3., 4.), (5., 6.)]
+        wkb = struct.pack('<BII', 1, 2, len(coords)) + b''.join(
+            struct.pack('<dd', *c) for c in coords)
+        np.testing.assert_array_equal(dem.linestring_coords(wkb), coords)
+
+    def test_slope_statistics(self):
+        # a line up 10 m and down 5 m over 2 x 100 m and a line of 0 length
+        z = np.array([0., 10., 5., 3., 3.])
+        distances = np.array([np.nan, 100., 100., 50., 0.])
+        stats = dem.slope_statistics(z, distances, [0, 3, 5])
+        np.testing.assert_allclose(stats[0], [.025, 10, 5, .1])
+        np.testing.assert_allclose(stats[1], [0, 0, 0, 0])
+
+        z[1] = np.nan
+        stats = dem.slope_statistics(z, distances, [0, 3, 5])
+        self.assertAlmostEqual(stats[0, 0], .025)
+        self.assertTrue(np.isnan(stats[0, 1:]).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
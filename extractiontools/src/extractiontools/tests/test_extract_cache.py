@@ -0,0 +1,171 @@
+import os
+import unittest
+import tempfile
+from collections import namedtuple
+import psycopg2
+from ..extract_cache import ExtractCache
+
+
+class TestExtractCache(unittest.TestCase):
+    """Test the keys and entries of the extraction cache"""
+
+    def test_key(self):
+        key = ExtractCache.key('host', 5432, 'europe', 'osm', 'nodes', '1/2')
+        self.assertEqual(len(key), 64)
+        self.assertEqual(
+            key, ExtractCache.key('host', '5432', 'europe', 'osm', 'nodes',
+                                  '1/2'))
+        # the parts are separated, so that shifted strings differ
+        self.assertNotEqual(ExtractCache.key('ab', 'c'),
+                            ExtractCache.key('a', 'bc'))
+
+    def test_entry(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache = ExtractCache(folder)
+            key = cache.key('nodes')
+            self.assertNotIn(key, cache)
+            dump_path, json_path = cache.path(key)
+            self.assertEqual(os.path.dirname(dump_path),
+                             os.path.join(folder, key[:2]))
+            os.makedirs(os.path.dirname(dump_path))
+            for path in (dump_path, json_path):
+                with open(path, 'w'):
+                    pass
+            self.assertIn(key, cache)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, vars=None):
+        self.conn.executed.append(' '.join(sql.split()))
+        self.conn.results = list(self.conn.responses.pop(0)
+                                 if self.conn.responses else [])
+
+    def fetchone(self):
+        return self.conn.results.pop(0) if self.conn.results else None
+
+    def fetchall(self):
+        results, self.conn.results = self.conn.results, []
+        return results
+
+    def copy_expert(self, sql, f):
+        if 'TO STDOUT' in sql:
+            f.write(self.conn.data)
+        elif self.conn.fail:
+            raise psycopg2.DataError('invalid COPY file header')
+        else:
+            self.conn.restored = f.read()
+
+
+class FakeConnection:
+    """mimics the parts of a psycopg2 connection used by the cache"""
+    def __init__(self, data=b'', fail=False, responses=None):
+        self.data = data
+        self.fail = fail
+        self.restored = None
+        self.executed = []
+        self.responses = responses or []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+Version = namedtuple('Version', ['relfilenode', 'replication', 'versions'])
+
+
+class TestExtractCacheEntries(unittest.TestCase):
+    """Test storing, restoring and invalidating the cache entries"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache = ExtractCache(self.folder.name)
+        self.columns = [[('id', 'bigint'), ('geom', 'geometry')]]
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_round_trip(self):
+        key = self.cache.key('nodes', 1)
+        source = FakeConnection(data=b'PGCOPY rows',
+                                responses=self.columns)
+        self.cache.store(key, 'osm', 'nodes', source)
+        self.assertIn(key, self.cache)
+
+        target = FakeConnection()
+        self.assertTrue(self.cache.restore(key, 'osm', 'nodes', target))
+        self.assertEqual(target.restored, b'PGCOPY rows')
+        self.assertEqual(target.executed, [
+            'SAVEPOINT restore_from_cache;',
+            'CREATE TABLE osm.nodes ( "id" bigint, "geom" geometry );',
+            'RELEASE SAVEPOINT restore_from_cache;'])
+
+    def test_failed_restore(self):
+        key = self.cache.key('nodes', 1)
+        self.cache.store(key, 'osm', 'nodes',
+                         FakeConnection(data=b'broken',
+                                        responses=self.columns))
+        target = FakeConnection(fail=True)
+        with self.assertLogs(self.cache.logger, 'WARNING'):
+            self.assertFalse(self.cache.restore(key, 'osm', 'nodes', target))
+        # the transaction is rolled back and the broken entry removed,
+        # so that the table is extracted again
+        self.assertEqual(target.executed[-1],
+                         'ROLLBACK TO SAVEPOINT restore_from_cache;')
+        self.assertNotIn(key, self.cache)
+        self.assertFalse(self.cache.restore(key, 'osm', 'nodes', target))
+
+    def test_source_version(self):
+        def version(*responses, schema='osm', table='nodes'):
+            conn = FakeConnection(responses=list(responses))
+            return ExtractCache.source_version(schema, table, conn)
+
+        # views and databases without data versions are not cached
+        self.assertIsNone(version([Version(None, True, True)]))
+        self.assertIsNone(version([Version(1234, False, False)]))
+
+        v1 = version([Version(1234, True, True)], [(7, )], [(1, )])
+        self.assertEqual(v1, '1234/7/1')
+        # a new replication sequence, a new version of the table
+        # or a rewritten table invalidate the entries
+        self.assertNotEqual(
+            v1, version([Version(1234, True, True)], [(8, )], [(1, )]))
+        self.assertNotEqual(
+            v1, version([Version(1234, True, True)], [(7, )], [(2, )]))
+        self.assertNotEqual(
+            v1, version([Version(5678, True, True)], [(7, )], [(1, )]))
+        self.assertEqual(version([Version(1234, True, False)], [(7, )]),
+                         '1234/7/None')
+
+        # the replication sequence applies only to the osm tables,
+        # other tables are versioned by meta.table_versions only
+        self.assertEqual(version([Version(1234, True, True)], [(3, )],
+                                 schema='landuse', table='clc18'),
+                         '1234/None/3')
+        # and are not cached, if untracked
+        self.assertIsNone(version([Version(1234, True, True)], [],
+                                  schema='landuse', table='clc18'))
+        self.assertIsNone(version([Version(1234, True, False)],
+                                  schema='landuse', table='clc18'))
+
+    def test_record_versions(self):
+        conn = FakeConnection()
+        ExtractCache.record_versions('osm', conn, tables=['nodes', 'ways'])
+        self.assertTrue(conn.executed[0].startswith(
+            'CREATE SCHEMA IF NOT EXISTS meta;'))
+        self.assertIn('ON CONFLICT (schema_name, table_name) '
+                      'DO UPDATE SET version = EXCLUDED.version;',
+                      conn.executed[1])
+
+    def test_invalidation(self):
+        keys = [self.cache.key('host', 5432, 'europe', 'osm', 'nodes',
+                               version, 'SELECT ...')
+                for version in ('1234/7/1', '1234/8/1')]
+        self.cache.store(keys[0], 'osm', 'nodes',
+                         FakeConnection(data=b'rows',
+                                        responses=self.columns))
+        self.assertIn(keys[0], self.cache)
+        self.assertNotIn(keys[1], self.cache)
+        self.assertFalse(self.cache.restore(keys[1], 'osm', 'nodes',
+                                            FakeConnection()))
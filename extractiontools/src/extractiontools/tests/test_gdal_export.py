@@ -0,0 +1,133 @@
+import os
+import struct
+import tempfile
+import unittest
+try:
+    from osgeo import ogr
+except ImportError:
+    ogr = None
+from ..utils.gdal_export import (field_type, select_expression,
+                                 geometry_type, write_layer, translate_layer)
+from ..utils.progress import Progress
+
+
+class TestGdalExport(unittest.TestCase):
+    """Test the mapping of the PostgreSQL types to OGR"""
+
+    def test_field_type(self):
+        self.assertEqual(field_type('int8'), ('OFTInteger64', None))
+        self.assertEqual(field_type('bool'), ('OFTInteger', 'OFSTBoolean'))
+        self.assertEqual(field_type('hstore'), ('OFTString', None))
+
+    def test_select_expression(self):
+        self.assertEqual(select_expression('area', 'numeric'),
+                         '"area"::float8 AS "area"')
+        self.assertEqual(select_expression('name', 'varchar'), '"name"')
+        self.assertEqual(select_expression('tags', 'hstore'),
+                         '"tags"::text AS "tags"')
+
+    def test_geometry_type(self):
+        self.assertEqual(geometry_type('MultiPolygon'), 'wkbMultiPolygon')
+        self.assertEqual(geometry_type('GEOMETRY'), 'wkbUnknown')
+        self.assertEqual(geometry_type(None), 'wkbUnknown')
+
+
+def point(x: float, y: float) -> bytes:
+    """return the WKB of a point"""
+    return struct.pack('<BIdd', 1, 1, x, y)
+
+
+@unittest.skipIf(ogr is None, 'gdal is not installed')
+class TestWriteLayer(unittest.TestCase):
+    """Test writing layers in-process and copying them between files"""
+    fields = [('id', 'int8'), ('name', 'text'), ('bridge', 'bool')]
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.batches = [[(point(10., 50.), 1, 'a', True),
+                         (point(11., 51.), 2, None, False)],
+                        [(None, 3, 'c', None)]]
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def read_layer(self, path: str, layer: str):
+        """return the features of the layer as tuples"""
+        datasource = ogr.Open(path)
+        ogr_layer = datasource.GetLayerByName(layer)
+        features = []
+        for feature in ogr_layer:
+            geom = feature.GetGeometryRef()
+            features.append((
+                geom.GetPoint_2D() if geom else None,
+                feature.GetField('id'),
+                feature.GetField('name'),
+                feature.GetField('bridge')))
+        srid = ogr_layer.GetSpatialRef().GetAuthorityCode(None)
+        datasource = None
+        return features, srid
+
+    def test_round_trip(self):
+        gpkg = os.path.join(self.folder.name, 'layers.gpkg')
+        n = write_layer(gpkg, 'GPKG', 'bridges', self.fields,
+                        iter(self.batches), srid=4326, geometry='POINT')
+        self.assertEqual(n, 3)
+        expected = [((10., 50.), 1, 'a', 1),
+                    ((11., 51.), 2, None, 0),
+                    (None, 3, 'c', None)]
+        features, srid = self.read_layer(gpkg, 'bridges')
+        self.assertEqual(features, expected)
+        self.assertEqual(srid, '4326')
+
+        # a second layer is added to the file and a layer with the same
+        # name is replaced
+        write_layer(gpkg, 'GPKG', 'other', self.fields,
+                    [self.batches[1]], srid=4326, geometry='POINT')
+        write_layer(gpkg, 'GPKG', 'bridges', self.fields,
+                    [self.batches[0]], srid=4326, geometry='POINT')
+        self.assertEqual(self.read_layer(gpkg, 'bridges')[0], expected[:2])
+        self.assertEqual(self.read_layer(gpkg, 'other')[0], expected[2:])
+
+        fgb = os.path.join(self.folder.name, 'bridges.fgb')
+        translate_layer(gpkg, fgb, 'FlatGeobuf', 'bridges')
+        features, srid = self.read_layer(fgb, 'bridges')
+        self.assertEqual(features, expected[:2])
+        self.assertEqual(srid, '4326')
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class TestProgress(unittest.TestCase):
+    """Test the progress and throughput of an export"""
+
+    def test_throughput(self):
+        clock = FakeClock()
+        progress = Progress('layer', total=400, interval=10, clock=clock)
+        clock.now = 2.
+        progress.update(100, 2**20)
+        clock.now = 4.
+        progress.update(100, 2**20)
+        self.assertEqual(progress.message(),
+                         'layer: 200 features (50%) in 4.0s '
+                         '(50 features/s, 0.5 MB/s)')
+        result = progress.finish()
+        self.assertEqual(result['features'], 200)
+        self.assertEqual(result['bytes'], 2 * 2**20)
+        self.assertAlmostEqual(result['features_per_second'], 50.)
+
+    def test_interval(self):
+        clock = FakeClock()
+        with self.assertLogs('extractiontools.utils.progress') as cm:
+            progress = Progress('layer', interval=10, clock=clock)
+            clock.now = 5.
+            progress.update(10)
+            clock.now = 11.
+            progress.update(10)
+            progress.logger.info('done')
+        self.assertEqual(len(cm.output), 2)
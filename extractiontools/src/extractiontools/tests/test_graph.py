@@ -0,0 +1,149 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from ..utils.graph import (NetworkGraph, csr_graph, save_graph, load_graph,
+                           graph_matrix, matrix_arrays, snap_points,
+                           shortest_paths)
+
+
+class TestNetworkGraph(unittest.TestCase):
+    """Test the connectivity analysis of the network"""
+
+    def setUp(self):
+        # a cycle 10 -> 20 -> 30 -> 10, a two-way edge 30 <-> 40,
+        # a oneway 40 -> 50, a closed edge 50 - 60
+        # and a separate two-way edge 70 <-> 80
+        self.graph = NetworkGraph(
+            fromnodes=[10, 20, 30, 30, 40, 50, 70],
+            tonodes=[20, 30, 10, 40, 50, 60, 80],
+            cost=[1, 1, 1, 2, 1, -1, 3],
+            reverse_cost=[-1, -1, -1, 2, -1, -1, 3])
+
+    def test_nodes(self):
+        # node 60 is only connected by the closed edge
+        np.testing.assert_array_equal(self.graph.nodes,
+                                      [10, 20, 30, 40, 50, 70, 80])
+        self.assertEqual(self.graph.matrix().nnz, 8)
+
+    def test_components(self):
+        np.testing.assert_array_equal(self.graph.components('strong'),
+                                      [10, 10, 10, 10, 50, 70, 70])
+        np.testing.assert_array_equal(self.graph.components('weak'),
+                                      [10, 10, 10, 10, 10, 70, 70])
+
+    def test_reached(self):
+        strong, weak, reached = self.graph.analyze(min_component_size=2)
+        np.testing.assert_array_equal(
+            reached, [True, True, True, True, False, False, False])
+        np.testing.assert_array_equal(
+            self.graph.reached_edges(reached),
+            [True, True, True, True, False, False])
+
+    def test_from_batches(self):
+        batches = [{'fromnode': np.array([1]), 'tonode': np.array([2]),
+                    'cost': np.array([1.]), 'reverse_cost': np.array([1.])},
+                   {'fromnode': np.array([2]), 'tonode': np.array([3]),
+                    'cost': np.array([np.nan]),
+                    'reverse_cost': np.array([1.])}]
+        graph = NetworkGraph.from_batches(batches)
+        np.testing.assert_array_equal(graph.components(), [1, 1, 3])
+        empty = NetworkGraph.from_batches([])
+        self.assertEqual(len(empty.components()), 0)
+
+
+
+class TestCSRGraph(unittest.TestCase):
+    """Test the export of the graph in compressed sparse row format"""
+
+    def setUp(self):
+        # edge 1: 30 -> 10 oneway, edge 2: 10 <-> 20, edge 3: closed
+        self.arrays = csr_graph(edge_ids=[1, 2, 3],
+                                fromnodes=[30, 10, 20],
+                                tonodes=[10, 20, 30],
+                                cost=[1.5, 2., -1],
+                                reverse_cost=[-1, 3., -1])
+
+    def test_csr_graph(self):
+        a = self.arrays
+        np.testing.assert_array_equal(a['nodes'], [10, 20, 30])
+        np.testing.assert_array_equal(a['indptr'], [0, 1, 2, 3])
+        np.testing.assert_array_equal(a['indices'], [1, 0, 0])
+        np.testing.assert_array_equal(a['cost'], [2., 3., 1.5])
+        np.testing.assert_array_equal(a['edge'], [2, 2, 1])
+        np.testing.assert_array_equal(a['reverse'], [False, True, False])
+        self.assertEqual(a['cost'].dtype, np.float32)
+        self.assertEqual(a['nodes'].dtype, np.int64)
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'csr')
+            save_graph(path, self.arrays)
+            loaded = load_graph(path)
+            self.assertSetEqual(set(loaded), set(self.arrays))
+            self.assertIsInstance(loaded['indptr'], np.memmap)
+            np.testing.assert_array_equal(loaded['cost'],
+                                          self.arrays['cost'])
+            del loaded
+
+
+class TestShortestPaths(unittest.TestCase):
+    """Test the skims between the nodes of the graph"""
+
+    def setUp(self):
+        # 10 -> 20 twice, 20 <-> 30 at no cost, 30 -> 10, 40 isolated
+        self.arrays = csr_graph(edge_ids=[1, 2, 3, 4, 5],
+                                fromnodes=[10, 10, 20, 30, 40],
+                                tonodes=[20, 20, 30, 10, 50],
+                                cost=[5., 2., 0., 4., 1.],
+                                reverse_cost=[-1, -1, 0., -1, -1])
+
+    def test_graph_matrix(self):
+        matrix = graph_matrix(self.arrays)
+        # the parallel arcs are reduced to the cheapest
+        self.assertEqual(matrix.nnz, 5)
+        self.assertEqual(matrix[0, 1], 2.)
+        # arcs without cost are kept
+        self.assertIn(2, matrix[1].indices)
+
+    def test_saved_matrix(self):
+        arrays = dict(self.arrays)
+        arrays.update(matrix_arrays(arrays))
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'csr')
+            save_graph(path, arrays)
+            loaded = load_graph(path)
+            matrix = graph_matrix(loaded)
+            # the matrix wraps the memory-mapped arrays without a copy
+            for name, values in (('matrix_cost', matrix.data),
+                                 ('matrix_indices', matrix.indices),
+                                 ('matrix_indptr', matrix.indptr)):
+                self.assertTrue(np.shares_memory(values, loaded[name]))
+            expected = graph_matrix(self.arrays)
+            np.testing.assert_array_equal(matrix.toarray(),
+                                          expected.toarray())
+            costs = shortest_paths(matrix, [0, 2], [0, 1, 2])
+            np.testing.assert_array_equal(costs, [[0, 2, 2], [4, 0, 0]])
+            del matrix, loaded
+
+    def test_shortest_paths(self):
+        matrix = graph_matrix(self.arrays)
+        costs = shortest_paths(matrix, [0, 2, 0], [0, 1, 2, 4])
+        self.assertEqual(costs.dtype, np.float32)
+        np.testing.assert_array_equal(costs,
+                                      [[0, 2, 2, np.inf],
+                                       [4, 0, 0, np.inf],
+                                       [0, 2, 2, np.inf]])
+        costs = shortest_paths(matrix, [2], [0, 1], limit=3)
+        np.testing.assert_array_equal(costs, [[np.inf, 0]])
+
+    def test_snap_points(self):
+        x = np.array([0., 10., np.nan, 5.])
+        y = np.array([0., 0., np.nan, 5.])
+        nodes, distance = snap_points(x, y, [9., 1., 5.], [1., 0., 4.])
+        np.testing.assert_array_equal(nodes, [1, 0, 3])
+        np.testing.assert_allclose(distance, [np.sqrt(2), 1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
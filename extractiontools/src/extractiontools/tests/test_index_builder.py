@@ -0,0 +1,68 @@
+import unittest
+import logging
+from ..index_builder import IndexBuilder, parse_statement
+
+
+class FakeApp:
+    """records the queries instead of running them"""
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.conn = object()
+        self.queries = []
+
+    def run_query(self, sql, conn=None, split=True, verbose=True):
+        self.queries.append(sql)
+
+
+class TestIndexBuilder(unittest.TestCase):
+    """Test the grouping of the index statements"""
+
+    sql = '''
+    ALTER TABLE "osm".nodes ADD PRIMARY KEY (id);
+    CREATE INDEX idx_nodes_geom
+      ON "osm".nodes
+      USING gist
+      (geom);
+    -- Partial index for nodes
+    CREATE INDEX node_tags_idx
+    ON osm.nodes
+    USING gist(tags)
+    WHERE tags <> ''::hstore;
+    CLUSTER osm.nodes USING idx_nodes_geom;
+    CREATE UNIQUE INDEX ON osm.ways (id);
+    ANALYZE osm.nodes;
+    '''
+
+    def test_parse_statement(self):
+        self.assertEqual(
+            parse_statement('CREATE INDEX idx_a ON "net".links USING gist(geom);'),
+            ('net.links', True, 'idx_a'))
+        self.assertEqual(
+            parse_statement('ALTER TABLE "net"."links" ADD PRIMARY KEY (id);')[:2],
+            ('net.links', False))
+        self.assertEqual(
+            parse_statement('CREATE INDEX CONCURRENTLY idx_a ON a (b);')[:2],
+            ('', False))
+
+    def test_groups(self):
+        builder = IndexBuilder(FakeApp(), n_workers=4)
+        builder.add(self.sql)
+        self.assertEqual(len(builder), 6)
+        self.assertEqual(list(builder.tables), ['osm.nodes', 'osm.ways'])
+        groups = [[label for label, sql, parallel in group]
+                  for group in builder.tables['osm.nodes']]
+        self.assertEqual(len(groups), 4)
+        self.assertEqual(groups[1], ['idx_nodes_geom', 'node_tags_idx'])
+
+    def test_run_serial(self):
+        app = FakeApp()
+        builder = IndexBuilder(app, n_workers=1,
+                               maintenance_work_mem='2GB',
+                               max_parallel_maintenance_workers=4)
+        builder.add(self.sql)
+        timings = builder.run()
+        self.assertIn("SET LOCAL maintenance_work_mem = '2GB'", app.queries[0])
+        self.assertEqual(len(app.queries), 7)
+        self.assertTrue(app.queries[-1].startswith('ANALYZE osm.nodes'))
+        self.assertIn('idx_nodes_geom', timings)
+        self.assertEqual(len(builder), 0)
@@ -0,0 +1,88 @@
+import unittest
+from collections import namedtuple
+import numpy as np
+from ..connection import DBApp
+
+
+Column = namedtuple('Column', ['name'])
+Row = namedtuple('Row', ['id', 'x'])
+
+
+class FakeNamedCursor:
+    """mimics a psycopg2 server-side cursor"""
+    def __init__(self, conn, name, withhold):
+        self.conn = conn
+        self.name = name
+        self.withhold = withhold
+        self.closed = False
+        self.description = (Column('id'), Column('x'))
+
+    def execute(self, sql, vars=None):
+        self.conn.executed.append((sql, vars))
+        self._rows = list(self.conn.rows)
+
+    def fetchmany(self, size):
+        self.conn.fetched.append(size)
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.closed = 0
+        self.cursors = []
+        self.executed = []
+        self.fetched = []
+
+    def cursor(self, name=None, withhold=False):
+        cur = FakeNamedCursor(self, name, withhold)
+        self.cursors.append(cur)
+        return cur
+
+
+class TestIterQuery(unittest.TestCase):
+    """Test the batches of rows fetched with server-side cursors"""
+
+    def setUp(self):
+        self.conn = FakeConnection([Row(i, i / 2) for i in range(5)])
+        self.app = DBApp(conn=self.conn)
+
+    def test_batches(self):
+        batches = list(self.app.iter_query('SELECT id, x FROM t',
+                                           vars={'a': 1}, itersize=2,
+                                           withhold=True))
+        self.assertEqual([len(rows) for rows in batches], [2, 2, 1])
+        self.assertEqual(batches[2][0].id, 4)
+        cur = self.conn.cursors[0]
+        self.assertTrue(cur.name)
+        self.assertTrue(cur.withhold)
+        self.assertTrue(cur.closed)
+        self.assertEqual(self.conn.executed, [('SELECT id, x FROM t',
+                                               {'a': 1})])
+        self.assertEqual(self.conn.fetched, [2, 2, 2, 2])
+
+    def test_arrays(self):
+        batches = list(self.app.iter_query('SELECT id, x FROM t',
+                                           itersize=3, arrays=True,
+                                           dtypes={'id': 'i8'}))
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(batches[0]['id'].dtype, np.int64)
+        np.testing.assert_array_equal(batches[1]['id'], [3, 4])
+        np.testing.assert_array_almost_equal(batches[0]['x'], [0, .5, 1])
+
+    def test_cursor_names(self):
+        list(self.app.iter_query('SELECT 1'))
+        list(self.app.iter_query('SELECT 1'))
+        names = [cur.name for cur in self.conn.cursors]
+        self.assertNotEqual(names[0], names[1])
+
+    def test_close_on_break(self):
+        batches = self.app.iter_query('SELECT id, x FROM t', itersize=2)
+        next(batches)
+        self.assertFalse(self.conn.cursors[0].closed)
+        batches.close()
+        self.assertTrue(self.conn.cursors[0].closed)
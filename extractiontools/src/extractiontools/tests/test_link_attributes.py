@@ -0,0 +1,147 @@
+import unittest
+import numpy as np
+import pandas as pd
+from ..utils import link_attributes as la
+from ..build_network_car import BuildNetwork
+
+
+def make_links(**columns):
+    """return links with defaults for the columns not given"""
+    n = len(next(iter(columns.values())))
+    data = {
+        'id': np.arange(1, n + 1),
+        'fromnode': np.arange(10, 10 + n),
+        'tonode': np.arange(20, 20 + n),
+        'wayid': np.arange(100, 100 + n),
+        'segment': np.zeros(n, dtype=int),
+        'length': np.full(n, 1000.),
+        'linkname': [None] * n,
+        'linkref': [None] * n,
+        'linktype': np.ones(n, dtype=int),
+        'io': np.zeros(n, dtype=bool),
+        'z_from': np.full(n, np.nan),
+        'z_to': np.full(n, np.nan),
+    }
+    for tag in la.TAGS:
+        data[f'tag_{tag}'] = [None] * n
+    data.update(columns)
+    return pd.DataFrame(data)
+
+
+class TestLinkAttributes(unittest.TestCase):
+    """Test the rules for the attributes of the car links"""
+
+    def setUp(self):
+        self.defaults = pd.DataFrame({'linktype': [1, 1, 2],
+                                      'io': [False, True, False],
+                                      'v_kfz': [80, 40, 100],
+                                      'v_kfz_zulaessig': [100, 50, 130]})
+        self.road_categories = pd.Series({1: 'B', 2: 'A', 3: 'D'})
+
+    def test_first_number(self):
+        values = pd.Series(['50', 'DE:urban', None, '7.5 t', '-5'])
+        np.testing.assert_array_equal(la.first_number(values),
+                                      [50, np.nan, np.nan, 7.5, 5])
+
+    def test_oneway_and_lanes(self):
+        links = make_links(
+            tag_oneway=['yes', None, 'no', '-1', None],
+            tag_junction=[None, 'roundabout', 'roundabout', None, None],
+            tag_lanes=[None, '3', None, None, '12;2'])
+        attrs = la.car_attributes(links, self.defaults, self.road_categories)
+        self.assertListEqual(attrs.oneway.tolist(),
+                             [True, True, False, True, False])
+        self.assertListEqual(attrs.reverse.tolist(),
+                             [False, False, False, True, False])
+        self.assertListEqual(attrs.fromnode.tolist(), [10, 11, 12, 23, 14])
+        self.assertListEqual(attrs.tonode.tolist(), [20, 21, 22, 13, 24])
+        self.assertListEqual(attrs.lanes.tolist(), [1, 3, 2, 1, 10])
+
+    def test_bridge_tunnel_and_slope(self):
+        links = make_links(tag_bridge=['yes', 'no', None, None],
+                           tag_tunnel=[None, None, None, None],
+                           tag_oneway=[None, None, None, '-1'],
+                           length=[100., 100., 0., 100.],
+                           z_from=[10., 10., 10., 10.],
+                           z_to=[20., 20., 20., np.nan])
+        attrs = la.car_attributes(links, self.defaults, self.road_categories)
+        self.assertListEqual(attrs.bridge_tunnel.tolist(), ['b', '', '', ''])
+        np.testing.assert_allclose(attrs.slope, [0, .1, 0, 0])
+
+        links['z_to'] = [20., 20., 20., 30.]
+        attrs = la.car_attributes(links, self.defaults, self.road_categories)
+        # the reversed link goes downhill
+        np.testing.assert_allclose(attrs.slope, [0, .1, 0, -.2])
+
+    def test_maxspeed(self):
+        links = make_links(
+            tag_maxspeed=['50', '120', 'signals', 'none', None, None, 'walk'],
+            linktype=[1, 1, 2, 2, 1, 4, 1],
+            io=[False, False, False, False, True, False, False])
+        attrs = la.car_attributes(links, self.defaults, self.road_categories)
+        # the average speed of category B is limited to the default
+        np.testing.assert_array_equal(attrs.maxspeed,
+                                      [50, 80, 120, 150, 40, np.nan, 80])
+        np.testing.assert_array_equal(attrs.speed_zulaessig,
+                                      [50, 120, 120, 150, 50, np.nan, 100])
+        np.testing.assert_allclose(attrs.t_kfz[:2],
+                                   [1000 / 50 * 3.6 / 60,
+                                    1000 / 80 * 3.6 / 60])
+        self.assertTrue(np.isnan(attrs.t_kfz[5]))
+
+    def test_ferries(self):
+        links = make_links(linktype=[3, 3, 3, 1],
+                           wayid=[7, 7, 7, 8],
+                           segment=[0, 1, 2, 0],
+                           length=[100., 300., 200., 100.],
+                           tag_maxspeed=['0', '0', '0', '0'],
+                           tag_duration=['45', '45', '45', '30'])
+        attrs = la.car_attributes(links, self.defaults, self.road_categories)
+        np.testing.assert_allclose(
+            attrs.t_kfz, [la.FERRY_SEGMENT_TIME, 45, la.FERRY_SEGMENT_TIME,
+                          la.CLOSED_TIME])
+
+    def test_to_rows(self):
+        df = pd.DataFrame({'a': [1., np.nan], 'b': ['x', None],
+                           'c': [True, False]})
+        rows = list(la.to_rows(df, integer_columns=('a', )))
+        self.assertListEqual(rows, [[1, 'x', True], [None, None, False]])
+        self.assertIsInstance(rows[0][0], int)
+        self.assertIsInstance(rows[0][2], bool)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TestLinkAttributeBatches(unittest.TestCase):
+    """Test computing the link attributes batch by batch"""
+
+    def test_ways_in_one_batch(self):
+        defaults = pd.DataFrame({'linktype': [1], 'io': [False],
+                                 'v_kfz': [80], 'v_kfz_zulaessig': [100]})
+        road_categories = pd.Series({1: 'B', 3: 'D'})
+        # the segments of the ferry 7 are split across the batches
+        links = make_links(linktype=[1, 3, 3, 3, 1],
+                           wayid=[5, 7, 7, 7, 8],
+                           segment=[0, 0, 1, 2, 0],
+                           length=[100., 100., 300., 200., 100.],
+                           tag_duration=[None, '45', '45', '45', None])
+
+        def iter_query(sql, arrays=False, dtypes=None, itersize=None):
+            for i in range(0, len(links), 2):
+                batch = links.iloc[i:i + 2]
+                yield {col: batch[col].to_numpy() for col in batch.columns}
+
+        network = BuildNetwork.__new__(BuildNetwork)
+        network.network = 'network'
+        network.iter_query = iter_query
+        rows = list(network.link_attribute_rows(defaults, road_categories))
+        expected = list(la.to_rows(
+            la.car_attributes(links, defaults, road_categories),
+            integer_columns=('id', 'fromnode', 'tonode', 'lanes',
+                             'maxspeed', 'speed_zulaessig')))
+        self.assertEqual(rows, expected)
+        t_kfz = [row[-1] for row in rows]
+        self.assertEqual(t_kfz[1:4],
+                         [la.FERRY_SEGMENT_TIME, 45, la.FERRY_SEGMENT_TIME])
@@ -0,0 +1,178 @@
+import unittest
+from typing import List
+import numpy as np
+from ..build_network_car import BuildNetwork
+from ..build_network_multimode import BuildNetworkMultiMode
+from ..utils.graph import csr_graph, graph_matrix, shortest_paths
+from .testdb import (connect_test_db, create_grid_network, get_test_login,
+                     grid_node)
+
+
+class MainRoadNetwork(BuildNetwork):
+    """
+    the car network restricted to the main roads
+    """
+
+    def create_streets_view(self):
+        """
+        Create Views defining the relevant waytypes of the main roads
+        """
+        network = self.network
+        sql = f"""
+CREATE MATERIALIZED VIEW "{network}".streets AS
+SELECT
+  w.id,
+  min(wtl.linktype_id) linktype_id,
+  min(lt.road_category)::char(1) category
+FROM
+osm.ways w,
+classifications.linktypes lt,
+classifications.waytype2linktype wtl,
+classifications.wt2lt_construction wtc
+WHERE (w.tags @> wtl.tags
+OR (w.tags @> wtc.tag1 AND w.tags @> wtc.tag2))
+AND wtl.linktype_id=lt.id
+AND wtc.linktype_id=lt.id
+AND lt.road_category <= 'B'
+GROUP BY w.id;
+CREATE INDEX streets_idx ON "{network}".streets USING btree(id);
+ANALYZE "{network}".streets;
+"""
+        self.run_query(sql)
+
+
+class FootNetwork(BuildNetwork):
+    """
+    the network of the footways
+    """
+
+    def create_roads(self):
+        """
+        Create the view for the footways
+        """
+        sql = f"""
+CREATE MATERIALIZED VIEW "{self.network}".roads AS
+SELECT s.id, s.linktype_id, s.category
+FROM "{self.network}".streets s
+WHERE s.category = 'E';
+"""
+        self.run_query(sql)
+
+
+class TestNetworkMultiMode(unittest.TestCase):
+    """
+    Test that the networks built together with BuildNetworkMultiMode
+    have the same costs and connectivity as the networks built on their own
+    """
+    networks = {'car': 'mm_car', 'main': 'mm_main', 'foot': 'mm_foot'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = connect_test_db()
+        create_grid_network(cls.conn)
+        kwargs = dict(db=get_test_login().db, links_to_find=3)
+        BuildNetwork(network_schema='car', **kwargs).build()
+        MainRoadNetwork(network_schema='main', **kwargs).build()
+        FootNetwork(network_schema='foot', **kwargs).build()
+        BuildNetworkMultiMode(
+            networks=[BuildNetwork(network_schema='mm_car', **kwargs),
+                      MainRoadNetwork(network_schema='mm_main', **kwargs),
+                      FootNetwork(network_schema='mm_foot', **kwargs)],
+            segments_schema='mm_segments',
+            **kwargs).build()
+
+    @classmethod
+    def tearDownClass(cls):
+        cur = cls.conn.cursor()
+        for network, multimode in cls.networks.items():
+            for schema in (network, multimode):
+                cur.execute(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE;')
+        cur.execute('DROP SCHEMA IF EXISTS mm_segments CASCADE;')
+        cls.conn.commit()
+        cls.conn.close()
+
+    def fetch(self, sql: str) -> List[tuple]:
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        return [tuple(row) for row in cur.fetchall()]
+
+    def vertices(self, network: str) -> np.ndarray:
+        rows = self.fetch(f'SELECT id FROM "{network}".edge_table_vertices_pgr '
+                          'ORDER BY id;')
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+    def reached(self, network: str) -> set:
+        rows = self.fetch(f'SELECT node FROM "{network}".nodes_reached;')
+        return {row[0] for row in rows}
+
+    def costs(self, network: str, nodes: np.ndarray) -> np.ndarray:
+        """
+        return the costs of the shortest paths between the nodes
+        """
+        rows = self.fetch(f'''
+SELECT id, fromnode, tonode, cost, reverse_cost
+FROM "{network}".edge_table
+WHERE NOT planned;''')
+        arrays = csr_graph(*(np.array(col) for col in zip(*rows)))
+        idx = np.searchsorted(arrays['nodes'], nodes)
+        np.testing.assert_array_equal(arrays['nodes'][idx], nodes)
+        return shortest_paths(graph_matrix(arrays), idx, idx)
+
+    def test_links(self):
+        """the networks are split only at their own junctions"""
+        sql = '''
+SELECT wayid, segment, fromnode, tonode, st_astext(geom),
+  linktype, maxspeed, io, round(t_kfz::numeric, 6), oneway
+FROM "{network}".links
+ORDER BY wayid, segment;'''
+        for network, multimode in self.networks.items():
+            self.assertListEqual(self.fetch(sql.format(network=multimode)),
+                                 self.fetch(sql.format(network=network)))
+
+        sql = '''
+SELECT wayid, segment, idx, nodeid
+FROM "{network}".link_points
+ORDER BY wayid, segment, idx;'''
+        for network, multimode in self.networks.items():
+            self.assertListEqual(self.fetch(sql.format(network=multimode)),
+                                 self.fetch(sql.format(network=network)))
+
+    def test_connectivity(self):
+        for network, multimode in self.networks.items():
+            np.testing.assert_array_equal(self.vertices(multimode),
+                                          self.vertices(network))
+            self.assertSetEqual(self.reached(multimode),
+                                self.reached(network))
+        # the main roads are not split at the junctions with the residential
+        # roads of the car network
+        self.assertNotIn(grid_node(2, 1), set(self.vertices('mm_main')))
+
+    def test_isolated_component(self):
+        """
+        the isolated road crossed by the footways is a single link,
+        which is not reached, as it is shorter than links_to_find
+        """
+        for network in ('car', 'mm_car'):
+            rows = self.fetch(f'SELECT fromnode, tonode FROM "{network}".links '
+                              'WHERE wayid = 300;')
+            self.assertListEqual(rows, [(17, 18)])
+            self.assertNotIn(17, self.reached(network))
+            vertices = set(self.vertices(network))
+            self.assertNotIn(22, vertices)
+            self.assertNotIn(23, vertices)
+        # the footways crossing the road are not split either
+        rows = self.fetch('SELECT wayid, fromnode, tonode FROM mm_foot.links '
+                          'ORDER BY wayid;')
+        self.assertListEqual(rows, [(400, 24, 25), (401, 26, 27)])
+
+    def test_costs(self):
+        for network, multimode in self.networks.items():
+            vertices = self.vertices(network)
+            costs = self.costs(network, vertices)
+            self.assertTrue(np.isfinite(costs).any())
+            np.testing.assert_allclose(self.costs(multimode, vertices), costs,
+                                       rtol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+from typing import List, Tuple
+from ..build_network_car import BuildNetwork
+from .testdb import (X0, Y0, add_nodes, add_way, connect_test_db,
+                     create_grid_network, delete_way, get_test_login,
+                     grid_node)
+
+
+class TestNetworkUpdate(unittest.TestCase):
+    """
+    Test that the incremental update of a network gives the same links,
+    edges and components as a full rebuild with the changed ways
+    """
+    networks = ('network_update', 'network_rebuilt')
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = connect_test_db()
+        create_grid_network(cls.conn)
+        cls.builder('network_update').build()
+
+        # a new maxspeed on row 102
+        add_way(cls.conn, 102, [grid_node(i, 2) for i in range(4)],
+                highway='residential', name='Row 2', maxspeed='20')
+        # column 200 through a new node
+        add_nodes(cls.conn, {21: (X0 - 20, Y0 + 50)})
+        add_way(cls.conn, 200, [grid_node(0, 0), 21] +
+                [grid_node(0, j) for j in range(1, 4)],
+                highway='residential', name='Column 0')
+        # the oneway column 203 is deleted
+        delete_way(cls.conn, 203)
+        # a new road ending at the grid
+        add_nodes(cls.conn, {19: (X0 + 400, Y0 + 300),
+                             20: (X0 + 500, Y0 + 300)})
+        add_way(cls.conn, 301, [grid_node(3, 3), 19, 20],
+                highway='residential')
+        cls.conn.commit()
+
+        cls.builder('network_update').update(wayids=[102, 200, 203, 301])
+        cls.builder('network_rebuilt').build()
+
+    @classmethod
+    def tearDownClass(cls):
+        cur = cls.conn.cursor()
+        for network in cls.networks:
+            cur.execute(f'DROP SCHEMA IF EXISTS "{network}" CASCADE;')
+        cls.conn.commit()
+        cls.conn.close()
+
+    @staticmethod
+    def builder(network_schema: str) -> BuildNetwork:
+        return BuildNetwork(network_schema=network_schema,
+                            db=get_test_login().db,
+                            links_to_find=3)
+
+    def fetch(self, sql: str) -> Tuple[List[tuple], List[tuple]]:
+        """return the rows of the query in the updated and rebuilt network"""
+        results = []
+        cur = self.conn.cursor()
+        for network in self.networks:
+            cur.execute(sql.format(network=network))
+            results.append([tuple(row) for row in cur.fetchall()])
+        return tuple(results)
+
+    def test_links(self):
+        updated, rebuilt = self.fetch('''
+SELECT wayid, segment, fromnode, tonode, st_astext(geom),
+  linkname, linktype, maxspeed, io, round(t_kfz::numeric, 6), oneway,
+  planned, construction, lanes, bridge_tunnel, slope
+FROM "{network}".links
+ORDER BY wayid, segment;''')
+        self.assertListEqual(updated, rebuilt)
+        wayids = {row[0] for row in updated}
+        self.assertIn(301, wayids)
+        self.assertNotIn(203, wayids)
+        # the new node splits no link, as it is no junction
+        self.assertEqual(len([row for row in updated if row[0] == 200]), 3)
+
+    def test_link_points(self):
+        updated, rebuilt = self.fetch('''
+SELECT wayid, segment, idx, nodeid
+FROM "{network}".link_points
+ORDER BY wayid, segment, idx;''')
+        self.assertListEqual(updated, rebuilt)
+
+    def test_edges(self):
+        # the ids of the edges are not the same after an update
+        updated, rebuilt = self.fetch('''
+SELECT wayid, segment, fromnode, tonode, source, target,
+  round(cost::numeric, 6), round(reverse_cost::numeric, 6), planned
+FROM "{network}".edge_table
+ORDER BY wayid, segment;''')
+        self.assertListEqual(updated, rebuilt)
+
+        updated, rebuilt = self.fetch('''
+SELECT id, cardinality(in_edges), cardinality(out_edges), x, y
+FROM "{network}".edge_table_vertices_pgr
+ORDER BY id;''')
+        self.assertListEqual(updated, rebuilt)
+
+    def test_components(self):
+        updated, rebuilt = self.fetch('''
+SELECT node, component, weak_component, reached
+FROM "{network}".nodes_reached_components
+ORDER BY node;''')
+        self.assertListEqual(updated, rebuilt)
+
+        updated, rebuilt = self.fetch('''
+SELECT wayid, segment, fromnode, tonode
+FROM "{network}".edges_reached
+ORDER BY wayid, segment;''')
+        self.assertListEqual(updated, rebuilt)
+        # the isolated road is not reached
+        self.assertNotIn(300, {row[0] for row in updated})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import re
+import unittest
+import logging
+from collections import namedtuple
+import psycopg2
+try:
+    from ..osm2polygons import CreatePolygons
+except ImportError:
+    # the extracts need gdal
+    CreatePolygons = None
+
+
+Relation = namedtuple('Relation', ['relation_id'])
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, sql, vars=None):
+        db = self.db
+        db.executed.append(' '.join(sql.split()))
+        between = re.search(r'BETWEEN (\d+) AND (\d+)', sql)
+        ids = set(range(int(between[1]), int(between[2]) + 1)
+                  if between else ()) & db.relations
+        if sql.startswith('SAVEPOINT'):
+            db.savepoint = (set(db.pending), dict(db.pending_errors))
+        elif sql.startswith('ROLLBACK TO SAVEPOINT'):
+            pending, pending_errors = db.savepoint
+            db.pending, db.pending_errors = set(pending), dict(pending_errors)
+        elif sql.startswith('RELEASE SAVEPOINT'):
+            db.savepoint = None
+        elif 'INSERT INTO "osm".polygon_errors' in sql:
+            db.pending_errors[vars['relation_id']] = vars['error']
+        elif sql.lstrip().startswith('SELECT relation_id'):
+            self.rows = [Relation(i) for i in sorted(ids)]
+        elif ids & db.failing:
+            raise psycopg2.DataError('Shell is not a line')
+        else:
+            db.pending |= ids
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeDatabase:
+    """
+    mimics the assembly of the relations in the polygon_with_holes table,
+    the relations in `failing` cannot be assembled
+    """
+    def __init__(self, relations, failing):
+        self.relations = set(relations)
+        self.failing = set(failing)
+        self.assembled = set()
+        self.errors = {}
+        self.pending = set()
+        self.pending_errors = {}
+        self.savepoint = None
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.assembled |= self.pending
+        self.errors.update(self.pending_errors)
+        self.rollback()
+
+    def rollback(self):
+        self.pending = set()
+        self.pending_errors = {}
+
+
+if CreatePolygons is not None:
+    class FakeCreatePolygons(CreatePolygons):
+        """CreatePolygons running its queries on a FakeDatabase"""
+        def __init__(self):
+            self.logger = logging.getLogger('OrcaLog')
+
+
+@unittest.skipIf(CreatePolygons is None, 'gdal is not installed')
+class TestAssembleBatch(unittest.TestCase):
+    """Test the quarantine of the relations failing in a batch"""
+
+    def test_failing_relation(self):
+        db = FakeDatabase(relations=range(1, 6), failing=[3])
+        n_errors = FakeCreatePolygons().assemble_batch('osm', 1, 5, conn=db)
+        self.assertEqual(n_errors, 1)
+        # the other relations of the batch are assembled
+        self.assertSetEqual(db.assembled, {1, 2, 4, 5})
+        self.assertListEqual(list(db.errors), [3])
+        self.assertEqual(db.errors[3], 'Shell is not a line')
+        self.assertIn('ROLLBACK TO SAVEPOINT relation;', db.executed)
+
+    def test_batch(self):
+        db = FakeDatabase(relations=range(1, 6), failing=[7])
+        n_errors = FakeCreatePolygons().assemble_batch('osm', 1, 5, conn=db)
+        self.assertEqual(n_errors, 0)
+        self.assertSetEqual(db.assembled, {1, 2, 3, 4, 5})
+        self.assertDictEqual(db.errors, {})
+        # the batch is assembled at once
+        self.assertNotIn('SAVEPOINT relation;', db.executed)
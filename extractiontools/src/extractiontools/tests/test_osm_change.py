@@ -0,0 +1,64 @@
+import os
+import gzip
+import datetime
+import tempfile
+import unittest
+from ..utils.osm_change import read_osm_change, read_state
+
+OSC = b'''<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6" generator="test">
+<modify>
+  <node id="1" version="2" timestamp="2021-05-01T10:00:00Z" uid="7"
+   user="a" changeset="3" lat="54.1" lon="9.5">
+    <tag k="highway" v="crossing"/>
+  </node>
+</modify>
+<create>
+  <way id="10" version="1" timestamp="2021-05-01T10:00:00Z" uid="7"
+   user="a" changeset="3">
+    <nd ref="1"/><nd ref="2"/>
+    <tag k="highway" v="residential"/>
+  </way>
+  <relation id="20" version="1" timestamp="2021-05-01T10:00:00Z" uid="7"
+   user="a" changeset="3">
+    <member type="way" ref="10" role="outer"/>
+  </relation>
+</create>
+<delete>
+  <node id="2" version="3" timestamp="2021-05-01T10:00:00Z" uid="7"
+   user="a" changeset="3"/>
+</delete>
+</osmChange>
+'''
+
+
+class TestOSMChange(unittest.TestCase):
+    """Test reading osmChange files"""
+
+    def test_read_osm_change(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, '456.osc.gz')
+            with gzip.open(path, 'wb') as f:
+                f.write(OSC)
+            with open(os.path.join(folder, '456.state.txt'), 'w') as f:
+                f.write('#Sat May 01 10:00:02 UTC 2021\n'
+                        'sequenceNumber=3123456\n'
+                        'timestamp=2021-05-01T10\\:00\\:00Z\n')
+            changes = list(read_osm_change(path))
+            self.assertEqual(read_state(path),
+                             (3123456, datetime.datetime(2021, 5, 1, 10)))
+
+        self.assertEqual([(a, t, o['id']) for a, t, o in changes],
+                         [('modify', 'node', 1), ('create', 'way', 10),
+                          ('create', 'relation', 20), ('delete', 'node', 2)])
+        node = changes[0][2]
+        self.assertEqual((node['lon'], node['lat']), (9.5, 54.1))
+        self.assertEqual(node['tags'], {'highway': 'crossing'})
+        self.assertEqual(node['tstamp'], datetime.datetime(2021, 5, 1, 10))
+        self.assertEqual(changes[1][2]['nodes'], [1, 2])
+        self.assertEqual(changes[2][2]['members'], [('W', 10, 'outer')])
+        self.assertIsNone(changes[3][2]['lon'])
+
+    def test_sequence_from_path(self):
+        self.assertEqual(read_state('/diffs/004/123/456.osc.gz'),
+                         (4123456, None))
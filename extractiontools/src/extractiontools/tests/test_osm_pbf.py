@@ -0,0 +1,76 @@
+import unittest
+import datetime
+import numpy as np
+from ..utils import osm_pbf
+from ..utils import copy_format as cf
+
+
+class OSMSelectionFromBatches(osm_pbf.OSMSelection):
+    """a selection reading the batches from a list instead of a file"""
+
+    def __init__(self, objects, **kwargs):
+        super().__init__('POLYGON((0 0, 0 10, 10 10, 10 0, 0 0))', **kwargs)
+        self.objects = objects
+
+    def _batches(self, filename, with_data=False):
+        meta = (1, 7, 'user', datetime.datetime(2021, 5, 1), 3, {'a': 'b'})
+        for osm_type, rows in self.objects:
+            yield osm_type, [row + meta if with_data else row
+                             for row in rows]
+
+
+class TestOSMPBF(unittest.TestCase):
+    """Test the selection of OSM objects in a polygon"""
+
+    def test_ids_in(self):
+        sorted_ids = np.array([2, 5, 9], dtype=np.int64)
+        np.testing.assert_array_equal(
+            osm_pbf.ids_in([1, 2, 9, 10], sorted_ids),
+            [False, True, True, False])
+        self.assertFalse(osm_pbf.ids_in([1], np.empty(0, np.int64)).any())
+
+    def test_any_per_group(self):
+        mask = np.array([False, True, False, False, True])
+        np.testing.assert_array_equal(
+            osm_pbf.any_per_group(mask, np.array([2, 0, 2, 1])),
+            [True, False, False, True])
+
+    def test_parent_closure(self):
+        parents = np.array([10, 11, 12])
+        children = np.array([1, 10, 5])
+        np.testing.assert_array_equal(
+            osm_pbf.parent_closure(np.array([1]), parents, children),
+            [1, 10, 11])
+
+    def test_selection(self):
+        objects = [
+            ('n', [(1, 1.0, 1.0), (2, 20.0, 20.0), (3, 2.0, 2.0),
+                   (4, 30.0, 30.0)]),
+            ('w', [(100, [1, 2]), (101, [4, 2]), (102, [3])]),
+            ('r', [(200, [('w', 101, ''), ('n', 4, '')]),
+                   (201, [('w', 100, 'outer')]),
+                   (202, [('r', 201, '')])]),
+        ]
+        selection = OSMSelectionFromBatches(objects)
+        selection.select('test.osm.pbf')
+        np.testing.assert_array_equal(selection.node_ids, [1, 2, 3])
+        np.testing.assert_array_equal(selection.way_ids, [100, 102])
+        np.testing.assert_array_equal(selection.relation_ids, [201, 202])
+
+        rows = {}
+        for table, batch in selection.rows('test.osm.pbf'):
+            rows.setdefault(table, []).extend(batch)
+        self.assertEqual([r[0] for r in rows['nodes']], [1, 2, 3])
+        ways = {r[0]: r for r in rows['ways']}
+        self.assertEqual(ways[100][6], [1, 2])
+        self.assertEqual(ways[100][8],
+                         cf.linestring_ewkb((1.0, 1.0, 20.0, 20.0), 4326))
+        self.assertEqual(ways[102][7], cf.point_ewkb(2.0, 2.0, 4326))
+        self.assertIsNone(ways[102][8])
+        self.assertEqual(rows['way_nodes'],
+                         [(100, 1, 0), (100, 2, 1), (102, 3, 0)])
+        self.assertEqual(rows['relation_members'],
+                         [(201, 100, 'W', 'outer', 0), (202, 201, 'R', '', 0)])
+        self.assertEqual(selection.users, {7: 'user'})
+        self.assertEqual(selection.max_timestamp,
+                         datetime.datetime(2021, 5, 1))
@@ -0,0 +1,93 @@
+import unittest
+from inspect import getfullargspec
+from ..utils import query_stats as qs
+
+
+class TestQueryStats(unittest.TestCase):
+    """Test the collection of query statistics"""
+
+    def test_explainable(self):
+        self.assertTrue(qs.explainable('INSERT INTO a SELECT * FROM b;'))
+        self.assertTrue(qs.explainable(
+            '-- create the links\nCREATE UNLOGGED TABLE a AS SELECT 1;'))
+        self.assertTrue(qs.explainable(
+            'CREATE MATERIALIZED VIEW v AS SELECT 1;'))
+        self.assertFalse(qs.explainable('SELECT * FROM a;'))
+        self.assertFalse(qs.explainable(
+            'INSERT INTO a (x) VALUES (1) RETURNING id;'))
+        self.assertFalse(qs.explainable('CREATE TABLE a (id int);'))
+        self.assertFalse(qs.explainable(
+            'CREATE TABLE t (id int, CHECK (CAST(id AS int) > 0));'))
+        self.assertFalse(qs.explainable(
+            'CREATE TABLE t (id int GENERATED ALWAYS AS (1) STORED);'))
+        self.assertTrue(qs.explainable(
+            'CREATE TABLE IF NOT EXISTS "osm".t (id, geom) AS\n'
+            'WITH a AS (SELECT 1, NULL) SELECT * FROM a;'))
+        self.assertFalse(qs.explainable('CREATE INDEX ON a USING gist(geom);'))
+
+    def test_rows_from_plan(self):
+        plan = {'Plan': {'Node Type': 'ModifyTable', 'Actual Rows': 0,
+                         'Plans': [{'Node Type': 'Seq Scan',
+                                    'Actual Rows': 42}]}}
+        self.assertEqual(qs.rows_from_plan(plan), 42)
+        self.assertEqual(qs.rows_from_plan(
+            {'Plan': {'Node Type': 'Seq Scan', 'Actual Rows': 3}}), 3)
+
+    def test_explained_cursor(self):
+        class Cursor:
+            rowcount = 1
+            statusmessage = 'EXPLAIN'
+
+            def __init__(self):
+                self.executed = []
+
+            def execute(self, query, vars=None):
+                self.executed.append(query)
+
+            def fetchone(self):
+                return ([{'Plan': {'Node Type': 'ModifyTable',
+                                   'Actual Rows': 0,
+                                   'Plans': [{'Node Type': 'Seq Scan',
+                                              'Actual Rows': 42}]}}], )
+
+        stats = qs.QueryStats(explain=True)
+        cur = Cursor()
+        result = stats.execute(cur, 'INSERT INTO a SELECT * FROM b;')
+        self.assertTrue(cur.executed[0].startswith('EXPLAIN (ANALYZE'))
+        # the caller gets the rowcount of the statement, not of the EXPLAIN
+        self.assertEqual(result.rowcount, 42)
+        self.assertEqual(result.statusmessage, 'INSERT 0 42')
+        self.assertIs(result.executed, cur.executed)
+        self.assertEqual(stats.records[0]['statusmessage'], 'INSERT 0 42')
+        # statements, which are not explained, return the cursor itself
+        self.assertIs(stats.execute(cur, 'SELECT 1;'), cur)
+
+    def test_statusmessage_from_plan(self):
+        self.assertEqual(qs.statusmessage_from_plan(
+            '-- update\nUPDATE a SET x = 1;', 3), 'UPDATE 3')
+        self.assertEqual(qs.statusmessage_from_plan(
+            'CREATE TABLE a AS SELECT 1;', 1), 'SELECT 1')
+
+    def test_summary(self):
+        stats = qs.QueryStats(enabled=True, top=2)
+        stats.step = 'build_network_car'
+        stats.record('SELECT 1;', 0.5, rowcount=1)
+        stats.record('SELECT 2;', 2.0, rowcount=1)
+        stats.record('UPDATE a SET x = 1;', 1.0, rowcount=100)
+        slowest = stats.slowest()
+        self.assertEqual([r['query'] for r in slowest],
+                         ['SELECT 2;', 'UPDATE a SET x = 1;'])
+        summary = stats.summary()
+        self.assertIn('3 statements in step build_network_car took 3.50s',
+                      summary)
+        self.assertIn('(100 rows): UPDATE a SET x = 1;', summary)
+        stats.flush()
+        self.assertEqual(stats.records, [])
+
+    def test_step_signature(self):
+        def step(database: str, chunksize: int = 1000):
+            pass
+        wrapped = qs.log_query_stats(step)
+        self.assertEqual(wrapped.__name__, 'step')
+        self.assertEqual(getfullargspec(wrapped).args,
+                         ['database', 'chunksize'])
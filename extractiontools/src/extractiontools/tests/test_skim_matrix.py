@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+try:
+    from .. import skim_matrix
+except ImportError:
+    # the export of the edges needs geopandas
+    skim_matrix = None
+
+
+class FakeConnection:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+@unittest.skipIf(skim_matrix is None, 'geopandas is not installed')
+class TestGraphExport(unittest.TestCase):
+    """Test that the graph is exported again when the network changed"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.skims = skim_matrix.SkimMatrix.__new__(skim_matrix.SkimMatrix)
+        self.skims.network = 'network'
+        self.skims.login = mock.Mock(db='extract')
+        self.skims.graph_subfolder = 'graph'
+        self.skims.logger = mock.Mock()
+        self.skims.folder = self.folder.name
+        self.skims.get_points = mock.Mock(side_effect=StopIteration)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write_meta(self, network_hash: str):
+        os.makedirs(self.skims.graph_folder, exist_ok=True)
+        with open(os.path.join(self.skims.graph_folder, 'meta.json'),
+                  'w') as f:
+            json.dump({'srid': 25832, 'network_hash': network_hash}, f)
+
+    def run_skims(self, network_hash: str) -> mock.Mock:
+        """run the skims up to loading the points"""
+        export = mock.Mock()
+        export.network_hash.return_value = network_hash
+        export.export.side_effect = lambda: self.write_meta(network_hash)
+        with mock.patch.object(skim_matrix, 'ExportNetworkGraph',
+                               return_value=export), \
+                mock.patch.object(skim_matrix, 'Connection',
+                                  return_value=FakeConnection()):
+            with self.assertRaises(StopIteration):
+                self.skims.run()
+        self.skims.get_points.assert_called_with(self.skims.origins, 25832)
+        return export
+
+    def test_export(self):
+        self.skims.origins = 'laea.laea_vector_1000'
+        # not exported yet
+        self.assertEqual(self.run_skims('10:1/5:2').export.call_count, 1)
+        # unchanged
+        self.assertEqual(self.run_skims('10:1/5:2').export.call_count, 0)
+        # the network changed
+        self.assertEqual(self.run_skims('11:3/5:2').export.call_count, 1)
@@ -0,0 +1,44 @@
+import unittest
+import sqlparse
+from ..utils.sql_split import split_sql
+
+
+class TestSqlSplit(unittest.TestCase):
+    """Test the splitting of sql scripts into statements"""
+
+    scripts = [
+        'SELECT 1; SELECT 2;',
+        "SELECT 'a;b', \"c;d\"; SELECT 'it''s';",
+        '-- drop it; now\nDROP TABLE a; -- trailing; comment\nSELECT 1;',
+        '/* a; /* nested; */ comment */ SELECT 1;\nSELECT 2',
+        '''
+        CREATE OR REPLACE FUNCTION f(a integer) RETURNS integer AS
+        $BODY$
+        BEGIN
+          RETURN a + 1;
+        END;
+        $BODY$ LANGUAGE plpgsql;
+        CREATE FUNCTION g() RETURNS text AS $$ SELECT 'x;y'; $$
+        LANGUAGE sql;
+        ''',
+        'PREPARE p AS SELECT $1::int; EXECUTE p(1);',
+        "SELECT E'it\\'s; x'; SELECT 2;",
+        "SELECT e'a\\\\'; SELECT 2;",
+        '\n  \n',
+    ]
+
+    def test_same_as_sqlparse(self):
+        for script in self.scripts:
+            self.assertEqual(split_sql(script), tuple(sqlparse.split(script)),
+                             script)
+
+    def test_dollar_quote(self):
+        statements = split_sql('SELECT $tag$;$$;$tag$; SELECT 2;')
+        self.assertEqual(statements, ('SELECT $tag$;$$;$tag$;', 'SELECT 2;'))
+
+    def test_escape_string(self):
+        statements = split_sql("SELECT E'it\\'s; x'; SELECT 2;")
+        self.assertEqual(statements, ("SELECT E'it\\'s; x';", 'SELECT 2;'))
+        # a backslash escapes nothing in a standard string
+        statements = split_sql("SELECT 'a\\'; SELECT 2;")
+        self.assertEqual(statements, ("SELECT 'a\\';", 'SELECT 2;'))
@@ -0,0 +1,259 @@
+"""
+the test database for the tests running their queries in PostgreSQL
+
+The tests using it are skipped, unless the environment variable TEST_DB
+names a database, whose schemas osm, meta, classifications and landuse
+may be overwritten by the tests. The login is taken from DB_HOST, DB_PORT,
+DB_USER and DB_PASS like in DBApp.set_login.
+"""
+import os
+import unittest
+from typing import Dict, List, Tuple
+
+import psycopg2
+from psycopg2.extras import NamedTupleConnection
+
+from ..connection import Login
+
+
+EXTENSIONS = ('hstore', 'postgis', 'postgis_raster', 'pgrouting')
+SRID = 25832
+# the origin of the test data
+X0, Y0 = 500000, 5800000
+
+
+def get_test_login() -> Login:
+    """
+    return the login to the test database,
+    skip the test if no test database is given
+    """
+    database = os.environ.get('TEST_DB')
+    if not database:
+        raise unittest.SkipTest('no test database given in TEST_DB')
+    return Login(host=os.environ.get('DB_HOST', 'localhost'),
+                 port=os.environ.get('DB_PORT', 5432),
+                 user=os.environ.get('DB_USER', 'postgres'),
+                 password=os.environ.get('DB_PASS', ''),
+                 db=database)
+
+
+def connect_test_db() -> NamedTupleConnection:
+    """
+    connect to the test database and create the extensions,
+    skip the test if the database or the extensions are not available
+    """
+    login = get_test_login()
+    try:
+        conn = login.connect()
+    except psycopg2.OperationalError as e:
+        raise unittest.SkipTest(f'test database {login.db} not available: '
+                                f'{str(e).strip()}')
+    cur = conn.cursor()
+    cur.execute('SELECT name FROM pg_available_extensions '
+                'WHERE name = ANY(%s);', (list(EXTENSIONS), ))
+    missing = set(EXTENSIONS) - {row.name for row in cur.fetchall()}
+    if missing:
+        conn.close()
+        raise unittest.SkipTest(f'extensions {sorted(missing)} '
+                                'are not installed')
+    try:
+        for extension in EXTENSIONS:
+            cur.execute(f'CREATE EXTENSION IF NOT EXISTS {extension} CASCADE;')
+        conn.commit()
+    except psycopg2.DatabaseError as e:
+        conn.close()
+        raise unittest.SkipTest(f'extensions could not be created: '
+                                f'{str(e).strip()}')
+    return conn
+
+
+def create_osm_schema(conn: NamedTupleConnection):
+    """
+    (re)create the osm tables, the boundary and the classifications
+    used to build the networks
+    """
+    sql = f"""
+DROP SCHEMA IF EXISTS osm CASCADE;
+DROP SCHEMA IF EXISTS meta CASCADE;
+DROP SCHEMA IF EXISTS classifications CASCADE;
+DROP SCHEMA IF EXISTS landuse CASCADE;
+CREATE SCHEMA osm;
+CREATE SCHEMA meta;
+CREATE SCHEMA classifications;
+CREATE SCHEMA landuse;
+
+CREATE TABLE osm.nodes (
+id bigint PRIMARY KEY,
+tags hstore NOT NULL DEFAULT ''::hstore,
+geom geometry(POINT, {SRID}));
+
+CREATE TABLE osm.ways (
+id bigint PRIMARY KEY,
+tags hstore NOT NULL DEFAULT ''::hstore,
+nodes bigint[],
+linestring geometry(LINESTRING, {SRID}));
+
+CREATE TABLE osm.way_nodes (
+way_id bigint,
+node_id bigint,
+sequence_id integer,
+PRIMARY KEY (way_id, sequence_id));
+
+CREATE TABLE osm.relations (
+id bigint PRIMARY KEY,
+tags hstore NOT NULL DEFAULT ''::hstore);
+
+CREATE TABLE osm.relation_members (
+relation_id bigint,
+member_id bigint,
+member_type character(1),
+member_role text,
+sequence_id integer,
+PRIMARY KEY (relation_id, sequence_id));
+
+CREATE TABLE meta.boundary (
+name text PRIMARY KEY,
+geom geometry(MULTIPOLYGON, {SRID}));
+INSERT INTO meta.boundary (name, geom)
+SELECT 'test', st_multi(st_makeenvelope({X0 - 1000}, {Y0 - 1000},
+                                        {X0 + 2000}, {Y0 + 2000}, {SRID}));
+
+CREATE TABLE classifications.linktypes (
+id integer PRIMARY KEY,
+road_category char(1));
+INSERT INTO classifications.linktypes (id, road_category)
+VALUES (3, 'B'), (5, 'C'), (8, 'E');
+
+CREATE TABLE classifications.waytype2linktype (
+linktype_id integer,
+tags hstore);
+INSERT INTO classifications.waytype2linktype (linktype_id, tags)
+VALUES (3, 'highway=>primary'), (5, 'highway=>residential'),
+       (8, 'highway=>footway');
+
+CREATE TABLE classifications.wt2lt_construction (
+linktype_id integer,
+tag1 hstore,
+tag2 hstore);
+INSERT INTO classifications.wt2lt_construction (linktype_id, tag1, tag2)
+VALUES (3, 'highway=>construction', 'construction=>primary'),
+       (5, 'highway=>construction', 'construction=>residential'),
+       (8, 'highway=>construction', 'construction=>footway');
+
+CREATE TABLE classifications.access_types (
+tags hstore,
+sperre_pkw boolean,
+oeffne_pkw boolean);
+INSERT INTO classifications.access_types (tags, sperre_pkw, oeffne_pkw)
+VALUES ('motor_vehicle=>no', TRUE, FALSE),
+       ('motor_vehicle=>yes', FALSE, TRUE);
+
+CREATE TABLE classifications.link_defaults (
+linktype_number integer,
+innerorts boolean,
+v_kfz integer,
+v_kfz_zulaessig integer);
+INSERT INTO classifications.link_defaults
+(linktype_number, innerorts, v_kfz, v_kfz_zulaessig)
+VALUES (3, FALSE, 80, 100), (3, TRUE, 45, 50),
+       (5, FALSE, 50, 100), (5, TRUE, 25, 50),
+       (8, FALSE, 5, 5), (8, TRUE, 5, 5);
+
+CREATE TABLE classifications.corine_urban (code text PRIMARY KEY);
+INSERT INTO classifications.corine_urban (code) VALUES ('111'), ('112');
+
+-- the urban area covers only the westmost column of the grid
+CREATE TABLE landuse.clc18 (
+code text,
+geom geometry(MULTIPOLYGON, {SRID}));
+INSERT INTO landuse.clc18 (code, geom)
+SELECT '112', st_multi(st_makeenvelope({X0 - 50}, {Y0 - 50},
+                                       {X0 + 50}, {Y0 + 350}, {SRID}));
+
+CREATE TABLE landuse.aster (rid serial PRIMARY KEY, rast raster);
+"""
+    cur = conn.cursor()
+    cur.execute(sql)
+    conn.commit()
+
+
+def add_nodes(conn: NamedTupleConnection,
+              nodes: Dict[int, Tuple[float, float]]):
+    """
+    add the nodes with their coordinates
+    """
+    cur = conn.cursor()
+    for node_id, (x, y) in nodes.items():
+        cur.execute(f'''
+INSERT INTO osm.nodes (id, geom)
+VALUES (%s, st_setsrid(st_makepoint(%s, %s), {SRID}));
+''', (node_id, x, y))
+
+
+def add_way(conn: NamedTupleConnection,
+            way_id: int,
+            node_ids: List[int],
+            **tags: str):
+    """
+    add the way through the nodes with the tags, replacing an existing one
+    """
+    delete_way(conn, way_id)
+    cur = conn.cursor()
+    values = {'id': way_id, 'nodes': list(node_ids),
+              'keys': list(tags), 'values': list(tags.values())}
+    cur.execute('''
+INSERT INTO osm.ways (id, tags, nodes, linestring)
+SELECT %(id)s, hstore(%(keys)s::text[], %(values)s::text[]),
+  %(nodes)s::bigint[], st_makeline(n.geom ORDER BY u.idx)
+FROM unnest(%(nodes)s::bigint[]) WITH ORDINALITY u(node_id, idx)
+JOIN osm.nodes n ON n.id = u.node_id;
+
+INSERT INTO osm.way_nodes (way_id, node_id, sequence_id)
+SELECT %(id)s, u.node_id, u.idx - 1
+FROM unnest(%(nodes)s::bigint[]) WITH ORDINALITY u(node_id, idx);
+''', values)
+
+
+def delete_way(conn: NamedTupleConnection, way_id: int):
+    """
+    delete the way and its nodes from the way_nodes
+    """
+    cur = conn.cursor()
+    cur.execute('DELETE FROM osm.way_nodes WHERE way_id = %s;', (way_id, ))
+    cur.execute('DELETE FROM osm.ways WHERE id = %s;', (way_id, ))
+
+
+def grid_node(i: int, j: int) -> int:
+    """return the id of the node in column i and row j of the grid"""
+    return 1 + i + 4 * j
+
+
+def create_grid_network(conn: NamedTupleConnection):
+    """
+    create the roads of a grid of 4 x 4 nodes with a distance of 100 m
+
+    The rows are the ways 100-103 and the columns the ways 200-203,
+    row 101 and column 201 are primary roads, the others residential roads
+    and column 203 is a oneway. Way 300 is an isolated residential road,
+    which is crossed by the footways 400 and 401.
+    """
+    create_osm_schema(conn)
+    add_nodes(conn, {grid_node(i, j): (X0 + 100 * i, Y0 + 100 * j)
+                     for i in range(4) for j in range(4)})
+    add_nodes(conn, {17: (X0 + 1000, Y0 + 1000), 22: (X0 + 1030, Y0 + 1000),
+                     23: (X0 + 1060, Y0 + 1000), 18: (X0 + 1100, Y0 + 1000),
+                     24: (X0 + 1030, Y0 + 950), 25: (X0 + 1030, Y0 + 1050),
+                     26: (X0 + 1060, Y0 + 950), 27: (X0 + 1060, Y0 + 1050)})
+    for j in range(4):
+        highway = 'primary' if j == 1 else 'residential'
+        add_way(conn, 100 + j, [grid_node(i, j) for i in range(4)],
+                highway=highway, name=f'Row {j}')
+    for i in range(4):
+        highway = 'primary' if i == 1 else 'residential'
+        tags = {'oneway': 'yes'} if i == 3 else {}
+        add_way(conn, 200 + i, [grid_node(i, j) for j in range(4)],
+                highway=highway, name=f'Column {i}', **tags)
+    add_way(conn, 300, [17, 22, 23, 18], highway='residential')
+    add_way(conn, 400, [24, 22, 25], highway='footway')
+    add_way(conn, 401, [26, 23, 27], highway='footway')
+    conn.commit()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Update the extracted OSM data of a project database with osmChange files.
+
+The changes are loaded into temporary tables and applied set-based to the
+tables of the osm schema. Only objects in the project area are added:
+nodes within the boundary or referenced by an extracted way, ways with an
+extracted node and relations with an extracted member. Objects already in
+the database are always updated or deleted.
+
+The ways, which were changed directly or by changed nodes, are marked in
+the table osm.changed_ways with the sequence number of the change, so that
+the networks can be rebuilt incrementally.
+"""
+
+import os
+from argparse import ArgumentParser
+import logging
+from typing import List
+
+from extractiontools.ausschnitt import Extract
+from extractiontools.connection import Connection
+from extractiontools.extract_cache import ExtractCache
+from extractiontools.utils.copy_format import point_ewkb
+from extractiontools.utils.osm_change import read_osm_change, read_state
+
+
+class UpdateOSM(Extract):
+    """
+    Apply osmChange files to the osm schema of a project database
+    """
+    schema = 'osm'
+    # the tables changed by the osmChange files
+    osm_tables = ('nodes', 'ways', 'way_nodes', 'relations',
+                  'relation_members')
+
+    def update(self, files: List[str]):
+        """
+        apply the osmChange files in the order of their sequence numbers,
+        files already applied are skipped
+
+        Parameters
+        ----------
+        files : list of str
+            the paths to the .osc or .osc.gz files
+        """
+        changes = sorted((read_state(path) + (path, ) for path in files),
+                         key=lambda c: c[0])
+        with Connection(login=self.login) as conn:
+            self.conn = conn
+            self.create_update_tables()
+            last_sequence = self.get_last_sequence()
+            for sequence, timestamp, path in changes:
+                if last_sequence is not None and sequence <= last_sequence:
+                    self.logger.info(f'{path} with sequence number {sequence} '
+                                     f'already applied')
+                    continue
+                self.apply_change(path, sequence, timestamp)
+                ExtractCache.record_versions(self.schema, self.conn,
+                                             tables=list(self.osm_tables))
+                self.conn.commit()
+            for table in self.osm_tables:
+                self.run_query(f'ANALYZE "{self.schema}".{table};',
+                               conn=self.conn)
+
+    def create_update_tables(self):
+        """
+        create the tables recording the applied changes and the changed ways
+        """
+        sql = f'''
+        CREATE TABLE IF NOT EXISTS meta.osm_replication (
+          sequence_number bigint PRIMARY KEY,
+          replication_timestamp timestamp without time zone,
+          filename text,
+          applied timestamp with time zone DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS "{self.schema}".changed_ways (
+          id bigint PRIMARY KEY,
+          deleted boolean NOT NULL DEFAULT false,
+          sequence_number bigint
+        );
+        '''
+        self.run_query(sql, conn=self.conn)
+
+    def get_last_sequence(self) -> int:
+        """return the sequence number of the last applied change"""
+        cur = self.conn.cursor()
+        cur.execute('SELECT max(sequence_number) FROM meta.osm_replication;')
+        return cur.fetchone()[0]
+
+    def load_change(self, path: str):
+        """
+        load the objects of the osmChange file into the temporary tables
+        osc_nodes, osc_ways and osc_relations, only the last version
+        of an object in the file is kept
+        """
+        sql = '''
+        DROP TABLE IF EXISTS osc_nodes_raw, osc_ways_raw, osc_relations_raw,
+          osc_nodes, osc_ways, osc_relations,
+          osc_ways_in_scope, osc_relations_in_scope;
+        CREATE TEMP TABLE osc_nodes_raw (
+          seq integer, action text, id bigint, version integer,
+          user_id integer, user_name text, tstamp timestamp,
+          changeset_id bigint, tags hstore, geom geometry(POINT, 4326));
+        CREATE TEMP TABLE osc_ways_raw (
+          seq integer, action text, id bigint, version integer,
+          user_id integer, user_name text, tstamp timestamp,
+          changeset_id bigint, tags hstore, nodes bigint[]);
+        CREATE TEMP TABLE osc_relations_raw (
+          seq integer, action text, id bigint, version integer,
+          user_id integer, user_name text, tstamp timestamp,
+          changeset_id bigint, tags hstore, member_ids bigint[],
+          member_types text[], member_roles text[]);
+        '''
+        self.run_query(sql, conn=self.conn, verbose=False)
+        common = ('seq', 'action', 'id', 'version', 'user_id', 'user_name',
+                  'tstamp', 'changeset_id', 'tags')
+        inserters = {
+            'node': self.bulk_inserter('osc_nodes_raw', common + ('geom', ),
+                                       binary=True),
+            'way': self.bulk_inserter('osc_ways_raw', common + ('nodes', ),
+                                      binary=True),
+            'relation': self.bulk_inserter(
+                'osc_relations_raw',
+                common + ('member_ids', 'member_types', 'member_roles'),
+                binary=True),
+        }
+        for seq, (action, osm_type, obj) in enumerate(read_osm_change(path)):
+            row = (seq, action, obj['id'], obj['version'], obj['user_id'],
+                   obj['user'], obj['tstamp'], obj['changeset_id'],
+                   obj['tags'])
+            if osm_type == 'node':
+                geom = (point_ewkb(obj['lon'], obj['lat'], 4326)
+                        if obj['lon'] is not None else None)
+                row += (geom, )
+            elif osm_type == 'way':
+                row += (obj['nodes'], )
+            else:
+                members = obj['members']
+                row += ([m[1] for m in members], [m[0] for m in members],
+                        [m[2] for m in members])
+            inserters[osm_type].add(row)
+        for inserter in inserters.values():
+            inserter.close()
+
+        sql = '''
+        CREATE TEMP TABLE osc_nodes AS
+        SELECT DISTINCT ON (id) * FROM osc_nodes_raw ORDER BY id, seq DESC;
+        CREATE TEMP TABLE osc_ways AS
+        SELECT DISTINCT ON (id) * FROM osc_ways_raw ORDER BY id, seq DESC;
+        CREATE TEMP TABLE osc_relations AS
+        SELECT DISTINCT ON (id) * FROM osc_relations_raw
+        ORDER BY id, seq DESC;
+        ALTER TABLE osc_nodes ADD PRIMARY KEY (id);
+        ALTER TABLE osc_ways ADD PRIMARY KEY (id);
+        ALTER TABLE osc_relations ADD PRIMARY KEY (id);
+        ANALYZE osc_nodes;
+        ANALYZE osc_ways;
+        ANALYZE osc_relations;
+        '''
+        self.run_query(sql, conn=self.conn, verbose=False)
+
+    def apply_change(self, path: str, sequence: int, timestamp=None):
+        """
+        apply the osmChange file with the sequence number
+        """
+        self.logger.info(f'Applying {path} (sequence number {sequence})')
+        self.load_change(path)
+        schema = self.schema
+        boundary = f'''
+        (SELECT b.geom FROM meta.boundary b
+         WHERE b.name = '{self.boundary_name}')'''
+        mark_ways = '''
+        ON CONFLICT (id) DO UPDATE
+        SET deleted = EXCLUDED.deleted,
+        sequence_number = EXCLUDED.sequence_number;
+        '''
+
+        sql = f'''
+        -- mark the ways of changed and deleted nodes
+        INSERT INTO "{schema}".changed_ways (id, deleted, sequence_number)
+        SELECT DISTINCT wn.way_id, false, {sequence}
+        FROM "{schema}".way_nodes wn, osc_nodes c
+        WHERE wn.node_id = c.id
+        {mark_ways}
+
+        -- delete ways, relations and nodes
+        WITH deleted AS (
+          DELETE FROM "{schema}".ways w USING osc_ways c
+          WHERE c.action = 'delete' AND w.id = c.id
+          RETURNING w.id)
+        INSERT INTO "{schema}".changed_ways (id, deleted, sequence_number)
+        SELECT id, true, {sequence} FROM deleted
+        {mark_ways}
+
+        DELETE FROM "{schema}".way_nodes wn USING osc_ways c
+        WHERE c.action = 'delete' AND wn.way_id = c.id;
+
+        DELETE FROM "{schema}".relations r USING osc_relations c
+        WHERE c.action = 'delete' AND r.id = c.id;
+
+        DELETE FROM "{schema}".relation_members rm USING osc_relations c
+        WHERE c.action = 'delete' AND rm.relation_id = c.id;
+
+        DELETE FROM "{schema}".nodes n USING osc_nodes c
+        WHERE c.action = 'delete' AND n.id = c.id;
+
+        -- update the extracted nodes and add the new nodes in the area
+        -- or of extracted ways
+        INSERT INTO "{schema}".nodes
+        (id, version, user_id, tstamp, changeset_id, tags, geom)
+        SELECT c.id, c.version, c.user_id, c.tstamp, c.changeset_id, c.tags,
+          st_transform(c.geom, {self.target_srid})
+        FROM osc_nodes c
+        WHERE c.action <> 'delete'
+        AND (EXISTS (SELECT 1 FROM "{schema}".nodes n WHERE n.id = c.id)
+          OR EXISTS (SELECT 1 FROM "{schema}".way_nodes wn
+                     WHERE wn.node_id = c.id)
+          OR st_intersects(st_transform(c.geom, {self.target_srid}),
+                           {boundary}))
+        ON CONFLICT (id) DO UPDATE
+        SET version = EXCLUDED.version, user_id = EXCLUDED.user_id,
+        tstamp = EXCLUDED.tstamp, changeset_id = EXCLUDED.changeset_id,
+        tags = EXCLUDED.tags, geom = EXCLUDED.geom;
+
+        -- the extracted ways and the new ways with an extracted node
+        CREATE TEMP TABLE osc_ways_in_scope AS
+        SELECT c.*
+        FROM osc_ways c
+        WHERE c.action <> 'delete'
+        AND (EXISTS (SELECT 1 FROM "{schema}".ways w WHERE w.id = c.id)
+          OR EXISTS (SELECT 1 FROM "{schema}".nodes n
+                     WHERE n.id = ANY(c.nodes)));
+
+        DELETE FROM "{schema}".way_nodes wn USING osc_ways_in_scope c
+        WHERE wn.way_id = c.id;
+
+        INSERT INTO "{schema}".way_nodes (way_id, node_id, sequence_id)
+        SELECT c.id, u.node_id, u.ord - 1
+        FROM osc_ways_in_scope c,
+        unnest(c.nodes) WITH ORDINALITY AS u(node_id, ord);
+
+        INSERT INTO "{schema}".ways
+        (id, version, user_id, tstamp, changeset_id, tags, nodes)
+        SELECT c.id, c.version, c.user_id, c.tstamp, c.changeset_id, c.tags,
+          c.nodes
+        FROM osc_ways_in_scope c
+        ON CONFLICT (id) DO UPDATE
+        SET version = EXCLUDED.version, user_id = EXCLUDED.user_id,
+        tstamp = EXCLUDED.tstamp, changeset_id = EXCLUDED.changeset_id,
+        tags = EXCLUDED.tags, nodes = EXCLUDED.nodes;
+
+        INSERT INTO "{schema}".changed_ways (id, deleted, sequence_number)
+        SELECT c.id, false, {sequence} FROM osc_ways_in_scope c
+        {mark_ways}
+
+        -- add the changed nodes outside the area of new ways
+        INSERT INTO "{schema}".nodes
+        (id, version, user_id, tstamp, changeset_id, tags, geom)
+        SELECT c.id, c.version, c.user_id, c.tstamp, c.changeset_id, c.tags,
+          st_transform(c.geom, {self.target_srid})
+        FROM osc_nodes c
+        WHERE c.action <> 'delete'
+        AND EXISTS (SELECT 1 FROM osc_ways_in_scope w
+                    WHERE c.id = ANY(w.nodes))
+        ON CONFLICT (id) DO NOTHING;
+
+        -- rebuild the geometries of the changed ways
+        UPDATE "{schema}".ways w
+        SET linestring = g.linestring,
+        bbox = st_transform(
+          st_setsrid(Box2D(st_transform(g.linestring, 4326)), 4326),
+          {self.target_srid})
+        FROM (
+          SELECT wn.way_id,
+          CASE WHEN count(n.id) > 1
+          THEN st_makeline(n.geom ORDER BY wn.sequence_id) END AS linestring
+          FROM "{schema}".changed_ways cw
+          JOIN "{schema}".way_nodes wn ON wn.way_id = cw.id
+          JOIN "{schema}".nodes n ON n.id = wn.node_id
+          WHERE cw.sequence_number = {sequence}
+          AND NOT cw.deleted
+          GROUP BY wn.way_id
+        ) g
+        WHERE w.id = g.way_id;
+
+        -- the extracted relations and the new relations with an extracted
+        -- member
+        CREATE TEMP TABLE osc_relations_in_scope AS
+        SELECT c.*
+        FROM osc_relations c
+        WHERE c.action <> 'delete'
+        AND (EXISTS (SELECT 1 FROM "{schema}".relations r WHERE r.id = c.id)
+          OR EXISTS (
+            SELECT 1
+            FROM unnest(c.member_ids, c.member_types) AS m(id, member_type)
+            WHERE (m.member_type = 'N' AND EXISTS (
+                     SELECT 1 FROM "{schema}".nodes n WHERE n.id = m.id))
+            OR (m.member_type = 'W' AND EXISTS (
+                  SELECT 1 FROM "{schema}".ways w WHERE w.id = m.id))
+            OR (m.member_type = 'R' AND EXISTS (
+                  SELECT 1 FROM "{schema}".relations r WHERE r.id = m.id))));
+
+        DELETE FROM "{schema}".relation_members rm
+        USING osc_relations_in_scope c
+        WHERE rm.relation_id = c.id;
+
+        INSERT INTO "{schema}".relation_members
+        (relation_id, member_id, member_type, member_role, sequence_id)
+        SELECT c.id, m.member_id, m.member_type, m.member_role, m.ord - 1
+        FROM osc_relations_in_scope c,
+        unnest(c.member_ids, c.member_types, c.member_roles)
+        WITH ORDINALITY AS m(member_id, member_type, member_role, ord);
+
+        INSERT INTO "{schema}".relations
+        (id, version, user_id, tstamp, changeset_id, tags)
+        SELECT c.id, c.version, c.user_id, c.tstamp, c.changeset_id, c.tags
+        FROM osc_relations_in_scope c
+        ON CONFLICT (id) DO UPDATE
+        SET version = EXCLUDED.version, user_id = EXCLUDED.user_id,
+        tstamp = EXCLUDED.tstamp, changeset_id = EXCLUDED.changeset_id,
+        tags = EXCLUDED.tags;
+
+        -- add the new users
+        INSERT INTO "{schema}".users (id, name)
+        SELECT DISTINCT ON (u.user_id) u.user_id, u.user_name
+        FROM (
+          SELECT c.user_id, c.user_name FROM osc_nodes c
+          JOIN "{schema}".nodes n ON n.id = c.id
+          UNION ALL
+          SELECT c.user_id, c.user_name FROM osc_ways_in_scope c
+          UNION ALL
+          SELECT c.user_id, c.user_name FROM osc_relations_in_scope c
+        ) u
+        ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name;
+        '''
+        self.run_query(sql, conn=self.conn)
+
+        cur = self.conn.cursor()
+        cur.execute(f'''
+        SELECT count(*) FROM "{schema}".changed_ways
+        WHERE sequence_number = %s;
+        ''', (sequence, ))
+        n_ways = cur.fetchone()[0]
+        cur.execute(f'''
+        SELECT count(*) FROM osc_ways_in_scope c
+        WHERE EXISTS (SELECT 1 FROM unnest(c.nodes) u(node_id)
+                      WHERE NOT EXISTS (SELECT 1 FROM "{schema}".nodes n
+                                        WHERE n.id = u.node_id));
+        ''')
+        n_incomplete = cur.fetchone()[0]
+        if n_incomplete:
+            self.logger.warning(f'{n_incomplete} changed ways reference '
+                                'nodes, which are neither extracted nor '
+                                'part of the change')
+        cur.execute('''
+        INSERT INTO meta.osm_replication
+        (sequence_number, replication_timestamp, filename)
+        VALUES (%s, %s, %s);
+        ''', (sequence, timestamp, os.path.basename(path)))
+        self.logger.info(f'{n_ways} ways changed by sequence {sequence}')
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description="Update the OSM data with "
+                            "osmChange files")
+
+    parser.add_argument("-n", '--name', action="store",
+                        help="Name of destination database",
+                        dest="destination_db", default='extract')
+    parser.add_argument('files', nargs='+',
+                        help="the .osc or .osc.gz files")
+
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    update = UpdateOSM(destination_db=options.destination_db)
+    update.update(options.files)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Encode rows for `COPY ... FROM STDIN` in the text or the binary format
+of PostgreSQL.
+
+The encoders are chosen by the name of the column type in pg_type.
+Geometries are expected as WKB, EWKB (bytes or hex-string) or as objects
+providing WKB (shapely geometries with `wkb`, ogr geometries with
+`ExportToWkb`).
+"""
+
+import datetime
+import json
+import struct
+from typing import Callable, Dict, List, Sequence
+
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+BINARY_TRAILER = struct.pack('!h', -1)
+TEXT_NULL = '\\N'
+
+_TEXT_ESCAPES = str.maketrans({'\\': '\\\\',
+                               '\t': '\\t',
+                               '\n': '\\n',
+                               '\r': '\\r', })
+
+# EWKB flags in the geometry type
+_WKB_Z = 0x80000000
+_WKB_M = 0x40000000
+_WKB_SRID = 0x20000000
+
+_PG_EPOCH = datetime.datetime(2000, 1, 1)
+_PG_EPOCH_TZ = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+_PG_EPOCH_DATE = _PG_EPOCH.date()
+
+GEOMETRY_TYPES = ('geometry', 'geography')
+
+
+def to_wkb(geom) -> bytes:
+    """return the WKB or EWKB of a geometry as bytes"""
+    if isinstance(geom, (bytes, bytearray, memoryview)):
+        return bytes(geom)
+    if isinstance(geom, str):
+        return bytes.fromhex(geom)
+    if hasattr(geom, 'ExportToWkb'):
+        return bytes(geom.ExportToWkb())
+    if hasattr(geom, 'wkb'):
+        return bytes(geom.wkb)
+    raise TypeError(f'{type(geom)} can not be converted to WKB')
+
+
+def to_ewkb(geom, srid: int) -> bytes:
+    """
+    return the EWKB of the geometry with the given srid,
+    ISO-WKB with Z/M-dimensions is converted to EWKB,
+    geometries which have already a srid are returned unchanged
+    """
+    wkb = to_wkb(geom)
+    fmt = '<I' if wkb[0] == 1 else '>I'
+    geomtype = struct.unpack(fmt, wkb[1:5])[0]
+    if geomtype & _WKB_SRID:
+        return wkb
+    flags = geomtype & (_WKB_Z | _WKB_M)
+    iso_dims, base = divmod(geomtype & 0x0fffffff, 1000)
+    if iso_dims in (1, 3):
+        flags |= _WKB_Z
+    if iso_dims in (2, 3):
+        flags |= _WKB_M
+    return (wkb[:1]
+            + struct.pack(fmt, base | flags | _WKB_SRID)
+            + struct.pack(fmt, srid)
+            + wkb[5:])
+
+
+def point_ewkb(x: float, y: float, srid: int) -> bytes:
+    """return the EWKB of a point"""
+    return struct.pack('<BIidd', 1, 1 | _WKB_SRID, srid, x, y)
+
+
+def linestring_ewkb(coords: Sequence[float], srid: int) -> bytes:
+    """
+    return the EWKB of a linestring,
+    the coordinates are given as flat sequence x1, y1, x2, y2, ...
+    (e.g. a float64-array)
+    """
+    if hasattr(coords, 'astype'):
+        data = coords.astype('<f8').tobytes()
+    else:
+        data = struct.pack(f'<{len(coords)}d', *coords)
+    return struct.pack('<BIiI', 1, 2 | _WKB_SRID, srid,
+                       len(data) // 16) + data
+
+
+def box_ewkb(xmin: float, ymin: float, xmax: float, ymax: float,
+             srid: int) -> bytes:
+    """
+    return the EWKB of a box like the geometry of a Box2D in PostGIS,
+    a polygon or a point or linestring, if the box is degenerated
+    """
+    if xmin == xmax and ymin == ymax:
+        return point_ewkb(xmin, ymin, srid)
+    if xmin == xmax or ymin == ymax:
+        return linestring_ewkb((xmin, ymin, xmax, ymax), srid)
+    return struct.pack('<BIiII10d', 1, 3 | _WKB_SRID, srid, 1, 5,
+                       xmin, ymin, xmin, ymax, xmax, ymax,
+                       xmax, ymin, xmin, ymin)
+
+
+# text format
+
+def _text_str(value) -> str:
+    return str(value).translate(_TEXT_ESCAPES)
+
+
+def _text_bool(value) -> str:
+    if isinstance(value, str):
+        return value
+    return 't' if value else 'f'
+
+
+def _text_bytea(value) -> str:
+    # the backslash of the bytea hex format has to be escaped
+    return '\\\\x' + bytes(value).hex()
+
+
+def _text_datetime(value) -> str:
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return _text_str(value)
+
+
+def _text_json(value) -> str:
+    if not isinstance(value, str):
+        value = json.dumps(value)
+    return _text_str(value)
+
+
+def _hstore_quote(value) -> str:
+    if value is None:
+        return 'NULL'
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{value}"'
+
+
+def _text_hstore(value) -> str:
+    if isinstance(value, str):
+        return _text_str(value)
+    literal = ','.join(f'{_hstore_quote(k)}=>{_hstore_quote(v)}'
+                       for k, v in value.items())
+    return _text_str(literal)
+
+
+def _array_quote(value) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return str(value)
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{value}"'
+
+
+def _text_array(value) -> str:
+    if isinstance(value, str):
+        return _text_str(value)
+    literal = '{' + ','.join(_array_quote(v) for v in value) + '}'
+    return _text_str(literal)
+
+
+def _text_geometry(value) -> str:
+    if isinstance(value, str):
+        return value
+    return to_wkb(value).hex()
+
+
+_TEXT_ENCODERS: Dict[str, Callable] = {
+    'bool': _text_bool,
+    'bytea': _text_bytea,
+    'date': _text_datetime,
+    'time': _text_datetime,
+    'timestamp': _text_datetime,
+    'timestamptz': _text_datetime,
+    'json': _text_json,
+    'jsonb': _text_json,
+    'hstore': _text_hstore,
+    'geometry': _text_geometry,
+    'geography': _text_geometry,
+}
+
+
+def text_encoder(typname: str) -> Callable:
+    """return the text encoder for the type"""
+    if typname.startswith('_'):
+        return _text_array
+    return _TEXT_ENCODERS.get(typname, _text_str)
+
+
+def text_row(row: Sequence, encoders: List[Callable]) -> str:
+    """encode a row as a line of the text format"""
+    return '\t'.join(TEXT_NULL if v is None else enc(v)
+                     for v, enc in zip(row, encoders)) + '\n'
+
+
+# binary format
+
+def _bin_struct(fmt: str) -> Callable:
+    packer = struct.Struct(fmt).pack
+    return lambda value: packer(value)
+
+
+def _bin_text(value) -> bytes:
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return str(value).encode('utf-8')
+
+
+def _bin_jsonb(value) -> bytes:
+    return b'\x01' + _bin_text(value)
+
+
+def _bin_bytea(value) -> bytes:
+    return bytes(value)
+
+
+def _bin_date(value) -> bytes:
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value)
+    return struct.pack('!i', (value - _PG_EPOCH_DATE).days)
+
+
+def _bin_timestamp(value) -> bytes:
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    delta = value.replace(tzinfo=None) - _PG_EPOCH
+    return struct.pack('!q', _microseconds(delta))
+
+
+def _bin_timestamptz(value) -> bytes:
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return struct.pack('!q', _microseconds(value - _PG_EPOCH_TZ))
+
+
+def _microseconds(delta: datetime.timedelta) -> int:
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _bin_geometry(value) -> bytes:
+    return to_wkb(value)
+
+
+def _bin_hstore(value) -> bytes:
+    parts = [struct.pack('!i', len(value))]
+    for k, v in value.items():
+        key = str(k).encode('utf-8')
+        parts.append(struct.pack('!i', len(key)))
+        parts.append(key)
+        if v is None:
+            parts.append(struct.pack('!i', -1))
+        else:
+            val = str(v).encode('utf-8')
+            parts.append(struct.pack('!i', len(val)))
+            parts.append(val)
+    return b''.join(parts)
+
+
+_BINARY_ENCODERS: Dict[str, Callable] = {
+    'bool': lambda value: b'\x01' if value else b'\x00',
+    'int2': _bin_struct('!h'),
+    'int4': _bin_struct('!i'),
+    'int8': _bin_struct('!q'),
+    'float4': _bin_struct('!f'),
+    'float8': _bin_struct('!d'),
+    'oid': _bin_struct('!I'),
+    'text': _bin_text,
+    'varchar': _bin_text,
+    'bpchar': _bin_text,
+    'name': _bin_text,
+    'char': _bin_text,
+    'json': _bin_text,
+    'jsonb': _bin_jsonb,
+    'bytea': _bin_bytea,
+    'date': _bin_date,
+    'timestamp': _bin_timestamp,
+    'timestamptz': _bin_timestamptz,
+    'hstore': _bin_hstore,
+    'geometry': _bin_geometry,
+    'geography': _bin_geometry,
+}
+
+
+def _binary_array_encoder(element_typname: str, element_oid: int) -> Callable:
+    element_encoder = binary_encoder(element_typname)
+
+    def encode(values) -> bytes:
+        has_null = any(v is None for v in values)
+        parts = [struct.pack('!iiIii', 1, int(has_null), element_oid,
+                             len(values), 1)]
+        for v in values:
+            if v is None:
+                parts.append(struct.pack('!i', -1))
+            else:
+                data = element_encoder(v)
+                parts.append(struct.pack('!i', len(data)))
+                parts.append(data)
+        return b''.join(parts)
+    return encode
+
+
+def binary_encoder(typname: str,
+                   element_typname: str = None,
+                   element_oid: int = None) -> Callable:
+    """
+    return the binary encoder for the type,
+    for arrays the element type and its oid are required
+    """
+    if typname.startswith('_'):
+        return _binary_array_encoder(element_typname or typname[1:],
+                                     element_oid)
+    try:
+        return _BINARY_ENCODERS[typname]
+    except KeyError:
+        raise ValueError(f'binary COPY of type {typname} is not supported, '
+                         'use the text format instead')
+
+
+def binary_row(row: Sequence, encoders: List[Callable]) -> bytes:
+    """encode a row as a tuple of the binary format"""
+    parts = [struct.pack('!h', len(row))]
+    for v, enc in zip(row, encoders):
+        if v is None:
+            parts.append(struct.pack('!i', -1))
+        else:
+            data = enc(v)
+            parts.append(struct.pack('!i', len(data)))
+            parts.append(data)
+    return b''.join(parts)
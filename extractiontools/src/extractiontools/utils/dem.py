@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+A digital elevation model held as a (memory-mapped) numpy array.
+
+The tiles of a raster table are put together into one array, which is
+written tile by tile into a .npy file and mapped into memory. The heights are sampled with
+bilinear interpolation between the centres of the cells.
+"""
+
+import json
+import struct
+from typing import Iterable, Sequence, Tuple
+
+import numpy as np
+
+
+class DEM:
+    """
+    elevation model on a regular grid without rotation
+
+    Attributes
+    ----------
+    values : array of float (rows, cols)
+        the heights, NaN where there is no data
+    x0, y0 : float
+        the coordinates of the upper left corner of the grid
+    dx, dy : float
+        the size of the cells, dy is negative for north-up rasters
+    """
+
+    def __init__(self, values: np.ndarray,
+                 x0: float, y0: float, dx: float, dy: float):
+        self.values = values
+        self.x0 = x0
+        self.y0 = y0
+        self.dx = dx
+        self.dy = dy
+
+    @staticmethod
+    def tile_grid(headers: Iterable[Tuple]
+                  ) -> Tuple[float, float, float, float, int, int]:
+        """
+        return the grid covering the tiles
+
+        Parameters
+        ----------
+        headers : iterable of tuples
+            upperleftx, upperlefty, scalex, scaley, skewx, skewy, width and
+            height of each tile, all on the same grid
+
+        Returns
+        -------
+        x0, y0, dx, dy, n_rows, n_cols
+        """
+        headers = list(headers)
+        if not headers:
+            raise ValueError('no raster tiles given')
+        dx, dy = headers[0][2], headers[0][3]
+        for header in headers:
+            if header[4] or header[5]:
+                raise ValueError('rotated rasters are not supported')
+            if not (np.isclose(header[2], dx) and np.isclose(header[3], dy)):
+                raise ValueError('the tiles have different cell sizes')
+        x0 = (min(h[0] for h in headers) if dx > 0
+              else max(h[0] for h in headers))
+        y0 = (max(h[1] for h in headers) if dy < 0
+              else min(h[1] for h in headers))
+        n_rows = n_cols = 0
+        for ulx, uly, _, _, _, _, width, height in headers:
+            col = int(round((ulx - x0) / dx))
+            row = int(round((uly - y0) / dy))
+            n_rows = max(n_rows, row + height)
+            n_cols = max(n_cols, col + width)
+        return x0, y0, dx, dy, n_rows, n_cols
+
+    @classmethod
+    def from_tiles(cls,
+                   tiles: Iterable[Tuple],
+                   path: str = None,
+                   headers: Iterable[Tuple] = None) -> 'DEM':
+        """
+        put the tiles of a raster together
+
+        Parameters
+        ----------
+        tiles : iterable of tuples
+            upperleftx, upperlefty, scalex, scaley, skewx, skewy, nodata and
+            the values (rows, cols) of each tile, all on the same grid
+        path : str, optional
+            if given, the mosaic is written tile by tile into the
+            memory-mapped file {path}.npy and the grid is saved to
+            {path}.json instead of building the mosaic in memory
+        headers : iterable of tuples, optional
+            the headers of the tiles (see tile_grid), if given the tiles are
+            placed one by one as they come, otherwise they are read
+            completely to determine the grid
+
+        Returns
+        -------
+        DEM
+        """
+        if headers is None:
+            tiles = list(tiles)
+            headers = [tuple(tile[:6]) + np.shape(tile[7])[::-1]
+                       for tile in tiles]
+        x0, y0, dx, dy, n_rows, n_cols = cls.tile_grid(headers)
+        if path:
+            mosaic = np.lib.format.open_memmap(f'{path}.npy', mode='w+',
+                                               dtype=np.float64,
+                                               shape=(n_rows, n_cols))
+            mosaic[:] = np.nan
+        else:
+            mosaic = np.full((n_rows, n_cols), np.nan)
+        for ulx, uly, _, _, _, _, nodata, values in tiles:
+            values = np.asarray(values, dtype=np.float64)
+            if nodata is not None:
+                values[values == nodata] = np.nan
+            col = int(round((ulx - x0) / dx))
+            row = int(round((uly - y0) / dy))
+            window = mosaic[row:row + values.shape[0],
+                            col:col + values.shape[1]]
+            # overlapping tiles do not overwrite data with nodata
+            np.copyto(window, values, where=~np.isnan(values))
+        elevation = cls(mosaic, x0, y0, dx, dy)
+        if path:
+            mosaic.flush()
+            elevation.save_grid(path)
+        return elevation
+
+    def save(self, path: str):
+        """
+        save the values to {path}.npy and the grid to {path}.json
+        """
+        np.save(f'{path}.npy', self.values)
+        self.save_grid(path)
+
+    def save_grid(self, path: str):
+        """
+        save the grid to {path}.json
+        """
+        with open(f'{path}.json', 'w') as f:
+            json.dump({'x0': self.x0, 'y0': self.y0,
+                       'dx': self.dx, 'dy': self.dy}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'DEM':
+        """
+        load the DEM saved to path, memory-mapped if mmap is True
+        """
+        values = np.load(f'{path}.npy', mmap_mode='r' if mmap else None)
+        with open(f'{path}.json') as f:
+            grid = json.load(f)
+        return cls(values, **grid)
+
+    def sample(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        return the heights at the points interpolated bilinearly between
+        the centres of the four surrounding cells, cells without data are
+        left out, NaN outside of the grid
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        n_rows, n_cols = self.values.shape
+        # position relative to the cell centres
+        fx = (x - self.x0) / self.dx - 0.5
+        fy = (y - self.y0) / self.dy - 0.5
+        inside = ((fx >= -0.5) & (fx <= n_cols - 0.5)
+                  & (fy >= -0.5) & (fy <= n_rows - 0.5))
+        c0 = np.floor(fx).astype(np.int64)
+        r0 = np.floor(fy).astype(np.int64)
+        wx = fx - c0
+        wy = fy - r0
+        total = np.zeros(x.shape)
+        weights = np.zeros(x.shape)
+        for dr, dc, w in ((0, 0, (1 - wy) * (1 - wx)),
+                          (0, 1, (1 - wy) * wx),
+                          (1, 0, wy * (1 - wx)),
+                          (1, 1, wy * wx)):
+            r = np.clip(r0 + dr, 0, n_rows - 1)
+            c = np.clip(c0 + dc, 0, n_cols - 1)
+            v = self.values[r, c]
+            valid = ~np.isnan(v) & (w > 0)
+            total += np.where(valid, v * w, 0)
+            weights += np.where(valid, w, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = total / weights
+        # no data in the surrounding cells
+        z[weights == 0] = np.nan
+        z[~inside] = np.nan
+        return z
+
+
+def linestring_coords(wkb: bytes) -> np.ndarray:
+    """
+    return the coordinates (n, 2) of a 2D WKB linestring
+    """
+    wkb = bytes(wkb)
+    order = '<' if wkb[0] == 1 else '>'
+    n_points = struct.unpack(f'{order}I', wkb[5:9])[0]
+    return np.frombuffer(wkb, dtype=f'{order}f8', count=2 * n_points,
+                         offset=9).reshape(n_points, 2)
+
+
+def slope_statistics(z: np.ndarray,
+                     distances: np.ndarray,
+                     offsets: Sequence[int]) -> np.ndarray:
+    """
+    return the slope statistics of the lines
+
+    Parameters
+    ----------
+    z : array of float
+        the heights of the vertices of all lines
+    distances : array of float
+        the length of the segment ending at each vertex,
+        the value of the first vertex of a line is ignored
+    offsets : array of int
+        the index of the first vertex of each line and the number of
+        vertices at the end
+
+    Returns
+    -------
+    array (n_lines, 4) : the slope between the ends, the ascent and the
+    descent (both positive) in metres and the maximum absolute slope of
+    the segments, NaN if a height is missing
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts = offsets[:-1]
+    ends = offsets[1:] - 1
+    n_lines = len(starts)
+    result = np.full((n_lines, 4), np.nan)
+    if not n_lines:
+        return result
+    dz = np.diff(z, prepend=np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        segment_slope = np.abs(dz / distances)
+    # the first vertex of a line has no preceding segment of that line
+    first = np.zeros(len(z), dtype=bool)
+    first[starts] = True
+    dz[first] = 0
+    segment_slope[first | (distances <= 0)] = 0
+    line = np.repeat(np.arange(n_lines), np.diff(offsets))
+    length = np.bincount(line, weights=np.where(first, 0, distances),
+                         minlength=n_lines)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result[:, 0] = np.where(length > 0,
+                                (z[ends] - z[starts]) / length, 0)
+    result[:, 1] = np.bincount(line, weights=np.clip(dz, 0, None),
+                               minlength=n_lines)
+    result[:, 2] = -np.bincount(line, weights=np.clip(dz, None, 0),
+                                minlength=n_lines)
+    has_nan = np.bincount(line, weights=np.isnan(segment_slope),
+                          minlength=n_lines) > 0
+    max_slope = np.zeros(n_lines)
+    np.maximum.at(max_slope, line, np.nan_to_num(segment_slope))
+    result[:, 3] = max_slope
+    result[has_nan, 1:] = np.nan
+    result[np.isnan(z[starts]) | np.isnan(z[ends]), 0] = np.nan
+    return result
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Write layers with the GDAL python bindings in-process.
+
+The rows are read once in batches from a server-side cursor, the geometry
+as WKB in the first column followed by the attributes, and written as
+features to a GDAL vector format. The attributes are selected with types
+that map directly to OGR field types, all others are exported as text.
+"""
+
+import os
+from typing import Iterable, List, Sequence, Tuple
+
+from extractiontools.utils.progress import Progress
+
+
+# formats with one layer per file, the layers are written to one file each
+SINGLE_LAYER_FORMATS = ('FlatGeobuf', 'Parquet')
+
+# OGR field type and subtype per PostgreSQL type
+FIELD_TYPES = {
+    'bool': ('OFTInteger', 'OFSTBoolean'),
+    'int2': ('OFTInteger', 'OFSTInt16'),
+    'int4': ('OFTInteger', None),
+    'int8': ('OFTInteger64', None),
+    'float4': ('OFTReal', 'OFSTFloat32'),
+    'float8': ('OFTReal', None),
+    'numeric': ('OFTReal', None),
+    'date': ('OFTDate', None),
+    'time': ('OFTTime', None),
+    'timestamp': ('OFTDateTime', None),
+    'timestamptz': ('OFTDateTime', None),
+}
+
+# the casts of the PostgreSQL types, whose values OGR does not take as such
+CASTS = {
+    'numeric': 'float8',
+    'date': 'text',
+    'time': 'text',
+    'timestamp': 'text',
+    'timestamptz': 'text',
+}
+
+NATIVE_TYPES = ('bool', 'int2', 'int4', 'int8', 'float4', 'float8',
+                'text', 'varchar', 'bpchar', 'char', 'name')
+
+GEOMETRY_TYPES = {
+    'POINT': 'wkbPoint',
+    'LINESTRING': 'wkbLineString',
+    'POLYGON': 'wkbPolygon',
+    'MULTIPOINT': 'wkbMultiPoint',
+    'MULTILINESTRING': 'wkbMultiLineString',
+    'MULTIPOLYGON': 'wkbMultiPolygon',
+    'GEOMETRYCOLLECTION': 'wkbGeometryCollection',
+}
+
+
+def field_type(typname: str) -> Tuple[str, str]:
+    """
+    return the names of the OGR field type and subtype (or None)
+    of a PostgreSQL type, text for all types not mapped
+    """
+    return FIELD_TYPES.get(typname, ('OFTString', None))
+
+
+def select_expression(column: str, typname: str) -> str:
+    """
+    return the expression selecting the column with a type,
+    whose values can be set as OGR fields
+    """
+    if typname in CASTS:
+        return f'"{column}"::{CASTS[typname]} AS "{column}"'
+    if typname in NATIVE_TYPES:
+        return f'"{column}"'
+    return f'"{column}"::text AS "{column}"'
+
+
+def geometry_type(name: str) -> str:
+    """
+    return the name of the OGR geometry type for the type of a
+    PostGIS geometry column, wkbUnknown for generic geometries
+    """
+    if not name:
+        return 'wkbUnknown'
+    return GEOMETRY_TYPES.get(name.upper(), 'wkbUnknown')
+
+
+def write_layer(path: str,
+                gdal_format: str,
+                layer: str,
+                fields: Sequence[Tuple[str, str]],
+                batches: Iterable[List[tuple]],
+                srid: int,
+                geometry: str = None,
+                layer_options: List[str] = None,
+                progress: Progress = None) -> int:
+    """
+    write the rows to the layer of the file, an existing layer with the
+    same name is replaced like with ogr2ogr -overwrite
+
+    Parameters
+    ----------
+    path : str
+        the file to write to
+    gdal_format : str
+        the name of the GDAL driver
+    layer : str
+        the name of the layer
+    fields : list of tuples
+        the name and the PostgreSQL type of the attribute columns
+    batches : iterable of lists of rows
+        the rows with the geometry as WKB followed by the attributes
+    srid : int
+        the EPSG code of the geometries
+    geometry : str, optional
+        the type of the PostGIS geometry column
+    layer_options : list of str, optional
+        the layer creation options
+    progress : Progress, optional
+        counts the features written
+
+    Returns
+    -------
+    int : the number of features written
+    """
+    from osgeo import ogr, osr
+    ogr.UseExceptions()
+    driver = ogr.GetDriverByName(gdal_format)
+    if driver is None:
+        raise ValueError(f'GDAL driver {gdal_format} is not available')
+
+    datasource = None
+    if os.path.exists(path):
+        if gdal_format in SINGLE_LAYER_FORMATS:
+            driver.DeleteDataSource(path)
+        else:
+            datasource = ogr.Open(path, update=1)
+    if datasource is None:
+        datasource = driver.CreateDataSource(path)
+    for i in range(datasource.GetLayerCount()):
+        if datasource.GetLayerByIndex(i).GetName() == layer:
+            datasource.DeleteLayer(i)
+            break
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(srid)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    ogr_layer = datasource.CreateLayer(
+        layer, srs, getattr(ogr, geometry_type(geometry)),
+        options=layer_options or [])
+    for name, typname in fields:
+        ftype, subtype = field_type(typname)
+        field_defn = ogr.FieldDefn(name, getattr(ogr, ftype))
+        if subtype:
+            field_defn.SetSubType(getattr(ogr, subtype))
+        ogr_layer.CreateField(field_defn)
+
+    layer_defn = ogr_layer.GetLayerDefn()
+    n_fields = len(fields)
+    n_features = 0
+    for rows in batches:
+        n_bytes = 0
+        ogr_layer.StartTransaction()
+        for row in rows:
+            feature = ogr.Feature(layer_defn)
+            wkb = row[0]
+            if wkb is not None:
+                wkb = bytes(wkb)
+                n_bytes += len(wkb)
+                feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb))
+            for i in range(n_fields):
+                value = row[i + 1]
+                if value is None:
+                    feature.SetFieldNull(i)
+                else:
+                    feature.SetField(i, value)
+            ogr_layer.CreateFeature(feature)
+        ogr_layer.CommitTransaction()
+        n_features += len(rows)
+        if progress is not None:
+            progress.update(len(rows), n_bytes)
+    # closing the datasource flushes the file
+    ogr_layer = datasource = None
+    return n_features
+
+
+def translate_layer(source: str,
+                    path: str,
+                    gdal_format: str,
+                    layer: str,
+                    layer_options: List[str] = None):
+    """
+    copy the layer of the file source into the file path,
+    an existing layer with the same name is replaced
+    """
+    from osgeo import gdal
+    gdal.UseExceptions()
+    options = gdal.VectorTranslateOptions(
+        format=gdal_format,
+        accessMode='overwrite',
+        layers=[layer],
+        layerName=layer,
+        layerCreationOptions=layer_options or [])
+    datasource = gdal.VectorTranslate(path, source, options=options)
+    # closing the datasource flushes the file
+    datasource = None
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Graphs of a network in memory for the connectivity analysis and the export.
+
+The edges are given by the OSM ids of their from- and tonodes and their
+costs in both directions. Like in pgRouting, a negative cost closes the
+direction of the edge. The nodes are numbered in the order of their ids
+and the graph is held as a sparse matrix for scipy.sparse.csgraph.
+The shortest paths between sets of points are computed with Dijkstra's
+algorithm from many sources at once.
+"""
+
+import os
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+from scipy.spatial import cKDTree
+
+
+class NetworkGraph:
+    """
+    directed graph of the open directions of the edges
+    """
+
+    def __init__(self,
+                 fromnodes: np.ndarray,
+                 tonodes: np.ndarray,
+                 cost: np.ndarray,
+                 reverse_cost: np.ndarray):
+        """
+        Parameters
+        ----------
+        fromnodes, tonodes : array of int
+            the ids of the nodes at the start and the end of the edges
+        cost, reverse_cost : array of float
+            the costs in and against the direction of the edges,
+            a negative cost (or NaN) closes the direction
+        """
+        fromnodes = np.asarray(fromnodes, dtype=np.int64)
+        tonodes = np.asarray(tonodes, dtype=np.int64)
+        with np.errstate(invalid='ignore'):
+            forward = np.asarray(cost, dtype=np.float64) >= 0
+            backward = np.asarray(reverse_cost, dtype=np.float64) >= 0
+        # edges closed in both directions do not connect their nodes
+        is_open = forward | backward
+        fromnodes = fromnodes[is_open]
+        tonodes = tonodes[is_open]
+        self.forward = forward[is_open]
+        self.backward = backward[is_open]
+        n_edges = len(fromnodes)
+        self.nodes, idx = np.unique(np.concatenate([fromnodes, tonodes]),
+                                    return_inverse=True)
+        self.source = idx[:n_edges]
+        self.target = idx[n_edges:]
+
+    @classmethod
+    def from_batches(cls, batches: Iterable[Dict[str, np.ndarray]]
+                     ) -> 'NetworkGraph':
+        """
+        create the graph from batches of arrays with the columns
+        fromnode, tonode, cost and reverse_cost
+        """
+        columns = ('fromnode', 'tonode', 'cost', 'reverse_cost')
+        parts = {col: [] for col in columns}
+        for batch in batches:
+            for col in columns:
+                parts[col].append(batch[col])
+        arrays = [np.concatenate(parts[col]) if parts[col] else np.empty(0)
+                  for col in columns]
+        return cls(*arrays)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.nodes)
+
+    def matrix(self) -> csr_matrix:
+        """
+        return the adjacency matrix of the open directions of the edges
+        """
+        rows = np.concatenate([self.source[self.forward],
+                               self.target[self.backward]])
+        cols = np.concatenate([self.target[self.forward],
+                               self.source[self.backward]])
+        data = np.ones(len(rows), dtype=bool)
+        return csr_matrix((data, (rows, cols)),
+                          shape=(self.n_nodes, self.n_nodes))
+
+    def components(self, connection: str = 'strong') -> np.ndarray:
+        """
+        return the component of each node
+
+        Parameters
+        ----------
+        connection : str, optional
+            'strong' or 'weak'
+
+        Returns
+        -------
+        array of int : the smallest node id of the component of each node,
+        like the component ids of pgr_strongComponents
+        """
+        if not self.n_nodes:
+            return np.empty(0, dtype=np.int64)
+        n, labels = connected_components(self.matrix(), directed=True,
+                                         connection=connection)
+        # the nodes are sorted by id, so the first node of each label
+        # is the one with the smallest id
+        first = np.unique(labels, return_index=True)[1]
+        return self.nodes[first[labels]]
+
+    def reached_nodes(self,
+                      strong: np.ndarray,
+                      min_component_size: int) -> np.ndarray:
+        """
+        return a boolean mask of the nodes in strong components
+        with more than min_component_size nodes
+        """
+        _, inverse, counts = np.unique(strong, return_inverse=True,
+                                       return_counts=True)
+        return counts[inverse] > min_component_size
+
+    def reached_edges(self, reached: np.ndarray) -> np.ndarray:
+        """
+        return a boolean mask of the (open) edges with both nodes reached
+        """
+        return reached[self.source] & reached[self.target]
+
+    def analyze(self, min_component_size: int
+                ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        return the strong and the weak component of each node
+        and whether the node is reached
+        """
+        strong = self.components('strong')
+        weak = self.components('weak')
+        reached = self.reached_nodes(strong, min_component_size)
+        return strong, weak, reached
+
+
+def csr_graph(edge_ids: np.ndarray,
+              fromnodes: np.ndarray,
+              tonodes: np.ndarray,
+              cost: np.ndarray,
+              reverse_cost: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    return the arrays of the directed graph of the open directions of the
+    edges in compressed sparse row format
+
+    Returns
+    -------
+    dict with the arrays
+        nodes : the OSM ids of the nodes (int64), the position in the array
+        is the index of the node
+        indptr : the arcs of node i are indptr[i]:indptr[i + 1] (int64)
+        indices : the index of the node at the end of each arc (int32)
+        cost : the cost of each arc (float32)
+        edge : the id of the edge of each arc (int64)
+        reverse : if the arc runs against the direction of the edge (bool)
+    """
+    edge_ids = np.asarray(edge_ids, dtype=np.int64)
+    fromnodes = np.asarray(fromnodes, dtype=np.int64)
+    tonodes = np.asarray(tonodes, dtype=np.int64)
+    cost = np.asarray(cost, dtype=np.float64)
+    reverse_cost = np.asarray(reverse_cost, dtype=np.float64)
+    n_edges = len(edge_ids)
+    nodes, idx = np.unique(np.concatenate([fromnodes, tonodes]),
+                           return_inverse=True)
+    source, target = idx[:n_edges], idx[n_edges:]
+    with np.errstate(invalid='ignore'):
+        forward = cost >= 0
+        backward = reverse_cost >= 0
+    tail = np.concatenate([source[forward], target[backward]])
+    head = np.concatenate([target[forward], source[backward]])
+    arc_cost = np.concatenate([cost[forward], reverse_cost[backward]])
+    arc_edge = np.concatenate([edge_ids[forward], edge_ids[backward]])
+    reverse = np.concatenate([np.zeros(forward.sum(), dtype=bool),
+                              np.ones(backward.sum(), dtype=bool)])
+    order = np.lexsort((head, tail))
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tail, minlength=len(nodes)), out=indptr[1:])
+    return {'nodes': nodes,
+            'indptr': indptr,
+            'indices': head[order].astype(np.int32),
+            'cost': arc_cost[order].astype(np.float32),
+            'edge': arc_edge[order],
+            'reverse': reverse[order]}
+
+
+def save_graph(folder: str, arrays: Dict[str, np.ndarray]):
+    """
+    save the arrays of the graph as .npy files in the folder
+    """
+    os.makedirs(folder, exist_ok=True)
+    for name, values in arrays.items():
+        np.save(os.path.join(folder, f'{name}.npy'), values)
+
+
+def load_graph(folder: str, mmap: bool = True) -> Dict[str, np.ndarray]:
+    """
+    load the arrays of the graph saved in the folder,
+    memory-mapped if mmap is True
+    """
+    mode = 'r' if mmap else None
+    return {os.path.splitext(fn)[0]: np.load(os.path.join(folder, fn),
+                                             mmap_mode=mode)
+            for fn in sorted(os.listdir(folder)) if fn.endswith('.npy')}
+
+
+def matrix_arrays(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    return the cost matrix of a graph as returned by csr_graph with the
+    parallel arcs reduced to the cheapest one
+
+    Returns
+    -------
+    dict with the arrays matrix_indptr, matrix_indices and matrix_cost of
+    the matrix in compressed sparse row format, in the types used by
+    scipy.sparse.csgraph, so that they can be saved with the graph and
+    wrapped by graph_matrix without a copy
+    """
+    indptr = np.asarray(arrays['indptr'])
+    n_nodes = len(indptr) - 1
+    tail = np.repeat(np.arange(n_nodes), np.diff(indptr))
+    head = np.asarray(arrays['indices'])
+    cost = np.asarray(arrays['cost'], dtype=np.float64)
+    order = np.lexsort((cost, head, tail))
+    tail, head, cost = tail[order], head[order], cost[order]
+    first = np.ones(len(tail), dtype=bool)
+    first[1:] = (tail[1:] != tail[:-1]) | (head[1:] != head[:-1])
+    tail, head, cost = tail[first], head[first], cost[first]
+    index_dtype = (np.int32 if max(n_nodes, len(tail)) < 2 ** 31
+                   else np.int64)
+    new_indptr = np.zeros(n_nodes + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(tail, minlength=n_nodes), out=new_indptr[1:])
+    return {'matrix_indptr': new_indptr,
+            'matrix_indices': head.astype(index_dtype),
+            'matrix_cost': cost}
+
+
+def graph_matrix(arrays: Dict[str, np.ndarray]) -> csr_matrix:
+    """
+    return the cost matrix of a graph in compressed sparse row format
+    as returned by csr_graph, parallel arcs are reduced to the cheapest one
+
+    if the arrays contain the matrix arrays saved with the graph
+    (see matrix_arrays), the matrix wraps them without a copy, so that
+    processes share the memory-mapped files
+    """
+    if 'matrix_indptr' not in arrays:
+        arrays = matrix_arrays(arrays)
+    n_nodes = len(arrays['matrix_indptr']) - 1
+    # built from the arrays directly, the arcs with a cost of 0 are kept
+    # as explicit entries and not dropped as missing arcs
+    return csr_matrix((arrays['matrix_cost'], arrays['matrix_indices'],
+                       arrays['matrix_indptr']),
+                      shape=(n_nodes, n_nodes), copy=False)
+
+
+def snap_points(node_x: np.ndarray,
+                node_y: np.ndarray,
+                x: np.ndarray,
+                y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    return the index of the nearest node with coordinates for each point
+    and the distance to it
+    """
+    node_x = np.asarray(node_x, dtype=np.float64)
+    node_y = np.asarray(node_y, dtype=np.float64)
+    valid = np.flatnonzero(~(np.isnan(node_x) | np.isnan(node_y)))
+    if not len(valid):
+        raise ValueError('no nodes with coordinates to snap the points to')
+    tree = cKDTree(np.column_stack([node_x[valid], node_y[valid]]))
+    distance, idx = tree.query(np.column_stack([x, y]))
+    return valid[idx], distance
+
+
+def shortest_paths(matrix: csr_matrix,
+                   origins: np.ndarray,
+                   destinations: np.ndarray,
+                   limit: float = np.inf) -> np.ndarray:
+    """
+    return the costs (n_origins, n_destinations) of the shortest paths
+    between the nodes, inf where the destination is not reached within
+    the limit
+
+    Dijkstra's algorithm is run once for each distinct origin and holds the
+    costs to all nodes of the graph, so the origins should be passed in
+    chunks on large graphs.
+    """
+    sources, inverse = np.unique(origins, return_inverse=True)
+    costs = dijkstra(matrix, directed=True, indices=sources, limit=limit)
+    return costs[np.ix_(inverse, np.asarray(destinations))].astype(np.float32)
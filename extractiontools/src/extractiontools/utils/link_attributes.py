@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Rules deriving the attributes of the car links from the tags of their ways.
+
+The rules work on a DataFrame with one row per link and the tags as columns
+named tag_<key> and reproduce the UPDATE statements formerly run one after
+the other on the links table.
+"""
+
+from typing import Iterator, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# the pattern of the numbers in the tags like in the SQL substring
+NUMBER = r'([-+]?\d*\.\d+|\d+)'
+INTEGER = r'([0-9]+)'
+
+# the travel time of links with a maxspeed of 0
+CLOSED_TIME = 9999999
+# the travel time of the segments of a ferry except the longest one
+FERRY_SEGMENT_TIME = 0.01
+
+TAGS = ('oneway', 'junction', 'lanes', 'bridge', 'tunnel', 'maxspeed',
+        'duration')
+
+# the columns of the result of car_attributes
+ATTRIBUTE_COLUMNS = ('id', 'fromnode', 'tonode', 'reverse', 'linkname',
+                     'oneway', 'lanes', 'bridge_tunnel', 'slope', 'maxspeed',
+                     'speed_zulaessig', 't_kfz')
+
+
+def first_number(values: pd.Series, pattern: str = NUMBER) -> pd.Series:
+    """
+    return the first number in the values as float, NaN if there is none
+    """
+    text = values.astype(object).where(values.notna(), '').astype(str)
+    return text.str.extract(pattern, expand=False).astype(float)
+
+
+def oneway(links: pd.DataFrame) -> Tuple[pd.Series, pd.Series]:
+    """
+    return if the links are oneways and if they have to be reversed
+    (oneway=-1)
+    """
+    tag = links['tag_oneway']
+    is_oneway = (tag.isin(['motor_vehicle', 'true', 'yes', '1'])
+                 | (links['tag_junction'] == 'roundabout'))
+    is_oneway &= ~(tag == 'no')
+    reverse = (tag == '-1')
+    return (is_oneway | reverse), reverse
+
+
+def lanes(links: pd.DataFrame, is_oneway: pd.Series) -> pd.Series:
+    """
+    return the number of lanes, 2 by default, 1 for oneways,
+    or the number in the lanes tag limited to 0 to 10
+    """
+    n_lanes = pd.Series(np.where(is_oneway, 1., 2.), index=links.index)
+    tag = links['tag_lanes']
+    has_tag = tag.notna()
+    n_lanes[has_tag] = first_number(tag[has_tag], INTEGER).clip(0, 10)
+    return n_lanes
+
+
+def bridge_tunnel(links: pd.DataFrame) -> pd.Series:
+    """
+    return 'b' for bridges, 't' for tunnels and '' for the other links
+    """
+    bt = pd.Series('', index=links.index, dtype=object)
+    for key, code in (('bridge', 'b'), ('tunnel', 't')):
+        tag = links[f'tag_{key}']
+        bt[tag.notna() & ~(tag == 'no')] = code
+    return bt
+
+
+def slope(links: pd.DataFrame, bt: pd.Series) -> pd.Series:
+    """
+    return the slope between the heights of the from- and the tonode,
+    0 for bridges and tunnels and if a height is missing
+    """
+    length = links['length'].to_numpy(dtype=float)
+    dz = (links['z_to'] - links['z_from']).to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.where(length == 0, 0., dz / length)
+    valid = (bt == '').to_numpy() & ~np.isnan(dz)
+    return pd.Series(np.where(valid, values, 0.), index=links.index)
+
+
+def maxspeed(links: pd.DataFrame,
+             defaults: pd.DataFrame,
+             road_category: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """
+    return the average and the permitted speed of the links
+
+    The speeds are taken from the maxspeed tag or else from the defaults by
+    linktype and io (innerorts). Except for motorways (road category A)
+    the average speed is limited to the default. Without both the speeds
+    are NaN, which leaves speed_zulaessig NULL like the former SQL.
+
+    Parameters
+    ----------
+    defaults : DataFrame
+        the columns linktype, io, v_kfz and v_kfz_zulaessig
+    road_category : Series
+        the road category of the links
+    """
+    tag = links['tag_maxspeed']
+    number = np.rint(first_number(tag))
+    speed = number.copy()
+    permitted = number.copy()
+    for value, kmh in (('signals', 120.), ('none', 150.)):
+        speed[tag == value] = kmh
+        permitted[tag == value] = kmh
+
+    defaults = defaults.drop_duplicates(['linktype', 'io'])
+    d = links[['linktype', 'io']].merge(defaults, how='left',
+                                         on=['linktype', 'io'],
+                                         indicator=True)
+    d.index = links.index
+    has_default = d['_merge'] == 'both'
+    missing = speed.isna() & has_default
+    speed[missing] = d.loc[missing, 'v_kfz']
+    permitted[missing] = d.loc[missing, 'v_kfz_zulaessig']
+    limit = (has_default & (d['v_kfz'] < speed)
+             & (road_category.fillna('').astype(str) > 'A'))
+    speed[limit] = d.loc[limit, 'v_kfz']
+    return np.rint(speed), np.rint(permitted)
+
+
+def travel_time(links: pd.DataFrame,
+                speed: pd.Series,
+                road_category: pd.Series) -> pd.Series:
+    """
+    return the travel time in minutes
+
+    For ferries (road category D) with a duration tag the duration is
+    assigned to the longest segment of the way.
+    """
+    length = links['length'].to_numpy(dtype=float)
+    v = speed.to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(v == 0, CLOSED_TIME, length / v * 3.6 / 60)
+    t = pd.Series(t, index=links.index)
+
+    ferries = links.loc[(road_category == 'D').to_numpy()
+                        & links['tag_duration'].notna().to_numpy()]
+    if len(ferries):
+        ferries = ferries.sort_values(['wayid', 'length', 'segment'],
+                                      ascending=[True, False, True],
+                                      kind='stable')
+        longest = ~ferries['wayid'].duplicated()
+        duration = first_number(ferries['tag_duration'])
+        t[ferries.index] = duration.where(longest, FERRY_SEGMENT_TIME)
+    return t
+
+
+def car_attributes(links: pd.DataFrame,
+                   defaults: pd.DataFrame,
+                   road_categories: pd.Series) -> pd.DataFrame:
+    """
+    compute the attributes of the car links
+
+    Parameters
+    ----------
+    links : DataFrame
+        the columns id, fromnode, tonode, wayid, segment, length, linkname,
+        linkref, linktype, io, z_from, z_to and tag_<key> for the TAGS
+    defaults : DataFrame
+        the default speeds with the columns linktype, io, v_kfz and
+        v_kfz_zulaessig
+    road_categories : Series
+        the road category by linktype
+
+    Returns
+    -------
+    DataFrame with the ATTRIBUTE_COLUMNS
+    """
+    links = links.reset_index(drop=True)
+    road_category = links['linktype'].map(road_categories)
+    is_oneway, reverse = oneway(links)
+    rev = reverse.to_numpy()
+    fromnode = np.where(rev, links['tonode'], links['fromnode'])
+    tonode = np.where(rev, links['fromnode'], links['tonode'])
+    turned = links.assign(z_from=np.where(rev, links['z_to'], links['z_from']),
+                          z_to=np.where(rev, links['z_from'], links['z_to']))
+    bt = bridge_tunnel(links)
+    speed, permitted = maxspeed(links, defaults, road_category)
+    return pd.DataFrame({
+        'id': links['id'],
+        'fromnode': fromnode,
+        'tonode': tonode,
+        'reverse': reverse,
+        'linkname': links['linkname'].where(links['linkname'].notna(),
+                                            links['linkref']),
+        'oneway': is_oneway,
+        'lanes': lanes(links, is_oneway),
+        'bridge_tunnel': bt,
+        'slope': slope(turned, bt),
+        'maxspeed': speed,
+        'speed_zulaessig': permitted,
+        't_kfz': travel_time(links, speed, road_category),
+    }, columns=ATTRIBUTE_COLUMNS)
+
+
+def to_rows(df: pd.DataFrame,
+            integer_columns: Sequence[str] = ()) -> Iterator[List]:
+    """
+    yield the rows of the DataFrame as lists of python values with None
+    for the missing values, the integer_columns are converted to int
+    """
+    columns = []
+    for col in df.columns:
+        values = df[col].astype(object)
+        isna = df[col].isna().to_numpy()
+        if col in integer_columns:
+            values = [None if na else int(v) for v, na in zip(values, isna)]
+        else:
+            values = [None if na else (v.item() if hasattr(v, 'item') else v)
+                      for v, na in zip(values, isna)]
+        columns.append(values)
+    for row in zip(*columns):
+        yield list(row)
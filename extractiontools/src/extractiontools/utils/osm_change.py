@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Read osmChange files (.osc or .osc.gz) and the state files of the
+replication diffs.
+"""
+
+import os
+import re
+import gzip
+import datetime
+from typing import Dict, Iterator, Tuple
+from xml.etree import ElementTree
+
+ACTIONS = ('create', 'modify', 'delete')
+OSM_TYPES = ('node', 'way', 'relation')
+_TIMESTAMP = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _parse_timestamp(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value.replace('\\:', ':'), _TIMESTAMP)
+
+
+def _element_data(elem: ElementTree.Element) -> Dict[str, object]:
+    """return the data of a node, way or relation element"""
+    a = elem.attrib
+    data = {
+        'id': int(a['id']),
+        'version': int(a.get('version', 0)),
+        'user_id': int(a.get('uid', 0)),
+        'user': a.get('user', ''),
+        'tstamp': (_parse_timestamp(a['timestamp'])
+                   if 'timestamp' in a else None),
+        'changeset_id': int(a.get('changeset', 0)),
+        'tags': {t.get('k'): t.get('v') for t in elem.iter('tag')},
+    }
+    if elem.tag == 'node':
+        data['lon'] = float(a['lon']) if 'lon' in a else None
+        data['lat'] = float(a['lat']) if 'lat' in a else None
+    elif elem.tag == 'way':
+        data['nodes'] = [int(nd.get('ref')) for nd in elem.iter('nd')]
+    else:
+        data['members'] = [(m.get('type')[0].upper(), int(m.get('ref')),
+                            m.get('role', ''))
+                           for m in elem.iter('member')]
+    return data
+
+
+def read_osm_change(path: str) -> Iterator[Tuple[str, str, Dict]]:
+    """
+    read the osmChange file
+
+    Yields
+    ------
+    tuple : the action (create, modify, delete), the type
+    (node, way, relation) and the data of the object
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        action = None
+        for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag in ACTIONS:
+                    action = elem.tag
+                continue
+            if elem.tag in OSM_TYPES:
+                yield action, elem.tag, _element_data(elem)
+                elem.clear()
+            elif elem.tag in ACTIONS:
+                elem.clear()
+
+
+def read_state(path: str) -> Tuple[int, datetime.datetime]:
+    """
+    return the sequence number and the timestamp of the osmChange file
+
+    They are read from the state file next to the change file
+    (e.g. 123.state.txt for 123.osc.gz) or else the sequence number is
+    derived from the path of the replication diff (e.g. 004/123/456.osc.gz)
+    """
+    base = re.sub(r'\.osc(\.gz)?$', '', path)
+    state_file = f'{base}.state.txt'
+    if os.path.exists(state_file):
+        state = {}
+        with open(state_file) as f:
+            for line in f:
+                if '=' in line and not line.startswith('#'):
+                    key, value = line.strip().split('=', 1)
+                    state[key] = value
+        timestamp = state.get('timestamp')
+        return (int(state['sequenceNumber']),
+                _parse_timestamp(timestamp) if timestamp else None)
+    parts = base.replace('\\', '/').split('/')[-3:]
+    digits = ''.join(p for p in parts if p.isdigit())
+    if not digits:
+        raise ValueError(f'no sequence number found for {path}')
+    return int(digits), None
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Read the OSM data within a polygon from a PBF file.
+
+The file is read twice with pyosmium (>= 3.7). The first pass selects the
+ids: the nodes within the polygon, the ways with at least one of these
+nodes, all nodes of these ways, the relations with a selected node or way
+as member and recursively their parent relations (like the extraction
+from a pgsnapshot database). The second pass yields the selected objects.
+The file has to be sorted by type and id (nodes, ways, relations),
+as the PBF files of planet and geofabrik are.
+
+The ids are kept in sorted numpy arrays instead of python sets, so that
+the selection of a regional extract fits into memory.
+"""
+
+import datetime
+import logging
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from shapely import wkt as shapely_wkt
+from shapely import contains_xy, prepare
+
+from extractiontools.utils.copy_format import (point_ewkb, linestring_ewkb,
+                                               box_ewkb)
+
+
+def ids_in(ids: np.ndarray, sorted_ids: np.ndarray) -> np.ndarray:
+    """return a mask of the ids contained in the sorted unique ids"""
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(sorted_ids):
+        return np.zeros(len(ids), dtype=bool)
+    idx = np.searchsorted(sorted_ids, ids)
+    idx[idx == len(sorted_ids)] = 0
+    return sorted_ids[idx] == ids
+
+
+def any_per_group(mask: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    return for consecutive groups of values with the given lengths,
+    if any value of the group is True (False for empty groups)
+    """
+    counts = np.concatenate([[0], np.cumsum(mask, dtype=np.int64)])
+    ends = np.cumsum(lengths, dtype=np.int64)
+    return counts[ends] - counts[ends - lengths] > 0
+
+
+def parent_closure(selected: np.ndarray,
+                   parents: np.ndarray,
+                   children: np.ndarray) -> np.ndarray:
+    """
+    add the parents of the selected ids recursively
+
+    Parameters
+    ----------
+    selected : np.ndarray
+        the sorted unique ids
+    parents, children : np.ndarray
+        the pairs of parent and child ids
+
+    Returns
+    -------
+    np.ndarray : the sorted unique selected ids and all their ancestors
+    """
+    new = selected
+    while len(new):
+        found = np.unique(parents[ids_in(children, new)])
+        new = found[~ids_in(found, selected)]
+        selected = np.union1d(selected, new)
+    return selected
+
+
+class _IdBuffer:
+    """collects ids in chunks"""
+
+    def __init__(self):
+        self.chunks: List[np.ndarray] = []
+
+    def extend(self, ids):
+        self.chunks.append(np.asarray(ids, dtype=np.int64))
+
+    def concatenate(self) -> np.ndarray:
+        if not self.chunks:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(self.chunks)
+
+    def unique(self) -> np.ndarray:
+        return np.unique(self.concatenate())
+
+
+class OSMSelection:
+    """
+    Selects the OSM objects within a polygon in a PBF file
+    """
+    _type_order = {'n': 0, 'w': 1, 'r': 2}
+
+    def __init__(self,
+                 boundary_wkt: str,
+                 batch_size: int = 100000,
+                 logger: logging.Logger = None):
+        """
+        Parameters
+        ----------
+        boundary_wkt : str
+            the polygon in WGS84 as WKT
+        batch_size : int, optional
+            the number of objects processed at once
+        """
+        self.polygon = shapely_wkt.loads(boundary_wkt)
+        prepare(self.polygon)
+        self.bounds = self.polygon.bounds
+        self.batch_size = batch_size
+        self.logger = logger or logging.getLogger(self.__module__)
+        empty = np.empty(0, dtype=np.int64)
+        self.node_ids = empty
+        self.way_ids = empty
+        self.relation_ids = empty
+        # the coordinates of the selected nodes, read in the second pass
+        self.lons = self.lats = np.empty(0)
+        self.users: Dict[int, str] = {}
+        self.max_timestamp: datetime.datetime = None
+
+    def inside(self, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+        """return a mask of the coordinates within the polygon"""
+        xmin, ymin, xmax, ymax = self.bounds
+        mask = (lons >= xmin) & (lons <= xmax) & (lats >= ymin) & (lats <= ymax)
+        if mask.any():
+            mask[mask] = contains_xy(self.polygon, lons[mask], lats[mask])
+        return mask
+
+    def _batches(self, filename: str, with_data: bool = False
+                 ) -> Iterator[Tuple[str, List[tuple]]]:
+        """
+        yield batches of objects of one type as tuples
+        (id, lon, lat) for nodes, (id, refs) for ways and
+        (id, [(type, ref, role), ...]) for relations,
+        with data the tuples are followed by
+        version, user_id, user, timestamp, changeset_id and tags
+        """
+        import osmium
+        batch: List[tuple] = []
+        current = 'n'
+        for obj in osmium.FileProcessor(filename):
+            osm_type = obj.type_str()
+            if osm_type != current:
+                if self._type_order[osm_type] < self._type_order[current]:
+                    raise ValueError(f'{filename} is not sorted by type')
+                if batch:
+                    yield current, batch
+                    batch = []
+                current = osm_type
+            if osm_type == 'n':
+                location = obj.location
+                if not location.valid():
+                    continue
+                row = (obj.id, location.lon, location.lat)
+            elif osm_type == 'w':
+                row = (obj.id, [n.ref for n in obj.nodes])
+            else:
+                row = (obj.id, [(m.type, m.ref, m.role) for m in obj.members])
+            if with_data:
+                row += (obj.version, obj.uid, obj.user,
+                        obj.timestamp.replace(tzinfo=None), obj.changeset,
+                        {t.k: t.v for t in obj.tags})
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield current, batch
+                batch = []
+        if batch:
+            yield current, batch
+
+    def select(self, filename: str):
+        """
+        select the ids of the nodes, ways and relations (first pass)
+        """
+        inside_nodes = _IdBuffer()
+        way_nodes = _IdBuffer()
+        ways = _IdBuffer()
+        relations = _IdBuffer()
+        parents = _IdBuffer()
+        children = _IdBuffer()
+        current = 'n'
+
+        def finish(osm_type: str):
+            # the selection of the preceding types is complete
+            if osm_type in 'wr' and current == 'n':
+                self.node_ids = inside_nodes.unique()
+                self.logger.info(f'{len(self.node_ids)} nodes in the area')
+            if osm_type == 'r' and current != 'r':
+                self.way_ids = ways.unique()
+                self.node_ids = np.union1d(self.node_ids, way_nodes.unique())
+                self.logger.info(f'{len(self.way_ids)} ways with '
+                                 f'{len(self.node_ids)} nodes selected')
+
+        for osm_type, batch in self._batches(filename):
+            if osm_type != current:
+                finish(osm_type)
+                current = osm_type
+            ids = np.fromiter((b[0] for b in batch), dtype=np.int64,
+                              count=len(batch))
+            if osm_type == 'n':
+                lons = np.fromiter((b[1] for b in batch), dtype=np.float64,
+                                   count=len(batch))
+                lats = np.fromiter((b[2] for b in batch), dtype=np.float64,
+                                   count=len(batch))
+                inside_nodes.extend(ids[self.inside(lons, lats)])
+            elif osm_type == 'w':
+                lengths = np.array([len(b[1]) for b in batch], dtype=np.int64)
+                refs = np.fromiter((r for b in batch for r in b[1]),
+                                   dtype=np.int64, count=lengths.sum())
+                keep = any_per_group(ids_in(refs, self.node_ids), lengths)
+                ways.extend(ids[keep])
+                way_nodes.extend(refs[np.repeat(keep, lengths)])
+            else:
+                lengths = np.array([len(b[1]) for b in batch], dtype=np.int64)
+                types = np.array([m[0] for b in batch for m in b[1]],
+                                 dtype='U1')
+                refs = np.array([m[1] for b in batch for m in b[1]],
+                                dtype=np.int64)
+                member = np.zeros(len(refs), dtype=bool)
+                is_node = types == 'n'
+                is_way = types == 'w'
+                is_relation = types == 'r'
+                member[is_node] = ids_in(refs[is_node], self.node_ids)
+                member[is_way] = ids_in(refs[is_way], self.way_ids)
+                relations.extend(ids[any_per_group(member, lengths)])
+                parents.extend(np.repeat(ids, lengths)[is_relation])
+                children.extend(refs[is_relation])
+        finish('r')
+        self.relation_ids = parent_closure(relations.unique(),
+                                           parents.concatenate(),
+                                           children.concatenate())
+        self.logger.info(f'{len(self.relation_ids)} relations selected')
+
+    def _add_metadata(self, rows: List[tuple]):
+        for row in rows:
+            self.users[row[-5]] = row[-4]
+        latest = max(row[-3] for row in rows)
+        if self.max_timestamp is None or latest > self.max_timestamp:
+            self.max_timestamp = latest
+
+    def rows(self, filename: str, srid: int = 4326
+             ) -> Iterator[Tuple[str, List[tuple]]]:
+        """
+        yield the rows of the selected objects in the column order of the
+        pgsnapshot tables per table (second pass),
+        the geometries are EWKB in WGS84 (srid 4326)
+        """
+        self.lons = np.full(len(self.node_ids), np.nan)
+        self.lats = np.full(len(self.node_ids), np.nan)
+        for osm_type, batch in self._batches(filename, with_data=True):
+            ids = np.fromiter((b[0] for b in batch), dtype=np.int64,
+                              count=len(batch))
+            if osm_type == 'n':
+                keep = ids_in(ids, self.node_ids)
+                if not keep.any():
+                    continue
+                rows = [b for b, k in zip(batch, keep) if k]
+                idx = np.searchsorted(self.node_ids, ids[keep])
+                self.lons[idx] = [b[1] for b in rows]
+                self.lats[idx] = [b[2] for b in rows]
+                self._add_metadata(rows)
+                yield 'nodes', [
+                    (b[0], b[3], b[4], b[6], b[7], b[8],
+                     point_ewkb(b[1], b[2], srid)) for b in rows]
+            elif osm_type == 'w':
+                keep = ids_in(ids, self.way_ids)
+                if not keep.any():
+                    continue
+                rows = [b for b, k in zip(batch, keep) if k]
+                self._add_metadata(rows)
+                yield 'ways', [
+                    (b[0], b[2], b[3], b[5], b[6], b[7], b[1])
+                    + self.way_geometries(b[1], srid) for b in rows]
+                yield 'way_nodes', [(b[0], ref, seq) for b in rows
+                                    for seq, ref in enumerate(b[1])]
+            else:
+                keep = ids_in(ids, self.relation_ids)
+                if not keep.any():
+                    continue
+                rows = [b for b, k in zip(batch, keep) if k]
+                self._add_metadata(rows)
+                yield 'relations', [
+                    (b[0], b[2], b[3], b[5], b[6], b[7]) for b in rows]
+                yield 'relation_members', [
+                    (b[0], ref, member_type.upper(), role, seq) for b in rows
+                    for seq, (member_type, ref, role) in enumerate(b[1])]
+
+    def way_geometries(self, refs: List[int], srid: int = 4326
+                       ) -> Tuple[bytes, bytes]:
+        """
+        return the bounding box and the linestring of the way as EWKB,
+        missing nodes are skipped
+        """
+        if not len(self.node_ids):
+            return None, None
+        idx = np.searchsorted(self.node_ids, refs)
+        idx[idx == len(self.node_ids)] = 0
+        coords = np.column_stack([self.lons[idx], self.lats[idx]])
+        coords = coords[~np.isnan(coords[:, 0])
+                        & (self.node_ids[idx] == refs)]
+        if not len(coords):
+            return None, None
+        (xmin, ymin), (xmax, ymax) = coords.min(axis=0), coords.max(axis=0)
+        bbox = box_ewkb(xmin, ymin, xmax, ymax, srid)
+        if len(coords) < 2:
+            return bbox, None
+        return bbox, linestring_ewkb(coords.ravel(), srid)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Progress and throughput of an export, logged while the rows are written.
+"""
+
+import logging
+import time
+from typing import Callable, Dict
+
+
+class Progress:
+    """
+    counts the exported features and bytes and logs the progress
+    at most every `interval` seconds
+    """
+
+    def __init__(self,
+                 name: str,
+                 logger: logging.Logger = None,
+                 total: int = None,
+                 interval: float = 10.,
+                 clock: Callable[[], float] = time.perf_counter):
+        """
+        Parameters
+        ----------
+        name : str
+            the name of the exported layer or file
+        logger : logging.Logger, optional
+        total : int, optional
+            the (estimated) number of features, to log the percentage
+        interval : float, optional
+            the minimum number of seconds between two log messages
+        clock : callable, optional
+            returns the time in seconds
+        """
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+        self.total = total
+        self.interval = interval
+        self.clock = clock
+        self.n_features = 0
+        self.n_bytes = 0
+        self.t0 = self._last = clock()
+
+    @property
+    def seconds(self) -> float:
+        return self.clock() - self.t0
+
+    def update(self, n_features: int, n_bytes: int = 0):
+        """add the features and bytes written and log the progress"""
+        self.n_features += n_features
+        self.n_bytes += n_bytes
+        now = self.clock()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.logger.info(self.message())
+
+    def message(self) -> str:
+        """return the progress and the throughput as message"""
+        seconds = max(self.seconds, 1e-6)
+        percent = (f' ({min(100 * self.n_features / self.total, 100):.0f}%)'
+                   if self.total else '')
+        return (f'{self.name}: {self.n_features} features{percent} in '
+                f'{seconds:.1f}s ({self.n_features / seconds:.0f} features/s, '
+                f'{self.n_bytes / seconds / 2**20:.1f} MB/s)')
+
+    def finish(self) -> Dict[str, float]:
+        """
+        log the throughput of the whole export and return it
+        """
+        seconds = max(self.seconds, 1e-6)
+        self.logger.info(self.message())
+        return {'features': self.n_features,
+                'bytes': self.n_bytes,
+                'seconds': seconds,
+                'features_per_second': self.n_features / seconds}
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Opt-in instrumentation of the statements run by `DBApp.run_query`.
+
+Set the environment variable QUERY_STATS to `1` to record the wall time,
+the rowcount and the statusmessage of each statement or to `explain` to
+additionally run data modifying statements with
+`EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)` and record their plans.
+
+The statements are collected per orca step (see `log_query_stats`) and
+written to the table `meta.query_stats` of the database they were run in
+and appended as JSON lines to the file QUERY_STATS_LOG (if set).
+At the end of each step the slowest statements are logged.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import datetime
+import functools
+import inspect
+import threading
+from typing import Dict, List, Optional, Tuple
+
+_COMMENT = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+# statements, which are executed by EXPLAIN ANALYZE instead
+_EXPLAINABLE = re.compile(
+    r'^\s*(INSERT|UPDATE|DELETE'
+    r'|CREATE\s+((GLOBAL|LOCAL)\s+)?((TEMP|TEMPORARY|UNLOGGED)\s+)?TABLE\s+'
+    # only CREATE TABLE AS, the AS following the name and the column names
+    r'(IF\s+NOT\s+EXISTS\s+)?\S+(\s*\([^)]*\))?\s+AS\s*\(?\s*'
+    r'(SELECT|WITH|VALUES|TABLE)\b'
+    r'|CREATE\s+MATERIALIZED\s+VIEW\b.*\bAS\b)',
+    re.IGNORECASE | re.DOTALL)
+_NOT_EXPLAINABLE = re.compile(r'\bRETURNING\b|\bWITH\s+NO\s+DATA\b',
+                              re.IGNORECASE)
+
+
+def explainable(query: str) -> bool:
+    """
+    return True, if the query can be run with EXPLAIN ANALYZE instead
+    of running it directly without changing its effect for the caller
+    (no results are fetched)
+    """
+    query = _COMMENT.sub(' ', query)
+    return bool(_EXPLAINABLE.match(query)
+                and not _NOT_EXPLAINABLE.search(query))
+
+
+def rows_from_plan(plan: dict) -> Optional[int]:
+    """return the number of rows processed by the top node of the plan"""
+    node = plan.get('Plan', {})
+    if node.get('Node Type') == 'ModifyTable' and node.get('Plans'):
+        node = node['Plans'][0]
+    rows = node.get('Actual Rows')
+    return int(rows) if rows is not None else None
+
+
+def statusmessage_from_plan(query: str, rows: Optional[int]) -> str:
+    """
+    return the statusmessage the statement would have returned
+    without EXPLAIN ANALYZE
+    """
+    command = _COMMENT.sub(' ', query).split(None, 1)[0].upper()
+    rows = 0 if rows is None else rows
+    if command == 'INSERT':
+        return f'INSERT 0 {rows}'
+    if command in ('UPDATE', 'DELETE'):
+        return f'{command} {rows}'
+    # CREATE TABLE AS and CREATE MATERIALIZED VIEW
+    return f'SELECT {rows}'
+
+
+class ExplainedCursor:
+    """
+    proxy of a cursor, which ran a statement with EXPLAIN ANALYZE, with the
+    rowcount and statusmessage of the statement instead of the EXPLAIN
+    """
+
+    def __init__(self, cur, rowcount: Optional[int], statusmessage: str):
+        self._cur = cur
+        self.rowcount = -1 if rowcount is None else rowcount
+        self.statusmessage = statusmessage
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+
+class QueryStats:
+    """Collects the statistics of the statements run with run_query"""
+    create_table = '''
+    CREATE SCHEMA IF NOT EXISTS meta;
+    CREATE TABLE IF NOT EXISTS meta.query_stats (
+      id bigserial PRIMARY KEY,
+      step text,
+      app text,
+      started timestamptz,
+      duration double precision,
+      rowcount bigint,
+      statusmessage text,
+      query text,
+      plan jsonb
+    );
+    '''
+
+    def __init__(self,
+                 enabled: bool = False,
+                 explain: bool = False,
+                 log_file: str = None,
+                 top: int = 10):
+        self.enabled = enabled or explain
+        self.explain = explain
+        self.log_file = log_file
+        self.top = top
+        self.step = None
+        self.records: List[Dict[str, object]] = []
+        self.logins: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'QueryStats':
+        """create the collector configured by the environment"""
+        mode = os.environ.get('QUERY_STATS', '').lower()
+        return cls(enabled=mode not in ('', '0', 'false', 'no'),
+                   explain=mode == 'explain',
+                   log_file=os.environ.get('QUERY_STATS_LOG'),
+                   top=int(os.environ.get('QUERY_STATS_TOP', 10)))
+
+    def execute(self, cur, query: str, vars=None,
+                app: str = None, login=None):
+        """
+        execute the query with the cursor and record its statistics
+
+        Returns
+        -------
+        the cursor or, if the statement was explained, a proxy of the
+        cursor with the rowcount and statusmessage of the statement
+        taken from the plan
+        """
+        plan = None
+        started = datetime.datetime.now(datetime.timezone.utc)
+        t0 = time.perf_counter()
+        if self.explain and isinstance(query, str) and explainable(query):
+            cur.execute(
+                f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}', vars)
+            plan = cur.fetchone()[0][0]
+            rowcount = rows_from_plan(plan)
+            statusmessage = statusmessage_from_plan(query, rowcount)
+            result = ExplainedCursor(cur, rowcount, statusmessage)
+        else:
+            cur.execute(query, vars)
+            rowcount = cur.rowcount if cur.rowcount >= 0 else None
+            statusmessage = cur.statusmessage
+            result = cur
+        duration = time.perf_counter() - t0
+        if not isinstance(query, str):
+            query = query.as_string(cur.connection)
+        self.record(query, duration, rowcount=rowcount,
+                    statusmessage=statusmessage, plan=plan,
+                    started=started, app=app, login=login)
+        return result
+
+    def record(self, query: str, duration: float,
+               rowcount: int = None,
+               statusmessage: str = None,
+               plan: dict = None,
+               started: datetime.datetime = None,
+               app: str = None,
+               login=None):
+        """add the statistics of a statement"""
+        key = login.key if login is not None else None
+        rec = dict(step=self.step, app=app,
+                   database=login.db if login is not None else None,
+                   started=started or datetime.datetime.now(
+                       datetime.timezone.utc),
+                   duration=duration, rowcount=rowcount,
+                   statusmessage=statusmessage,
+                   query=query.strip(), plan=plan, login=key)
+        with self._lock:
+            if key is not None:
+                self.logins[key] = login
+            self.records.append(rec)
+
+    def slowest(self, n: int = None) -> List[Dict[str, object]]:
+        """return the n slowest statements recorded"""
+        with self._lock:
+            records = sorted(self.records, key=lambda r: r['duration'],
+                             reverse=True)
+        return records[:n or self.top]
+
+    def summary(self, n: int = None) -> str:
+        """return a summary of the slowest statements"""
+        with self._lock:
+            total = sum(r['duration'] for r in self.records)
+            count = len(self.records)
+        lines = [f'{count} statements in step {self.step} took {total:.2f}s, '
+                 'the slowest were:']
+        for rec in self.slowest(n):
+            query = ' '.join(rec['query'].split())
+            if len(query) > 200:
+                query = query[:197] + '...'
+            rows = '' if rec['rowcount'] is None else f" ({rec['rowcount']} rows)"
+            lines.append(f"{rec['duration']:10.2f}s{rows}: {query}")
+        return '\n'.join(lines)
+
+    def flush(self, logger: logging.Logger = None):
+        """
+        write the recorded statistics to the databases and the log file
+        and reset the records
+        """
+        from extractiontools.connection import Connection
+        logger = logger or logging.getLogger(__name__)
+        with self._lock:
+            records, self.records = self.records, []
+            logins, self.logins = self.logins, {}
+        if not records:
+            return
+        if self.log_file:
+            with open(self.log_file, 'a') as f:
+                for rec in records:
+                    rec = {k: v for k, v in rec.items() if k != 'login'}
+                    rec['started'] = rec['started'].isoformat()
+                    f.write(json.dumps(rec) + '\n')
+
+        for key, login in logins.items():
+            rows = [(r['step'], r['app'], r['started'], r['duration'],
+                     r['rowcount'], r['statusmessage'], r['query'],
+                     json.dumps(r['plan']) if r['plan'] else None)
+                    for r in records if r['login'] == key]
+            try:
+                with Connection(login=login) as conn:
+                    cur = conn.cursor()
+                    cur.execute(self.create_table)
+                    cur.executemany('''
+                    INSERT INTO meta.query_stats
+                    (step, app, started, duration, rowcount, statusmessage,
+                    query, plan)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
+                    ''', rows)
+            except Exception as e:
+                logger.warning(f'query stats could not be written to '
+                               f'database {login.db}: {e}')
+
+
+query_stats = QueryStats.from_env()
+
+
+def log_query_stats(func):
+    """
+    decorator for orca steps, which logs a summary of the slowest
+    statements of the step and writes the statistics of the step,
+    if the query stats are enabled
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not query_stats.enabled:
+            return func(*args, **kwargs)
+        import orca
+        logger = getattr(orca, 'logger', None) or logging.getLogger(__name__)
+        query_stats.step = func.__name__
+        try:
+            return func(*args, **kwargs)
+        finally:
+            logger.info(query_stats.summary())
+            query_stats.flush(logger=logger)
+            query_stats.step = None
+    # orca injects the arguments by the signature of the step
+    wrapper.__signature__ = inspect.signature(func)
+    return wrapper
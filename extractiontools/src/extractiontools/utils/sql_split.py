@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Fast splitting of SQL scripts into statements.
+
+`split_sql` is a replacement for `sqlparse.split` for the scripts run
+with `DBApp.run_query`. It only scans for semicolons outside of quoted
+strings, quoted identifiers, dollar-quoted bodies and comments instead of
+tokenizing the whole script and the results are cached per script,
+because the same large scripts (e.g. function definitions) are split
+again and again.
+
+See `extractiontools.sql_split_benchmark` for a comparison with sqlparse.
+"""
+
+import re
+import functools
+from typing import Tuple
+
+_DOLLAR_TAG = re.compile(r'\$([A-Za-z_\u0080-\uffff][\w\u0080-\uffff]*)?\$')
+_SPECIAL = re.compile(r"[;'\"$]|--|/\*")
+# the body of an escape string E'...', where backslashes escape quotes
+_ESCAPE_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*(?:'|\Z)", re.DOTALL)
+# a comment in the line of the semicolon belongs to the statement
+_TRAILING_COMMENT = re.compile(r'[ \t]*--[^\n]*')
+
+
+@functools.lru_cache(maxsize=1024)
+def split_sql(sql: str) -> Tuple[str, ...]:
+    """
+    split the sql script into statements
+
+    Parameters
+    ----------
+    sql : str
+        the sql script with statements separated by ;
+
+    Returns
+    -------
+    tuple of str : the stripped statements including their semicolon,
+    comments preceding a statement belong to the statement
+    """
+    statements = []
+    start = 0
+    pos = 0
+    n = len(sql)
+    while pos < n:
+        match = _SPECIAL.search(sql, pos)
+        if not match:
+            break
+        token = match.group()
+        pos = match.start()
+        if token == ';':
+            comment = _TRAILING_COMMENT.match(sql, pos + 1)
+            end = comment.end() if comment else pos + 1
+            statements.append(sql[start:end])
+            start = pos = end
+        elif token == '--':
+            end = sql.find('\n', pos)
+            pos = n if end == -1 else end + 1
+        elif token == '/*':
+            pos = _end_of_block_comment(sql, pos)
+        elif token == '$':
+            tag = _DOLLAR_TAG.match(sql, pos)
+            # a $ not starting a dollar quote (e.g. a parameter $1)
+            if not tag or (pos > 0 and _is_identifier_char(sql[pos - 1])):
+                pos += 1
+                continue
+            end = sql.find(tag.group(), tag.end())
+            pos = n if end == -1 else end + len(tag.group())
+        elif token == "'" and _is_escape_string(sql, pos):
+            pos = _ESCAPE_STRING.match(sql, pos).end()
+        else:
+            # quoted strings and identifiers, doubled quotes are escaped
+            pos += 1
+            while True:
+                end = sql.find(token, pos)
+                if end == -1:
+                    pos = n
+                    break
+                if end + 1 < n and sql[end + 1] == token:
+                    pos = end + 2
+                    continue
+                pos = end + 1
+                break
+    statements.append(sql[start:])
+    return tuple(stmt for stmt in (s.strip() for s in statements) if stmt)
+
+
+def _is_identifier_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+def _is_escape_string(sql: str, pos: int) -> bool:
+    """return True, if the quote at pos starts an escape string E'...'"""
+    return (pos > 0 and sql[pos - 1] in 'Ee'
+            and (pos < 2 or not _is_identifier_char(sql[pos - 2])))
+
+
+def _end_of_block_comment(sql: str, pos: int) -> int:
+    """return the position after the (nested) block comment at pos"""
+    depth = 0
+    n = len(sql)
+    while pos < n:
+        if sql.startswith('/*', pos):
+            depth += 1
+            pos += 2
+        elif sql.startswith('*/', pos):
+            depth -= 1
+            pos += 2
+            if depth == 0:
+                return pos
+        else:
+            pos += 1
+    return n
+